@@ -0,0 +1,382 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : BulkExport
+Purpose             : Runs a batch of hdfsToS3, dbexport, localToS3, s3ToHdfs, hiveToS3 and dbToS3 specs as one plan. The
+                      source listings, boto3 clients, distcp options and S3 inventories are shared across the batch,
+                      overlapping hdfsToS3 transfers are executed once, and every transfer of the batch runs on a
+                      single pool of max_parallel threads. The S3 size verification of all hdfsToS3 transfers is
+                      done after the copies, with one inventory listing per bucket.
+Input Parameters    : {"exports": [export spec, ...], "max_parallel": n}
+Output Value        : Dictionary with the overall status, the result of each spec in request order and the number
+                      of transfers removed by deduplication
+Dependencies        : HdfsToS3, ExportContext, ExportRegistry, DedupIndex
+Predecessor Module  : DataExportService
+Successor Module    : None
+Pre-requisites      : None
+How to run          : Call runBulkExport with the request json
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import json
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+from LogSetup import logger
+from ConfigUtility import get_snapshot
+from ExportContext import ExportContext, credentials_key
+import HdfsToS3
+import DedupIndex
+import Metrics
+import ExportRegistry
+import JobEvents
+import Tracing
+import Retry
+
+"""
+Module Constants
+"""
+MODULE_NAME = "BulkExport"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "bulkexport"
+DEFAULT_MAX_PARALLEL = 8
+EXPORTS_KEY = "exports"
+MAX_PARALLEL_KEY = "max_parallel"
+EXPORT_TYPE_KEY = "export_type"
+RESULTS_KEY = "results"
+DEDUPLICATED_KEY = "deduplicated_transfers"
+MESSAGE_KEY = "message"
+STATUS_KEY = HdfsToS3.STATUS_KEY
+STATUS_SUCCESS = HdfsToS3.STATUS_SUCCESS
+STATUS_FAILED = HdfsToS3.STATUS_FAILED
+FILES_COPIED_LIST_KEY = HdfsToS3.FILES_COPIED_LIST_KEY
+FILE_NAME_KEY = HdfsToS3.FILE_NAME_KEY
+FILE_SIZE_KEY = HdfsToS3.FILE_SIZE_KEY
+# Export types whose handler takes the ExportContext of the batch, hdfsToS3 specs run here are fan-outs
+CONTEXT_EXPORT_TYPES = ("hdfsToS3", "localToS3", "dbToS3")
+
+
+class TransferTask(object):
+    """
+    One hdfsToS3 transfer of the batch. A task can belong to several specs when they name the same source and
+    target, and can cover other tasks whose source and target are inside its own.
+    """
+
+    __slots__ = ("source_path", "file_name", "target_path", "hdfs_file", "s3_file_path", "s3_credentials_json",
+                 "option_string", "spec_indexes", "covered_tasks", "covered_by", "status", "target_paths")
+
+    def __init__(self, source_path, file_name, target_path, s3_credentials_json, option_string):
+        relative_path = file_name.replace(source_path, "").strip("/")
+        self.source_path = source_path
+        self.file_name = file_name
+        self.target_path = target_path
+        self.hdfs_file = source_path + "/" + relative_path
+        self.s3_file_path = target_path + "/" + relative_path
+        self.s3_credentials_json = s3_credentials_json
+        self.option_string = option_string
+        self.spec_indexes = []
+        self.covered_tasks = []
+        self.covered_by = None
+        self.status = None
+        self.target_paths = []
+
+
+class BulkExport(object):
+    def __init__(self, exports, max_parallel):
+        self.exports = exports
+        self.max_parallel = max_parallel
+        self.context = ExportContext()
+        self.context.defer_verification = True
+        self.hdfs_to_s3 = HdfsToS3.HdfsToS3(self.context)
+        self.results = [None] * len(exports)
+        self.tasks = []
+        self.task_index = {}
+        self.option_strings = {}
+        self.other_jobs = []
+        self.other_job_index = {}
+        self.deduplicated = 0
+        # Job of the request thread, made current in the pool threads so their events reach the same stream
+        self.job = JobEvents.current_job()
+
+    """
+    Purpose   :   Build the plan of the batch: expand every hdfsToS3 spec into transfer tasks, merge identical
+                  tasks and specs, and drop the transfers already covered by a transfer of a parent directory
+    Input     :   None
+    Output    :   None
+    """
+
+    @Tracing.traced("plan")
+    def plan(self):
+        for index, spec in enumerate(self.exports):
+            export_type = spec.get(EXPORT_TYPE_KEY) if isinstance(spec, dict) else None
+            try:
+                if export_type == "hdfsToS3" and not isinstance(spec.get("target_path"), list):
+                    self.plan_hdfs_to_s3(index, spec)
+                elif export_type in ("hdfsToS3", "dbexport", "localToS3", "s3ToHdfs", "hiveToS3", "dbToS3"):
+                    # hdfsToS3 specs with several target paths run as a job of their own (see HdfsFanOut)
+                    job_key = json.dumps(spec, sort_keys=True)
+                    if job_key in self.other_job_index:
+                        self.other_job_index[job_key][0].append(index)
+                        self.deduplicated += 1
+                    else:
+                        job = ([index], spec)
+                        self.other_job_index[job_key] = job
+                        self.other_jobs.append(job)
+                else:
+                    self.results[index] = {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Invalid export_type"}
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt
+            except:
+                logger.error("Error planning export " + str(index) + ": " + traceback.format_exc())
+                self.results[index] = {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Error Parsing Input Config"}
+        self.remove_overlaps()
+
+    def plan_hdfs_to_s3(self, index, spec):
+        source_path = spec["source_path"]
+        target_path = spec["target_path"]
+        s3_credentials_json = spec["s3_credentials"]
+        credentials = credentials_key(s3_credentials_json)
+        option_string = self.option_strings.get(credentials)
+        if option_string is None:
+            option_string = self.hdfs_to_s3.create_command_options_string(s3_credentials_json)
+            if not option_string:
+                raise Exception("Error Occured while creating hadoop distcp options")
+            self.option_strings[credentials] = option_string
+        files_list = spec.get("file_list") or self.context.list_hdfs(source_path)
+        planned = []
+        for file_name in files_list:
+            task = TransferTask(source_path, file_name, target_path, s3_credentials_json, option_string)
+            planned.append(((task.hdfs_file, task.s3_file_path, credentials), task))
+        self.results[index] = {STATUS_KEY: STATUS_SUCCESS, FILES_COPIED_LIST_KEY: []}
+        for task_key, task in planned:
+            existing = self.task_index.get(task_key)
+            if existing is not None:
+                existing.spec_indexes.append(index)
+                self.deduplicated += 1
+                continue
+            task.spec_indexes.append(index)
+            self.task_index[task_key] = task
+            self.tasks.append(task)
+
+    """
+    Purpose   :   Mark the tasks whose source is inside the source directory of another task with the same relative
+                  target and credentials. They are not copied again; their size is verified after the covering task
+    Input     :   None
+    Output    :   None
+    """
+
+    def remove_overlaps(self):
+        ancestors = []
+        for task in sorted(self.tasks, key=lambda item: item.hdfs_file):
+            while ancestors and not task.hdfs_file.startswith(ancestors[-1].hdfs_file.rstrip("/") + "/"):
+                ancestors.pop()
+            # From the nearest ancestor to the outermost one, a covered ancestor is copied by its own covering task
+            for ancestor in reversed(ancestors):
+                suffix = task.hdfs_file[len(ancestor.hdfs_file):]
+                if task.s3_file_path == ancestor.s3_file_path + suffix and \
+                        credentials_key(task.s3_credentials_json) == \
+                        credentials_key(ancestor.s3_credentials_json):
+                    covering = ancestor.covered_by or ancestor
+                    task.covered_by = covering
+                    covering.covered_tasks.append(task)
+                    self.deduplicated += 1
+                    break
+            ancestors.append(task)
+
+    def run_transfer(self, task):
+        Metrics.QUEUE_DEPTH.dec(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+        task.status = self.hdfs_to_s3.transfer_file_with_retries(task.option_string, task.source_path,
+                                                                 task.file_name, task.target_path,
+                                                                 task.s3_credentials_json, set(), task.target_paths)
+        if not task.status[FILE_NAME_KEY]:
+            return
+        for covered in task.covered_tasks:
+            size = self.hdfs_to_s3.get_hdfs_folder_size(covered.hdfs_file)
+            if size is None:
+                covered.status = {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0}
+                continue
+            self.context.add_pending_verification(covered.s3_file_path, covered.s3_credentials_json, size)
+            covered.status = {FILE_NAME_KEY: covered.s3_file_path, FILE_SIZE_KEY: str(size)}
+
+    def run_other_job(self, job):
+        indexes, spec = job
+        try:
+            handler = ExportRegistry.get_handler(spec[EXPORT_TYPE_KEY])
+            if spec[EXPORT_TYPE_KEY] in CONTEXT_EXPORT_TYPES:
+                # S3 clients and listings are reused across the batch, the transfers are verified by the export
+                result = handler(spec, self.context.shared())
+            else:
+                result = handler(spec)
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            logger.error("Export " + str(indexes) + " failed: " + traceback.format_exc())
+            result = {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Export failed"}
+        for index in indexes:
+            self.results[index] = result
+
+    def run_item(self, item):
+        JobEvents.set_current_job(self.job)
+        try:
+            if isinstance(item, TransferTask):
+                self.run_transfer(item)
+            else:
+                self.run_other_job(item)
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            logger.error("Bulk export item failed: " + traceback.format_exc())
+
+    def run_pool(self, work):
+        pool = ThreadPool(max(1, min(self.max_parallel, len(work) or 1)))
+        try:
+            for _ in pool.imap_unordered(self.run_item, work):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    """
+    Purpose   :   Copy again the transfers whose size did not match after the batch, with the backoff and retry
+                  budget of the job (see Retry). The objects of the failed copy are removed first and only these
+                  transfers are verified again
+    Input     :   Transfers of the batch, dictionary of target path to verified size
+    Output    :   Returns the dictionary updated with the sizes verified by the retries
+    """
+
+    def retry_unverified(self, transfers, verified):
+        policy = Retry.get_policy(HdfsToS3.S3PUT_RETRIES)
+        budget = Retry.job_budget()
+        for retry_number in range(1, policy.max_retries + 1):
+            failed = []
+            for task in transfers:
+                if task.status and task.status[FILE_NAME_KEY] and verified.get(task.s3_file_path) is None:
+                    decision = Retry.DECISION_RETRIED if budget.take() else Retry.DECISION_BUDGET_EXHAUSTED
+                    Metrics.RETRIES.inc(1, Metrics.EXPORT_TYPE_HDFS_TO_S3, decision)
+                    if decision == Retry.DECISION_RETRIED:
+                        failed.append(task)
+            if not failed:
+                break
+            delay = policy.delay(retry_number)
+            logger.warning("Size verification failed for " + str(len(failed)) + " transfers, retrying them in " +
+                           "%.1f" % delay + " seconds")
+            time.sleep(delay)
+            retried = []
+            for task in failed:
+                if self.hdfs_to_s3.s3_cleanup(task.target_paths, task.s3_credentials_json):
+                    task.target_paths = []
+                    retried.append(task)
+            Metrics.QUEUE_DEPTH.inc(len(retried), Metrics.EXPORT_TYPE_HDFS_TO_S3)
+            self.run_pool(retried)
+            with Tracing.span("verify", transfers=len(retried)):
+                verified.update(self.context.verify_pending())
+        return verified
+
+    """
+    Purpose   :   Execute the plan. All the transfers and jobs of the batch share one thread pool; the size of
+                  every transfer is then verified against one S3 inventory per bucket, the transfers that do not
+                  match are retried, the result of each spec is assembled and the specs that failed are rolled back
+    Input     :   None
+    Output    :   Returns the result of the batch
+    """
+
+    @Tracing.traced("execute")
+    def execute(self):
+        transfers = [task for task in self.tasks if task.covered_by is None]
+        work = transfers + self.other_jobs
+        logger.info("Running bulk export of " + str(len(self.exports)) + " specs as " + str(len(work)) +
+                    " transfers/jobs on " + str(self.max_parallel) + " threads, " + str(self.deduplicated) +
+                    " duplicate transfers removed")
+        Metrics.QUEUE_DEPTH.inc(len(transfers), Metrics.EXPORT_TYPE_HDFS_TO_S3)
+        self.run_pool(work)
+
+        with Tracing.span("verify", transfers=len(transfers)):
+            verified = self.context.verify_pending()
+        verified = self.retry_unverified(transfers, verified)
+        for task in self.tasks:
+            if task.status and task.status[FILE_NAME_KEY] and verified.get(task.s3_file_path) is None:
+                task.status = {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0}
+            elif task.status and task.status[FILE_NAME_KEY]:
+                Metrics.BYTES_TRANSFERRED.inc(verified[task.s3_file_path], Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                Metrics.FILES_TRANSFERRED.inc(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                JobEvents.publish(JobEvents.EVENT_FILE_COPIED, **task.status)
+
+        spec_tasks = {}
+        for task in self.tasks:
+            for index in task.spec_indexes:
+                spec_tasks.setdefault(index, []).append(task)
+        succeeded_specs = set()
+        for index, tasks in spec_tasks.items():
+            if all(task.status and task.status[FILE_NAME_KEY] for task in tasks):
+                succeeded_specs.add(index)
+                self.results[index] = {STATUS_KEY: STATUS_SUCCESS,
+                                       FILES_COPIED_LIST_KEY: [task.status for task in tasks]}
+            else:
+                self.results[index] = {STATUS_KEY: STATUS_FAILED, FILES_COPIED_LIST_KEY: []}
+        self.rollback(spec_tasks, succeeded_specs)
+
+        overall = STATUS_SUCCESS
+        for result in self.results:
+            if not isinstance(result, dict) or result.get(STATUS_KEY) != STATUS_SUCCESS:
+                overall = STATUS_FAILED
+        result = {STATUS_KEY: overall, RESULTS_KEY: self.results, DEDUPLICATED_KEY: self.deduplicated}
+        if self.hdfs_to_s3.dedup_index is not None:
+            result[HdfsToS3.BYTES_SAVED_KEY] = sum(task.status.get(HdfsToS3.BYTES_SAVED_KEY, 0)
+                                                   for task in transfers if task.status and task.status[FILE_NAME_KEY])
+        return result
+
+    """
+    Purpose   :   Remove from S3 the files written for failed specs. Transfers shared with a spec that succeeded
+                  are kept
+    Input     :   Tasks of each spec, indexes of the specs that succeeded
+    Output    :   None
+    """
+
+    @Tracing.traced("rollback")
+    def rollback(self, spec_tasks, succeeded_specs):
+        for index, tasks in spec_tasks.items():
+            if index in succeeded_specs:
+                continue
+            if self.exports[index].get("atomic_transaction", HdfsToS3.FLAG_YES).lower() != HdfsToS3.FLAG_YES:
+                continue
+            paths = []
+            for task in tasks:
+                owner = task.covered_by or task
+                owners = set(owner.spec_indexes)
+                for covered in owner.covered_tasks:
+                    owners.update(covered.spec_indexes)
+                if task.covered_by is None and not owners & succeeded_specs:
+                    paths.extend(task.target_paths)
+            if paths:
+                logger.info("Rolling back " + str(len(paths)) + " paths of failed export " + str(index))
+                if not self.hdfs_to_s3.s3_cleanup(paths, self.exports[index]["s3_credentials"]):
+                    logger.error("Error in cleaning files already loaded to s3 for export " + str(index))
+
+
+"""
+Purpose   :   Entry point of the bulk export endpoint
+Input     :   Request json containing the list of export specs and optionally max_parallel
+Output    :   Returns the result of the batch
+"""
+
+
+def runBulkExport(config):
+    try:
+        exports = list(config[EXPORTS_KEY])
+    except Exception:
+        logger.error("Error Parsing Input Config ")
+        return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Error Parsing Input Config"}
+    max_parallel = config.get(MAX_PARALLEL_KEY)
+    if max_parallel is None:
+        max_parallel = get_snapshot(CONFIGURATION_FILE).get_int(SETTINGS_SECTION, MAX_PARALLEL_KEY,
+                                                                DEFAULT_MAX_PARALLEL)
+    bulk_export = BulkExport(exports, int(max_parallel or DEFAULT_MAX_PARALLEL))
+    if DedupIndex.is_enabled(config):
+        bulk_export.hdfs_to_s3.enable_dedup(config.get(HdfsToS3.DEDUP_BUCKETS_KEY))
+    bulk_export.plan()
+    return bulk_export.execute()
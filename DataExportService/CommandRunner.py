@@ -0,0 +1,556 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : CommandRunner
+Purpose             : Runs the external commands of the exports (hadoop fs, distcp, sqoop). One supervisor thread per
+                      service process starts every command in its own process group and reads the stdout and stderr
+                      of all the running commands from non-blocking pipes with a single poll() loop. The supervisor
+                      kills the process group of a command that runs past its timeout or is cancelled (SIGTERM, then
+                      SIGKILL after kill_grace seconds) and reaps the commands with wait4, so their CPU time and peak
+                      memory are added to the span of the caller. At most max_processes commands run at the same
+                      time, the others wait for a slot. The callers wait for the exit code or read the output while
+                      the command runs; the output of a streamed command is buffered up to STREAM_BUFFER_BYTES, then
+                      its pipes are not read until the caller catches up.
+Input Parameters    : Shell command, timeout in seconds
+Output Value        : Exit code and output of the command
+Dependencies        : None
+Predecessor Module  : ExportContext, HdfsToS3, HdfsFanOut, S3ToHdfs, SqoopUtility, DataExportService, WorkQueue
+Successor Module    : Tracing, Metrics
+Pre-requisites      : [commands] section of settings.conf
+How to run          : exit_code, output = CommandRunner.run("hadoop fs -du -s /tmp/x", CommandRunner.fs_timeout())
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import time
+import errno
+import fcntl
+import select
+import signal
+import threading
+import traceback
+import collections
+from subprocess import Popen, PIPE, STDOUT
+from ConfigUtility import get_snapshot
+from LogSetup import logger
+import Metrics
+import Tracing
+
+"""
+Module Constants
+"""
+MODULE_NAME = "CommandRunner"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "commands"
+DEFAULT_MAX_PROCESSES = 64
+DEFAULT_FS_TIMEOUT = 1800
+DEFAULT_JOB_TIMEOUT = 0
+DEFAULT_KILL_GRACE = 10
+READ_SIZE = 65536
+# Output of a streamed command buffered before its pipes are no longer read, the command then blocks on its writes
+STREAM_BUFFER_BYTES = 4194304
+# Bytes of the stderr of a command kept when it is not merged with stdout
+ERROR_OUTPUT_BYTES = 65536
+# Seconds between two checks of a command that closed its output but has not exited yet
+REAP_INTERVAL = 0.05
+# Exit code of a command that could not be started, or was cancelled before it started
+EXIT_NOT_STARTED = -1
+STATE_WAITING = "waiting"
+STATE_RUNNING = "running"
+REASON_TIMEOUT = "timeout"
+REASON_CANCELLED = "cancelled"
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_max_processes():
+    return max(1, get_snapshot(CONFIGURATION_FILE).get_int(SETTINGS_SECTION, "max_processes",
+                                                          DEFAULT_MAX_PROCESSES))
+
+
+def _get_timeout(option, default):
+    timeout = get_snapshot(CONFIGURATION_FILE).get_float(SETTINGS_SECTION, option, default)
+    return timeout if timeout > 0 else None
+
+
+def fs_timeout():
+    """Timeout of the hadoop fs commands (listings, du, rm, test), None for no limit"""
+    return _get_timeout("fs_timeout", DEFAULT_FS_TIMEOUT)
+
+
+def job_timeout():
+    """Timeout of the distcp and sqoop jobs and of the hadoop fs -cat/-put streams, None for no limit"""
+    return _get_timeout("job_timeout", DEFAULT_JOB_TIMEOUT)
+
+
+def get_kill_grace():
+    return max(0.0, get_snapshot(CONFIGURATION_FILE).get_float(SETTINGS_SECTION, "kill_grace", DEFAULT_KILL_GRACE))
+
+
+def _set_flag(fd, flag):
+    fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | flag)
+
+
+def _set_non_blocking(fd):
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+
+class Command(object):
+    """
+    One command run by the supervisor. The output of a captured command is kept until the command is done, the output
+    of a streamed command is read with lines() or read() while it runs.
+    """
+
+    def __init__(self, runner, command, timeout, stream, stdin, merge_stderr):
+        self.runner = runner
+        self.command = command
+        self.timeout = timeout
+        self.stream = stream
+        self.stdin_pipe = stdin
+        self.merge_stderr = merge_stderr
+        self.condition = threading.Condition(threading.Lock())
+        self.chunks = collections.deque()
+        self.buffered = 0
+        self.error_chunks = collections.deque()
+        self.error_bytes = 0
+        self.eof = False
+        self.discard = False
+        self.started = threading.Event()
+        self.finished = threading.Event()
+        self.process = None
+        self.stdin = None
+        self.exit_code = None
+        self.rusage = None
+        self.kill_reason = None
+        self.cancel_requested = False
+        self.recorded = False
+        # Supervisor state
+        self.open_fds = set()
+        self.paused_fds = set()
+        self.deadline = None
+        self.kill_at = None
+
+    """
+    Purpose   :   Called by the supervisor with the output read from the command
+    Input     :   Bytes read, True when read from stderr
+    Output    :   Returns True when the buffer is full and the pipes of the command must not be read for now
+    """
+
+    def add_output(self, data, from_stderr):
+        with self.condition:
+            if from_stderr:
+                self.error_chunks.append(data)
+                self.error_bytes += len(data)
+                while self.error_bytes - len(self.error_chunks[0]) >= ERROR_OUTPUT_BYTES:
+                    self.error_bytes -= len(self.error_chunks.popleft())
+                return False
+            if self.discard:
+                return False
+            self.chunks.append(data)
+            self.buffered += len(data)
+            self.condition.notify_all()
+            return self.stream and self.buffered >= STREAM_BUFFER_BYTES
+
+    def buffer_full(self):
+        return self.stream and not self.discard and self.buffered >= STREAM_BUFFER_BYTES
+
+    def finish(self, exit_code, rusage):
+        message = self.kill_message()
+        with self.condition:
+            if message and not self.discard:
+                self.chunks.append(message + "\n")
+                self.buffered += len(message) + 1
+            self.exit_code = exit_code
+            self.rusage = rusage
+            self.eof = True
+            self.condition.notify_all()
+        self.started.set()
+        self.finished.set()
+
+    def kill_message(self):
+        if self.kill_reason == REASON_TIMEOUT:
+            return "Command timed out after %g seconds" % self.timeout
+        if self.kill_reason == REASON_CANCELLED:
+            return "Command cancelled"
+        return None
+
+    def next_chunk(self, limit=None):
+        with self.condition:
+            while not self.chunks and not self.eof:
+                self.condition.wait()
+            if not self.chunks:
+                return ""
+            chunk = self.chunks.popleft()
+            if limit is not None and len(chunk) > limit:
+                self.chunks.appendleft(chunk[limit:])
+                chunk = chunk[:limit]
+            was_full = self.buffer_full()
+            self.buffered -= len(chunk)
+            resume = was_full and not self.buffer_full()
+        if resume:
+            self.runner.wakeup()
+        return chunk
+
+    """
+    Purpose   :   Iterate over the output of a streamed command while it runs. A command killed after its timeout or
+                  cancelled ends with a line saying so
+    Input     :   None
+    Output    :   Yields the lines of the output, with their end of line
+    """
+
+    def lines(self):
+        partial = ""
+        while True:
+            chunk = self.next_chunk()
+            if not chunk:
+                break
+            lines = (partial + chunk).split("\n")
+            partial = lines.pop()
+            for line in lines:
+                yield line + "\n"
+        if partial:
+            yield partial
+
+    def read(self, size=None):
+        """Read up to size bytes of a streamed command, all of its output when size is None, "" at the end"""
+        pieces = []
+        remaining = size
+        while remaining is None or remaining > 0:
+            chunk = self.next_chunk(remaining)
+            if not chunk:
+                break
+            pieces.append(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+        return "".join(pieces)
+
+    """
+    Purpose   :   Wait for the end of the command. The output of a streamed command that was not read is dropped
+                  so the command is not blocked on its pipes. The CPU time, peak memory and exit code are added
+                  to the current span of the caller
+    Input     :   None
+    Output    :   Returns the exit code, negative for a command killed by a signal (see EXIT_NOT_STARTED)
+    """
+
+    def wait(self):
+        if self.stream and not self.finished.is_set():
+            with self.condition:
+                self.discard = True
+                self.chunks.clear()
+                self.buffered = 0
+            self.runner.wakeup()
+        self.finished.wait()
+        if not self.recorded:
+            self.recorded = True
+            if self.rusage is not None:
+                Tracing.current_span().set(cpu_user_seconds=self.rusage.ru_utime,
+                                           cpu_system_seconds=self.rusage.ru_stime,
+                                           max_rss_kb=self.rusage.ru_maxrss, exit_code=self.exit_code)
+        return self.exit_code
+
+    def done(self):
+        return self.finished.is_set()
+
+    def output(self):
+        """Output of a captured command, once it is done"""
+        with self.condition:
+            return "".join(self.chunks)
+
+    def error_output(self):
+        """Last ERROR_OUTPUT_BYTES of the stderr of a command started with merge_stderr=False"""
+        with self.condition:
+            return "".join(self.error_chunks)
+
+    def cancel(self):
+        """Kill the process group of the command, or drop the command if it is waiting for a slot"""
+        self.runner.cancel(self)
+
+
+class Supervisor(threading.Thread):
+    """
+    Starts, reads, times out and reaps the commands of the process. The commands waiting for a slot and the
+    cancellations are handed over under a lock and a byte written to a pipe wakes the poll() loop up.
+    """
+
+    def __init__(self, max_processes=None):
+        threading.Thread.__init__(self, name="CommandRunner")
+        self.daemon = True
+        self.pid = os.getpid()
+        self.max_processes = max_processes
+        self.lock = threading.Lock()
+        self.waiting = collections.deque()
+        self.running = set()
+        self.fds = {}
+        self.poller = select.poll()
+        self.wake_read, self.wake_write = os.pipe()
+        for fd in (self.wake_read, self.wake_write):
+            _set_non_blocking(fd)
+            _set_flag(fd, fcntl.FD_CLOEXEC)
+        self.poller.register(self.wake_read, select.POLLIN)
+
+    def wakeup(self):
+        try:
+            os.write(self.wake_write, "x")
+        except OSError as e:
+            # The pipe is full, the supervisor is already woken up
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def submit(self, command):
+        with self.lock:
+            self.waiting.append(command)
+        Metrics.COMMANDS.inc(1, STATE_WAITING)
+        self.wakeup()
+
+    def cancel(self, command):
+        with self.lock:
+            if command in self.waiting:
+                self.waiting.remove(command)
+                Metrics.COMMANDS.dec(1, STATE_WAITING)
+                command.kill_reason = REASON_CANCELLED
+                Metrics.COMMAND_KILLS.inc(1, REASON_CANCELLED)
+                command.finish(EXIT_NOT_STARTED, None)
+                return
+            command.cancel_requested = True
+        self.wakeup()
+
+    def commands(self):
+        with self.lock:
+            return list(self.waiting) + list(self.running)
+
+    def run(self):
+        while True:
+            try:
+                self.step()
+            except Exception:
+                logger.error("Command supervisor error: " + traceback.format_exc())
+                time.sleep(REAP_INTERVAL)
+
+    def step(self):
+        self.start_waiting()
+        now = time.time()
+        for command in list(self.running):
+            self.check(command, now)
+        try:
+            events = self.poller.poll(self.poll_timeout(time.time()))
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        for fd, _ in events:
+            if fd == self.wake_read:
+                try:
+                    while os.read(self.wake_read, 4096):
+                        pass
+                except OSError as e:
+                    if e.errno != errno.EAGAIN:
+                        raise
+            elif fd in self.fds:
+                self.read(fd)
+
+    def start_waiting(self):
+        max_processes = self.max_processes or get_max_processes()
+        while True:
+            with self.lock:
+                if not self.waiting or len(self.running) >= max_processes:
+                    return
+                command = self.waiting.popleft()
+                self.running.add(command)
+            Metrics.COMMANDS.dec(1, STATE_WAITING)
+            self.launch(command)
+
+    def launch(self, command):
+        try:
+            # A new session per command: the whole process group (the shell, hadoop and its children) is killed
+            process = Popen(command.command, shell=True, stdin=PIPE if command.stdin_pipe else None, stdout=PIPE,
+                            stderr=STDOUT if command.merge_stderr else PIPE, preexec_fn=os.setsid)
+        except Exception as e:
+            with self.lock:
+                self.running.discard(command)
+            logger.error("Unable to start the command: " + str(e))
+            command.add_output("Unable to start the command: " + str(e) + "\n", False)
+            command.finish(EXIT_NOT_STARTED, None)
+            return
+        Metrics.COMMANDS.inc(1, STATE_RUNNING)
+        command.process = process
+        if command.timeout:
+            command.deadline = time.time() + command.timeout
+        pipes = [(process.stdout, False)] + ([(process.stderr, True)] if process.stderr else [])
+        for pipe, from_stderr in pipes:
+            fd = pipe.fileno()
+            _set_non_blocking(fd)
+            # Commands started later must not inherit the pipes, an inherited stdin would never be closed
+            _set_flag(fd, fcntl.FD_CLOEXEC)
+            self.fds[fd] = (command, from_stderr, pipe)
+            command.open_fds.add(fd)
+            self.poller.register(fd, select.POLLIN)
+        if process.stdin:
+            _set_flag(process.stdin.fileno(), fcntl.FD_CLOEXEC)
+            command.stdin = process.stdin
+        command.started.set()
+
+    def read(self, fd):
+        command, from_stderr, _ = self.fds[fd]
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            data = ""
+        if not data:
+            self.close_fd(fd)
+            if not command.open_fds:
+                self.reap(command)
+        elif command.add_output(data, from_stderr):
+            self.poller.unregister(fd)
+            command.paused_fds.add(fd)
+
+    def close_fd(self, fd):
+        command, _, pipe = self.fds.pop(fd)
+        if fd in command.paused_fds:
+            command.paused_fds.discard(fd)
+        else:
+            self.poller.unregister(fd)
+        command.open_fds.discard(fd)
+        pipe.close()
+
+    def check(self, command, now):
+        if command.kill_reason is None:
+            if command.cancel_requested:
+                self.kill(command, REASON_CANCELLED)
+            elif command.deadline is not None and now >= command.deadline:
+                self.kill(command, REASON_TIMEOUT)
+        elif command.kill_at is not None and now >= command.kill_at:
+            command.kill_at = None
+            self.signal(command, signal.SIGKILL)
+        if command.paused_fds and not command.buffer_full():
+            for fd in command.paused_fds:
+                self.poller.register(fd, select.POLLIN)
+            command.paused_fds.clear()
+        if not command.open_fds:
+            self.reap(command)
+
+    def kill(self, command, reason):
+        command.kill_reason = reason
+        Metrics.COMMAND_KILLS.inc(1, reason)
+        logger.warning("Killing the process group " + str(command.process.pid) + ": " + command.kill_message())
+        self.signal(command, signal.SIGTERM)
+        command.kill_at = time.time() + get_kill_grace()
+
+    def signal(self, command, signal_number):
+        try:
+            os.killpg(command.process.pid, signal_number)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def reap(self, command):
+        try:
+            pid, status, rusage = os.wait4(command.process.pid, os.WNOHANG)
+        except OSError as e:
+            if e.errno != errno.ECHILD:
+                raise
+            # Reaped by someone else, the exit status is lost
+            pid, status, rusage = command.process.pid, None, None
+        if pid == 0:
+            return
+        if status is None:
+            exit_code = EXIT_NOT_STARTED if command.process.returncode is None else command.process.returncode
+        elif os.WIFSIGNALED(status):
+            exit_code = -os.WTERMSIG(status)
+        else:
+            exit_code = os.WEXITSTATUS(status)
+        command.process.returncode = exit_code
+        with self.lock:
+            self.running.discard(command)
+        Metrics.COMMANDS.dec(1, STATE_RUNNING)
+        command.finish(exit_code, rusage)
+
+    def poll_timeout(self, now):
+        """Milliseconds until the next deadline, kill or exit check, -1 to wait for the pipes only"""
+        wakeups = []
+        for command in self.running:
+            if not command.open_fds:
+                wakeups.append(now + REAP_INTERVAL)
+            if command.kill_reason is None and command.deadline is not None:
+                wakeups.append(command.deadline)
+            if command.kill_at is not None:
+                wakeups.append(command.kill_at)
+        if not wakeups:
+            return -1
+        return max(0, int((min(wakeups) - now) * 1000) + 1)
+
+
+"""
+Purpose   :   Return the supervisor of this process, started on first use. A process forked from a process with a
+              supervisor starts its own
+Input     :   None
+Output    :   Returns the Supervisor
+"""
+
+
+def get_runner():
+    global _runner
+    runner = _runner
+    if runner is None or runner.pid != os.getpid():
+        with _runner_lock:
+            runner = _runner
+            if runner is None or runner.pid != os.getpid():
+                runner = Supervisor()
+                runner.start()
+                _runner = runner
+    return runner
+
+
+"""
+Purpose   :   Start a shell command. It waits for a slot when max_processes commands are running, its timeout
+              starts once it runs
+Input     :   Shell command, timeout in seconds (None for no limit), stream: the output is read with lines() or
+              read() while the command runs instead of being kept until the end, stdin: the caller writes the input
+              of the command to command.stdin (the call waits for the command to start), merge_stderr: stderr is
+              part of the output, otherwise its end is kept apart (error_output())
+Output    :   Returns the Command
+"""
+
+
+def start(command, timeout=None, stream=False, stdin=False, merge_stderr=True):
+    runner = get_runner()
+    running_command = Command(runner, command, timeout, stream, stdin, merge_stderr)
+    runner.submit(running_command)
+    if stdin:
+        running_command.started.wait()
+    return running_command
+
+
+def run(command, timeout=None):
+    """Run a shell command and return its exit code and its output, stderr included"""
+    running_command = start(command, timeout)
+    exit_code = running_command.wait()
+    return exit_code, running_command.output()
+
+
+"""
+Purpose   :   Cancel the commands of the process, when the exports still running are abandoned by a stopping worker
+Input     :   Seconds to wait for the commands to end (kill_grace and a few seconds by default)
+Output    :   Returns the number of commands cancelled
+"""
+
+
+def cancel_all(timeout=None):
+    runner = _runner
+    if runner is None or runner.pid != os.getpid():
+        return 0
+    commands = runner.commands()
+    for command in commands:
+        command.cancel()
+    deadline = time.time() + (get_kill_grace() + 5 if timeout is None else timeout)
+    for command in commands:
+        command.finished.wait(max(0, deadline - time.time()))
+    if commands:
+        logger.warning(str(len(commands)) + " commands cancelled")
+    return len(commands)
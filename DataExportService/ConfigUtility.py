@@ -14,42 +14,229 @@ Execution Steps     :   1.Import this class in the class where we need to read v
 Predecessor module  :   All modules which reads values from configuration files
 Successor module    :
 Pre-requisites      :
-Last changed on     :   12th August 2015
-Last changed by     :   Amal G Jose
-Reason for change   :   Removed PEP 8 errors and Pychecker errors
+Last changed on     :
+Last changed by     :
+Reason for change   :   Each configuration file is parsed once into an immutable snapshot, cached by file and
+                        replaced when the modification time of the file changes. Lookups are dictionary lookups
+                        by key path (section and name, or the json hierarchy), typed values are cached per
+                        snapshot.
 """
 
 # Define all module level constants here
 MODULE_NAME = "ConfigUtility"
 
+import os
 import json
+import time
+import threading
+from ConfigParser import SafeConfigParser
+
+# Seconds between two checks of the modification time of a configuration file
+RELOAD_CHECK_INTERVAL = 1.0
+TRUE_VALUES = ("y", "yes", "true", "on", "1")
+FALSE_VALUES = ("n", "no", "false", "off", "0")
+
+_config_files = {}
+_config_files_lock = threading.Lock()
+
+
+class FrozenDict(dict):
+    """
+    Read-only dictionary holding the json objects of a snapshot
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Configuration snapshots are read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+"""
+Class holding the values of one version of a configuration file, keyed by their key path
+"""
+class ConfigSnapshot(object):
+    __slots__ = ("path", "version", "values", "typed_values")
+
+    def __init__(self, path, version, values):
+        object.__setattr__(self, "path", path)
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "values", FrozenDict(values))
+        object.__setattr__(self, "typed_values", {})
+
+    def __setattr__(self, name, value):
+        raise TypeError("Configuration snapshots are read-only")
+
+    """
+    Purpose            :   Return the value at a key path, (section, name) for a .conf file or the json hierarchy
+    Input              :   Key path tuple, default value
+    Output             :   Returns the value or the default if the path does not exist
+    """
+    def lookup(self, path, default=None):
+        return self.values.get(path, default)
+
+    def get(self, conf_section, conf_name, default=None):
+        # SafeConfigParser stores the option names in lower case
+        return self.values.get((conf_section, conf_name.lower()), default)
+
+    def has(self, conf_section, conf_name):
+        return (conf_section, conf_name.lower()) in self.values
+
+    """
+    Purpose            :   Return a value converted to int, float or bool. Missing and empty values return the
+                           default, the converted value is cached in the snapshot
+    Input              :   Section, configuration name, default value
+    Output             :   Returns the converted value. Raises ValueError if the value cannot be converted
+    """
+    def get_int(self, conf_section, conf_name, default=None):
+        return self._get_typed(conf_section, conf_name, default, int)
+
+    def get_float(self, conf_section, conf_name, default=None):
+        return self._get_typed(conf_section, conf_name, default, float)
+
+    def get_bool(self, conf_section, conf_name, default=None):
+        return self._get_typed(conf_section, conf_name, default, to_bool)
+
+    def _get_typed(self, conf_section, conf_name, default, converter):
+        key = (conf_section, conf_name, converter)
+        try:
+            return self.typed_values[key]
+        except KeyError:
+            pass
+        value = self.values.get((conf_section, conf_name.lower()))
+        if value is None or (isinstance(value, basestring) and value.strip() == ""):
+            return default
+        value = converter(value.strip() if isinstance(value, basestring) else value)
+        self.typed_values[key] = value
+        return value
+
+
+def to_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in TRUE_VALUES:
+        return True
+    if str(value).lower() in FALSE_VALUES:
+        return False
+    raise ValueError("Not a boolean value: " + str(value))
+
+
+def parse_conf_file(path, version):
+    parser = SafeConfigParser()
+    parser.read(path)
+    values = {}
+    for section in parser.sections():
+        for name in parser.options(section):
+            try:
+                values[(section, name)] = parser.get(section, name)
+            except Exception:
+                values[(section, name)] = parser.get(section, name, raw=True)
+    return ConfigSnapshot(path, version, values)
+
+
+def flatten(value, path, values):
+    values[path] = freeze(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(item, path + (key,), values)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            flatten(item, path + (index,), values)
+    return values
+
+
+def parse_json_file(path, version):
+    with open(path) as config_fp:
+        return ConfigSnapshot(path, version, flatten(json.load(config_fp), (), {}))
+
+
+"""
+Class keeping the current snapshot of a configuration file. The modification time and size of the file are checked
+at most once every RELOAD_CHECK_INTERVAL seconds; when they changed the file is parsed into a new snapshot, which
+replaces the current one in a single assignment. A file that fails to parse keeps the previous snapshot.
+"""
+class ConfigFile(object):
+
+    def __init__(self, path, parse):
+        self.path = path
+        self.parse = parse
+        self.lock = threading.Lock()
+        self.current = None
+        self.checked = 0
+
+    def get_version(self):
+        try:
+            file_stat = os.stat(self.path)
+            return file_stat.st_mtime, file_stat.st_size
+        except OSError:
+            return None
+
+    def snapshot(self):
+        current = self.current
+        if current is not None and time.time() - self.checked < RELOAD_CHECK_INTERVAL:
+            return current
+        with self.lock:
+            if self.current is not None and time.time() - self.checked < RELOAD_CHECK_INTERVAL:
+                return self.current
+            self.checked = time.time()
+            version = self.get_version()
+            if self.current is None or version != self.current.version:
+                try:
+                    self.current = self.parse(self.path, version)
+                except Exception:
+                    if self.current is None:
+                        self.current = ConfigSnapshot(self.path, version, {})
+            return self.current
+
+
+def _get_config_file(conf_file, parse):
+    path = os.path.realpath(conf_file)
+    config_file = _config_files.get((path, parse))
+    if config_file is None:
+        with _config_files_lock:
+            config_file = _config_files.setdefault((path, parse), ConfigFile(path, parse))
+    return config_file
+
+
+"""
+Purpose            :   Return the current snapshot of a .conf file, parsing it on first use and again when it changed
+Input              :   Configuration file
+Output             :   Returns a ConfigSnapshot
+"""
+def get_snapshot(conf_file):
+    return _get_config_file(conf_file, parse_conf_file).snapshot()
+
+
+def get_json_snapshot(conf_file):
+    return _get_config_file(conf_file, parse_json_file).snapshot()
 
 
 """
 Class contains all the functions related to ConfigUtility
 """
 class ConfigUtility(object):
-    from ConfigParser import SafeConfigParser
-    # Instantiating SafeConfigParser()
-    parser = SafeConfigParser()
 
     # Parametrized constructor with Configuration file as input
     def __init__(self, conf_file):
-        try:
-            self.parser.read(conf_file)
-        except:
-            pass
+        self.conf_file = conf_file
 
     """
     Purpose            :   This method will read the value of a configuration parameter corresponding to
                            a section in the configuration file
     Input              :   Section in the configuration file, Configuration Name
-    
+
     Output             :   Returns the value of the configuration parameter present in the configuration file
     """
     def get_configuration(self, conf_section, conf_name):
         try:
-            return self.parser.get(conf_section, conf_name)
+            return get_snapshot(self.conf_file).get(conf_section, conf_name)
         except:
             pass
 
@@ -62,17 +249,18 @@ class JsonConfigUtility(object):
 
     # Parametrized constructor with Configuration file as input
     def __init__(self, conf_file=None, conf=None):
+        self.conf_file = conf_file
+        self.snapshot = None
         try:
-            if conf_file is not None:
-                config_fp = open(conf_file)
-                self.json_configuration = json.load(config_fp)
-            elif conf is not None:
-                self.json_configuration = conf
-            else:
-                self.json_configuration = {}
+            if conf_file is None:
+                self.snapshot = ConfigSnapshot(None, None, flatten(conf if conf is not None else {}, (), {}))
         except:
             pass
 
+    @property
+    def json_configuration(self):
+        return self.get_configuration(())
+
     """
     Purpose            :   This method will read the value of a configuration parameter corresponding to
                            a section in the configuration file
@@ -81,7 +269,7 @@ class JsonConfigUtility(object):
     """
     def get_configuration(self, conf_hierarchy):
         try:
-
-            return reduce(lambda dictionary, key: dictionary[key], conf_hierarchy, self.json_configuration)
+            snapshot = self.snapshot if self.snapshot is not None else get_json_snapshot(self.conf_file)
+            return snapshot.lookup(tuple(conf_hierarchy))
         except:
-            pass
\ No newline at end of file
+            pass
@@ -1,23 +1,56 @@
 import sys
 import os
+import time
 from flask import request
-from flask import Flask, jsonify
-from ConfigParser import SafeConfigParser
+from flask import Flask, jsonify, Response, stream_with_context, url_for
+from ConfigUtility import get_snapshot
 import SeviceConstants
 from flask import abort
-import SqoopUtility
-import LocalToS3
-import HdfsToS3
 from LogSetup import logger
 from flask_basicauth import BasicAuth
+import WsgiServer
+import Metrics
+import ExportRegistry
+import JobEvents
+import JobLog
+import WorkQueue
+import CommandRunner
+import ExportHistory
+import Tracing
+from EDLExceptions import BackendUnavailable
 
 
 CONFIGURATION_FILE =os.path.normpath(os.path.dirname(os.path.realpath(__file__)))+'/settings.conf'
-parser = SafeConfigParser()
-parser.read(CONFIGURATION_FILE)
-host = parser.get("servicesettings","host")
-port = parser.get("servicesettings","port")
-servicename=parser.get("servicesettings","servicename")
+SETTINGS_SECTION = "servicesettings"
+settings = get_snapshot(CONFIGURATION_FILE)
+host = settings.get(SETTINGS_SECTION, "host")
+port = settings.get(SETTINGS_SECTION, "port")
+servicename = settings.get(SETTINGS_SECTION, "servicename")
+
+
+def get_setting(name, default):
+    return get_snapshot(CONFIGURATION_FILE).get(SETTINGS_SECTION, name, default)
+
+
+def get_int_setting(name, default):
+    return get_snapshot(CONFIGURATION_FILE).get_int(SETTINGS_SECTION, name, default)
+
+
+server_mode = get_setting("server_mode", WsgiServer.SERVER_MODE_PRODUCTION)
+graceful_timeout = get_int_setting("graceful_timeout", WsgiServer.DEFAULT_GRACEFUL_TIMEOUT)
+metrics_dir = get_setting("metrics_dir", None)
+metrics_flush_interval = get_int_setting("metrics_flush_interval", Metrics.DEFAULT_FLUSH_INTERVAL)
+backend_loading = get_setting("backend_loading", ExportRegistry.LOADING_BACKGROUND)
+
+
+# Read again on every call, so a change of settings.conf resizes the worker pool without a restart
+def get_workers():
+    return get_int_setting("workers", WsgiServer.DEFAULT_WORKERS)
+
+
+def get_threads_per_worker():
+    return get_int_setting("threads_per_worker", WsgiServer.DEFAULT_THREADS_PER_WORKER)
+
 response={"success":"False"}
 
 app = Flask(servicename)
@@ -28,6 +61,89 @@ app.config['BASIC_AUTH_USERNAME'] = 'admin'
 app.config['BASIC_AUTH_PASSWORD'] = 'admin'
 
 
+def run_export(export_type, handler, config):
+    Metrics.IN_FLIGHT_JOBS.inc(1, export_type)
+    started = time.time()
+    try:
+        with Metrics.REQUEST_LATENCY.time(export_type), Tracing.span("export", export_type=export_type):
+            result = handler(config)
+    finally:
+        Metrics.IN_FLIGHT_JOBS.dec(1, export_type)
+    status = result.get("status", "UNKNOWN") if isinstance(result, dict) else "FAILED"
+    Metrics.REQUESTS.inc(1, export_type, status)
+    if export_type != ExportRegistry.BULK_EXPORT:
+        ExportHistory.record(export_type, config, result, time.time() - started)
+    return result
+
+
+"""
+Purpose   :   Start the export as a job. With "async": true in the request the export runs in a background thread
+              and the job id is returned at once with status 202; otherwise the result of the export is returned
+              with its job id. When the work queue is enabled the job is added to the queue and run by the
+              workers of the fleet instead (see WorkQueue). The progress of the job is available at
+              /dataexportservice/jobs/<job_id>/events, and with "trace": true its phase timings at
+              /dataexportservice/jobs/<job_id>/trace
+Input     :   Export type and the request json, optionally containing job_id, async and trace
+Output    :   Returns the flask response
+"""
+
+
+def submit_export(export_type, config):
+    try:
+        handler = ExportRegistry.get_handler(export_type)
+    except BackendUnavailable as e:
+        return abort(501, str(e))
+    job_id = config.get("job_id")
+    if job_id is not None and (not JobEvents.is_valid_job_id(job_id) or
+                               os.path.exists(JobEvents.events_path(job_id))):
+        logger.error("Invalid or already used job_id " + str(job_id))
+        return abort(400, SeviceConstants.INVALID_INPUT)
+    job = JobEvents.start_job(job_id, export_type)
+    if config.get("trace", JobEvents.is_tracing_default()):
+        job.trace = Tracing.Trace(job.job_id)
+    events_url = url_for("jobEvents", job_id=job.job_id)
+    if WorkQueue.is_enabled():
+        return submit_to_queue(export_type, config, job, events_url)
+    if config.get("async"):
+        JobEvents.set_current_job(None)
+        JobEvents.run_in_background(job, lambda job_config: run_export(export_type, handler, job_config), config)
+        accepted = {"status": "RUNNING", "job_id": job.job_id, "events_url": events_url}
+        if job.trace is not None:
+            accepted["trace_url"] = url_for("jobTrace", job_id=job.job_id)
+        return jsonify(accepted), 202
+    result = {"status": "FAILED"}
+    try:
+        result = run_export(export_type, handler, config)
+    finally:
+        job.finish(result)
+        JobEvents.set_current_job(None)
+    response = dict(result) if isinstance(result, dict) else {"status": "FAILED"}
+    response["job_id"] = job.job_id
+    response["events_url"] = events_url
+    if job.trace is not None:
+        response["trace_url"] = url_for("jobTrace", job_id=job.job_id)
+    return jsonify(response)
+
+
+def submit_to_queue(export_type, config, job, events_url):
+    # The worker claiming the job continues its events file
+    job.close()
+    JobEvents.set_current_job(None)
+    WorkQueue.get_queue().submit_job(job.job_id, export_type, config)
+    if config.get("async"):
+        accepted = {"status": "QUEUED", "job_id": job.job_id, "events_url": events_url}
+        if config.get("trace", JobEvents.is_tracing_default()):
+            accepted["trace_url"] = url_for("jobTrace", job_id=job.job_id)
+        return jsonify(accepted), 202
+    result = WorkQueue.wait_for_result(job.job_id)
+    response = dict(result) if isinstance(result, dict) else {"status": "FAILED"}
+    response["job_id"] = job.job_id
+    response["events_url"] = events_url
+    if config.get("trace", JobEvents.is_tracing_default()):
+        response["trace_url"] = url_for("jobTrace", job_id=job.job_id)
+    return jsonify(response)
+
+
 @app.route('/dataexportservice/export', methods=['POST'])
 @basic_auth.required
 def exportToS3():
@@ -36,19 +152,121 @@ def exportToS3():
         logger.error(SeviceConstants.REQUIRED_PARAMETER_MISSING)
         return abort(400, SeviceConstants.REQUIRED_PARAMETER_MISSING)
 
-    if request.json["export_type"] == "dbexport":
-        response= SqoopUtility.runSqoop(request.json)
-    elif request.json["export_type"] == "hdfsToS3":
-        response=HdfsToS3.runHdfsTOS3(request.json)
+    if not ExportRegistry.is_export_type(request.json["export_type"]):
+        logger.error(SeviceConstants.REQUIRED_PARAMETER_MISSING)
+        return abort(400, SeviceConstants.INVALID_INPUT)
+    return submit_export(request.json["export_type"], request.json)
 
-    elif request.json["export_type"]=="localToS3":
-        response = LocalToS3.runLocalTos3Upload(request.json)
-    else:
+
+"""
+Purpose   :   Dry run of an export: takes the payload of /dataexportservice/export and returns the files, bytes,
+              delta against the target, batching, tuning and estimated duration of the export without moving data
+              (see ExportPlanner)
+Input     :   Request json of an export
+Output    :   Returns the plan json
+"""
+
+
+@app.route('/dataexportservice/plan', methods=['POST'])
+@basic_auth.required
+def planExport():
+
+    if not request.json or "export_type" not in request.json.keys():
         logger.error(SeviceConstants.REQUIRED_PARAMETER_MISSING)
+        return abort(400, SeviceConstants.REQUIRED_PARAMETER_MISSING)
+
+    if not ExportRegistry.is_export_type(request.json["export_type"]):
+        logger.error(SeviceConstants.INVALID_INPUT)
         return abort(400, SeviceConstants.INVALID_INPUT)
-    return jsonify(response)
+    # Imported on first use, the planner loads boto3 which is slow to import
+    import ExportPlanner
+    return jsonify(ExportPlanner.plan_export(request.json["export_type"], request.json))
+
+
+@app.route('/dataexportservice/bulkexport', methods=['POST'])
+@basic_auth.required
+def bulkExportToS3():
+
+    if not request.json or "exports" not in request.json.keys():
+        logger.error(SeviceConstants.REQUIRED_PARAMETER_MISSING)
+        return abort(400, SeviceConstants.REQUIRED_PARAMETER_MISSING)
+
+    return submit_export(ExportRegistry.BULK_EXPORT, request.json)
+
+
+@app.route('/dataexportservice/jobs/<job_id>/events', methods=['GET'])
+@basic_auth.required
+def jobEvents(job_id):
+    if not JobEvents.is_valid_job_id(job_id):
+        return abort(400, SeviceConstants.INVALID_INPUT)
+    last_event_id = request.headers.get("Last-Event-ID", "0")
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else 0
+    # One request thread of the worker is always left to the other requests
+    stream = JobEvents.open_stream(job_id, last_event_id, max(1, get_threads_per_worker() - 1))
+    if stream is None:
+        logger.error("Too many event streams open, rejecting the stream of job " + job_id)
+        return abort(503)
+    return Response(stream_with_context(stream),
+                    mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route('/dataexportservice/jobs/<job_id>/trace', methods=['GET'])
+@basic_auth.required
+def jobTrace(job_id):
+    if not JobEvents.is_valid_job_id(job_id):
+        return abort(400, SeviceConstants.INVALID_INPUT)
+    trace_format = request.args.get("format", Tracing.FORMAT_CHROME)
+    if trace_format not in (Tracing.FORMAT_CHROME, Tracing.FORMAT_FOLDED):
+        return abort(400, SeviceConstants.INVALID_INPUT)
+    trace = Tracing.load_trace(job_id, trace_format)
+    if trace is None:
+        return abort(404)
+    if trace_format == Tracing.FORMAT_FOLDED:
+        return Response(trace, mimetype="text/plain",
+                        headers={"Content-Disposition": "attachment; filename=" + job_id + ".folded"})
+    return Response(trace, mimetype="application/json",
+                    headers={"Content-Disposition": "attachment; filename=" + job_id + ".trace.json"})
+
+
+@app.route('/dataexportservice/metrics', methods=['GET'])
+@basic_auth.required
+def metrics():
+    return Response(Metrics.render(), content_type=Metrics.CONTENT_TYPE)
+
+
+def start_worker():
+    JobEvents.purge_old_jobs()
+    JobLog.purge_old_logs()
+    if metrics_dir:
+        Metrics.registry.start_snapshot_writer(metrics_dir, metrics_flush_interval)
+    if backend_loading == ExportRegistry.LOADING_BACKGROUND:
+        ExportRegistry.warm_up()
+    if WorkQueue.is_enabled():
+        WorkQueue.start_worker()
+
+
+def stop_worker(timeout):
+    deadline = time.time() + timeout
+    background_done = JobEvents.wait_background_jobs(timeout)
+    stopped = WorkQueue.stop_worker(max(0, deadline - time.time())) and background_done
+    if not stopped:
+        # The exports still running are abandoned, their hadoop and sqoop commands must not outlive the worker
+        CommandRunner.cancel_all()
+    return stopped
 
 
 if __name__ == '__main__':
-    logger.info("Starting service" )
-    app.run(host=host, port=int(port), debug=True)
+    logger.info("Starting service in " + server_mode + " mode")
+    if server_mode == WsgiServer.SERVER_MODE_DEVELOPMENT:
+        if backend_loading == ExportRegistry.LOADING_BACKGROUND:
+            ExportRegistry.warm_up()
+        if WorkQueue.is_enabled():
+            WorkQueue.start_worker()
+        app.run(host=host, port=int(port), debug=True)
+    else:
+        if metrics_dir:
+            Metrics.registry.clear_snapshots(metrics_dir)
+        WsgiServer.serve_forever(app, host, int(port), workers=get_workers, threads=get_threads_per_worker,
+                                 graceful_timeout=graceful_timeout,
+                                 on_worker_start=start_worker, on_worker_stop=stop_worker)
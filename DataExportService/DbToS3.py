@@ -0,0 +1,269 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : DbToS3
+Purpose             : Database table export to S3 in one request, with the sqoop import and the S3 transfer running
+                      at the same time. Sqoop imports the table into a staging directory on HDFS, with the version 2
+                      output committer so every map task moves its part file into the directory as soon as it
+                      finishes. The staging directory is polled while the import runs and each new part file is
+                      copied to the target with the distcp transfer, verification and retries of HdfsToS3, so the
+                      export takes about as long as the longer of the two stages instead of their sum. When the import
+                      succeeded and the last part files are copied, the staging directory is deleted. A failed export
+                      removes the objects written (atomic_transaction) and the staging directory. When sqoop runs the
+                      import again after a transient failure, the objects copied from the failed run are removed first.
+                      On a cluster ignoring the committer setting the part files appear when the job commits and are
+                      copied after the import.
+Input Parameters    : db_type, db_name, user_name, password, table_name, db_host, db_port, s3_credentials,
+                      target_path (S3) and optionally staging_dir, num_mappers, transfer_workers, atomic_transaction
+Output Value        : Status json with the record_count and the files_copied_list array (file_name, file_size)
+Dependencies        : SqoopUtility, HdfsToS3, hadoop and sqoop command line
+Predecessor Module  : DataExportService
+Successor Module    : SqoopUtility, HdfsToS3
+Pre-requisites      : [dbtos3] section of settings.conf
+How to run          : Call runDbToS3 with the request json
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import uuid
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+from LogSetup import logger
+from ConfigUtility import get_snapshot
+from ExportContext import ExportContext, split_s3_path, run_command, parse_hdfs_listing
+from SqoopUtility import SqoopUtility, RETURN_KEYS, STATUS_TYPE
+import HdfsToS3
+import JobEvents
+import Tracing
+
+"""
+Module Constants
+"""
+MODULE_NAME = "DbToS3"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "dbtos3"
+STATUS_KEY = "status"
+STATUS_SUCCESS = "SUCCESS"
+STATUS_FAILED = "FAILED"
+MESSAGE_KEY = "message"
+RECORD_COUNT_KEY = "record_count"
+FILES_COPIED_LIST_KEY = "files_copied_list"
+FILE_NAME_KEY = "file_name"
+FILE_SIZE_KEY = "file_size"
+FLAG_YES = "y"
+
+DB_KEYS = ("user_name", "password", "db_name", "db_type", "db_host", "db_port", "table_name")
+S3_CREDENTIALS_KEY = "s3_credentials"
+TARGET_PATH_KEY = "target_path"
+STAGING_DIR_KEY = "staging_dir"
+NUM_MAPPERS_KEY = "num_mappers"
+TRANSFER_WORKERS_KEY = "transfer_workers"
+ATOMIC_TRANSACTION_KEY = "atomic_transaction"
+DEFAULT_STAGING_ROOT = "/tmp/dataexportservice_staging"
+DEFAULT_POLL_INTERVAL = 5
+DEFAULT_TRANSFER_WORKERS = 4
+# Generic option of the import: a map task moves its output into the target directory when it finishes, instead of
+# all the outputs being moved when the job commits
+COMMITTER_OPTION = "-Dmapreduce.fileoutputcommitter.algorithm.version=2"
+
+
+class DbToS3(object):
+    def __init__(self, config, context=None):
+        self.config = config
+        self.context = context if context is not None else ExportContext()
+        self.db_config = [str(config[key]) for key in DB_KEYS]
+        self.s3_credentials_json = config[S3_CREDENTIALS_KEY]
+        self.target_path = config[TARGET_PATH_KEY].rstrip("/")
+        if not split_s3_path(self.target_path)[1]:
+            raise ValueError("The target of a database export must be a prefix, not the bucket root")
+        settings = get_snapshot(CONFIGURATION_FILE)
+        staging_root = settings.get(SETTINGS_SECTION, "staging_root") or DEFAULT_STAGING_ROOT
+        self.staging_dir = (config.get(STAGING_DIR_KEY) or staging_root.rstrip("/") + "/" +
+                            config["table_name"] + "_" + uuid.uuid4().hex).rstrip("/")
+        self.num_mappers = config.get(NUM_MAPPERS_KEY)
+        self.poll_interval = settings.get_int(SETTINGS_SECTION, "poll_interval", DEFAULT_POLL_INTERVAL)
+        self.transfer_workers = max(1, int(config.get(TRANSFER_WORKERS_KEY) or settings.get_int(
+            SETTINGS_SECTION, TRANSFER_WORKERS_KEY, DEFAULT_TRANSFER_WORKERS)))
+        self.hdfs_to_s3 = HdfsToS3.HdfsToS3(self.context)
+        self.hdfs_to_s3.atomic_transaction = (config.get(ATOMIC_TRANSACTION_KEY) or FLAG_YES).lower()
+        self.sqoop_utility = SqoopUtility()
+        self.option_string = None
+        # Part files copied (name : status) and S3 paths written, shared by the poll loop and the retries of sqoop
+        self.copied = {}
+        self.target_paths = []
+        self.failed = None
+        # Sqoop process of the failed run while the import is restarted, its part files are not copied any more
+        self.restarting = None
+        self.lock = threading.Lock()
+        self.import_finished = threading.Event()
+        self.import_status = None
+        self.job = JobEvents.current_job()
+
+    def generate_command(self):
+        command = self.sqoop_utility.generate_command(*(self.db_config + [self.staging_dir]))
+        if not isinstance(command, str):
+            raise ValueError("Invalid db_type " + self.db_config[3])
+        # Generic options go before the options of the tool
+        command = command.replace("sqoop import ", "sqoop import " + COMMITTER_OPTION + " ", 1)
+        if self.num_mappers:
+            command += " --num-mappers " + str(int(self.num_mappers))
+        return command
+
+    def run_import(self, command):
+        JobEvents.set_current_job(self.job)
+        try:
+            self.import_status = self.sqoop_utility.execute_sqoop_command(command, self.restart)
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            logger.error("Sqoop import into " + self.staging_dir + " failed: " + traceback.format_exc())
+            self.import_status = {RETURN_KEYS[0]: STATUS_TYPE[1], RETURN_KEYS[1]: -1,
+                                  RETURN_KEYS[2]: "Sqoop import failed"}
+        finally:
+            self.import_finished.set()
+
+    """
+    Purpose   :   Called by sqoop before it runs the import again: waits for the copies in progress and removes the
+                  objects copied from the failed run, its part files are written again. The staging directory is
+                  not polled until the new run is started, sqoop deletes it in between
+    Input     :   None
+    Output    :   Returns True if the objects were removed, otherwise the import is not retried
+    """
+
+    def restart(self):
+        with self.lock:
+            if self.failed is not None:
+                return False
+            if self.target_paths and not self.hdfs_to_s3.s3_cleanup(self.target_paths, self.s3_credentials_json):
+                self.failed = "Unable to remove the objects copied from the failed import"
+                return False
+            logger.info("Dropping " + str(len(self.copied)) + " part files copied from the failed import")
+            self.copied = {}
+            self.target_paths = []
+            self.restarting = self.sqoop_utility.command
+            return True
+
+    """
+    Purpose   :   List the part files committed to the staging directory and copy the ones not copied yet. Hidden
+                  entries (_temporary, _SUCCESS) are left out
+    Input     :   None
+    Output    :   None, a failed copy is recorded in self.failed
+    """
+
+    @Tracing.traced("dbtos3.poll")
+    def copy_new_files(self):
+        with self.lock:
+            if self.failed is not None:
+                return
+            if self.restarting is not None:
+                if self.sqoop_utility.command is self.restarting and not self.import_finished.is_set():
+                    return
+                self.restarting = None
+            exit_code, output = run_command("hadoop fs -ls " + self.staging_dir)
+            if exit_code != 0:
+                # The import has not created the directory yet
+                return
+            names = sorted(os.path.basename(path) for path in parse_hdfs_listing(output))
+            names = [name for name in names if name[:1] not in ("_", ".") and name not in self.copied]
+            if not names:
+                return
+            logger.info("Copying " + str(len(names)) + " part files of " + self.staging_dir + " to " +
+                        self.target_path)
+            pool = ThreadPool(min(self.transfer_workers, len(names)))
+            try:
+                statuses = pool.map(self.copy_file, names)
+            finally:
+                pool.close()
+                pool.join()
+            for name, status in zip(names, statuses):
+                if not status[FILE_NAME_KEY]:
+                    self.failed = "Transfer of " + self.staging_dir + "/" + name + " failed"
+                    return
+                self.copied[name] = status
+
+    def copy_file(self, name):
+        JobEvents.set_current_job(self.job)
+        target_paths = []
+        status = self.hdfs_to_s3.transfer_file_with_retries(self.option_string, self.staging_dir, name,
+                                                            self.target_path, self.s3_credentials_json, set(),
+                                                            target_paths)
+        self.target_paths.extend(target_paths)
+        if status[FILE_NAME_KEY]:
+            JobEvents.publish(JobEvents.EVENT_FILE_COPIED, **status)
+        return status
+
+    def cleanup_staging(self):
+        if self.sqoop_utility.dir_exists(self.staging_dir) and not self.sqoop_utility.delete_dir(self.staging_dir):
+            logger.error("Unable to delete the staging directory " + self.staging_dir)
+
+    def run(self):
+        status_message = ""
+        try:
+            self.option_string = self.hdfs_to_s3.create_command_options_string(self.s3_credentials_json)
+            if not self.option_string:
+                status_message = "Error Occured while creating hadoop distcp options"
+                raise Exception
+            command = self.generate_command()
+            status_message = "Exporting table " + self.db_config[6] + " to " + self.target_path + " through " + \
+                             self.staging_dir
+            logger.info(status_message)
+            importer = threading.Thread(target=self.run_import, args=(command,), name="dbtos3-import")
+            importer.daemon = True
+            importer.start()
+            # One more listing after the import finished picks up the last part files
+            while True:
+                finished = self.import_finished.is_set()
+                self.copy_new_files()
+                if finished or self.failed is not None:
+                    break
+                self.import_finished.wait(self.poll_interval)
+            if self.failed is not None:
+                # The import cannot succeed any more
+                self.sqoop_utility.cancel()
+            importer.join()
+
+            record_count = self.import_status[RETURN_KEYS[1]]
+            if self.failed is not None:
+                status_message = self.failed
+            elif self.import_status[RETURN_KEYS[0]] != STATUS_TYPE[0]:
+                status_message = "Sqoop import failed: " + str(self.import_status[RETURN_KEYS[2]])
+            else:
+                self.cleanup_staging()
+                files_copied_list = [self.copied[name] for name in sorted(self.copied)]
+                return {STATUS_KEY: STATUS_SUCCESS, RECORD_COUNT_KEY: record_count,
+                        FILES_COPIED_LIST_KEY: files_copied_list}
+
+            logger.error(status_message)
+            if self.hdfs_to_s3.atomic_transaction == FLAG_YES and self.target_paths:
+                self.hdfs_to_s3.s3_cleanup(self.target_paths, self.s3_credentials_json)
+            self.cleanup_staging()
+            return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: status_message, RECORD_COUNT_KEY: record_count,
+                    FILES_COPIED_LIST_KEY: []}
+
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+
+        except:
+            logger.error(status_message + " ERROR MESSAGE: " + traceback.format_exc())
+            return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: status_message, FILES_COPIED_LIST_KEY: []}
+
+
+"""
+Purpose   :   Entry point of the dbToS3 export type
+Input     :   Request json, optional ExportContext shared with other exports
+Output    :   Returns the status of the export
+"""
+
+
+def runDbToS3(config, context=None):
+    try:
+        db_to_s3 = DbToS3(config, context)
+    except Exception:
+        logger.error("Error Parsing Input Config " + traceback.format_exc())
+        return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Error Parsing Input Config", FILES_COPIED_LIST_KEY: []}
+    return db_to_s3.run()
@@ -0,0 +1,164 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : DedupIndex
+Purpose             : Content-hash index of the objects written by the exports, used by the dedup mode of HdfsToS3.
+                      Each row maps the HDFS checksum and size of a file to an S3 object holding the same bytes;
+                      a file whose checksum is already indexed in one of the allowed buckets is copied server side
+                      from that object instead of being uploaded again. The index is a SQLite database in WAL mode,
+                      shared by the threads and worker processes of the service on one node. An entry is only a
+                      hint: the object is checked with HeadObject before it is copied and dropped when it is gone or
+                      its ETag is not the one recorded when it was written (the object was overwritten since).
+Input Parameters    : Checksum, size, bucket and key
+Output Value        : Objects holding the same content
+Dependencies        : sqlite3
+Predecessor Module  : HdfsToS3
+Successor Module    : None
+Pre-requisites      : index_path in the [dedup] section of settings.conf on a local file system
+How to run          : DedupIndex.get_index().lookup(checksum, size, [bucket])
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import time
+import sqlite3
+import threading
+from ConfigUtility import get_snapshot
+from LogSetup import logger
+
+"""
+Module Constants
+"""
+MODULE_NAME = "DedupIndex"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "dedup"
+DEFAULT_INDEX_PATH = "/tmp/dataexportservice_dedup.sqlite"
+# Seconds a writer waits for the lock of the database held by another thread or worker
+LOCK_TIMEOUT = 30
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    checksum TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    object_key TEXT NOT NULL,
+    indexed_at REAL NOT NULL,
+    etag TEXT,
+    PRIMARY KEY (checksum, size, bucket, object_key)
+)
+"""
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def is_enabled(config):
+    """The request flag "dedup" (y/n) overrides enabled in the [dedup] section"""
+    flag = config.get("dedup") if isinstance(config, dict) else None
+    if flag is None:
+        return get_snapshot(CONFIGURATION_FILE).get_bool(SETTINGS_SECTION, "enabled", False)
+    return str(flag).strip().lower() in ("y", "yes", "true", "1")
+
+
+def get_checksum_options():
+    return get_snapshot(CONFIGURATION_FILE).get(SETTINGS_SECTION, "checksum_options") or ""
+
+
+class DedupIndex(object):
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(SCHEMA)
+        # Indexes created before the ETags were recorded; their rows have no ETag and are never copied from
+        if "etag" not in [row[1] for row in connection.execute("PRAGMA table_info(objects)").fetchall()]:
+            connection.execute("ALTER TABLE objects ADD COLUMN etag TEXT")
+        connection.commit()
+
+    def connection(self):
+        # One connection per thread and process; a connection inherited through fork is not reused
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    """
+    Purpose   :   Find the indexed objects holding a content
+    Input     :   Checksum, size in bytes, buckets to search
+    Output    :   Returns a list of (bucket, key, etag), the most recently indexed first. etag is None for the rows
+                  indexed without one
+    """
+
+    def lookup(self, checksum, size, buckets):
+        if not buckets:
+            return []
+        placeholders = ",".join("?" * len(buckets))
+        rows = self.connection().execute(
+            "SELECT bucket, object_key, etag FROM objects WHERE checksum = ? AND size = ? AND bucket IN (" +
+            placeholders + ") ORDER BY indexed_at DESC", [checksum, size] + list(buckets)).fetchall()
+        return [(bucket, key, etag) for bucket, key, etag in rows]
+
+    """
+    Purpose   :   Record objects written by an export
+    Input     :   List of (checksum, size, bucket, key, etag), the ETag of the object once written
+    Output    :   None
+    """
+
+    def add(self, entries):
+        if not entries:
+            return
+        now = time.time()
+        connection = self.connection()
+        with connection:
+            connection.executemany("INSERT OR REPLACE INTO objects (checksum, size, bucket, object_key, etag, "
+                                   "indexed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                   [tuple(entry) + (now,) for entry in entries])
+
+    def remove(self, bucket, key):
+        connection = self.connection()
+        with connection:
+            connection.execute("DELETE FROM objects WHERE bucket = ? AND object_key = ?", (bucket, key))
+
+    """
+    Purpose   :   Drop the entries of the objects below a prefix, e.g. after a rollback deleted them
+    Input     :   Bucket, key prefix
+    Output    :   None
+    """
+
+    def remove_prefix(self, bucket, prefix):
+        connection = self.connection()
+        with connection:
+            connection.execute("DELETE FROM objects WHERE bucket = ? AND (object_key = ? OR substr(object_key, 1, ?) "
+                               "= ?)", (bucket, prefix, len(prefix.rstrip("/")) + 1, prefix.rstrip("/") + "/"))
+
+
+"""
+Purpose   :   Return the index configured in the [dedup] section, opened once per process
+Input     :   None
+Output    :   Returns a DedupIndex, or None if the index cannot be opened
+"""
+
+
+def get_index():
+    path = get_snapshot(CONFIGURATION_FILE).get(SETTINGS_SECTION, "index_path") or DEFAULT_INDEX_PATH
+    index = _indexes.get(path)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(path)
+            if index is None:
+                try:
+                    index = DedupIndex(path)
+                except Exception as e:
+                    logger.error("Unable to open the dedup index " + path + ": " + str(e))
+                    return None
+                _indexes[path] = index
+    return index
@@ -24,3 +24,11 @@ class HashDoesNotMatch(Exception):
 class FileSizeDoesNotMatchException(Exception):
     pass
 
+
+
+class BackendUnavailable(Exception):
+    pass
+
+
+class WorkerStopping(Exception):
+    pass
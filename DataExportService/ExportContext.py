@@ -0,0 +1,320 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : ExportContext
+Purpose             : Holds the state that can be shared between the transfers of one export or of a batch of
+                      exports: boto3 clients per set of credentials, HDFS directory listings, S3 inventories and
+                      the transfers waiting for a deferred size verification; and the path and hadoop command
+                      helpers shared by the exports.
+Input Parameters    : None
+Output Value        : None
+Dependencies        : boto3, hadoopy
+Predecessor Module  : HdfsToS3, BulkExport
+Successor Module    : None
+Pre-requisites      : None
+How to run          : Create one ExportContext per export (or per batch) and pass it to HdfsToS3
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import bisect
+import threading
+from urlparse import urlparse
+import collections
+from multiprocessing.pool import ThreadPool
+import boto3
+import CommandRunner
+import JobEvents
+import Metrics
+import Tracing
+from LogSetup import logger
+
+"""
+Module Constants
+"""
+MODULE_NAME = "ExportContext"
+ACCESS_KEY = "aws_access_key_id"
+SECRET_KEY = "aws_secret_access_key"
+ENDPOINT_URL_KEY = "endpoint_url"
+# Output lines of a failed hadoop fs -ls kept for the error message
+LISTING_ERROR_LINES = 20
+# Transfers checked at the same time by verify_pending
+VERIFY_CONCURRENCY = 16
+
+
+"""
+Purpose   :   Split a s3/s3a/s3n url into bucket name and key
+Input     :   S3 url, e.g. s3a://bucket/path/file
+Output    :   Returns a tuple of bucket name and key (key is "" for the bucket root)
+"""
+
+
+def split_s3_path(s3_path):
+    path = s3_path[s3_path.index("://") + 3:]
+    if "/" not in path:
+        return path, ""
+    bucket_name, key = path.split("/", 1)
+    return bucket_name, key
+
+
+def hdfs_path_of(path):
+    """Path part of an HDFS uri: hdfs://namenode:8020/tmp/x and /tmp/x are both /tmp/x"""
+    return urlparse(path).path.rstrip("/") or "/"
+
+
+"""
+Purpose   :   Run a hadoop fs command with the timeout of the [commands] section and collect its output
+Input     :   Command (String)
+Output    :   Returns the exit code and the output of the command
+"""
+
+
+def run_command(command):
+    return CommandRunner.run(command, CommandRunner.fs_timeout())
+
+
+"""
+Purpose   :   Parse the output of hadoop fs -ls [-R]
+Input     :   Output of the command
+Output    :   Returns a dictionary of file path (see hdfs_path_of) to size, directories are left out
+"""
+
+
+def parse_hdfs_listing(output):
+    sizes = {}
+    for line in output.splitlines():
+        fields = line.split(None, 7)
+        if len(fields) == 8 and fields[0].startswith("-") and fields[4].isdigit():
+            sizes[hdfs_path_of(fields[7])] = int(fields[4])
+    return sizes
+
+
+def credentials_key(s3_credentials_json):
+    return (s3_credentials_json.get(ACCESS_KEY), s3_credentials_json.get(SECRET_KEY),
+            s3_credentials_json.get(ENDPOINT_URL_KEY))
+
+
+class S3Inventory(object):
+    """
+    Sorted listing of the objects under a prefix of a bucket. Sizes of a file or of a whole directory are summed
+    with a bisect over the sorted keys instead of a scan of the listing.
+    """
+
+    def __init__(self, objects):
+        objects = sorted(objects)
+        self.keys = [key for key, _ in objects]
+        self.sizes = [size for _, size in objects]
+
+    """
+    Purpose   :   Total size of the object stored at key, or of all the objects below key/ when key is a directory
+    Input     :   S3 key
+    Output    :   Returns the size in bytes and the number of objects counted
+    """
+
+    def size_of(self, key):
+        size = 0
+        count = 0
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            size += self.sizes[index]
+            count += 1
+            index += 1
+        directory = key.rstrip("/") + "/"
+        index = max(index, bisect.bisect_left(self.keys, directory))
+        while index < len(self.keys) and self.keys[index].startswith(directory):
+            size += self.sizes[index]
+            count += 1
+            index += 1
+        return size, count
+
+
+class ExportContext(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.s3_clients = {}
+        self.hdfs_listings = {}
+        self.s3_inventories = {}
+        self.defer_verification = False
+        self.pending_verifications = []
+
+    """
+    Purpose   :   Context for an export run inside a batch: it shares the S3 clients and the cached listings of
+                  this context, and verifies its own transfers
+    Input     :   None
+    Output    :   Returns an ExportContext
+    """
+
+    def shared(self):
+        context = ExportContext()
+        context.lock = self.lock
+        context.s3_clients = self.s3_clients
+        context.hdfs_listings = self.hdfs_listings
+        context.s3_inventories = self.s3_inventories
+        return context
+
+    """
+    Purpose   :   Return the boto3 client for a set of credentials, creating it on first use
+    Input     :   s3_credentials_json
+    Output    :   Returns a boto3 S3 client
+    """
+
+    def get_s3_client(self, s3_credentials_json):
+        key = credentials_key(s3_credentials_json)
+        with self.lock:
+            client = self.s3_clients.get(key)
+            if client is None:
+                client = boto3.client('s3', aws_access_key_id=key[0], aws_secret_access_key=key[1],
+                                      endpoint_url=key[2])
+                self.s3_clients[key] = client
+        return client
+
+    """
+    Purpose   :   List a HDFS directory, reusing the listing of an earlier call for the same path
+    Input     :   HDFS path
+    Output    :   Returns the list of absolute paths in the directory
+    """
+
+    def list_hdfs(self, path):
+        with self.lock:
+            listing = self.hdfs_listings.get(path)
+        if listing is None:
+            # Imported here so the exports that never touch HDFS (localToS3) do not need hadoopy
+            import hadoopy
+            with Tracing.span("hdfs.ls", path=path):
+                listing = hadoopy.ls(path)
+            with self.lock:
+                self.hdfs_listings[path] = listing
+        return listing
+
+    """
+    Purpose   :   Stream a HDFS directory listing. The entries are yielded while hadoop fs -ls prints them, so a
+                  directory of millions of files is never held in memory. The listing is not cached
+    Input     :   HDFS path
+    Output    :   Yields the absolute paths in the directory (the path itself for a file). Raises an exception when
+                  the listing fails
+    """
+
+    def iter_hdfs(self, path):
+        with Tracing.span("hdfs.ls", path=path):
+            command = CommandRunner.start("hadoop fs -ls " + path, CommandRunner.fs_timeout(), stream=True)
+            other_lines = collections.deque(maxlen=LISTING_ERROR_LINES)
+            try:
+                for line in command.lines():
+                    fields = line.rstrip("\n").split(None, 7)
+                    if len(fields) == 8 and fields[0][:1] in ("-", "d"):
+                        yield fields[7]
+                    else:
+                        other_lines.append(line)
+                if command.wait() != 0:
+                    raise Exception("Error listing " + path + ": " + "".join(other_lines).strip())
+            finally:
+                # The consumer stopped before the end of the listing
+                if not command.done():
+                    command.cancel()
+                    command.wait()
+
+    """
+    Purpose   :   List every object of a bucket below a prefix, following the pagination of list_objects_v2
+    Input     :   Bucket name, key prefix, s3_credentials_json
+    Output    :   Returns a list of (key, size) tuples
+    """
+
+    def list_s3_objects(self, bucket_name, prefix, s3_credentials_json):
+        s3 = self.get_s3_client(s3_credentials_json)
+        objects = []
+        kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+        while True:
+            response = Metrics.s3_call("list_objects_v2", s3.list_objects_v2, **kwargs)
+            for item in response.get("Contents", []):
+                objects.append((item["Key"], item["Size"]))
+            if not response.get("IsTruncated"):
+                return objects
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    """
+    Purpose   :   Return the inventory of a bucket prefix, listing it only once per context unless refreshed
+    Input     :   Bucket name, key prefix, s3_credentials_json, refresh flag
+    Output    :   Returns a S3Inventory
+    """
+
+    def get_s3_inventory(self, bucket_name, prefix, s3_credentials_json, refresh=False):
+        cache_key = (bucket_name, prefix, credentials_key(s3_credentials_json))
+        with self.lock:
+            inventory = None if refresh else self.s3_inventories.get(cache_key)
+        if inventory is None:
+            inventory = S3Inventory(self.list_s3_objects(bucket_name, prefix, s3_credentials_json))
+            with self.lock:
+                self.s3_inventories[cache_key] = inventory
+        return inventory
+
+    """
+    Purpose   :   Queue a transfer for size verification after the whole batch has been copied
+    Input     :   S3 target path, s3_credentials_json, expected size in bytes
+    Output    :   None
+    """
+
+    def add_pending_verification(self, target_file_path, s3_credentials_json, expected_size):
+        with self.lock:
+            self.pending_verifications.append((target_file_path, s3_credentials_json, expected_size))
+
+    """
+    Purpose   :   Size of a transferred target: the object at key, or the objects below key/ when there is no such
+                  object (a directory copied by distcp). Only the target itself is listed, so verifying the entries
+                  of a directory one batch at a time costs one request per file instead of listings of the whole
+                  directory growing as the files land
+    Input     :   Bucket name, key, s3_credentials_json
+    Output    :   Returns the size in bytes
+    """
+
+    def size_of_target(self, bucket_name, key, s3_credentials_json):
+        s3 = self.get_s3_client(s3_credentials_json)
+        try:
+            return Metrics.s3_call("head_object", s3.head_object, Bucket=bucket_name, Key=key)["ContentLength"]
+        except Exception as e:
+            error_code = getattr(e, "response", {}).get("Error", {}).get("Code")
+            if error_code not in ("404", "NoSuchKey", "NotFound"):
+                raise
+        directory = key.rstrip("/") + "/"
+        return S3Inventory(self.list_s3_objects(bucket_name, directory, s3_credentials_json)).size_of(key)[0]
+
+    """
+    Purpose   :   Verify every pending transfer, VERIFY_CONCURRENCY at a time (see size_of_target)
+    Input     :   None
+    Output    :   Returns a dictionary of target path to verified size, or None when the sizes do not match
+    """
+
+    @Tracing.traced("verify_pending")
+    def verify_pending(self):
+        with self.lock:
+            pending = self.pending_verifications
+            self.pending_verifications = []
+        if not pending:
+            return {}
+        job = JobEvents.current_job()
+
+        def verify(item):
+            JobEvents.set_current_job(job)
+            target_file_path, s3_credentials_json, expected_size = item
+            bucket_name, key = split_s3_path(target_file_path)
+            try:
+                size = self.size_of_target(bucket_name, key, s3_credentials_json)
+            except Exception as e:
+                logger.error("Unable to check the size of " + target_file_path + " for verification: " + str(e))
+                return target_file_path, None
+            if size != expected_size:
+                logger.error("Size of source and target do not match for " + target_file_path +
+                             ". S3 size = " + str(size) + " Hdfs size = " + str(expected_size))
+                return target_file_path, None
+            return target_file_path, size
+
+        if len(pending) == 1:
+            return dict([verify(pending[0])])
+        pool = ThreadPool(min(VERIFY_CONCURRENCY, len(pending)))
+        try:
+            return dict(pool.map(verify, pending))
+        finally:
+            pool.close()
+            pool.join()
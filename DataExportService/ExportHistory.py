@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : ExportHistory
+Purpose             : Throughput history of the exports, used by ExportPlanner to estimate the duration of an export
+                      before it runs. Every successful export records its type, its destination (the S3 bucket or
+                      hdfs), the bytes and files written and its duration in a SQLite database in WAL mode shared by
+                      the workers of the node. The estimate of an export uses the last history_runs runs of the same
+                      type and destination, or of the same type when the destination has no history.
+Input Parameters    : Export type, request json, result and duration of an export
+Output Value        : Throughput of the past runs
+Dependencies        : sqlite3
+Predecessor Module  : DataExportService, WorkQueue, ExportPlanner
+Successor Module    : None
+Pre-requisites      : history_path in the [planner] section of settings.conf
+How to run          : ExportHistory.record("hdfsToS3", request_json, result, seconds)
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import time
+import sqlite3
+import threading
+from ConfigUtility import get_snapshot
+from LogSetup import logger
+
+"""
+Module Constants
+"""
+MODULE_NAME = "ExportHistory"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "planner"
+DEFAULT_HISTORY_PATH = "/tmp/dataexportservice_history.sqlite"
+DEFAULT_HISTORY_RUNS = 20
+# Seconds a writer waits for the lock of the database held by another thread or worker
+LOCK_TIMEOUT = 30
+STATUS_KEY = "status"
+STATUS_SUCCESS = "SUCCESS"
+FILES_COPIED_LIST_KEY = "files_copied_list"
+FILE_SIZE_KEY = "file_size"
+BYTES_SAVED_KEY = "bytes_saved"
+DESTINATION_HDFS = "hdfs"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    export_type TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    finished_at REAL NOT NULL
+)
+"""
+INDEX = "CREATE INDEX IF NOT EXISTS runs_type ON runs (export_type, destination, finished_at)"
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def bucket_of(path):
+    """s3://bucket for an S3 url, hdfs for any other path"""
+    if isinstance(path, basestring) and "://" in path and path.split("://", 1)[0].startswith("s3"):
+        return "s3://" + path.split("://", 1)[1].split("/", 1)[0]
+    return DESTINATION_HDFS
+
+
+"""
+Purpose   :   Name the destination of an export, the key of its throughput history
+Input     :   Export type, request json
+Output    :   Returns the S3 bucket (s3://bucket, the sorted buckets separated by commas for several target paths)
+              or hdfs
+"""
+
+
+def destination_of(export_type, config):
+    if export_type == "localToS3":
+        return "s3://" + str(config.get("bucket_name"))
+    if export_type == "dbexport":
+        return bucket_of(config.get("destination"))
+    target = config.get("target_path")
+    if isinstance(target, list):
+        return ",".join(sorted(set(bucket_of(item.get("target_path") if isinstance(item, dict) else item)
+                                   for item in target)))
+    return bucket_of(target)
+
+
+class ExportHistory(object):
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(SCHEMA)
+        connection.execute(INDEX)
+        connection.commit()
+
+    def connection(self):
+        # One connection per thread and process; a connection inherited through fork is not reused
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def add(self, export_type, destination, size, files, seconds):
+        connection = self.connection()
+        with connection:
+            connection.execute("INSERT INTO runs (export_type, destination, bytes, files, seconds, finished_at) "
+                               "VALUES (?, ?, ?, ?, ?, ?)", (export_type, destination, size, files, seconds,
+                                                             time.time()))
+
+    """
+    Purpose   :   Sum the last runs of an export type, to one destination or to any destination
+    Input     :   Export type, destination (None for all the destinations), number of runs
+    Output    :   Returns (runs, bytes, files, seconds)
+    """
+
+    def totals(self, export_type, destination, runs):
+        query = "SELECT bytes, files, seconds FROM runs WHERE export_type = ?"
+        parameters = [export_type]
+        if destination is not None:
+            query += " AND destination = ?"
+            parameters.append(destination)
+        rows = self.connection().execute(query + " ORDER BY finished_at DESC LIMIT ?",
+                                         parameters + [runs]).fetchall()
+        return (len(rows), sum(row[0] for row in rows), sum(row[1] for row in rows),
+                sum(row[2] for row in rows))
+
+    def purge(self, export_type, destination, keep):
+        """Keep the last keep runs of a type and destination, older ones are not used by the estimates"""
+        connection = self.connection()
+        with connection:
+            connection.execute("DELETE FROM runs WHERE export_type = ? AND destination = ? AND rowid NOT IN "
+                               "(SELECT rowid FROM runs WHERE export_type = ? AND destination = ? ORDER BY "
+                               "finished_at DESC LIMIT ?)", (export_type, destination, export_type, destination,
+                                                             keep))
+
+
+def get_history_runs():
+    return max(1, get_snapshot(CONFIGURATION_FILE).get_int(SETTINGS_SECTION, "history_runs", DEFAULT_HISTORY_RUNS))
+
+
+"""
+Purpose   :   Return the history configured in the [planner] section, opened once per process
+Input     :   None
+Output    :   Returns an ExportHistory, or None if the history cannot be opened
+"""
+
+
+def get_history():
+    path = get_snapshot(CONFIGURATION_FILE).get(SETTINGS_SECTION, "history_path") or DEFAULT_HISTORY_PATH
+    history = _histories.get(path)
+    if history is None:
+        with _histories_lock:
+            history = _histories.get(path)
+            if history is None:
+                try:
+                    history = ExportHistory(path)
+                except Exception as e:
+                    logger.error("Unable to open the export history " + path + ": " + str(e))
+                    return None
+                _histories[path] = history
+    return history
+
+
+"""
+Purpose   :   Record the throughput of a successful export. The bytes are the sizes of files_copied_list, so an
+              export to several destinations counts the bytes written to each of them. The bytes_saved of a dedup
+              export were copied server side or skipped, not uploaded, and are not counted
+Input     :   Export type, request json, result and duration in seconds of the export
+Output    :   None
+"""
+
+
+def record(export_type, config, result, seconds):
+    if not isinstance(result, dict) or result.get(STATUS_KEY) != STATUS_SUCCESS or seconds <= 0:
+        return
+    try:
+        history = get_history()
+        if history is None:
+            return
+        files = result.get(FILES_COPIED_LIST_KEY) or []
+        size = sum(int(status.get(FILE_SIZE_KEY) or 0) for status in files)
+        size = max(0, size - int(result.get(BYTES_SAVED_KEY) or 0))
+        destination = destination_of(export_type, config)
+        history.add(export_type, destination, size, len(files), seconds)
+        history.purge(export_type, destination, get_history_runs())
+    except KeyboardInterrupt:
+        raise KeyboardInterrupt
+    except Exception as e:
+        logger.error("Unable to record the throughput of the " + export_type + " export: " + str(e))
+
+
+"""
+Purpose   :   Estimate the duration of an export from the throughput of the past runs of its type, to the same
+              destination if it has history, otherwise to any destination. Exports of unknown size (database
+              imports) are estimated with the average duration of the past runs
+Input     :   Export type, destination, bytes to copy (None when unknown)
+Output    :   Returns a json with seconds (None without history), bytes_per_second, runs and basis (destination,
+              export_type or none)
+"""
+
+
+def estimate(export_type, destination, size):
+    estimate_json = {"seconds": None, "bytes_per_second": None, "runs": 0, "basis": "none"}
+    history = get_history()
+    if history is None:
+        return estimate_json
+    runs = get_history_runs()
+    for basis, scope in (("destination", destination), ("export_type", None)):
+        count, total_bytes, _, total_seconds = history.totals(export_type, scope, runs)
+        if not count or total_seconds <= 0:
+            continue
+        if size is None:
+            seconds = total_seconds / count
+        elif total_bytes <= 0:
+            # Only empty runs, nothing to derive a throughput from
+            continue
+        else:
+            seconds = size / (float(total_bytes) / total_seconds)
+            estimate_json["bytes_per_second"] = int(float(total_bytes) / total_seconds)
+        estimate_json.update(seconds=round(seconds, 1), runs=count, basis=basis)
+        return estimate_json
+    return estimate_json
@@ -0,0 +1,367 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : ExportPlanner
+Purpose             : Dry run of an export, served by /dataexportservice/plan with the payload of
+                      /dataexportservice/export. The source is listed and compared with the target as the export
+                      would do it, without copying anything, and the plan reports the resolved file set (the first
+                      max_listed_files entries), the total bytes, the delta against the target (new, changed and
+                      unchanged files), how the files would be batched into distcp jobs, PutObject/multipart uploads or
+                      put batches, the tuning the export would use, and an estimated duration from the throughput
+                      recorded for the export type and destination (ExportHistory). Database imports are only known
+                      once sqoop runs: their plan reports the tuning and the average duration of the past imports.
+Input Parameters    : Request json of an export
+Output Value        : Plan json
+Dependencies        : ExportHistory, the export backends (imported on use), boto3, hadoop command line
+Predecessor Module  : DataExportService
+Successor Module    : HdfsToS3, HdfsFanOut, HiveToS3, S3ToHdfs, LocalToS3, ExportHistory
+Pre-requisites      : [planner] section of settings.conf
+How to run          : ExportPlanner.plan_export("hdfsToS3", request_json)
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import pipes
+import traceback
+from LogSetup import logger
+from ConfigUtility import get_snapshot
+from ExportContext import ExportContext, S3Inventory, split_s3_path, hdfs_path_of, run_command, parse_hdfs_listing
+import ExportHistory
+import Tracing
+
+"""
+Module Constants
+"""
+MODULE_NAME = "ExportPlanner"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "planner"
+DEFAULT_MAX_LISTED_FILES = 1000
+STATUS_KEY = "status"
+STATUS_SUCCESS = "SUCCESS"
+STATUS_FAILED = "FAILED"
+MESSAGE_KEY = "message"
+FILE_NAME_KEY = "file_name"
+FILE_SIZE_KEY = "file_size"
+TARGET_KEY = "target"
+ACTION_KEY = "action"
+ACTION_NEW = "new"
+ACTION_CHANGED = "changed"
+ACTION_UNCHANGED = "unchanged"
+# Map tasks of a sqoop import without --num-mappers
+SQOOP_DEFAULT_MAPPERS = 4
+
+
+def ceil_div(value, divisor):
+    return (value + divisor - 1) // divisor
+
+
+"""
+Purpose   :   Compare a source file or directory with the target
+Input     :   Inventory of the target (S3Inventory), key or path of the target, size of the source in bytes
+Output    :   Returns new when nothing is stored at the target, unchanged when the sizes match, otherwise changed
+"""
+
+
+def compare(inventory, key, size):
+    target_size, target_count = inventory.size_of(key)
+    if not target_count:
+        return ACTION_NEW
+    return ACTION_UNCHANGED if target_size == size else ACTION_CHANGED
+
+
+class ExportPlan(object):
+    """The file set of a plan with its delta, built one entry at a time"""
+
+    def __init__(self, max_listed_files):
+        self.max_listed_files = max_listed_files
+        self.files = []
+        self.file_count = 0
+        self.total_bytes = 0
+        self.delta = {}
+        for action in (ACTION_NEW, ACTION_CHANGED, ACTION_UNCHANGED):
+            self.delta[action + "_files"] = 0
+            self.delta[action + "_bytes"] = 0
+
+    def add(self, source, target, size, action, **extra):
+        self.file_count += 1
+        self.total_bytes += size
+        self.delta[action + "_files"] += 1
+        self.delta[action + "_bytes"] += size
+        if len(self.files) < self.max_listed_files:
+            entry = {FILE_NAME_KEY: source, TARGET_KEY: target, FILE_SIZE_KEY: size, ACTION_KEY: action}
+            entry.update(extra)
+            self.files.append(entry)
+
+    def result(self, bytes_to_copy, batching, tuning):
+        return {"file_count": self.file_count, "total_bytes": self.total_bytes, "bytes_to_copy": bytes_to_copy,
+                "files": self.files, "files_truncated": self.file_count > len(self.files), "delta": self.delta,
+                "batching": batching, "tuning": tuning}
+
+
+class ExportPlanner(object):
+    def __init__(self, export_type, config, context=None):
+        self.export_type = export_type
+        self.config = config
+        self.context = context if context is not None else ExportContext()
+        settings = get_snapshot(CONFIGURATION_FILE)
+        self.max_listed_files = max(0, settings.get_int(SETTINGS_SECTION, "max_listed_files",
+                                                        DEFAULT_MAX_LISTED_FILES))
+
+    def new_plan(self):
+        return ExportPlan(self.max_listed_files)
+
+    """
+    Purpose   :   Plan of an hdfsToS3 export to one target. Every entry of file_list (or of the listing of the source)
+                  is copied by its own distcp job, transfer_workers at a time, or split into file tasks of the work
+                  queue when it is enabled and the export has split_files entries. The sizes come from one recursive
+                  listing of the source
+    Input     :   None
+    Output    :   Returns the plan json
+    """
+
+    @Tracing.traced("plan.hdfs_to_s3")
+    def plan_hdfs_to_s3(self):
+        import HdfsToS3
+        import DedupIndex
+        import WorkQueue
+        source_path = self.config["source_path"]
+        target_path = self.config["target_path"].rstrip("/")
+        s3_credentials_json = self.config["s3_credentials"]
+        entries = self.config.get("file_list") or list(self.context.iter_hdfs(source_path))
+        exit_code, output = run_command("hadoop fs -ls -R " + pipes.quote(source_path))
+        if exit_code != 0:
+            raise Exception("Error listing " + source_path + ": " + output.strip()[-2000:])
+        source_files = S3Inventory(parse_hdfs_listing(output).items())
+        base_path = hdfs_path_of(source_path)
+        bucket_name, prefix = split_s3_path(target_path)
+        inventory = self.context.get_s3_inventory(bucket_name, prefix, s3_credentials_json, refresh=True)
+        plan = self.new_plan()
+        entry_sizes = []
+        for entry in entries:
+            path = hdfs_path_of(entry)
+            relative = path[len(base_path):].strip("/") if path.startswith(base_path) else \
+                entry.replace(source_path, "").strip("/")
+            size, _ = source_files.size_of(base_path.rstrip("/") + "/" + relative if relative else base_path)
+            key = prefix.rstrip("/") + "/" + relative if prefix and relative else relative or prefix
+            plan.add(entry, target_path + ("/" + relative if relative else ""), size, compare(inventory, key, size))
+            entry_sizes.append(size)
+
+        settings = get_snapshot(HdfsToS3.CONFIGURATION_FILE)
+        transfer_workers = max(1, settings.get_int(HdfsToS3.SETTINGS_SECTION, "transfer_workers",
+                                                   HdfsToS3.DEFAULT_TRANSFER_WORKERS))
+        queue_settings = get_snapshot(WorkQueue.CONFIGURATION_FILE)
+        split_files = queue_settings.get_int(WorkQueue.SETTINGS_SECTION, "split_files", WorkQueue.DEFAULT_SPLIT_FILES)
+        queued = WorkQueue.is_enabled() and len(entries) >= split_files
+        batching = {"kind": "distcp", "jobs": len(entries), "parallel": transfer_workers,
+                    "waves": ceil_div(len(entries), transfer_workers),
+                    "largest_job_bytes": max(entry_sizes) if entry_sizes else 0,
+                    "work_queue_file_tasks": len(entries) if queued else 0}
+        tuning = {"transfer_workers": transfer_workers,
+                  "queue_size": settings.get_int(HdfsToS3.SETTINGS_SECTION, "queue_size",
+                                                 HdfsToS3.DEFAULT_QUEUE_SIZE),
+                  "verify_batch": settings.get_int(HdfsToS3.SETTINGS_SECTION, "verify_batch",
+                                                   HdfsToS3.DEFAULT_VERIFY_BATCH),
+                  "multipart_block_size": int(HdfsToS3.S3A_MULTIPART_UPLOADS_BLOCK_SIZE),
+                  "dedup": DedupIndex.is_enabled(self.config), "work_queue": queued,
+                  "atomic_transaction": (self.config.get("atomic_transaction") or "y").lower()}
+        return plan.result(plan.total_bytes, batching, tuning)
+
+    """
+    Purpose   :   Plan of an hdfsToS3 export to several targets. Every file is read once and written to each
+                  destination in process, with one PutObject for a file smaller than part_size and a multipart
+                  upload otherwise; the delta is computed for every destination
+    Input     :   None
+    Output    :   Returns the plan json
+    """
+
+    @Tracing.traced("plan.fan_out")
+    def plan_fan_out(self):
+        import HdfsFanOut
+        fan_out = HdfsFanOut.HdfsFanOut(self.config, self.context)
+        files = fan_out.list_files()
+        plan = self.new_plan()
+        for destination in fan_out.destinations:
+            inventory = self.context.get_s3_inventory(destination.bucket_name, destination.prefix,
+                                                      destination.s3_credentials_json, refresh=True)
+            for item in files:
+                key = destination.key_for(item)
+                plan.add(item.hdfs_path, "s3://" + destination.bucket_name + "/" + key, item.size,
+                         compare(inventory, key, item.size))
+        large_files = [item for item in files if item.size >= fan_out.part_size]
+        batching = {"kind": "in_process", "destinations": len(fan_out.destinations),
+                    "put_object_files": len(files) - len(large_files), "multipart_files": len(large_files),
+                    "parts_per_destination": sum(ceil_div(item.size, fan_out.part_size) for item in large_files),
+                    "parallel": fan_out.max_streams}
+        tuning = {"part_size": fan_out.part_size, "max_concurrency": fan_out.max_concurrency,
+                  "max_streams": fan_out.max_streams, "buffers_per_stream": fan_out.buffers_per_stream,
+                  "atomic_transaction": fan_out.atomic_transaction}
+        return plan.result(plan.total_bytes, batching, tuning)
+
+    """
+    Purpose   :   Plan of a hiveToS3 export, with the partition selection of the export itself: the partitions
+                  committed on S3 with the size of the source are unchanged and are not copied
+    Input     :   None
+    Output    :   Returns the plan json
+    """
+
+    @Tracing.traced("plan.hive_to_s3")
+    def plan_hive_to_s3(self):
+        import HiveToS3
+        hive_to_s3 = HiveToS3.HiveToS3(self.config, self.context)
+        selected, unchanged = hive_to_s3.plan()
+        inventory = self.context.get_s3_inventory(hive_to_s3.bucket_name, hive_to_s3.target_prefix,
+                                                  hive_to_s3.s3_credentials_json)
+        unchanged_set = set(unchanged)
+        plan = self.new_plan()
+        for partition in sorted(selected + unchanged, key=lambda partition: partition.path):
+            target = hive_to_s3.partition_target(partition)
+            if partition in unchanged_set:
+                action = ACTION_UNCHANGED
+            else:
+                _, target_count = inventory.size_of(split_s3_path(target)[1])
+                action = ACTION_CHANGED if target_count else ACTION_NEW
+            plan.add(hive_to_s3.table_location + "/" + partition.path, target, partition.size, action,
+                     partition=partition.path, files=partition.files)
+        bytes_to_copy = sum(partition.size for partition in selected)
+        batching = {"kind": "distcp", "jobs": len(selected), "parallel": hive_to_s3.max_parallel,
+                    "waves": ceil_div(len(selected), hive_to_s3.max_parallel),
+                    "largest_job_bytes": max([partition.size for partition in selected] or [0]),
+                    "partitions_unchanged": len(unchanged)}
+        tuning = {"max_parallel": hive_to_s3.max_parallel, "refresh": hive_to_s3.refresh,
+                  "marker_name": hive_to_s3.marker_name, "dedup": hive_to_s3.hdfs_to_s3.dedup_index is not None,
+                  "atomic_transaction": hive_to_s3.hdfs_to_s3.atomic_transaction}
+        return plan.result(bytes_to_copy, batching, tuning)
+
+    """
+    Purpose   :   Plan of an s3ToHdfs import: the mode chosen by the import (distcp or direct) and, in direct mode,
+                  the put batches of the small objects and the ranged GETs of the large ones. The delta is computed
+                  against one recursive listing of target_path
+    Input     :   None
+    Output    :   Returns the plan json
+    """
+
+    @Tracing.traced("plan.s3_to_hdfs")
+    def plan_s3_to_hdfs(self):
+        import S3ToHdfs
+        s3_to_hdfs = S3ToHdfs.S3ToHdfs(self.config, self.context)
+        objects = s3_to_hdfs.list_objects()
+        exit_code, output = run_command("hadoop fs -ls -R " + pipes.quote(s3_to_hdfs.target_path))
+        # The target does not exist yet when the listing fails
+        target_files = S3Inventory(parse_hdfs_listing(output).items() if exit_code == 0 else [])
+        plan = self.new_plan()
+        for item in objects:
+            plan.add("s3://" + s3_to_hdfs.bucket_name + "/" + item.key, item.hdfs_path, item.size,
+                     compare(target_files, hdfs_path_of(item.hdfs_path), item.size))
+        mode = s3_to_hdfs.choose_mode(objects) if objects else s3_to_hdfs.mode
+        if mode == S3ToHdfs.MODE_DISTCP:
+            batching = {"kind": "distcp", "jobs": 1 if objects else 0, "parallel": 1, "waves": 1 if objects else 0}
+        else:
+            small_objects = [item for item in objects if item.size < s3_to_hdfs.range_size]
+            large_objects = [item for item in objects if item.size >= s3_to_hdfs.range_size]
+            batching = {"kind": "direct", "put_batches": len(list(s3_to_hdfs.batches(small_objects))),
+                        "small_objects": len(small_objects), "streamed_objects": len(large_objects),
+                        "ranged_gets": sum(ceil_div(item.size, s3_to_hdfs.range_size) for item in large_objects),
+                        "parallel": s3_to_hdfs.max_streams}
+        tuning = {"mode": mode, "distcp_threshold": s3_to_hdfs.distcp_threshold,
+                  "large_object_size": s3_to_hdfs.large_object_size, "range_size": s3_to_hdfs.range_size,
+                  "max_concurrency": s3_to_hdfs.max_concurrency, "max_streams": s3_to_hdfs.max_streams,
+                  "buffers_per_stream": s3_to_hdfs.buffers_per_stream,
+                  "put_batch_bytes": s3_to_hdfs.put_batch_bytes, "put_batch_files": s3_to_hdfs.put_batch_files,
+                  "atomic_transaction": s3_to_hdfs.atomic_transaction}
+        return plan.result(plan.total_bytes, batching, tuning)
+
+    """
+    Purpose   :   Plan of a localToS3 upload: the files uploaded with one PutObject and the multipart uploads with
+                  their number of parts
+    Input     :   None
+    Output    :   Returns the plan json
+    """
+
+    @Tracing.traced("plan.local_to_s3")
+    def plan_local_to_s3(self):
+        import LocalToS3
+        local_to_s3 = LocalToS3.LocalToS3(self.config, self.context)
+        files = local_to_s3.resolve_sources(self.config[LocalToS3.SOURCE_FILE_KEY],
+                                            self.config.get(LocalToS3.DESTINATION_FILE_KEY, ""))
+        prefix = os.path.commonprefix([item.key for item in files])
+        inventory = self.context.get_s3_inventory(local_to_s3.bucket_name, prefix, self.config, refresh=True)
+        plan = self.new_plan()
+        for item in files:
+            plan.add(item.path, "s3://" + local_to_s3.bucket_name + "/" + item.key, item.size,
+                     compare(inventory, item.key, item.size))
+        large_files = [item for item in files if item.size >= local_to_s3.multipart_threshold]
+        batching = {"kind": "in_process", "put_object_files": len(files) - len(large_files),
+                    "multipart_files": len(large_files),
+                    "parts": sum(ceil_div(item.size, local_to_s3.part_size_for(item)) for item in large_files),
+                    "parallel": local_to_s3.max_concurrency}
+        tuning = {"part_size": local_to_s3.part_size, "multipart_threshold": local_to_s3.multipart_threshold,
+                  "max_concurrency": local_to_s3.max_concurrency}
+        return plan.result(plan.total_bytes, batching, tuning)
+
+    """
+    Purpose   :   Plan of a database import (dbexport, dbToS3). The rows are only known once sqoop runs, the plan
+                  reports the map tasks and the tuning, and the estimate is the average duration of the past imports
+    Input     :   None
+    Output    :   Returns the plan json
+    """
+
+    def plan_database(self):
+        num_mappers = int(self.config.get("num_mappers") or SQOOP_DEFAULT_MAPPERS)
+        batching = {"kind": "sqoop", "jobs": 1, "map_tasks": num_mappers}
+        tuning = {"num_mappers": num_mappers}
+        if self.export_type == "dbToS3":
+            import DbToS3
+            settings = get_snapshot(DbToS3.CONFIGURATION_FILE)
+            transfer_workers = max(1, int(self.config.get(DbToS3.TRANSFER_WORKERS_KEY) or settings.get_int(
+                DbToS3.SETTINGS_SECTION, DbToS3.TRANSFER_WORKERS_KEY, DbToS3.DEFAULT_TRANSFER_WORKERS)))
+            batching.update(kind="sqoop_and_distcp", distcp_jobs=num_mappers, parallel=transfer_workers)
+            tuning.update(transfer_workers=transfer_workers,
+                          poll_interval=settings.get_int(DbToS3.SETTINGS_SECTION, "poll_interval",
+                                                         DbToS3.DEFAULT_POLL_INTERVAL),
+                          committer=DbToS3.COMMITTER_OPTION)
+        result = self.new_plan().result(None, batching, tuning)
+        result.update(file_count=None, total_bytes=None, delta=None)
+        result[MESSAGE_KEY] = "The files of a database import are known once sqoop runs"
+        return result
+
+    def plan(self):
+        if self.export_type == "hdfsToS3":
+            if isinstance(self.config.get("target_path"), list):
+                return self.plan_fan_out()
+            return self.plan_hdfs_to_s3()
+        planners = {"hiveToS3": self.plan_hive_to_s3, "s3ToHdfs": self.plan_s3_to_hdfs,
+                    "localToS3": self.plan_local_to_s3, "dbexport": self.plan_database,
+                    "dbToS3": self.plan_database}
+        if self.export_type not in planners:
+            raise ValueError("No planner for export type " + str(self.export_type))
+        return planners[self.export_type]()
+
+
+"""
+Purpose   :   Plan an export without moving data, and estimate its duration from the throughput history
+Input     :   Export type, request json
+Output    :   Returns the plan json with status SUCCESS, or status FAILED and a message
+"""
+
+
+def plan_export(export_type, config):
+    status_message = ""
+    try:
+        status_message = "Error planning the " + str(export_type) + " export"
+        result = ExportPlanner(export_type, config).plan()
+        destination = ExportHistory.destination_of(export_type, config)
+        result.update({STATUS_KEY: STATUS_SUCCESS, "export_type": export_type, "destination": destination,
+                       "estimate": ExportHistory.estimate(export_type, destination, result["bytes_to_copy"])})
+        return result
+
+    except KeyboardInterrupt:
+        raise KeyboardInterrupt
+
+    except:
+        logger.error(status_message + " ERROR MESSAGE: " + traceback.format_exc())
+        return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: status_message + ": " +
+                traceback.format_exc().strip().split("\n")[-1]}
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : ExportRegistry
+Purpose             : Maps every export_type (and the bulk export) to the module and function implementing it. The
+                      backend modules pull in hadoopy, boto3 and the sqoop helpers, so they are only imported on
+                      first use or by a background warm-up thread started with the service. A backend whose module
+                      cannot be imported is reported as unavailable instead of breaking the service start.
+Input Parameters    : Backend name, e.g. hdfsToS3
+Output Value        : Handler function taking the request json
+Dependencies        : None
+Predecessor Module  : DataExportService, BulkExport
+Successor Module    : SqoopUtility, HdfsToS3, LocalToS3, S3ToHdfs, HiveToS3, DbToS3, BulkExport
+Pre-requisites      : None
+How to run          : ExportRegistry.get_handler("hdfsToS3")(request_json)
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import threading
+import importlib
+import traceback
+from LogSetup import logger
+from EDLExceptions import BackendUnavailable
+
+"""
+Module Constants
+"""
+MODULE_NAME = "ExportRegistry"
+BULK_EXPORT = "bulk"
+LOADING_BACKGROUND = "background"
+LOADING_FIRST_USE = "first_use"
+
+# backend name : (module name, handler function name)
+BACKENDS = {
+    "dbexport": ("SqoopUtility", "runSqoop"),
+    "hdfsToS3": ("HdfsToS3", "runHdfsTOS3"),
+    "localToS3": ("LocalToS3", "runLocalTos3Upload"),
+    "s3ToHdfs": ("S3ToHdfs", "runS3ToHdfs"),
+    "hiveToS3": ("HiveToS3", "runHiveToS3"),
+    "dbToS3": ("DbToS3", "runDbToS3"),
+    BULK_EXPORT: ("BulkExport", "runBulkExport"),
+}
+EXPORT_TYPES = ("dbexport", "hdfsToS3", "localToS3", "s3ToHdfs", "hiveToS3", "dbToS3")
+
+_handlers = {}
+_failures = {}
+_lock = threading.Lock()
+
+
+def is_export_type(export_type):
+    return export_type in EXPORT_TYPES
+
+
+"""
+Purpose   :   Return the handler of a backend, importing its module on first use
+Input     :   Backend name
+Output    :   Returns the handler function. Raises BackendUnavailable if the name is unknown or its module
+              failed to import
+"""
+
+
+def get_handler(name):
+    handler = _handlers.get(name)
+    if handler is not None:
+        return handler
+    if name not in BACKENDS:
+        raise BackendUnavailable("Unknown export backend " + str(name))
+    with _lock:
+        handler = _handlers.get(name)
+        if handler is None:
+            if name in _failures:
+                raise BackendUnavailable(_failures[name])
+            module_name, function_name = BACKENDS[name]
+            try:
+                handler = getattr(importlib.import_module(module_name), function_name)
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt
+            except:
+                _failures[name] = "Export backend " + name + " is unavailable: " + \
+                                  traceback.format_exc().strip().split("\n")[-1]
+                logger.error(_failures[name])
+                raise BackendUnavailable(_failures[name])
+            _handlers[name] = handler
+    return handler
+
+
+"""
+Purpose   :   Import the backend modules ahead of the first request
+Input     :   Backend names to load (all by default), background flag
+Output    :   Returns the warm-up thread when loading in the background, otherwise None
+"""
+
+
+def warm_up(names=None, background=True):
+    def load():
+        for name in names or sorted(BACKENDS):
+            try:
+                get_handler(name)
+            except BackendUnavailable:
+                pass
+        logger.debug("Export backends loaded: " + ", ".join(sorted(_handlers)))
+
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="export-backend-warm-up")
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,410 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : HdfsFanOut
+Purpose             : hdfsToS3 export to several S3 destinations, used when target_path is a list. Every HDFS file is
+                      read once with "hadoop fs -cat" and each block read is uploaded to all the destinations
+                      concurrently: files smaller than part_size with one PutObject per destination, larger files
+                      as one multipart upload per destination fed from the same parts, with buffers_per_stream parts
+                      read ahead. Each destination has its own credentials and is verified against its own S3
+                      listing; a destination that fails is rolled back on its own and the other destinations are
+                      kept.
+Input Parameters    : source_path, s3_credentials, target_path as a list of s3 paths or of
+                      {"target_path": ..., "s3_credentials": ...}, and optionally file_list, atomic_transaction and
+                      the [fanout] settings
+Output Value        : Status json with the files_copied_list array of all the destinations and the targets array
+                      (target_path, status, files_copied_list)
+Dependencies        : boto3, hadoop command line
+Predecessor Module  : HdfsToS3
+Successor Module    : None
+Pre-requisites      : [fanout] section of settings.conf
+How to run          : Call runHdfsFanOut with the request json
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import pipes
+import threading
+import traceback
+import collections
+from multiprocessing.pool import ThreadPool
+from LogSetup import logger
+from ConfigUtility import get_snapshot
+from ExportContext import ExportContext, split_s3_path, hdfs_path_of, run_command, parse_hdfs_listing
+import CommandRunner
+import Metrics
+import JobEvents
+import Tracing
+import Retry
+
+"""
+Module Constants
+"""
+MODULE_NAME = "HdfsFanOut"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "fanout"
+STATUS_KEY = "status"
+STATUS_SUCCESS = "SUCCESS"
+STATUS_FAILED = "FAILED"
+MESSAGE_KEY = "message"
+FILES_COPIED_LIST_KEY = "files_copied_list"
+FILE_NAME_KEY = "file_name"
+FILE_SIZE_KEY = "file_size"
+TARGETS_KEY = "targets"
+FLAG_YES = "y"
+
+S3_CREDENTIALS_KEY = "s3_credentials"
+SOURCE_PATH_KEY = "source_path"
+TARGET_PATH_KEY = "target_path"
+FILE_LIST_KEY = "file_list"
+ATOMIC_TRANSACTION_KEY = "atomic_transaction"
+AES_ENCRYPTION_ENABLED_KEY = "aes_encryption_enabled"
+ENCRYPTION_ALGORITHM = "AES256"
+
+MEGABYTE = 1024 * 1024
+DEFAULT_PART_SIZE = 16 * MEGABYTE
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_STREAMS = 4
+DEFAULT_BUFFERS_PER_STREAM = 2
+# S3 limits: parts are at least 5 MB (except the last one) and an upload has at most 10000 parts
+MINIMUM_PART_SIZE = 5 * MEGABYTE
+MAXIMUM_PARTS = 10000
+S3_DELETE_BATCH_SIZE = 1000
+
+
+class FanOutFile(object):
+    __slots__ = ("hdfs_path", "relative_path", "size")
+
+    def __init__(self, hdfs_path, relative_path, size):
+        self.hdfs_path = hdfs_path
+        self.relative_path = relative_path
+        self.size = size
+
+
+class Destination(object):
+    """One S3 target of the export with the keys written to it, failed independently of the others"""
+
+    def __init__(self, target_path, s3_credentials_json):
+        self.target_path = target_path.rstrip("/")
+        self.s3_credentials_json = s3_credentials_json
+        self.bucket_name, self.prefix = split_s3_path(self.target_path)
+        self.extra_args = {}
+        encryption = s3_credentials_json.get(AES_ENCRYPTION_ENABLED_KEY)
+        if encryption and encryption.lower() == FLAG_YES:
+            self.extra_args["ServerSideEncryption"] = ENCRYPTION_ALGORITHM
+        self.failed = False
+        self.message = None
+        self.written_keys = []
+        self.lock = threading.Lock()
+
+    def key_for(self, item):
+        return self.prefix.rstrip("/") + "/" + item.relative_path if item.relative_path else self.prefix
+
+    def add_written_key(self, key):
+        with self.lock:
+            self.written_keys.append(key)
+
+    def fail(self, message):
+        with self.lock:
+            if not self.failed:
+                self.failed = True
+                self.message = message
+                logger.error("Destination " + self.target_path + " failed: " + message)
+
+
+class HdfsFanOut(object):
+    def __init__(self, config, context=None):
+        self.config = config
+        self.context = context if context is not None else ExportContext()
+        self.source_path = config[SOURCE_PATH_KEY].rstrip("/")
+        self.files_list = config.get(FILE_LIST_KEY)
+        self.atomic_transaction = (config.get(ATOMIC_TRANSACTION_KEY) or FLAG_YES).lower()
+        self.destinations = []
+        for target in config[TARGET_PATH_KEY]:
+            if isinstance(target, dict):
+                destination = Destination(target[TARGET_PATH_KEY],
+                                          target.get(S3_CREDENTIALS_KEY) or config[S3_CREDENTIALS_KEY])
+            else:
+                destination = Destination(target, config[S3_CREDENTIALS_KEY])
+            if not destination.prefix:
+                raise ValueError("Refusing to export to the bucket root " + destination.target_path)
+            self.destinations.append(destination)
+        if not self.destinations:
+            raise ValueError("No target_path given")
+        # Request values override settings.conf, read for every request so tuning changes apply without a restart
+        settings = get_snapshot(CONFIGURATION_FILE)
+
+        def setting(name, default):
+            return int(config.get(name) or settings.get_int(SETTINGS_SECTION, name, default))
+
+        self.part_size = max(MINIMUM_PART_SIZE, setting("part_size", DEFAULT_PART_SIZE))
+        self.max_concurrency = max(1, setting("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+        self.max_streams = max(1, setting("max_streams", DEFAULT_MAX_STREAMS))
+        self.buffers_per_stream = max(1, setting("buffers_per_stream", DEFAULT_BUFFERS_PER_STREAM))
+        self.policy = Retry.get_policy()
+        self.upload_pool = None
+        self.job = JobEvents.current_job()
+
+    """
+    Purpose   :   List the files to export with their size, one recursive listing per entry of file_list (or of
+                  the source path). The entries are resolved against the source path as in HdfsToS3.transfer_file.
+                  The path of a file relative to the source is its key below each target
+    Input     :   None
+    Output    :   Returns a list of FanOutFile
+    """
+
+    @Tracing.traced("hdfs.ls")
+    def list_files(self):
+        base_path = hdfs_path_of(self.source_path)
+        files = []
+        for entry in self.files_list or [self.source_path]:
+            relative_entry = entry.replace(self.source_path, "").strip("/")
+            entry = self.source_path + "/" + relative_entry if relative_entry else self.source_path
+            exit_code, output = run_command("hadoop fs -ls -R " + pipes.quote(entry))
+            if exit_code != 0:
+                raise Exception("Error listing " + entry + ": " + output.strip()[-2000:])
+            for path, size in sorted(parse_hdfs_listing(output).items()):
+                relative_path = path[len(base_path):].strip("/") if path.startswith(base_path + "/") else ""
+                files.append(FanOutFile(path, relative_path, size))
+        return files
+
+    def active_destinations(self):
+        return [destination for destination in self.destinations if not destination.failed]
+
+    """
+    Purpose   :   Run one S3 call of a destination, retrying transient errors with the backoff and retry budget of
+                  the job (see Retry). A call that still fails fails the destination
+    Input     :   Destination, operation (name of the client method) and its arguments
+    Output    :   Returns the response, or None if the call failed
+    """
+
+    def call(self, destination, operation, **kwargs):
+        if destination.failed:
+            return None
+        JobEvents.set_current_job(self.job)
+        s3 = self.context.get_s3_client(destination.s3_credentials_json)
+        errors = []
+
+        def attempt():
+            try:
+                return Metrics.s3_call(operation, getattr(s3, operation), **kwargs), None
+            except Exception as e:
+                errors.append(str(e))
+                return None, Retry.classify(str(e), Retry.FAILURE_TRANSIENT)
+
+        response = Retry.run_with_retries(operation + " " + destination.bucket_name + "/" + kwargs.get("Key", ""),
+                                          Metrics.EXPORT_TYPE_HDFS_TO_S3, attempt, policy=self.policy)
+        if response is None:
+            destination.fail(operation + " of " + kwargs.get("Key", "") + " failed: " + errors[-1])
+        return response
+
+    """
+    Purpose   :   Upload one block read from the source to every destination at the same time
+    Input     :   Destinations, function building the call arguments of a destination, operation name
+    Output    :   Returns the list of AsyncResult of the calls, one per destination
+    """
+
+    def submit(self, destinations, operation, arguments):
+        return [self.upload_pool.apply_async(lambda destination=destination: (
+            destination, self.call(destination, operation, **arguments(destination)))) for destination in destinations]
+
+    """
+    Purpose   :   Read one HDFS file once and write it to every destination that has not failed. The parts read
+                  ahead are bounded by buffers_per_stream, so memory use is part_size * buffers_per_stream per file
+                  being streamed. A source read error fails every destination, since none of them can hold the file
+    Input     :   FanOutFile
+    Output    :   None
+    """
+
+    def stream_file(self, item):
+        JobEvents.set_current_job(self.job)
+        destinations = self.active_destinations()
+        if not destinations:
+            return
+        with Tracing.span("fanout.file", file_name=item.hdfs_path, destinations=len(destinations)):
+            # The part size grows for very large files so an upload stays below MAXIMUM_PARTS parts
+            part_size = max(self.part_size, -(-item.size // MAXIMUM_PARTS))
+            command = CommandRunner.start("hadoop fs -cat " + pipes.quote(item.hdfs_path), CommandRunner.job_timeout(),
+                                          stream=True, merge_stderr=False)
+            read_bytes = 0
+            try:
+                if item.size < part_size:
+                    body = command.read()
+                    read_bytes = len(body)
+                    if read_bytes == item.size:
+                        for result in self.submit(destinations, "put_object", lambda destination: dict(
+                                Bucket=destination.bucket_name, Key=destination.key_for(item), Body=body,
+                                **destination.extra_args)):
+                            destination, response = result.get()
+                            if response is not None:
+                                destination.add_written_key(destination.key_for(item))
+                else:
+                    read_bytes = self.stream_multipart(item, destinations, command, part_size)
+            finally:
+                if not command.done():
+                    command.cancel()
+                exit_code = command.wait()
+            if exit_code != 0 or read_bytes != item.size:
+                message = (command.kill_message() or command.error_output()).strip()[-2000:]
+                for destination in destinations:
+                    destination.fail("Error reading " + item.hdfs_path + " (exit code " + str(exit_code) + ", " +
+                                     str(read_bytes) + " of " + str(item.size) + " bytes)" +
+                                     (": " + message if message else ""))
+
+    def stream_multipart(self, item, destinations, source, part_size):
+        uploads = {}
+        for destination in destinations:
+            response = self.call(destination, "create_multipart_upload", Bucket=destination.bucket_name,
+                                 Key=destination.key_for(item), **destination.extra_args)
+            if response is not None:
+                uploads[destination] = (response["UploadId"], {})
+        read_bytes = 0
+        in_flight = collections.deque()
+        part_number = 0
+        while any(not destination.failed for destination in uploads):
+            part = source.read(part_size)
+            if not part:
+                break
+            read_bytes += len(part)
+            part_number += 1
+            in_flight.append((part_number, self.submit(list(uploads), "upload_part", lambda destination, part=part,
+                              number=part_number: dict(Bucket=destination.bucket_name, Key=destination.key_for(item),
+                                                       UploadId=uploads[destination][0], PartNumber=number,
+                                                       Body=part))))
+            while len(in_flight) >= self.buffers_per_stream:
+                self.collect_parts(uploads, *in_flight.popleft())
+        while in_flight:
+            self.collect_parts(uploads, *in_flight.popleft())
+        complete = read_bytes == item.size
+        for destination, (upload_id, parts) in uploads.items():
+            if complete and not destination.failed:
+                if self.call(destination, "complete_multipart_upload", Bucket=destination.bucket_name,
+                             Key=destination.key_for(item), UploadId=upload_id, MultipartUpload={"Parts": [
+                                 {"ETag": etag, "PartNumber": number} for number, etag in sorted(parts.items())]}):
+                    destination.add_written_key(destination.key_for(item))
+            else:
+                try:
+                    s3 = self.context.get_s3_client(destination.s3_credentials_json)
+                    Metrics.s3_call("abort_multipart_upload", s3.abort_multipart_upload,
+                                    Bucket=destination.bucket_name, Key=destination.key_for(item), UploadId=upload_id)
+                except Exception:
+                    logger.error("Unable to abort the upload of " + destination.key_for(item) + ": " +
+                                 traceback.format_exc())
+        return read_bytes
+
+    def collect_parts(self, uploads, part_number, results):
+        for result in results:
+            destination, response = result.get()
+            if response is not None:
+                uploads[destination][1][part_number] = response["ETag"]
+
+    """
+    Purpose   :   Check the size of every object of a destination against the source with one S3 listing
+    Input     :   Destination, list of FanOutFile
+    Output    :   Returns True if all the sizes match
+    """
+
+    @Tracing.traced("verify")
+    def verify(self, destination, files):
+        inventory = self.context.get_s3_inventory(destination.bucket_name, destination.prefix,
+                                                  destination.s3_credentials_json, refresh=True)
+        sizes = dict(zip(inventory.keys, inventory.sizes))
+        for item in files:
+            key = destination.key_for(item)
+            if sizes.get(key) != item.size:
+                destination.fail("Size of source and target do not match for " + key + ". S3 size = " +
+                                 str(sizes.get(key)) + " Hdfs size = " + str(item.size))
+                return False
+        return True
+
+    @Tracing.traced("s3_cleanup")
+    def cleanup(self, destination):
+        s3 = self.context.get_s3_client(destination.s3_credentials_json)
+        keys = destination.written_keys
+        for index in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+            Metrics.s3_call("delete_objects", s3.delete_objects, Bucket=destination.bucket_name,
+                            Delete={"Objects": [{"Key": key} for key in keys[index:index + S3_DELETE_BATCH_SIZE]],
+                                    "Quiet": True})
+
+    def run(self):
+        status_message = ""
+        files = []
+        try:
+            status_message = "Error listing the Hdfs source " + self.source_path
+            files = self.list_files()
+            if not files:
+                status_message = "No file found below " + self.source_path
+                raise Exception
+            status_message = "Exporting " + str(len(files)) + " files from " + self.source_path + " to " + \
+                             str(len(self.destinations)) + " destinations"
+            logger.info(status_message)
+            pending = len(files)
+            Metrics.QUEUE_DEPTH.inc(pending, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+            self.upload_pool = ThreadPool(self.max_concurrency)
+            stream_pool = ThreadPool(min(self.max_streams, len(files)))
+            try:
+                for _ in stream_pool.imap_unordered(self.stream_file, files):
+                    pending -= 1
+                    Metrics.QUEUE_DEPTH.dec(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+            finally:
+                Metrics.QUEUE_DEPTH.dec(pending, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                stream_pool.close()
+                stream_pool.join()
+                self.upload_pool.close()
+                self.upload_pool.join()
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            logger.error(status_message + " ERROR MESSAGE: " + traceback.format_exc())
+            for destination in self.destinations:
+                destination.fail(status_message)
+
+        targets = []
+        files_copied_list = []
+        total_size = sum(item.size for item in files)
+        for destination in self.destinations:
+            if not destination.failed and self.verify(destination, files):
+                statuses = [{FILE_NAME_KEY: "s3://" + destination.bucket_name + "/" + destination.key_for(item),
+                             FILE_SIZE_KEY: str(item.size)} for item in files]
+                for status in statuses:
+                    JobEvents.publish(JobEvents.EVENT_FILE_COPIED, **status)
+                Metrics.BYTES_TRANSFERRED.inc(total_size, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                Metrics.FILES_TRANSFERRED.inc(len(files), Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                files_copied_list.extend(statuses)
+                targets.append({TARGET_PATH_KEY: destination.target_path, STATUS_KEY: STATUS_SUCCESS,
+                                FILES_COPIED_LIST_KEY: statuses})
+                continue
+            if self.atomic_transaction == FLAG_YES and destination.written_keys:
+                try:
+                    self.cleanup(destination)
+                except Exception:
+                    logger.error("Error in cleaning files already loaded to " + destination.target_path + ": " +
+                                 traceback.format_exc())
+            targets.append({TARGET_PATH_KEY: destination.target_path, STATUS_KEY: STATUS_FAILED,
+                            MESSAGE_KEY: destination.message, FILES_COPIED_LIST_KEY: []})
+        failed = [target for target in targets if target[STATUS_KEY] != STATUS_SUCCESS]
+        result = {STATUS_KEY: STATUS_FAILED if failed else STATUS_SUCCESS, FILES_COPIED_LIST_KEY: files_copied_list,
+                  TARGETS_KEY: targets}
+        if failed:
+            result[MESSAGE_KEY] = str(len(failed)) + " of " + str(len(targets)) + " destinations failed"
+        return result
+
+
+"""
+Purpose   :   Entry point of hdfsToS3 exports with a list of target paths
+Input     :   Request json, optional ExportContext shared with other exports
+Output    :   Returns the status of the export
+"""
+
+
+def runHdfsFanOut(config, context=None):
+    try:
+        fan_out = HdfsFanOut(config, context)
+    except Exception:
+        logger.error("Error Parsing Input Config " + traceback.format_exc())
+        return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Error Parsing Input Config", FILES_COPIED_LIST_KEY: []}
+    return fan_out.run()
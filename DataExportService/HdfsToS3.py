@@ -1,9 +1,22 @@
 import traceback
 import hadoopy
-import errno
+import os
+import re
+import pipes
+import threading
+import collections
+from Queue import Queue, Empty
+from ConfigUtility import get_snapshot
 from LogSetup import logger
-import subprocess
-import boto3
+import CommandRunner
+import time
+import Metrics
+import JobEvents
+import JobLog
+import Tracing
+import Retry
+import DedupIndex
+from ExportContext import ExportContext, split_s3_path, hdfs_path_of, run_command, parse_hdfs_listing
 
 ERROR_LIST = ["Exception in thread \"main\" java.lang.RuntimeException", "Job failed", "Access Denied", "Traceback"]
 # Constants representing the status keys
@@ -44,17 +57,65 @@ HADOOP_OPTIONS_KEY = "hadoop_options"
 DISTCP_OPTIONS_KEY = "distcp_options"
 
 MERGED_FILE_NAME_KEY = "merged_file_name"
+# MapReduce progress line printed by distcp and sqoop jobs, e.g. "map 45% reduce 0%"
+PROGRESS_PATTERN = re.compile(r"map (\d+)% reduce (\d+)%")
 FILE_SIZE_KEY = "file_size"
+# Set on the status of a failed transfer: Retry.FAILURE_TRANSIENT or Retry.FAILURE_PERMANENT
+FAILURE_KEY = "failure"
+# Bytes copied server side from identical objects instead of uploaded, set in dedup mode
+BYTES_SAVED_KEY = "bytes_saved"
+DEDUP_BUCKETS_KEY = "dedup_buckets"
+# Sources passed to one distcp or hadoop fs -checksum command in dedup mode
+COMMAND_BATCH_SIZE = 200
+
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "hdfstos3"
+# Pipeline of hdfs_to_s3: entries waiting between the listing, transfer and verification stages, transfer threads
+# and transfers verified with one S3 listing
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_TRANSFER_WORKERS = 1
+DEFAULT_VERIFY_BATCH = 100
+# Seconds the listing stage waits for room in the transfer queue before checking whether the export stopped
+QUEUE_POLL_INTERVAL = 0.5
+END_OF_STAGE = None
 
 ERROR_STATUS = {STATUS_KEY: STATUS_FAILED, FILES_COPIED_LIST_KEY: []}
 SUCCESS_STATUS={STATUS_KEY: STATUS_SUCCESS, FILES_COPIED_LIST_KEY: []}
+# Maximum number of keys accepted by one S3 DeleteObjects call
+S3_DELETE_BATCH_SIZE = 1000
 STATUS_FAILED = "FAILED"
 STATUS_SUCCESS = "SUCCESS"
 
+class TransferRecord(object):
+    """State of one entry of the source listing between the transfer and verification stages"""
+
+    __slots__ = ("file_name", "target_path", "file_size", "bytes_saved", "attempts")
+
+    def __init__(self, file_name, status):
+        self.file_name = file_name
+        self.target_path = status[FILE_NAME_KEY]
+        self.file_size = status[FILE_SIZE_KEY]
+        self.bytes_saved = status.get(BYTES_SAVED_KEY)
+        self.attempts = 0
+
+    def status(self):
+        status = {FILE_NAME_KEY: self.target_path, FILE_SIZE_KEY: self.file_size}
+        if self.bytes_saved is not None:
+            status[BYTES_SAVED_KEY] = self.bytes_saved
+        return status
+
+
 class HdfsToS3(object):
-    def __init__(self):
+    def __init__(self, context=None):
         self.atomic_transaction = FLAG_YES
         self.s3_cleanup_before_transfer = FLAG_YES
+        # Clients, listings and inventories shared with the other transfers of the export or batch
+        self.context = context if context is not None else ExportContext()
+        # DedupIndex when the dedup mode is on, and the buckets whose objects can be copied
+        self.dedup_index = None
+        self.dedup_buckets = None
+        # Guards the lists of S3 paths written, shared by the transfer threads of an export
+        self.target_paths_lock = threading.Lock()
 
     """  
     Purpose   :   This method is used to set options used in the hadoop distcp command
@@ -67,6 +128,7 @@ class HdfsToS3(object):
     Output    :   Returns a sting of options for command
     """
 
+    @Tracing.traced("create_command_options_string")
     def create_command_options_string(self, s3_credentials_json):
         status_message = ""
         try:
@@ -115,85 +177,352 @@ class HdfsToS3(object):
     Purpose   :   This method is called if the source type is Hdfs. It checks if the file/dir in the source exists
                   and also checks for the type. If type is a directory, it constructs a s3distcp command and if the
                   type is a file, it constructs a distcp command and submits it to the child method hdfs_to_s3_loader
-                  for file loading. If any of the file transfer fails, the entire process fails cleaning up the s3
-                  target path
+                  for file loading. A file failing with a transient error is retried on its own
+                  (transfer_file_with_retries); if a file still fails, the entire process fails cleaning up the s3
+                  target path.
+                  The export runs as a pipeline so the listing is never held in memory: a listing thread streams
+                  the entries (file_list or hadoop fs -ls) into a bounded queue, transfer_workers threads copy them
+                  and pass them through a second bounded queue to this thread, which verifies them verify_batch at a
+                  time against one S3 listing. Sizes are set in the [hdfstos3] section of settings.conf
     Input     :   The source Hdfs path, the file/directory path to transfer to s3, s3 target location and dictionary
                   containing the s3 credentials along with the s3distcp jar path
     Output    :   Returns a status json containing the status i.e. true or false and also the files_copied_list array
                   containing a json for each file/dir transferred with file_name and file_size
     """
 
+    @Tracing.traced("hdfs_to_s3")
     def hdfs_to_s3(self, source_path, files_list, target_path, s3_credentials_json):
-        transferred_file_list = []
+        transferred_files = set()
+        transferred_target_paths = []
         status_message = ""
+        defer_verification = self.context.defer_verification
         try:
             status_message = "Executing function to load data from Hdfs to S3"
             logger.debug(status_message)
-            overall_file_status = dict()
-            overall_file_status[STATUS_KEY] = STATUS_SUCCESS
-            files_transferred = []
             option_string = self.create_command_options_string(s3_credentials_json)
 
-            if files_list == False:
-                files_list = hadoopy.ls(source_path)
-
-
-
-
             if not option_string:
                 status_message = "Error Occured while creating hadoop distcp options"
                 raise Exception
-            for file_name in files_list:
-                hdfs_file = source_path + "/" + file_name.replace(source_path, "").strip("/")
-                s3_file_path = target_path + "/" + file_name.replace(source_path, "").strip("/")
+            if files_list == False:
+                files_list = self.context.iter_hdfs(source_path)
+
+            settings = get_snapshot(CONFIGURATION_FILE)
+            queue_size = max(1, settings.get_int(SETTINGS_SECTION, "queue_size", DEFAULT_QUEUE_SIZE))
+            workers = max(1, settings.get_int(SETTINGS_SECTION, "transfer_workers", DEFAULT_TRANSFER_WORKERS))
+            verify_batch = max(1, settings.get_int(SETTINGS_SECTION, "verify_batch", DEFAULT_VERIFY_BATCH))
+            transfer_queue = Queue(queue_size)
+            verify_queue = Queue(queue_size)
+            stopped = threading.Event()
+            errors = []
+            job = JobEvents.current_job()
+
+            def fail(message):
+                errors.append(message)
+                stopped.set()
+
+            def list_files():
+                JobEvents.set_current_job(job)
+                try:
+                    for file_name in files_list:
+                        Metrics.QUEUE_DEPTH.inc(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                        while not stopped.is_set():
+                            try:
+                                transfer_queue.put(file_name, timeout=QUEUE_POLL_INTERVAL)
+                                break
+                            except Exception:
+                                continue
+                        if stopped.is_set():
+                            Metrics.QUEUE_DEPTH.dec(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                            break
+                except Exception:
+                    logger.error("Error listing " + source_path + ": " + traceback.format_exc())
+                    fail("Error while listing the Hdfs source " + source_path)
+                finally:
+                    for _ in range(workers):
+                        transfer_queue.put(END_OF_STAGE)
+
+            def transfer_files():
+                JobEvents.set_current_job(job)
+                try:
+                    while True:
+                        file_name = transfer_queue.get()
+                        if file_name is END_OF_STAGE:
+                            return
+                        Metrics.QUEUE_DEPTH.dec(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                        # After a failure the queue is drained without copying so the listing stage can finish
+                        if stopped.is_set():
+                            continue
+                        status = self.transfer_file_with_retries(option_string, source_path, file_name,
+                                                                 target_path, s3_credentials_json,
+                                                                 transferred_files, transferred_target_paths)
+                        if not status[FILE_NAME_KEY]:
+                            fail("Failed to transfer Hdfs file " + file_name + " to S3")
+                            continue
+                        verify_queue.put(TransferRecord(file_name, status))
+                except Exception:
+                    logger.error("Transfer stage failed: " + traceback.format_exc())
+                    fail("Transfer stage failed")
+                    while transfer_queue.get() is not END_OF_STAGE:
+                        Metrics.QUEUE_DEPTH.dec(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                finally:
+                    verify_queue.put(END_OF_STAGE)
+
+            self.context.defer_verification = True
+            threads = [threading.Thread(target=list_files, name="hdfs-to-s3-listing")]
+            threads.extend(threading.Thread(target=transfer_files, name="hdfs-to-s3-transfer-" + str(index))
+                           for index in range(workers))
+            for thread in threads:
+                thread.daemon = True
+                thread.start()
+            try:
+                files_transferred = self.verify_stage(verify_queue, workers, verify_batch, stopped, fail,
+                                                      (option_string, source_path, target_path,
+                                                       s3_credentials_json, transferred_files,
+                                                       transferred_target_paths))
+            finally:
+                # When the verification stage failed the other stages are stopped, and the transfers blocked on
+                # the full verify_queue released, before the rollback: nothing may be copied after it
+                stopped.set()
+                while any(thread.is_alive() for thread in threads):
+                    try:
+                        verify_queue.get(timeout=QUEUE_POLL_INTERVAL)
+                    except Empty:
+                        pass
+                for thread in threads:
+                    thread.join()
+            if errors:
+                status_message = errors[0]
+                raise Exception
 
-                if not hadoopy.exists(hdfs_file)and not hadoopy.isdir(file_name):
-                    status_message = "Hdfs File :" + hdfs_file + " does not exists"
-                    raise Exception
-                status_message = "Loading file from Hdfs to S3. File name - " + hdfs_file
-                logger.info(status_message)
-                # transferred_file_list.append(s3_file_path)
-                command = "hadoop distcp " + option_string + " " + hdfs_file + " " + s3_file_path
-                # Just used for display purpose
-                replace_param_list = [s3_credentials_json[ACCESS_KEY],
-                                      s3_credentials_json[SECRET_KEY]]
-                cmd_to_display = command
-                for replace_param in replace_param_list:
-                    cmd_to_display = cmd_to_display.replace(replace_param, "*********")
-                status_message = "Running command - " + cmd_to_display
-                logger.debug(status_message)
-                status = self.hdfs_to_s3_loader(command, hdfs_file, s3_file_path, s3_credentials_json,
-                                                transferred_file_list)
-                transfer_status = status[FILE_NAME_KEY]
-                if not transfer_status:
-                    status_message = "Failed to transfer Hdfs file " + hdfs_file + " to S3"
-                    raise Exception
-                files_transferred.append(status)
-                SUCCESS_STATUS[FILES_COPIED_LIST_KEY] = files_transferred
-            return SUCCESS_STATUS
+            result = {STATUS_KEY: STATUS_SUCCESS, FILES_COPIED_LIST_KEY: [record.status() for record in
+                                                                          files_transferred]}
+            if self.dedup_index is not None:
+                result[BYTES_SAVED_KEY] = sum(record.bytes_saved or 0 for record in files_transferred)
+            return result
 
         except KeyboardInterrupt:
             raise KeyboardInterrupt
 
         except:
-            error = " ERROR MESSAGE: " + str(traceback.format_exc())
-            traceback.print_exc()
-            logger.error(status_message)
+            logger.error(status_message + " ERROR MESSAGE: " + traceback.format_exc())
 
             if self.atomic_transaction.lower() == FLAG_YES:
-                if transferred_file_list:
-                    deleted = self.s3_cleanup(transferred_file_list, s3_credentials_json)
-                    # TODO - Handling retries in case of cleanup fails
+                if transferred_target_paths:
+                    deleted = self.s3_cleanup(transferred_target_paths, s3_credentials_json)
+                    # The cleanup is retried with the delays of the file retries
+                    policy = Retry.get_policy(S3PUT_RETRIES)
+                    attempt = 0
+                    while not deleted and attempt < policy.max_retries:
+                        attempt += 1
+                        time.sleep(policy.delay(attempt))
+                        deleted = self.s3_cleanup(transferred_target_paths, s3_credentials_json)
                     if not deleted:
                         status_message = "Error in cleaning files already loaded to s3"
-                        error = " ERROR MESSAGE: " + str(traceback.format_exc())
                         logger.error(status_message)
 
             else:
                 status_message = "Clean up over transaction error is set to false. Skipping the clean up process"
                 logger.info(status_message)
 
-                return ERROR_STATUS
+            return ERROR_STATUS
+
+        finally:
+            self.context.defer_verification = defer_verification
+
+    """
+    Purpose   :   Verification stage of the hdfs_to_s3 pipeline. The transferred entries are verified against one
+                  S3 listing per batch of verify_batch entries, or as soon as no transferred entry is waiting. An
+                  entry whose size does not match is removed and copied again, with the backoff and retry budget of
+                  the job (see Retry)
+    Input     :   Queue of TransferRecord, number of transfer threads, batch size, stop event and failure function
+                  of the pipeline, arguments of transfer_file_with_retries after the file name
+    Output    :   Returns the list of TransferRecord verified
+    """
+
+    @Tracing.traced("verify")
+    def verify_stage(self, verify_queue, workers, verify_batch, stopped, fail, transfer_arguments):
+        option_string, source_path, target_path, s3_credentials_json, transferred_files, \
+            transferred_target_paths = transfer_arguments
+        policy = Retry.get_policy(S3PUT_RETRIES)
+        budget = None
+        verified_records = []
+        verified_sizes = {}
+        batch = []
+        running = workers
+        while running or batch:
+            record = END_OF_STAGE
+            if running:
+                try:
+                    record = verify_queue.get(block=not batch)
+                except Empty:
+                    record = END_OF_STAGE
+                else:
+                    if record is END_OF_STAGE:
+                        running -= 1
+                        continue
+            if record is not END_OF_STAGE:
+                batch.append(record)
+                if len(batch) < verify_batch:
+                    continue
+            # The pending verifications of the context can include entries not dequeued yet, their sizes are kept
+            verified_sizes.update(self.context.verify_pending())
+            for record in batch:
+                size = verified_sizes.pop(record.target_path, None)
+                while size is None and not stopped.is_set():
+                    if budget is None:
+                        budget = Retry.job_budget()
+                    record.attempts += 1
+                    if record.attempts > policy.max_retries:
+                        decision = Retry.DECISION_ATTEMPTS_EXHAUSTED
+                    else:
+                        decision = Retry.DECISION_RETRIED if budget.take() else Retry.DECISION_BUDGET_EXHAUSTED
+                    Metrics.RETRIES.inc(1, Metrics.EXPORT_TYPE_HDFS_TO_S3, decision)
+                    if decision != Retry.DECISION_RETRIED:
+                        fail("Size of source and target do not match for " + record.target_path)
+                        break
+                    time.sleep(policy.delay(record.attempts))
+                    if not self.s3_cleanup([record.target_path], s3_credentials_json):
+                        fail("Error in cleaning " + record.target_path + " before copying it again")
+                        break
+                    status = self.transfer_file_with_retries(option_string, source_path, record.file_name,
+                                                             target_path, s3_credentials_json, transferred_files,
+                                                             transferred_target_paths)
+                    if not status[FILE_NAME_KEY]:
+                        fail("Failed to transfer Hdfs file " + record.file_name + " to S3")
+                        break
+                    verified_sizes.update(self.context.verify_pending())
+                    size = verified_sizes.pop(record.target_path, None)
+                if size is None:
+                    continue
+                Metrics.BYTES_TRANSFERRED.inc(size, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                Metrics.FILES_TRANSFERRED.inc(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                verified_records.append(record)
+                JobEvents.publish(JobEvents.EVENT_FILE_COPIED, **record.status())
+            del batch[:]
+        return verified_records
+
+    """
+    Purpose   :   This method transfers one entry of the source listing. It resolves the Hdfs and S3 paths of the
+                  file/dir, checks that the source exists, builds the distcp command and submits it to
+                  hdfs_to_s3_loader. The S3 path is recorded in transferred_target_paths before the copy starts
+                  so a partially copied file is also removed by the rollback. In dedup mode only the keys copied
+                  or uploaded are recorded, see dedup_transfer.
+    Input     :   distcp option string, source Hdfs path, file/dir name from the listing, s3 target location,
+                  s3 credentials, set of Hdfs files transferred and list of S3 paths written by this attempt
+    Output    :   Returns a json containing file_name and file_size of the s3 target location. file_name is empty
+                  if the transfer failed
+    """
+
+    def transfer_file(self, option_string, source_path, file_name, target_path, s3_credentials_json,
+                      transferred_files, transferred_target_paths):
+        status_message = ""
+        failure = Retry.FAILURE_PERMANENT
+        try:
+            hdfs_file = source_path + "/" + file_name.replace(source_path, "").strip("/")
+            s3_file_path = target_path + "/" + file_name.replace(source_path, "").strip("/")
+
+            try:
+                with Tracing.span("hdfs.exists", path=hdfs_file):
+                    source_exists = hadoopy.exists(hdfs_file) or hadoopy.isdir(file_name)
+            except Exception as e:
+                failure = Retry.classify(str(e), Retry.FAILURE_TRANSIENT)
+                raise
+            if not source_exists:
+                status_message = "Hdfs File :" + hdfs_file + " does not exists"
+                raise Exception
+            status_message = "Loading file from Hdfs to S3. File name - " + hdfs_file
+            logger.info(status_message)
+            command = "hadoop distcp " + option_string + " " + hdfs_file + " " + s3_file_path
+            # Just used for display purpose
+            replace_param_list = [s3_credentials_json[ACCESS_KEY],
+                                  s3_credentials_json[SECRET_KEY]]
+            cmd_to_display = command
+            for replace_param in replace_param_list:
+                cmd_to_display = cmd_to_display.replace(replace_param, "*********")
+            status_message = "Running command - " + cmd_to_display
+            logger.debug(status_message)
+            if self.dedup_index is not None:
+                return self.dedup_transfer(option_string, hdfs_file, s3_file_path, s3_credentials_json,
+                                           transferred_files, transferred_target_paths)
+            transferred_target_paths.append(s3_file_path)
+            return self.hdfs_to_s3_loader(command, hdfs_file, s3_file_path, s3_credentials_json,
+                                          transferred_files)
+
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+
+        except:
+            error = " ERROR MESSAGE: " + str(traceback.format_exc())
+            logger.error(status_message)
+            return {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0, FAILURE_KEY: failure}
+
+    """
+    Purpose   :   This method transfers one entry of the source listing and retries it while it fails with a
+                  transient error (S3 throttling, timeouts, YARN preemption), up to S3PUT_RETRIES times unless
+                  max_retries is set in the [retry] section, with a jittered exponential backoff. Each retry is
+                  taken from the retry budget of the job and starts by removing the objects written by the failed
+                  attempt. Only this entry is copied again; the entries already transferred are kept. Each attempt
+                  records its paths in its own list, the paths of the last attempt are added to
+                  transferred_target_paths, which the transfer threads share, under target_paths_lock
+    Input     :   Same as transfer_file
+    Output    :   Returns the status of the last attempt, see transfer_file
+    """
+
+    def transfer_file_with_retries(self, option_string, source_path, file_name, target_path, s3_credentials_json,
+                                   transferred_files, transferred_target_paths):
+        written_paths = []
+
+        def attempt():
+            status = self.transfer_file(option_string, source_path, file_name, target_path, s3_credentials_json,
+                                        transferred_files, written_paths)
+            if status[FILE_NAME_KEY]:
+                return status, None
+            return status, status.get(FAILURE_KEY, Retry.FAILURE_PERMANENT)
+
+        def before_retry():
+            if not self.s3_cleanup(written_paths, s3_credentials_json):
+                return False
+            del written_paths[:]
+            return True
+
+        try:
+            return Retry.run_with_retries(file_name, Metrics.EXPORT_TYPE_HDFS_TO_S3, attempt, before_retry,
+                                          Retry.get_policy(S3PUT_RETRIES))
+        finally:
+            # Paths not removed by a retry are left to the rollback of the export
+            with self.target_paths_lock:
+                transferred_target_paths.extend(written_paths)
+
+    """
+    Purpose   :   This method runs a distcp command with the job timeout of the [commands] section, publishing its
+                  progress and errors to the job as the output is read, and parses the output for errors
+    Input     :   The command to execute, the source path reported in the events
+    Output    :   Returns the output of the command and True if it shows an error or the command was killed
+    """
+
+    def run_distcp(self, command_to_execute, source_file_path):
+        distcp_started = time.time()
+        with Tracing.span("distcp", file_name=source_file_path):
+            command = CommandRunner.start(command_to_execute, CommandRunner.job_timeout(), stream=True)
+            # Lines are joined once at the end, appending to a string copies the whole log for every line
+            log_lines = []
+            output_summarizer = JobLog.OutputSummarizer(logger, "distcp")
+            try:
+                for log in command.lines():
+                    output_summarizer.line(log)
+                    log_lines.append(log)
+                    if JobEvents.current_job() is not None:
+                        self.publish_log_events(log, source_file_path)
+            finally:
+                if not command.done():
+                    command.cancel()
+                command.wait()
+            output_summarizer.close()
+        consolidated_log = "".join(log_lines)
+        error_status = self.log_parser(consolidated_log) or command.kill_reason is not None
+        Metrics.DISTCP_DURATION.observe(time.time() - distcp_started, "failed" if error_status else "ok")
+        return consolidated_log, error_status
 
     """       
     Purpose   :   This method takes the command along with source path and target path and executes it. It checks
@@ -202,56 +531,40 @@ class HdfsToS3(object):
                   size of Hdfs file/dir with the transferred s3 file/dir. If it cannot verify the size, it fails and
                   cleans up the transferred files from s3.
     Input     :   The command to execute, either s3distcp or distcp, the fully qualified source and target paths, the
-                    list containing the files transferred
+                    set of the Hdfs files transferred
     Output    :   Returns a json containing file_name and file_size of the s3 target location
     """
 
     def hdfs_to_s3_loader(self, command_to_execute, source_file_path, target_file_path, s3_credentials_json,
-                          transferred_file_list):
+                          transferred_files):
         status_message = ""
+        failure = Retry.FAILURE_PERMANENT
         try:
             status_message = "Starting function to Load data from HDFS to S3"
             logger.debug(status_message)
 
-            process = subprocess.Popen(command_to_execute, stdout=subprocess.PIPE, shell=True, stderr=subprocess.STDOUT)
-            consolidated_log = ""
-            while True:
-                try:
-                    ret_code = process.poll()
-                    log = process.stdout.readline()
-                    logger.debug(log)
-                    consolidated_log += log
-                    if ret_code is not None:
-                        break
-                except IOError as e:
-                    if e.errno == errno.EINTR:
-                        logger.error(str(e))
-                        continue
-                    else:
-                        error = "ERROR in " + self.execution_context.get_context_param("module_name") + \
-                                " ERROR MESSAGE: " + str(traceback.format_exc())
-                        logger.error(status_message)
-                        raise e
-            error_status = self.log_parser(consolidated_log)
+            consolidated_log, error_status = self.run_distcp(command_to_execute, source_file_path)
             if error_status:
                 status_message = "Error executing the command - " + consolidated_log
+                failure = Retry.classify(consolidated_log)
                 raise Exception
-            transferred_relative_files_list = []
-            transferred_absolute_files_list = []
-            return_status = self.get_hdfs_files_list(source_file_path, source_file_path,
-                                                     transferred_relative_files_list, transferred_absolute_files_list)
-
-            if not return_status:
-                status_message = "Error while fetching HDFS file list"
-                raise Exception
-
-            transferred_file_list.extend(list(set(transferred_absolute_files_list) - set(transferred_file_list)))
+            # The copy succeeded, failures of the listings and size checks below are retried
+            failure = Retry.FAILURE_TRANSIENT
+            # One recursive listing gives the files copied and their total size
+            status_message = "Error while fetching HDFS file list"
+            files = self.get_hdfs_file_sizes(source_file_path)
+            transferred_files.update(path for path, _, _ in files)
+            hdfs_file_size = sum(size for _, _, size in files)
+
+            if self.context.defer_verification:
+                self.context.add_pending_verification(target_file_path, s3_credentials_json, hdfs_file_size)
+                status = {FILE_NAME_KEY: target_file_path, FILE_SIZE_KEY: str(hdfs_file_size)}
+                return status
 
             s3_file_size = self.get_s3_folder_size(target_file_path, s3_credentials_json,
-                                                   transferred_relative_files_list)
-            hdfs_file_size = self.get_hdfs_folder_size(source_file_path)
-            if s3_file_size is None or hdfs_file_size is None:
-                status_message = "Could not calculate S3 or Hdfs size"
+                                                   [relative for _, relative, _ in files])
+            if s3_file_size is None:
+                status_message = "Could not calculate S3 size"
                 raise Exception
             if s3_file_size != hdfs_file_size:
                 status_message = "Size of source and target do not match while transferring hdfs file to s3. " \
@@ -259,6 +572,8 @@ class HdfsToS3(object):
                                  + str(s3_file_size) + " Hdfs file size = " + str(hdfs_file_size)
                 raise Exception
 
+            Metrics.BYTES_TRANSFERRED.inc(s3_file_size, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+            Metrics.FILES_TRANSFERRED.inc(len(files), Metrics.EXPORT_TYPE_HDFS_TO_S3)
             status = {FILE_NAME_KEY: target_file_path, FILE_SIZE_KEY: str(s3_file_size)}
             return status
 
@@ -268,36 +583,239 @@ class HdfsToS3(object):
         except:
             error = " ERROR MESSAGE: " + str(traceback.format_exc())
             logger.error(status_message)
-            status = {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0}
+            status = {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0, FAILURE_KEY: failure}
             return status
 
+    """
+    Purpose   :   Turn on the dedup mode: files whose content is already in one of the allowed buckets are copied
+                  server side from the indexed object instead of being uploaded
+    Input     :   Buckets whose objects can be copied, by default only the target bucket of each transfer
+    Output    :   Returns True if the dedup index could be opened
+    """
+
+    def enable_dedup(self, dedup_buckets=None):
+        self.dedup_index = DedupIndex.get_index()
+        self.dedup_buckets = dedup_buckets
+        return self.dedup_index is not None
+
+    """
+    Purpose   :   List the files below a Hdfs path with their size, using one recursive listing
+    Input     :   Hdfs file or directory
+    Output    :   Returns a list of (absolute path, path relative to the source, size)
+    """
+
+    @Tracing.traced("hdfs.ls")
+    def get_hdfs_file_sizes(self, source_file_path):
+        exit_code, output = run_command("hadoop fs -ls -R " + pipes.quote(source_file_path))
+        if exit_code != 0:
+            raise Exception("Error listing " + source_file_path + ": " + output.strip()[-2000:])
+        base_path = hdfs_path_of(source_file_path)
+        files = []
+        for path, size in sorted(parse_hdfs_listing(output).items()):
+            relative = path[len(base_path):].strip("/") if path.startswith(base_path) else ""
+            files.append((source_file_path.rstrip("/") + "/" + relative if relative else source_file_path,
+                          relative, size))
+        return files
+
+    """
+    Purpose   :   Compute the Hdfs checksums of files, COMMAND_BATCH_SIZE files per hadoop fs -checksum command.
+                  The checksum is computed by the datanodes from the stored block checksums, the data is not read
+                  by the service. checksum_options of the [dedup] section is added to the command, e.g.
+                  -Ddfs.checksum.combine.mode=COMPOSITE_CRC so files stored with different block sizes match
+    Input     :   List of Hdfs paths
+    Output    :   Returns a dictionary of path (see hdfs_path_of) to "algorithm:checksum"
+    """
+
+    @Tracing.traced("hdfs.checksum")
+    def get_hdfs_checksums(self, paths):
+        checksums = {}
+        options = DedupIndex.get_checksum_options()
+        for index in range(0, len(paths), COMMAND_BATCH_SIZE):
+            batch = paths[index:index + COMMAND_BATCH_SIZE]
+            exit_code, output = run_command("hadoop fs " + options + " -checksum " +
+                                            " ".join(pipes.quote(path) for path in batch))
+            if exit_code != 0:
+                raise Exception("Error computing the checksums: " + output.strip()[-2000:])
+            for line in output.splitlines():
+                fields = line.strip().split("\t")
+                if len(fields) == 3 and fields[2]:
+                    checksums[hdfs_path_of(fields[0])] = fields[1] + ":" + fields[2]
+        return checksums
+
+    """
+    Purpose   :   Find an existing object with the content of a file. The target object itself is preferred; every
+                  candidate is checked with HeadObject and must still have the size and the ETag recorded in the
+                  index. A candidate that is gone, was overwritten since or was indexed without an ETag is dropped
+                  from the index
+    Input     :   S3 client, checksum, size, buckets to search, target bucket and key
+    Output    :   Returns (bucket, key) of the object or None
+    """
+
+    def find_duplicate(self, s3, checksum, size, buckets, bucket_name, key):
+        candidates = self.dedup_index.lookup(checksum, size, buckets)
+        # sort is stable: the target first, then the most recently indexed
+        candidates.sort(key=lambda candidate: (candidate[0], candidate[1]) != (bucket_name, key))
+        for source_bucket, source_key, etag in candidates:
+            if etag is not None:
+                try:
+                    head = Metrics.s3_call("head_object", s3.head_object, Bucket=source_bucket, Key=source_key)
+                    if head["ContentLength"] == size and head.get("ETag") == etag:
+                        return source_bucket, source_key
+                    logger.debug(source_bucket + "/" + source_key + " changed since it was indexed")
+                except Exception as e:
+                    error_code = getattr(e, "response", {}).get("Error", {}).get("Code")
+                    if error_code not in ("404", "NoSuchKey", "NotFound"):
+                        logger.warning("Unable to check " + source_bucket + "/" + source_key + ": " + str(e))
+                        continue
+            self.dedup_index.remove(source_bucket, source_key)
+        return None
+
+    """
+    Purpose   :   List the ETags of the objects below a key, recorded in the dedup index with the objects written
+    Input     :   S3 client, bucket name, key prefix
+    Output    :   Returns a dictionary of key to ETag
+    """
+
+    def get_s3_etags(self, s3, bucket_name, prefix):
+        etags = {}
+        kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+        while True:
+            response = Metrics.s3_call("list_objects_v2", s3.list_objects_v2, **kwargs)
+            for item in response.get("Contents", []):
+                etags[item["Key"]] = item.get("ETag")
+            if not response.get("IsTruncated"):
+                return etags
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    """
+    Purpose   :   Dedup mode of the transfer of one entry of the source listing. The files of the entry are listed
+                  and their Hdfs checksums looked up in the dedup index: files already stored in an allowed bucket
+                  are copied server side (or left alone when the target already holds them) and only the other
+                  files are uploaded with distcp, one command per target directory. The target is verified, the
+                  objects are added to the index and the bytes not uploaded are reported as bytes_saved. Only the
+                  keys copied or uploaded are recorded for the rollback, the objects the target already held are
+                  not removed when the export fails
+    Input     :   distcp option string, the fully qualified source and target paths, the set of the Hdfs files
+                  transferred, list of the S3 paths written
+    Output    :   Returns a json containing file_name, file_size and bytes_saved of the s3 target location
+    """
+
+    @Tracing.traced("dedup_transfer")
+    def dedup_transfer(self, option_string, source_file_path, target_file_path, s3_credentials_json,
+                       transferred_files, transferred_target_paths):
+        status_message = ""
+        failure = Retry.FAILURE_TRANSIENT
+        try:
+            files = self.get_hdfs_file_sizes(source_file_path)
+            if not files:
+                status_message = "No file found below " + source_file_path
+                failure = Retry.FAILURE_PERMANENT
+                raise Exception
+            checksums = self.get_hdfs_checksums([path for path, _, _ in files])
+            bucket_name, key_root = split_s3_path(target_file_path)
+            buckets = list(self.dedup_buckets or [])
+            if bucket_name not in buckets:
+                buckets.append(bucket_name)
+            s3 = self.context.get_s3_client(s3_credentials_json)
+            extra_args = {}
+            encryption = s3_credentials_json.get(AES_ENCRYPTION_ENABLED_KEY)
+            if encryption and encryption.lower() == FLAG_YES:
+                extra_args["ServerSideEncryption"] = ENCRYPTION_ALGORITHM
+
+            bytes_saved = 0
+            index_entries = []
+            uploads = collections.OrderedDict()
+            for path, relative, size in files:
+                key = key_root.rstrip("/") + "/" + relative if relative else key_root
+                s3_file_path = target_file_path.rstrip("/") + ("/" + relative if relative else "")
+                checksum = checksums.get(hdfs_path_of(path))
+                source = self.find_duplicate(s3, checksum, size, buckets, bucket_name, key) if checksum else None
+                if source is None:
+                    uploads.setdefault(s3_file_path.rsplit("/", 1)[0] if relative else s3_file_path,
+                                       []).append((path, s3_file_path))
+                elif source != (bucket_name, key):
+                    status_message = "Copying " + source[0] + "/" + source[1] + " to " + bucket_name + "/" + key
+                    logger.debug(status_message)
+                    transferred_target_paths.append(s3_file_path)
+                    Metrics.s3_call("copy", s3.copy, CopySource={"Bucket": source[0], "Key": source[1]},
+                                    Bucket=bucket_name, Key=key, ExtraArgs=extra_args or None)
+                    bytes_saved += size
+                else:
+                    bytes_saved += size
+                if checksum:
+                    index_entries.append((checksum, size, key))
+
+            uploaded = sum(len(group) for group in uploads.values())
+            status_message = "Dedup of " + source_file_path + ": " + str(len(files) - uploaded) + " of " + \
+                             str(len(files)) + " files already stored, " + str(bytes_saved) + " bytes saved"
+            logger.info(status_message)
+            if uploaded == len(files) and len(files) > 1:
+                # Nothing to skip, copy the entry with one distcp
+                uploads = {target_file_path: [(source_file_path, target_file_path)]}
+            for target_directory, group in uploads.items():
+                for index in range(0, len(group), COMMAND_BATCH_SIZE):
+                    batch = group[index:index + COMMAND_BATCH_SIZE]
+                    transferred_target_paths.extend(s3_file_path for _, s3_file_path in batch)
+                    # One source is copied to its own target path, several sources into the target directory
+                    target = batch[0][1] if len(batch) == 1 else target_directory
+                    command = "hadoop distcp " + option_string + " " + \
+                              " ".join(pipes.quote(path) for path, _ in batch) + " " + pipes.quote(target)
+                    consolidated_log, error_status = self.run_distcp(command, source_file_path)
+                    if error_status:
+                        status_message = "Error executing the command - " + consolidated_log
+                        failure = Retry.classify(consolidated_log)
+                        raise Exception
+
+            transferred_files.update(path for path, _, _ in files)
+            total_size = sum(size for _, _, size in files)
+            if self.context.defer_verification:
+                self.context.add_pending_verification(target_file_path, s3_credentials_json, total_size)
+            else:
+                inventory = self.context.get_s3_inventory(bucket_name, key_root, s3_credentials_json, refresh=True)
+                s3_file_size, _ = inventory.size_of(key_root)
+                if s3_file_size != total_size:
+                    status_message = "Size of source and target do not match while transferring hdfs file to s3. " \
+                                     "S3 file size = " + str(s3_file_size) + " Hdfs file size = " + str(total_size)
+                    raise Exception
+                Metrics.BYTES_TRANSFERRED.inc(total_size, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+                Metrics.FILES_TRANSFERRED.inc(len(files), Metrics.EXPORT_TYPE_HDFS_TO_S3)
+            # The objects are indexed with the ETag they have now, a later overwrite makes the entry stale
+            etags = self.get_s3_etags(s3, bucket_name, key_root) if index_entries else {}
+            self.dedup_index.add([(entry_checksum, entry_size, bucket_name, entry_key, etags[entry_key])
+                                  for entry_checksum, entry_size, entry_key in index_entries
+                                  if etags.get(entry_key)])
+            Metrics.BYTES_DEDUPLICATED.inc(bytes_saved, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+            return {FILE_NAME_KEY: target_file_path, FILE_SIZE_KEY: str(total_size), BYTES_SAVED_KEY: bytes_saved}
+
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+
+        except:
+            error = " ERROR MESSAGE: " + str(traceback.format_exc())
+            logger.error(status_message + error)
+            return {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0, FAILURE_KEY: failure}
+
     """ 
-    Purpose   :   This method is used to calculate the file/dir size on s3.
-    Input     :   The path for which the size is need to be calculated
+    Purpose   :   This method is used to calculate the file/dir size on s3. Only the objects below the target
+                  path are listed; a directory's size is the sum of the objects under "<path>/".
+    Input     :   The path for which the size is need to be calculated, s3 credentials and the list of
+                  transferred files (kept for compatibility, the listing below the path covers them)
     Output    :   Returns the size of the path in bytes
     """
 
+    @Tracing.traced("verify.s3_folder_size")
     def get_s3_folder_size(self, target_file_path, s3_credentials_json, transferred_files_list):
         try:
             status_message = "Calculating s3 size for the file/directory - " + target_file_path
             logger.debug(status_message)
-            s3_access_key = s3_credentials_json[ACCESS_KEY]
-            s3_secret_key = s3_credentials_json[SECRET_KEY]
-            s3 = boto3.client('s3', aws_access_key_id=s3_access_key,
-                              aws_secret_access_key=s3_secret_key)
-
-            bucket_name = target_file_path[(target_file_path.index("://") +
-                                            3):(target_file_path.index("/", target_file_path.index("://") + 3))]
+            bucket_name, s3_target_path = split_s3_path(target_file_path)
             status_message = "Extracted bucket name - " + bucket_name
             logger.debug(status_message)
-            s3_target_path = target_file_path[target_file_path.index("/", target_file_path.index("//") + 2) + 1:]
 
             try:
-                size = 0
-                folder_key = s3.list_objects(Bucket=bucket_name, Delimiter=',')['Contents']
-                for keys in folder_key:
-                    if (keys["Key"] == s3_target_path) or (keys["Key"] in transferred_files_list):
-                        size = size + keys["Size"]
+                inventory = self.context.get_s3_inventory(bucket_name, s3_target_path, s3_credentials_json,
+                                                          refresh=True)
+                size, _ = inventory.size_of(s3_target_path)
                 status_message = "S3 file size for file " + target_file_path + " : " + str(size)
                 logger.debug(status_message)
                 return size
@@ -309,20 +827,53 @@ class HdfsToS3(object):
 
                 return None
 
-            folder_key = bucket.list(s3_target_path)
-            size = 0
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
 
+        except:
+            status_message = "Error getting S3 file size for the file - " + target_file_path
+            error = " ERROR MESSAGE: " + str(traceback.format_exc())
+            logger.error(status_message)
+            return None
 
+    """
+    Purpose   :   This method removes the files already loaded to s3 when a transfer fails. Each target path is
+                  deleted together with every object below it, in batches of S3_DELETE_BATCH_SIZE keys.
+    Input     :   List of s3 target paths written by the export, s3 credentials
+    Output    :   Returns True if all the objects were deleted else False
+    """
 
+    @Tracing.traced("s3_cleanup")
+    def s3_cleanup(self, target_paths, s3_credentials_json):
+        status_message = ""
+        try:
+            s3 = self.context.get_s3_client(s3_credentials_json)
+            for target_file_path in target_paths:
+                bucket_name, s3_target_path = split_s3_path(target_file_path)
+                if not s3_target_path:
+                    status_message = "Refusing to clean up the bucket root - " + target_file_path
+                    raise Exception
+                status_message = "Cleaning up s3 path - " + target_file_path
+                logger.info(status_message)
+                inventory = self.context.get_s3_inventory(bucket_name, s3_target_path, s3_credentials_json,
+                                                          refresh=True)
+                directory = s3_target_path.rstrip("/") + "/"
+                keys = [key for key in inventory.keys if key == s3_target_path or key.startswith(directory)]
+                if self.dedup_index is not None:
+                    self.dedup_index.remove_prefix(bucket_name, s3_target_path)
+                for index in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+                    batch = [{"Key": key} for key in keys[index:index + S3_DELETE_BATCH_SIZE]]
+                    Metrics.s3_call("delete_objects", s3.delete_objects, Bucket=bucket_name,
+                                    Delete={"Objects": batch, "Quiet": True})
+            return True
 
         except KeyboardInterrupt:
             raise KeyboardInterrupt
 
         except:
-            status_message = "Error getting S3 file size for the file - " + target_file_path
             error = " ERROR MESSAGE: " + str(traceback.format_exc())
             logger.error(status_message)
-            return None
+            return False
 
     """ 
     Purpose   :   This method is used to parse the logs to check if there is any error
@@ -348,33 +899,45 @@ class HdfsToS3(object):
             logger.error(status_message)
             return True
 
+    """
+    Purpose   :   This method publishes the progress and errors of a running distcp to the job of the current
+                  thread as soon as the line is read, using the same error patterns as log_parser
+    Input     :   One line of the command output, the file being transferred
+    Output    :   None
+    """
+
+    def publish_log_events(self, log, source_file_path):
+        progress = PROGRESS_PATTERN.search(log)
+        if progress:
+            JobEvents.publish(JobEvents.EVENT_PROGRESS, file_name=source_file_path, map=int(progress.group(1)),
+                              reduce=int(progress.group(2)))
+            return
+        for error in ERROR_LIST:
+            if error in log:
+                JobEvents.publish(JobEvents.EVENT_ERROR, file_name=source_file_path, message=log.strip())
+                return
+
     """
     Purpose   :   This method is used to calculate the file/dir size on Hdfs.
     Input     :   The path for which the size is need to be calculated
     Output    :   Returns the size of the path in bytes or None in case of exception
     """
 
+    @Tracing.traced("hdfs.du")
     def get_hdfs_folder_size(self, source_file_path):
         status_message = ""
         try:
             status_message = "Calculating Hdfs size for the file/directory - " + source_file_path
             logger.debug(status_message)
-            cmd = "hadoop fs -du -s " + source_file_path
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True, stderr=subprocess.STDOUT)
+            cmd = "hadoop fs -du -s " + pipes.quote(source_file_path)
             size = 0
-            standard_output, standard_error = process.communicate()
+            exit_code, standard_output = run_command(cmd)
+            if exit_code != 0 or self.log_parser(standard_output):
+                status_message = "Error in executing command - " + cmd
+                raise Exception
             if standard_output:
-                error_status = self.log_parser(standard_output)
-                if error_status:
-                    status_message = "Error in executing command - " + cmd
-                    raise Exception
                 output = standard_output.split()
                 size = output[0]
-            elif standard_error:
-                status_message = "Error in executing command - " + cmd
-                raise Exception
-            else:
-                pass
             status_message = "Hdfs file size for file " + source_file_path + " : " + str(size)
             logger.debug(status_message)
             return int(size)
@@ -387,41 +950,15 @@ class HdfsToS3(object):
             logger.error(status_message)
             return None
 
-    """
-    Purpose   :   This method is used to get the list of files present in the HDFS source folder
-    Input     :   The base path of the folder, current path for traversal, list of files with relative paths and the
-                     other with absolute paths
-    Output    :   Return True if the traversal was successful else return False
-    """
-
-    def get_hdfs_files_list(self, base_path, path, relative_list, absolute_list):
-        status_message = ""
-        try:
-            status_message = "Starting function to fetch HDFS files list."
-            logger.debug(status_message)
-            if hadoopy.isdir(path):
-                curr_files_list = hadoopy.ls(path)
-                for file_name in curr_files_list:
-                    if hadoopy.isdir(file_name):
-                        self.get_hdfs_files_list(base_path, file_name, relative_list, absolute_list)
-                    else:
-                        relative_list.append(file_name[len(base_path):])
-                        absolute_list.append(file_name)
-            else:
-                absolute_list.append(path)
-            return True
-
-        except KeyboardInterrupt:
-            raise KeyboardInterrupt
-
-        except:
-            error = " ERROR MESSAGE: " + str(traceback.format_exc())
-            logger.error(status_message)
-            return False
-
 
-def runHdfsTOS3(config):
-    hdfsToS3 = HdfsToS3()
+def runHdfsTOS3(config, context=None):
+    if isinstance(config.get("target_path"), list):
+        # Several destinations: every source file is read once and written to all of them
+        import HdfsFanOut
+        return HdfsFanOut.runHdfsFanOut(config, context)
+    hdfsToS3 = HdfsToS3(context)
+    if DedupIndex.is_enabled(config):
+        hdfsToS3.enable_dedup(config.get(DEDUP_BUCKETS_KEY))
     filelist = False
     if "file_list" in config:
         filelist = config['file_list']
@@ -0,0 +1,370 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : HiveToS3
+Purpose             : Partition-aware export of a Hive table directory to S3. The partitions are found from the
+                      key=value layout of the table location with one recursive listing, optionally narrowed by a
+                      partition filter, and compared with the target: a partition is copied again only when it has
+                      no commit marker on S3 or the size of its objects differs from the source, unless refresh is
+                      set. The selected partitions are copied in parallel with the distcp transfer of HdfsToS3,
+                      verified one by one and committed by writing a marker object (_SUCCESS, ignored by Spark
+                      readers) into the partition, so a reader can use a partition as soon as its marker exists.
+                      A failed partition is removed and does not affect the partitions already committed.
+Input Parameters    : s3_credentials, table_location (HDFS), target_path (S3) and optionally partition_filter,
+                      refresh, max_parallel, atomic_transaction, dedup
+Output Value        : Status json with the files_copied_list array (file_name, file_size) of the partitions
+                      committed and the partitions array (partition, status)
+Dependencies        : HdfsToS3, boto3, hadoop command line
+Predecessor Module  : DataExportService
+Successor Module    : HdfsToS3
+Pre-requisites      : [hivetos3] section of settings.conf
+How to run          : Call runHiveToS3 with the request json
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import pipes
+import re
+import json
+import time
+import urllib
+import traceback
+from multiprocessing.pool import ThreadPool
+from LogSetup import logger
+from ConfigUtility import get_snapshot
+from ExportContext import ExportContext, split_s3_path, hdfs_path_of, run_command, parse_hdfs_listing
+import HdfsToS3
+import DedupIndex
+import Metrics
+import JobEvents
+import Tracing
+
+"""
+Module Constants
+"""
+MODULE_NAME = "HiveToS3"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "hivetos3"
+STATUS_KEY = "status"
+STATUS_SUCCESS = "SUCCESS"
+STATUS_FAILED = "FAILED"
+STATUS_SKIPPED = "SKIPPED"
+MESSAGE_KEY = "message"
+FILES_COPIED_LIST_KEY = "files_copied_list"
+FILE_NAME_KEY = "file_name"
+FILE_SIZE_KEY = "file_size"
+PARTITIONS_KEY = "partitions"
+PARTITION_KEY = "partition"
+FLAG_YES = "y"
+
+S3_CREDENTIALS_KEY = "s3_credentials"
+TABLE_LOCATION_KEY = "table_location"
+TARGET_PATH_KEY = "target_path"
+PARTITION_FILTER_KEY = "partition_filter"
+REFRESH_KEY = "refresh"
+MAX_PARALLEL_KEY = "max_parallel"
+ATOMIC_TRANSACTION_KEY = "atomic_transaction"
+DEFAULT_MAX_PARALLEL = 4
+DEFAULT_MARKER_NAME = "_SUCCESS"
+
+PARTITION_SEGMENT = re.compile(r"^([^=/]+)=([^/]*)$")
+FILTER_CONDITION = re.compile(r"^\s*(\w+)\s*(==|=|!=|<>|<=|>=|<|>|\bin\b)\s*(.+?)\s*$", re.IGNORECASE)
+FILTER_SEPARATOR = re.compile(r"\s+and\s+", re.IGNORECASE)
+FILTER_INVALID_VALUE = re.compile(r"[\s'\"(),]")
+
+
+class Partition(object):
+    __slots__ = ("path", "values", "size", "files", "status")
+
+    def __init__(self, path, values):
+        # Path relative to the table location, e.g. dt=2024-01-01/country=US
+        self.path = path
+        self.values = values
+        self.size = 0
+        self.files = 0
+        self.status = None
+
+
+def is_yes(value):
+    return str(value).strip().lower() in ("y", "yes", "true", "1")
+
+
+def filter_value(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"" and text[0] not in text[1:-1]:
+        return text[1:-1]
+    # An unquoted value is a single word, e.g. "dt >= 1 or dt < 0" is not read as dt >= "1 or dt < 0"
+    if not text or FILTER_INVALID_VALUE.search(text):
+        raise ValueError("Invalid partition filter value: " + text)
+    return text
+
+
+def compare(left, right):
+    try:
+        return cmp(float(left), float(right))
+    except ValueError:
+        return cmp(left, right)
+
+
+"""
+Purpose   :   Parse a partition filter such as "dt >= '2024-01-01' and country in ('US', 'CA')". Conditions are
+              joined with and; the operators are =, !=, <>, <, <=, >, >= and in. Values are compared as numbers
+              when both sides are numbers, otherwise as strings
+Input     :   Filter string
+Output    :   Returns a list of (key, operator, value or list of values). Raises ValueError for an invalid filter
+"""
+
+
+def parse_filter(partition_filter):
+    conditions = []
+    for clause in FILTER_SEPARATOR.split(partition_filter.strip()):
+        match = FILTER_CONDITION.match(clause)
+        if not match:
+            raise ValueError("Invalid partition filter condition: " + clause)
+        key, operator, value = match.group(1), match.group(2).lower(), match.group(3)
+        if operator == "in":
+            if not (value.startswith("(") and value.endswith(")")):
+                raise ValueError("Invalid partition filter condition: " + clause)
+            value = [filter_value(item) for item in value[1:-1].split(",") if item.strip()]
+        else:
+            value = filter_value(value)
+        conditions.append((key, {"==": "=", "<>": "!="}.get(operator, operator), value))
+    return conditions
+
+
+def matches(values, conditions):
+    for key, operator, value in conditions:
+        if key not in values:
+            return False
+        actual = values[key]
+        if operator == "in":
+            if not any(compare(actual, item) == 0 for item in value):
+                return False
+            continue
+        result = compare(actual, value)
+        if not {"=": result == 0, "!=": result != 0, "<": result < 0, "<=": result <= 0, ">": result > 0,
+                ">=": result >= 0}[operator]:
+            return False
+    return True
+
+
+"""
+Purpose   :   Group the files of a table listing by partition. The partition of a file is given by the leading
+              key=value directories of its path relative to the table. Files below hidden directories (_temporary,
+              .hive-staging) and hidden files of the table directory are left out, and so is the commit marker of a
+              partition, which is replaced on S3. Hive escapes special characters of the values in the directory
+              names, the values are unescaped for the filter
+Input     :   Table location, dictionary of file path to size (see parse_hdfs_listing), name of the commit marker
+Output    :   Returns the list of Partition sorted by path. Raises ValueError if the table is not partitioned or the
+              partition keys differ between directories
+"""
+
+
+def find_partitions(table_location, sizes, marker_name=DEFAULT_MARKER_NAME):
+    base_path = hdfs_path_of(table_location)
+    partitions = {}
+    keys = None
+    for path, size in sizes.items():
+        if not path.startswith(base_path.rstrip("/") + "/"):
+            continue
+        segments = path[len(base_path):].strip("/").split("/")
+        if any(segment[:1] in ("_", ".") for segment in segments[:-1]) or \
+                (len(segments) == 1 and segments[0][:1] in ("_", ".")):
+            continue
+        partition_segments = []
+        for segment in segments[:-1]:
+            match = PARTITION_SEGMENT.match(segment)
+            if not match:
+                break
+            partition_segments.append((match.group(1), urllib.unquote(match.group(2))))
+        file_keys = [key for key, _ in partition_segments]
+        if keys is None:
+            keys = file_keys
+        elif file_keys != keys:
+            raise ValueError("Inconsistent partition layout below " + table_location + ": " + "/".join(keys) +
+                             " and " + "/".join(file_keys))
+        relative_path = "/".join(segments[:len(partition_segments)])
+        if len(segments) == len(partition_segments) + 1 and segments[-1] == marker_name:
+            continue
+        partition = partitions.get(relative_path)
+        if partition is None:
+            partition = partitions[relative_path] = Partition(relative_path, dict(partition_segments))
+        partition.size += size
+        partition.files += 1
+    if not keys:
+        raise ValueError("No key=value partition directories found below " + table_location)
+    return [partitions[path] for path in sorted(partitions)]
+
+
+class HiveToS3(object):
+    def __init__(self, config, context=None):
+        self.config = config
+        self.context = context if context is not None else ExportContext()
+        self.s3_credentials_json = config[S3_CREDENTIALS_KEY]
+        self.table_location = config[TABLE_LOCATION_KEY].rstrip("/")
+        self.target_path = config[TARGET_PATH_KEY].rstrip("/")
+        self.bucket_name, self.target_prefix = split_s3_path(self.target_path)
+        if not self.target_prefix:
+            raise ValueError("The target of a table export must be a prefix, not the bucket root")
+        partition_filter = config.get(PARTITION_FILTER_KEY)
+        self.conditions = parse_filter(partition_filter) if partition_filter else []
+        self.refresh = is_yes(config.get(REFRESH_KEY) or "n")
+        settings = get_snapshot(CONFIGURATION_FILE)
+        self.max_parallel = max(1, int(config.get(MAX_PARALLEL_KEY) or
+                                       settings.get_int(SETTINGS_SECTION, MAX_PARALLEL_KEY, DEFAULT_MAX_PARALLEL)))
+        self.marker_name = settings.get(SETTINGS_SECTION, "marker_name") or DEFAULT_MARKER_NAME
+        self.hdfs_to_s3 = HdfsToS3.HdfsToS3(self.context)
+        self.hdfs_to_s3.atomic_transaction = (config.get(ATOMIC_TRANSACTION_KEY) or FLAG_YES).lower()
+        if DedupIndex.is_enabled(config):
+            self.hdfs_to_s3.enable_dedup(config.get(HdfsToS3.DEDUP_BUCKETS_KEY))
+        self.option_string = None
+        self.job = JobEvents.current_job()
+
+    def partition_target(self, partition):
+        return self.target_path + "/" + partition.path
+
+    def marker_key(self, partition):
+        return split_s3_path(self.partition_target(partition))[1] + "/" + self.marker_name
+
+    """
+    Purpose   :   Find the partitions of the table and select the ones to copy: those matching the filter that are
+                  not committed on S3 yet, or whose objects on S3 do not add up to the size of the source
+    Input     :   None
+    Output    :   Returns the list of selected partitions and the list of partitions already up to date
+    """
+
+    @Tracing.traced("hive.plan")
+    def plan(self):
+        exit_code, output = run_command("hadoop fs -ls -R " + pipes.quote(self.table_location))
+        if exit_code != 0:
+            raise Exception("Error listing " + self.table_location + ": " + output.strip()[-2000:])
+        partitions = find_partitions(self.table_location, parse_hdfs_listing(output), self.marker_name)
+        partitions = [partition for partition in partitions if matches(partition.values, self.conditions)]
+        if self.refresh:
+            return partitions, []
+        inventory = self.context.get_s3_inventory(self.bucket_name, self.target_prefix, self.s3_credentials_json,
+                                                  refresh=True)
+        selected = []
+        unchanged = []
+        for partition in partitions:
+            marker_size, marker_count = inventory.size_of(self.marker_key(partition))
+            target_size, _ = inventory.size_of(split_s3_path(self.partition_target(partition))[1])
+            if marker_count and target_size - marker_size == partition.size:
+                partition.status = STATUS_SKIPPED
+                unchanged.append(partition)
+            else:
+                selected.append(partition)
+        return selected, unchanged
+
+    """
+    Purpose   :   Copy one partition and commit it. Objects left on S3 by an earlier failed or changed copy of the
+                  partition are removed first, the partition directory is copied with the distcp transfer and retries
+                  of HdfsToS3, which verifies its size, and the marker is written last
+    Input     :   Partition
+    Output    :   Returns the status of the transfer, file_name is empty if it failed
+    """
+
+    def export_partition(self, partition):
+        JobEvents.set_current_job(self.job)
+        target = self.partition_target(partition)
+        status = {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0}
+        try:
+            with Tracing.span("hive.partition", partition=partition.path):
+                inventory = self.context.get_s3_inventory(self.bucket_name, split_s3_path(target)[1],
+                                                          self.s3_credentials_json, refresh=True)
+                if inventory.keys and not self.hdfs_to_s3.s3_cleanup([target], self.s3_credentials_json):
+                    raise Exception("Unable to remove the previous copy of " + target)
+                target_paths = []
+                status = self.hdfs_to_s3.transfer_file_with_retries(
+                    self.option_string, self.table_location, partition.path, self.target_path,
+                    self.s3_credentials_json, set(), target_paths)
+                if not status[FILE_NAME_KEY]:
+                    if self.hdfs_to_s3.atomic_transaction == FLAG_YES and target_paths:
+                        self.hdfs_to_s3.s3_cleanup(target_paths, self.s3_credentials_json)
+                    return status
+                self.write_marker(partition)
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            logger.error("Export of partition " + partition.path + " failed: " + traceback.format_exc())
+            return {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0}
+        finally:
+            Metrics.QUEUE_DEPTH.dec(1, Metrics.EXPORT_TYPE_HDFS_TO_S3)
+        JobEvents.publish(JobEvents.EVENT_FILE_COPIED, partition=partition.path, **status)
+        return status
+
+    def write_marker(self, partition):
+        s3 = self.context.get_s3_client(self.s3_credentials_json)
+        body = json.dumps({"source": self.table_location + "/" + partition.path, "files": partition.files,
+                           "bytes": partition.size, "committed_at": time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                                                                  time.gmtime())})
+        arguments = {"Bucket": self.bucket_name, "Key": self.marker_key(partition), "Body": body}
+        encryption = self.s3_credentials_json.get(HdfsToS3.AES_ENCRYPTION_ENABLED_KEY)
+        if encryption and encryption.lower() == FLAG_YES:
+            arguments["ServerSideEncryption"] = HdfsToS3.ENCRYPTION_ALGORITHM
+        Metrics.s3_call("put_object", s3.put_object, **arguments)
+
+    def run(self):
+        status_message = ""
+        try:
+            self.option_string = self.hdfs_to_s3.create_command_options_string(self.s3_credentials_json)
+            if not self.option_string:
+                status_message = "Error Occured while creating hadoop distcp options"
+                raise Exception
+            partitions, unchanged = self.plan()
+            unchanged = len(unchanged)
+            status_message = "Exporting " + str(len(partitions)) + " partitions of " + self.table_location + \
+                             " to " + self.target_path + ", " + str(unchanged) + " partitions up to date"
+            logger.info(status_message)
+            Metrics.QUEUE_DEPTH.inc(len(partitions), Metrics.EXPORT_TYPE_HDFS_TO_S3)
+            pool = ThreadPool(max(1, min(self.max_parallel, len(partitions) or 1)))
+            try:
+                statuses = pool.map(self.export_partition, partitions)
+            finally:
+                pool.close()
+                pool.join()
+
+            files_copied_list = []
+            partition_statuses = []
+            for partition, status in zip(partitions, statuses):
+                partition.status = STATUS_SUCCESS if status[FILE_NAME_KEY] else STATUS_FAILED
+                partition_statuses.append({PARTITION_KEY: partition.path, STATUS_KEY: partition.status})
+                if status[FILE_NAME_KEY]:
+                    files_copied_list.append(status)
+            failed = len(partitions) - len(files_copied_list)
+            result = {STATUS_KEY: STATUS_FAILED if failed else STATUS_SUCCESS,
+                      FILES_COPIED_LIST_KEY: files_copied_list, PARTITIONS_KEY: partition_statuses,
+                      "partitions_unchanged": unchanged}
+            if failed:
+                result[MESSAGE_KEY] = str(failed) + " of " + str(len(partitions)) + " partitions failed"
+            if self.hdfs_to_s3.dedup_index is not None:
+                result[HdfsToS3.BYTES_SAVED_KEY] = sum(status.get(HdfsToS3.BYTES_SAVED_KEY, 0)
+                                                       for status in files_copied_list)
+            return result
+
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+
+        except:
+            logger.error(status_message + " ERROR MESSAGE: " + traceback.format_exc())
+            return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: status_message, FILES_COPIED_LIST_KEY: []}
+
+
+"""
+Purpose   :   Entry point of the hiveToS3 export type
+Input     :   Request json
+Output    :   Returns the status of the export
+"""
+
+
+def runHiveToS3(config):
+    try:
+        hive_to_s3 = HiveToS3(config)
+    except Exception:
+        logger.error("Error Parsing Input Config " + traceback.format_exc())
+        return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Error Parsing Input Config", FILES_COPIED_LIST_KEY: []}
+    return hive_to_s3.run()
@@ -0,0 +1,403 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : JobEvents
+Purpose             : Progress events of running exports. Every export request is a job with an id; the export code
+                      publishes events (file copied, sqoop record count, errors, ...) for the job of the current
+                      thread, and they are appended as json lines to <jobs_dir>/<job_id>.events. The events file is
+                      shared by all the worker processes, so the Server-Sent Events stream of a job can be served by
+                      any worker by following the file.
+Input Parameters    : Job id, event name and event data
+Output Value        : Server-Sent Events stream from stream_events()
+Dependencies        : None
+Predecessor Module  : DataExportService, HdfsToS3, SqoopUtility, BulkExport
+Successor Module    : None
+Pre-requisites      : jobs_dir in settings.conf must be on a file system shared by the workers
+How to run          : job = JobEvents.start_job(); JobEvents.publish("file_copied", file_name=...)
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import re
+import json
+import time
+import uuid
+import errno
+import fcntl
+import threading
+from ConfigUtility import get_snapshot
+from LogSetup import logger
+
+"""
+Module Constants
+"""
+MODULE_NAME = "JobEvents"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "jobs"
+DEFAULT_JOBS_DIR = "/tmp/dataexportservice_jobs"
+DEFAULT_RETENTION = 7 * 24 * 3600
+EVENTS_FILE_SUFFIX = ".events"
+TRACE_FILE_SUFFIX = ".trace.json"
+JOB_ID_PATTERN = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+# Seconds between two reads of the events file while the job is idle
+POLL_INTERVAL = 0.5
+# Seconds between two SSE comments sent to keep idle connections open
+KEEPALIVE_INTERVAL = 15
+# Seconds a stream waits for the events file of a job that has not started yet
+START_TIMEOUT = 30
+# Seconds a stream is kept open, the client reconnects with Last-Event-ID afterwards
+DEFAULT_STREAM_TIMEOUT = 3600
+# Seconds between two checks that an idle job is still run by a process
+OWNER_CHECK_INTERVAL = 15
+
+EVENT_JOB_STARTED = "job_started"
+EVENT_FILE_COPIED = "file_copied"
+EVENT_RECORD_COUNT = "record_count"
+EVENT_PROGRESS = "progress"
+EVENT_ERROR = "error"
+EVENT_RETRY = "retry"
+EVENT_JOB_FINISHED = "job_finished"
+# Set on the last log record of a job, closes the job log (JobLog)
+CLOSE_JOB_LOG = "close_job_log"
+
+_local = threading.local()
+_background_jobs = set()
+_background_lock = threading.Condition()
+_open_streams = [0]
+_streams_lock = threading.Lock()
+
+
+def get_jobs_dir():
+    return get_snapshot(CONFIGURATION_FILE).get(SETTINGS_SECTION, "jobs_dir") or DEFAULT_JOBS_DIR
+
+
+def get_retention():
+    return get_snapshot(CONFIGURATION_FILE).get_int(SETTINGS_SECTION, "retention", DEFAULT_RETENTION)
+
+
+def get_stream_timeout():
+    return get_snapshot(CONFIGURATION_FILE).get_float(SETTINGS_SECTION, "stream_timeout", DEFAULT_STREAM_TIMEOUT)
+
+
+def is_valid_job_id(job_id):
+    return bool(job_id) and JOB_ID_PATTERN.match(job_id) is not None
+
+
+def events_path(job_id):
+    return os.path.join(get_jobs_dir(), job_id + EVENTS_FILE_SUFFIX)
+
+
+def trace_path(job_id):
+    return os.path.join(get_jobs_dir(), job_id + TRACE_FILE_SUFFIX)
+
+
+def is_tracing_default():
+    return get_snapshot(CONFIGURATION_FILE).get_bool(SETTINGS_SECTION, "trace", False)
+
+
+class Job(object):
+    """
+    A running export. Events are numbered and appended to the events file of the job under a lock, so events
+    published from the threads of a bulk export keep a single order. A job continued by another process (a worker
+    of the work queue) numbers its events after the ones already in the file. The process running the job holds a
+    shared lock on the file until it closes it, which tells the streams of the other workers that the job is alive.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.sequence = 0
+        # Tracing.Trace of the job when it is traced
+        self.trace = None
+        # Retry.RetryBudget shared by all the transfers of the job, created on the first failure
+        self.retry_budget = None
+        jobs_dir = get_jobs_dir()
+        if not os.path.isdir(jobs_dir):
+            try:
+                os.makedirs(jobs_dir)
+            except OSError:
+                pass
+        path = os.path.join(jobs_dir, job_id + EVENTS_FILE_SUFFIX)
+        if os.path.exists(path):
+            with open(path) as events_file:
+                self.sequence = sum(1 for _ in events_file)
+        self.events_file = open(path, "a")
+        fcntl.flock(self.events_file.fileno(), fcntl.LOCK_SH)
+
+    def publish(self, event, data):
+        with self.lock:
+            if self.events_file is None:
+                return
+            self.sequence += 1
+            self.events_file.write(json.dumps({"id": self.sequence, "time": time.time(), "event": event,
+                                               "data": data}) + "\n")
+            self.events_file.flush()
+
+    def close(self):
+        """Close the events file without finishing the job, which is continued by another process"""
+        with self.lock:
+            if self.events_file is not None:
+                self.events_file.close()
+                self.events_file = None
+
+    def finish(self, result):
+        self.publish(EVENT_JOB_FINISHED, result)
+        with self.lock:
+            if self.events_file is not None:
+                self.events_file.close()
+                self.events_file = None
+        if self.trace is not None:
+            try:
+                self.trace.save(trace_path(self.job_id))
+            except (IOError, OSError):
+                logger.error("Could not save the trace of job " + self.job_id)
+        logger.info("Job " + self.job_id + " finished with status " + str((result or {}).get("status")),
+                    extra={"job_id": self.job_id, CLOSE_JOB_LOG: True})
+
+
+"""
+Purpose   :   Create a job and make it the current job of the calling thread
+Input     :   Job id requested by the client, generated when None
+Output    :   Returns the Job
+"""
+
+
+def start_job(job_id=None, export_type=None):
+    job = Job(job_id or uuid.uuid4().hex)
+    set_current_job(job)
+    job.publish(EVENT_JOB_STARTED, {"job_id": job.job_id, "export_type": export_type})
+    return job
+
+
+"""
+Purpose   :   Continue a job started by another process and make it the current job of the calling thread
+Input     :   Job id
+Output    :   Returns the Job
+"""
+
+
+def resume_job(job_id):
+    job = Job(job_id)
+    set_current_job(job)
+    return job
+
+
+def set_current_job(job):
+    _local.job = job
+
+
+def current_job():
+    return getattr(_local, "job", None)
+
+
+"""
+Purpose   :   Publish an event for the job of the calling thread. Does nothing when the thread runs no job
+Input     :   Event name and event data as keyword arguments
+Output    :   None
+"""
+
+
+def publish(event, **data):
+    job = getattr(_local, "job", None)
+    if job is not None:
+        job.publish(event, data)
+
+
+"""
+Purpose   :   Run an export in a background thread. The thread becomes the current thread of the job, which is
+              finished with the result of the export
+Input     :   Job, export function and its argument
+Output    :   None
+"""
+
+
+def run_in_background(job, function, argument):
+    def run():
+        set_current_job(job)
+        result = {"status": "FAILED"}
+        try:
+            result = function(argument)
+        finally:
+            job.finish(result)
+            with _background_lock:
+                _background_jobs.discard(job.job_id)
+                _background_lock.notify_all()
+
+    with _background_lock:
+        _background_jobs.add(job.job_id)
+    thread = threading.Thread(target=run, name="job-" + job.job_id)
+    thread.daemon = True
+    thread.start()
+
+
+"""
+Purpose   :   Wait for the background jobs of this process, used when a worker is stopping
+Input     :   Maximum number of seconds to wait
+Output    :   Returns True if no background job is left
+"""
+
+
+def wait_background_jobs(timeout):
+    deadline = time.time() + timeout
+    with _background_lock:
+        while _background_jobs:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            _background_lock.wait(remaining)
+    return True
+
+
+def _format_event(record):
+    return "id: %d\nevent: %s\ndata: %s\n\n" % (record["id"], record["event"], json.dumps(record["data"]))
+
+
+"""
+Purpose   :   Tell whether a process still runs a job: one holds the lock of its events file, or the job waits in
+              the work queue for a worker
+Input     :   Job id
+Output    :   Returns True if the job can still publish events
+"""
+
+
+def has_live_owner(job_id):
+    try:
+        with open(events_path(job_id)) as events_file:
+            fcntl.flock(events_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(events_file.fileno(), fcntl.LOCK_UN)
+    except IOError as e:
+        if e.errno in (errno.EAGAIN, errno.EACCES):
+            return True
+        if e.errno != errno.ENOENT:
+            raise
+    # Imported here, the work queue imports this module
+    import WorkQueue
+    if not WorkQueue.is_enabled():
+        return False
+    state = WorkQueue.get_queue().get_job(job_id)[0]
+    return state in (WorkQueue.STATE_PENDING, WorkQueue.STATE_LEASED)
+
+
+"""
+Purpose   :   Follow the events file of a job and yield its events in the Server-Sent Events format until the
+              job is finished. The stream ends after stream_timeout seconds (the client reconnects with the id of
+              the last event), and when the job stays idle without a process running it
+Input     :   Job id, id of the last event already received by the client (Last-Event-ID header)
+Output    :   Generator of SSE messages
+"""
+
+
+def stream_events(job_id, last_event_id=0):
+    path = events_path(job_id)
+    waited = 0
+    while not os.path.exists(path):
+        if waited >= START_TIMEOUT:
+            yield "event: %s\ndata: %s\n\n" % (EVENT_ERROR, json.dumps({"message": "Unknown job " + job_id}))
+            return
+        time.sleep(POLL_INTERVAL)
+        waited += POLL_INTERVAL
+    deadline = time.time() + get_stream_timeout()
+    last_sent = last_checked = time.time()
+    owner_gone = False
+    with open(path) as events_file:
+        partial = ""
+        while True:
+            line = events_file.readline()
+            if not line:
+                now = time.time()
+                if now >= deadline:
+                    return
+                if owner_gone:
+                    yield "event: %s\ndata: %s\n\n" % (EVENT_ERROR, json.dumps(
+                        {"message": "Job " + job_id + " is not run by any worker"}))
+                    return
+                if now - last_checked >= OWNER_CHECK_INTERVAL:
+                    last_checked = now
+                    # The file is read once more first, the owner may have written its last events meanwhile
+                    owner_gone = not has_live_owner(job_id)
+                    continue
+                if now - last_sent >= KEEPALIVE_INTERVAL:
+                    last_sent = now
+                    yield ": keepalive\n\n"
+                time.sleep(POLL_INTERVAL)
+                continue
+            if not line.endswith("\n"):
+                # The writer has not finished the line yet
+                partial += line
+                continue
+            record = json.loads(partial + line)
+            partial = ""
+            last_checked = time.time()
+            owner_gone = False
+            if record["id"] <= last_event_id:
+                continue
+            last_sent = time.time()
+            yield _format_event(record)
+            if record["event"] == EVENT_JOB_FINISHED:
+                return
+
+
+class EventStream(object):
+    """
+    Events of a job streamed to one client (see stream_events), counted in the open streams of the process until
+    the response is closed
+    """
+
+    def __init__(self, job_id, last_event_id):
+        self.events = stream_events(job_id, last_event_id)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self.events)
+
+    def close(self):
+        self.events.close()
+        with _streams_lock:
+            if not self.closed:
+                self.closed = True
+                _open_streams[0] -= 1
+
+
+"""
+Purpose   :   Open an event stream of a job unless max_streams streams are already open in this process, so that
+              long lived streams cannot take every request thread of a worker
+Input     :   Job id, id of the last event already received by the client, maximum number of open streams
+Output    :   Returns the EventStream, or None when too many streams are open
+"""
+
+
+def open_stream(job_id, last_event_id, max_streams):
+    with _streams_lock:
+        if _open_streams[0] >= max_streams:
+            return None
+        _open_streams[0] += 1
+    return EventStream(job_id, last_event_id)
+
+
+"""
+Purpose   :   Delete the events and trace files of jobs finished more than retention seconds ago
+Input     :   None
+Output    :   None
+"""
+
+
+def purge_old_jobs():
+    max_age = get_retention()
+    jobs_dir = get_jobs_dir()
+    if not os.path.isdir(jobs_dir):
+        return
+    oldest = time.time() - max_age
+    for file_name in os.listdir(jobs_dir):
+        path = os.path.join(jobs_dir, file_name)
+        try:
+            if file_name.endswith((EVENTS_FILE_SUFFIX, TRACE_FILE_SUFFIX)) and os.path.getmtime(path) < oldest:
+                os.remove(path)
+        except OSError:
+            pass
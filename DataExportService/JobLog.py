@@ -0,0 +1,252 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : JobLog
+Purpose             : Per-job structured logs. Records logged by the thread of a job are tagged with its job id and
+                      written as json lines to the job's own log file, <job_log_dir>/<job_id>.log, so concurrent
+                      exports no longer interleave in the shared log. A job log is cut into segments of
+                      job_log_segment_size bytes; a full segment, and the last one when the job finishes, is
+                      compressed to <job_id>.<segment>.log.gz. OutputSummarizer logs the output of distcp and sqoop,
+                      collapsing runs of similar lines (the same line up to its numbers) into one summary line.
+Input Parameters    : Log records, subprocess output lines
+Output Value        : Job log segments
+Dependencies        : None
+Predecessor Module  : LogSetup, HdfsToS3, SqoopUtility
+Successor Module    : JobEvents
+Pre-requisites      : job_log_dir in log_setup.conf, empty to disable the job logs
+How to run          : Installed by LogSetup.get_logger; summarizer = JobLog.OutputSummarizer(logger, "distcp")
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import re
+import gzip
+import json
+import time
+import shutil
+import logging
+import JobEvents
+from ConfigUtility import get_snapshot
+
+"""
+Module Constants
+"""
+MODULE_NAME = "JobLog"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/log_setup.conf'
+SETTINGS_SECTION = "log_setup"
+LOG_FILE_SUFFIX = ".log"
+SEGMENT_FILE_SUFFIX = ".log.gz"
+DEFAULT_SEGMENT_SIZE = 10 * 1024 * 1024
+DEFAULT_MAX_REPEATS = 3
+JOB_ID_ATTRIBUTE = "job_id"
+# Numbers, including dates, times, percentages and byte counts, do not make two output lines different
+NUMBER_PATTERN = re.compile(r"\d+")
+LEVELS = {"debug": logging.DEBUG, "info": logging.INFO, "warning": logging.WARNING, "error": logging.ERROR}
+
+
+def get_level(level_name, default=logging.INFO):
+    if level_name is None:
+        return default
+    return LEVELS.get(level_name.strip().lower(), default)
+
+
+class JobContextFilter(logging.Filter):
+    """
+    Logger filter tagging every record with the id of the job of the thread logging it. Logger filters run on the
+    logging thread, before the record is queued for an asynchronous handler.
+    """
+
+    def filter(self, record):
+        if JOB_ID_ATTRIBUTE not in record.__dict__:
+            job = JobEvents.current_job()
+            record.job_id = job.job_id if job is not None else None
+        return True
+
+
+class SharedLogFilter(logging.Filter):
+    """
+    Handler filter keeping the records of jobs below shared_level out of the shared log handlers, they are only
+    written to the job log.
+    """
+
+    def __init__(self, shared_level):
+        logging.Filter.__init__(self)
+        self.shared_level = shared_level
+
+    def filter(self, record):
+        return getattr(record, JOB_ID_ATTRIBUTE, None) is None or record.levelno >= self.shared_level
+
+
+class JobLogHandler(logging.Handler):
+    """
+    Writes the records of every job to the job's log file as json lines. The handler is closed for a job by the
+    record carrying JobEvents.CLOSE_JOB_LOG, logged when the job finishes.
+    """
+
+    def __init__(self, log_dir, segment_size=DEFAULT_SEGMENT_SIZE, level=logging.DEBUG):
+        logging.Handler.__init__(self, level)
+        self.log_dir = log_dir
+        self.segment_size = segment_size
+        # job id : [open file, bytes written to the segment, number of the segment]
+        self.streams = {}
+
+    def open_stream(self, job_id):
+        if not os.path.isdir(self.log_dir):
+            try:
+                os.makedirs(self.log_dir)
+            except OSError:
+                pass
+        path = os.path.join(self.log_dir, job_id + LOG_FILE_SUFFIX)
+        segment = 1
+        while os.path.exists(self.segment_path(job_id, segment)):
+            segment += 1
+        stream = [open(path, "a"), 0, segment]
+        self.streams[job_id] = stream
+        return stream
+
+    def segment_path(self, job_id, segment):
+        return os.path.join(self.log_dir, "%s.%04d%s" % (job_id, segment, SEGMENT_FILE_SUFFIX))
+
+    """
+    Purpose   :   Close the current segment of a job and compress it into its numbered .log.gz file
+    Input     :   Job id
+    Output    :   None
+    """
+
+    def close_segment(self, job_id):
+        stream = self.streams.pop(job_id, None)
+        if stream is None:
+            return
+        stream[0].close()
+        path = stream[0].name
+        with open(path, "rb") as source, gzip.open(self.segment_path(job_id, stream[2]), "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(path)
+
+    def format_record(self, record):
+        entry = {"time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) +
+                 ".%03d" % record.msecs, "level": record.levelname, "module": record.module,
+                 "thread": record.threadName, "job_id": record.job_id, "message": record.getMessage()}
+        if record.exc_info:
+            entry["exception"] = logging.Formatter().formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry) + "\n"
+
+    def emit(self, record):
+        job_id = getattr(record, JOB_ID_ATTRIBUTE, None)
+        if job_id is None:
+            return
+        try:
+            stream = self.streams.get(job_id) or self.open_stream(job_id)
+            line = self.format_record(record)
+            stream[0].write(line)
+            stream[0].flush()
+            stream[1] += len(line)
+            if getattr(record, JobEvents.CLOSE_JOB_LOG, False) or stream[1] >= self.segment_size:
+                self.close_segment(job_id)
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            for job_id in list(self.streams):
+                self.close_segment(job_id)
+        finally:
+            self.release()
+        logging.Handler.close(self)
+
+
+"""
+Purpose   :   Add the job log handler to a logger configured by LogSetup, and keep the job records below
+              shared_level out of its other handlers
+Input     :   Logger, job log directory, segment size in bytes, level of the job records kept in the shared log
+Output    :   None
+"""
+
+
+def install(logger_obj, log_dir, segment_size=DEFAULT_SEGMENT_SIZE, shared_level=logging.INFO):
+    shared_filter = SharedLogFilter(shared_level)
+    for handler in logger_obj.handlers:
+        handler.addFilter(shared_filter)
+    logger_obj.addFilter(JobContextFilter())
+    logger_obj.addHandler(JobLogHandler(log_dir, segment_size))
+
+
+"""
+Purpose   :   Delete the job logs last written more than the job retention (JobEvents) ago
+Input     :   None
+Output    :   None
+"""
+
+
+def purge_old_logs():
+    log_dir = get_snapshot(CONFIGURATION_FILE).get(SETTINGS_SECTION, "job_log_dir")
+    if not log_dir or not os.path.isdir(log_dir):
+        return
+    oldest = time.time() - JobEvents.get_retention()
+    for file_name in os.listdir(log_dir):
+        path = os.path.join(log_dir, file_name)
+        try:
+            if file_name.endswith(SEGMENT_FILE_SUFFIX) and os.path.getmtime(path) < oldest:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+class OutputSummarizer(object):
+    """
+    Logs the output lines of a subprocess. After max_repeats consecutive lines that only differ by their numbers
+    (e.g. "map 41% reduce 0%" progress lines) the next similar lines are counted instead of logged, and a single
+    summary line with the count and the last suppressed line is logged when the run ends.
+    """
+
+    def __init__(self, logger_obj, name, max_repeats=None, level=logging.DEBUG):
+        if max_repeats is None:
+            # The snapshot keeps the converted value, a run does not parse the setting again
+            max_repeats = get_snapshot(CONFIGURATION_FILE).get_int(SETTINGS_SECTION, "subprocess_max_repeats",
+                                                                   DEFAULT_MAX_REPEATS)
+        self.logger = logger_obj
+        self.name = name
+        self.max_repeats = max_repeats
+        self.level = level
+        self.shape = None
+        self.repeats = 0
+        self.suppressed = 0
+        self.last_suppressed = None
+
+    def line(self, line):
+        line = line.rstrip()
+        if not line:
+            return
+        shape = NUMBER_PATTERN.sub("#", line)
+        if shape == self.shape:
+            self.repeats += 1
+            if self.repeats > self.max_repeats:
+                self.suppressed += 1
+                self.last_suppressed = line
+                return
+        else:
+            self.flush()
+            self.shape = shape
+            self.repeats = 1
+        self.logger.log(self.level, line)
+
+    def flush(self):
+        if self.suppressed:
+            self.logger.log(self.level, "{:,} similar {} lines suppressed, last: {}".format(
+                self.suppressed, self.name, self.last_suppressed))
+        self.suppressed = 0
+        self.last_suppressed = None
+
+    def close(self):
+        self.flush()
+        self.shape = None
+        self.repeats = 0
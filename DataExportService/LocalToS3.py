@@ -0,0 +1,387 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : LocalToS3
+Purpose             : Uploads files from the local file system of the service node to S3. The source can be a file,
+                      a directory (uploaded recursively) or a glob pattern. Files smaller than the multipart
+                      threshold are sent with PutObject; larger files are sent as concurrent multipart uploads whose
+                      parts are read through read-only memory maps of the file, so a part is never copied into a
+                      Python buffer. All the PutObject calls and parts of the request share one bounded thread pool,
+                      which also bounds the number of parts mapped at any time and keeps memory use flat whatever
+                      the file sizes.
+Input Parameters    : aws_access_key_id, aws_secret_access_key, bucket_name, source_file, destination_file and
+                      optionally endpoint_url, aes_encryption_enabled, part_size, max_concurrency,
+                      multipart_threshold
+Output Value        : Status json with the files_copied_list array (file_name, file_size) like HdfsToS3
+Dependencies        : boto3
+Predecessor Module  : DataExportService
+Successor Module    : None
+Pre-requisites      : None
+How to run          : Call runLocalTos3Upload with the request json
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import glob
+import mmap
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+from LogSetup import logger
+from ExportContext import ExportContext
+import Metrics
+import JobEvents
+import Tracing
+from ConfigUtility import get_snapshot
+
+"""
+Module Constants
+"""
+MODULE_NAME = "LocalToS3"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "localtos3"
+STATUS_KEY = "status"
+STATUS_SUCCESS = "SUCCESS"
+STATUS_FAILED = "FAILED"
+MESSAGE_KEY = "message"
+FILES_COPIED_LIST_KEY = "files_copied_list"
+FILE_NAME_KEY = "file_name"
+FILE_SIZE_KEY = "file_size"
+
+BUCKET_NAME_KEY = "bucket_name"
+SOURCE_FILE_KEY = "source_file"
+DESTINATION_FILE_KEY = "destination_file"
+AES_ENCRYPTION_ENABLED_KEY = "aes_encryption_enabled"
+PART_SIZE_KEY = "part_size"
+MAX_CONCURRENCY_KEY = "max_concurrency"
+MULTIPART_THRESHOLD_KEY = "multipart_threshold"
+ENCRYPTION_ALGORITHM = "AES256"
+
+MEGABYTE = 1024 * 1024
+DEFAULT_PART_SIZE = 64 * MEGABYTE
+DEFAULT_MULTIPART_THRESHOLD = 64 * MEGABYTE
+DEFAULT_MAX_CONCURRENCY = 16
+# S3 limits: parts are at least 5 MB (except the last one) and an upload has at most 10000 parts
+MINIMUM_PART_SIZE = 5 * MEGABYTE
+MAXIMUM_PARTS = 10000
+GLOB_CHARACTERS = "*?["
+
+
+class UploadFile(object):
+    __slots__ = ("path", "key", "size", "upload_id", "parts", "failed", "written")
+
+    def __init__(self, path, key, size):
+        self.path = path
+        self.key = key
+        self.size = size
+        # Multipart upload created and not completed or aborted yet
+        self.upload_id = None
+        self.parts = {}
+        self.failed = False
+        # The object was written by this request, a rollback deletes only these keys
+        self.written = False
+
+
+class LocalToS3(object):
+    def __init__(self, config, context=None):
+        self.config = config
+        self.context = context if context is not None else ExportContext()
+        self.bucket_name = config[BUCKET_NAME_KEY]
+        # Request values override settings.conf, read for every request so tuning changes apply without a restart
+        settings = get_snapshot(CONFIGURATION_FILE)
+        self.max_concurrency = int(config.get(MAX_CONCURRENCY_KEY) or settings.get_int(
+            SETTINGS_SECTION, MAX_CONCURRENCY_KEY, DEFAULT_MAX_CONCURRENCY))
+        self.part_size = self.align_part_size(int(config.get(PART_SIZE_KEY) or settings.get_int(
+            SETTINGS_SECTION, PART_SIZE_KEY, DEFAULT_PART_SIZE)))
+        self.multipart_threshold = int(config.get(MULTIPART_THRESHOLD_KEY) or settings.get_int(
+            SETTINGS_SECTION, MULTIPART_THRESHOLD_KEY, DEFAULT_MULTIPART_THRESHOLD))
+        self.extra_args = {}
+        encryption = config.get(AES_ENCRYPTION_ENABLED_KEY)
+        if encryption and encryption.lower() == "y":
+            self.extra_args["ServerSideEncryption"] = ENCRYPTION_ALGORITHM
+        self.lock = threading.Lock()
+
+    """
+    Purpose   :   Round the part size up to the mmap allocation granularity (a memory map must start at a multiple
+                  of it) and to the minimum S3 part size
+    Input     :   Requested part size in bytes
+    Output    :   Returns the part size to use
+    """
+
+    def align_part_size(self, part_size):
+        part_size = max(part_size, MINIMUM_PART_SIZE)
+        granularity = mmap.ALLOCATIONGRANULARITY
+        return (part_size + granularity - 1) // granularity * granularity
+
+    """
+    Purpose   :   Resolve source_file into the list of files to upload and their S3 keys. A single file is uploaded
+                  to destination_file; the files of a directory or glob pattern are uploaded below the
+                  destination_file prefix with their path relative to the directory (or the fixed part of the
+                  pattern)
+    Input     :   Source file, directory or glob pattern and the destination key or prefix
+    Output    :   Returns a list of UploadFile
+    """
+
+    @Tracing.traced("resolve_sources")
+    def resolve_sources(self, source, destination):
+        if any(character in source for character in GLOB_CHARACTERS):
+            base_dir = source
+            while any(character in base_dir for character in GLOB_CHARACTERS):
+                base_dir = os.path.dirname(base_dir)
+            paths = []
+            for match in sorted(glob.glob(source)):
+                if os.path.isdir(match):
+                    paths.extend(self.walk(match))
+                else:
+                    paths.append(match)
+        elif os.path.isdir(source):
+            base_dir = source
+            paths = self.walk(source)
+        elif os.path.isfile(source):
+            key = destination or os.path.basename(source)
+            return [UploadFile(source, key, os.path.getsize(source))]
+        else:
+            raise IOError("Source file " + source + " does not exist")
+        prefix = destination.strip("/")
+        files = []
+        for path in paths:
+            relative = os.path.relpath(path, base_dir).replace(os.sep, "/")
+            key = prefix + "/" + relative if prefix else relative
+            files.append(UploadFile(path, key, os.path.getsize(path)))
+        return files
+
+    def walk(self, directory):
+        paths = []
+        for current_dir, _, file_names in os.walk(directory):
+            for file_name in sorted(file_names):
+                paths.append(os.path.join(current_dir, file_name))
+        return paths
+
+    def part_size_for(self, upload_file):
+        part_size = self.part_size
+        while (upload_file.size + part_size - 1) // part_size > MAXIMUM_PARTS:
+            part_size *= 2
+        return part_size
+
+    """
+    Purpose   :   Upload a small file with one PutObject call, streaming it from the open file
+    Input     :   UploadFile
+    Output    :   None. Sets upload_file.failed on error
+    """
+
+    @Tracing.traced("put_file")
+    def put_file(self, upload_file):
+        s3 = self.context.get_s3_client(self.config)
+        try:
+            with open(upload_file.path, "rb") as body:
+                Metrics.s3_call("put_object", s3.put_object, Bucket=self.bucket_name, Key=upload_file.key,
+                                Body=body, ContentLength=upload_file.size, **self.extra_args)
+            upload_file.written = True
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            logger.error("Failed to upload " + upload_file.path + ": " + traceback.format_exc())
+            upload_file.failed = True
+
+    """
+    Purpose   :   Upload one part of a multipart upload. The part is a read-only memory map of its byte range of
+                  the file and is handed to boto3 as the request body, so its pages come straight from the page
+                  cache and are released when the map is closed
+    Input     :   UploadFile, part number, offset and length of the part
+    Output    :   None. Records the part ETag or sets upload_file.failed on error
+    """
+
+    @Tracing.traced("upload_part")
+    def upload_part(self, upload_file, part_number, offset, length):
+        if upload_file.failed:
+            return
+        s3 = self.context.get_s3_client(self.config)
+        try:
+            with open(upload_file.path, "rb") as source:
+                part = mmap.mmap(source.fileno(), length, offset=offset, access=mmap.ACCESS_READ)
+                try:
+                    response = Metrics.s3_call("upload_part", s3.upload_part, Bucket=self.bucket_name,
+                                               Key=upload_file.key, UploadId=upload_file.upload_id,
+                                               PartNumber=part_number, Body=part, ContentLength=length)
+                finally:
+                    part.close()
+            with self.lock:
+                upload_file.parts[part_number] = response["ETag"]
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            logger.error("Failed to upload part " + str(part_number) + " of " + upload_file.path + ": " +
+                         traceback.format_exc())
+            upload_file.failed = True
+
+    def run_task(self, task):
+        if len(task) == 1:
+            self.put_file(task[0])
+        else:
+            self.upload_part(*task)
+
+    """
+    Purpose   :   Generate the work of the request: one task per small file and one task per part of each large
+                  file, small files first so they are not queued behind the parts of a large file
+    Input     :   Small files, large files with their multipart upload created
+    Output    :   Generator of tasks
+    """
+
+    def tasks(self, small_files, large_files):
+        for upload_file in small_files:
+            yield (upload_file,)
+        for upload_file in large_files:
+            part_size = self.part_size_for(upload_file)
+            for part_number, offset in enumerate(range(0, upload_file.size, part_size), 1):
+                yield (upload_file, part_number, offset, min(part_size, upload_file.size - offset))
+
+    def complete_upload(self, upload_file):
+        s3 = self.context.get_s3_client(self.config)
+        if upload_file.failed or len(upload_file.parts) == 0:
+            upload_file.failed = True
+            self.abort_upload(upload_file)
+            return
+        parts = [{"ETag": etag, "PartNumber": number} for number, etag in sorted(upload_file.parts.items())]
+        Metrics.s3_call("complete_multipart_upload", s3.complete_multipart_upload, Bucket=self.bucket_name,
+                        Key=upload_file.key, UploadId=upload_file.upload_id, MultipartUpload={"Parts": parts})
+        upload_file.upload_id = None
+        upload_file.written = True
+
+    def abort_upload(self, upload_file):
+        s3 = self.context.get_s3_client(self.config)
+        Metrics.s3_call("abort_multipart_upload", s3.abort_multipart_upload, Bucket=self.bucket_name,
+                        Key=upload_file.key, UploadId=upload_file.upload_id)
+        upload_file.upload_id = None
+
+    """
+    Purpose   :   Check the size of every uploaded object against the local file
+    Input     :   List of UploadFile
+    Output    :   Returns True if all the sizes match
+    """
+
+    @Tracing.traced("verify")
+    def verify(self, files):
+        prefix = os.path.commonprefix([upload_file.key for upload_file in files])
+        inventory = self.context.get_s3_inventory(self.bucket_name, prefix, self.config, refresh=True)
+        sizes = dict(zip(inventory.keys, inventory.sizes))
+        for upload_file in files:
+            if sizes.get(upload_file.key) != upload_file.size:
+                logger.error("Size of source and target do not match for " + upload_file.path + ". S3 size = " +
+                             str(sizes.get(upload_file.key)) + " local size = " + str(upload_file.size))
+                return False
+        return True
+
+    """
+    Purpose   :   Roll a failed request back: abort the multipart uploads still open, so their parts are not kept
+                  (and billed), and delete the objects written by this request. Objects that already existed at
+                  keys this request did not write are left alone
+    Input     :   List of UploadFile
+    Output    :   None
+    """
+
+    @Tracing.traced("s3_cleanup")
+    def cleanup(self, files):
+        s3 = self.context.get_s3_client(self.config)
+        for upload_file in files:
+            if upload_file.upload_id is not None:
+                try:
+                    self.abort_upload(upload_file)
+                except Exception:
+                    logger.error("Unable to abort the multipart upload of " + upload_file.key + ": " +
+                                 traceback.format_exc())
+        keys = [upload_file.key for upload_file in files if upload_file.written]
+        for index in range(0, len(keys), 1000):
+            Metrics.s3_call("delete_objects", s3.delete_objects, Bucket=self.bucket_name,
+                            Delete={"Objects": [{"Key": key} for key in keys[index:index + 1000]], "Quiet": True})
+
+    """
+    Purpose   :   Upload every file of the request. If any upload fails the open multipart uploads are aborted and
+                  the objects already written are deleted
+    Input     :   Source file, directory or glob pattern and the destination key or prefix
+    Output    :   Returns a status json containing the files_copied_list array
+    """
+
+    def upload(self, source, destination):
+        status_message = ""
+        files = []
+        try:
+            files = self.resolve_sources(source, destination)
+            if not files:
+                status_message = "No file matches " + source
+                raise Exception
+            small_files = [item for item in files if item.size < self.multipart_threshold]
+            large_files = [item for item in files if item.size >= self.multipart_threshold]
+            status_message = "Uploading " + str(len(small_files)) + " files with PutObject and " + \
+                             str(len(large_files)) + " files with multipart uploads to bucket " + self.bucket_name
+            logger.info(status_message)
+
+            s3 = self.context.get_s3_client(self.config)
+            for upload_file in large_files:
+                response = Metrics.s3_call("create_multipart_upload", s3.create_multipart_upload,
+                                           Bucket=self.bucket_name, Key=upload_file.key, **self.extra_args)
+                upload_file.upload_id = response["UploadId"]
+
+            pool = ThreadPool(self.max_concurrency)
+            job = JobEvents.current_job()
+            try:
+                for _ in pool.imap_unordered(lambda task: (JobEvents.set_current_job(job), self.run_task(task)),
+                                             self.tasks(small_files, large_files)):
+                    pass
+            finally:
+                pool.close()
+                pool.join()
+            for upload_file in large_files:
+                self.complete_upload(upload_file)
+
+            failed = [upload_file.path for upload_file in files if upload_file.failed]
+            if failed:
+                status_message = "Failed to upload " + ", ".join(failed[:10])
+                raise Exception
+            if not self.verify(files):
+                status_message = "Verification of the uploaded files failed"
+                raise Exception
+
+            files_copied_list = []
+            for upload_file in files:
+                status = {FILE_NAME_KEY: "s3://" + self.bucket_name + "/" + upload_file.key,
+                          FILE_SIZE_KEY: str(upload_file.size)}
+                files_copied_list.append(status)
+                JobEvents.publish(JobEvents.EVENT_FILE_COPIED, **status)
+            Metrics.BYTES_TRANSFERRED.inc(sum(upload_file.size for upload_file in files),
+                                          Metrics.EXPORT_TYPE_LOCAL_TO_S3)
+            Metrics.FILES_TRANSFERRED.inc(len(files), Metrics.EXPORT_TYPE_LOCAL_TO_S3)
+            return {STATUS_KEY: STATUS_SUCCESS, FILES_COPIED_LIST_KEY: files_copied_list}
+
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+
+        except:
+            logger.error(status_message + " ERROR MESSAGE: " + traceback.format_exc())
+            if files:
+                try:
+                    self.cleanup(files)
+                except Exception:
+                    logger.error("Error in cleaning files already loaded to s3")
+            return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: status_message, FILES_COPIED_LIST_KEY: []}
+
+
+"""
+Purpose   :   Entry point of the localToS3 export type
+Input     :   Request json, optional ExportContext shared with other exports
+Output    :   Returns the result of the upload
+"""
+
+
+def runLocalTos3Upload(config, context=None):
+    try:
+        source = config[SOURCE_FILE_KEY]
+        destination = config.get(DESTINATION_FILE_KEY, "")
+        local_to_s3 = LocalToS3(config, context)
+    except Exception:
+        logger.error("Error Parsing Input Config ")
+        return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Error Parsing Input Config", FILES_COPIED_LIST_KEY: []}
+    return local_to_s3.upload(source, destination)
@@ -14,12 +14,14 @@ __author__ = 'ZS Associates'
 # Library and external modules declaration
 import logging
 import logging.handlers
-import logstash
 import os
+import Queue
 import socket
+import itertools
+import threading
 from datetime import datetime
 from logging.handlers import TimedRotatingFileHandler
-from ConfigUtility import ConfigUtility
+from ConfigUtility import get_snapshot
 
 ENVIRONMENT_CONFIG_FILE = "log_setup.conf"
 MODULE_NAME = "log_setup"
@@ -28,22 +30,163 @@ DEFAULT_LOG_FILE_NAME = "log_setup"
 TIME_FORMAT = str(datetime.now().strftime("%Y%m%d_%H_%M_%S"))
 file_name="log.log"
 
+# Asynchronous logging: the handlers are moved behind a bounded in-memory queue drained by a listener thread
+ASYNC_OVERFLOW_BLOCK = "block"
+ASYNC_OVERFLOW_DROP_DEBUG = "drop_debug"
+ASYNC_OVERFLOW_SAMPLE = "sample"
+ASYNC_OVERFLOW_POLICIES = (ASYNC_OVERFLOW_BLOCK, ASYNC_OVERFLOW_DROP_DEBUG, ASYNC_OVERFLOW_SAMPLE)
+DEFAULT_ASYNC_QUEUE_SIZE = 10000
+DEFAULT_ASYNC_SAMPLE_RATE = 10
+_STOP_LISTENER = None
+_exception_formatter = logging.Formatter()
+
+
+class QueueListener(object):
+    """
+    Background thread passing the records of the queue to the handlers that were attached to the logger. When
+    records have been dropped because the queue was full, a warning with the number of dropped records is written
+    as soon as the queue is empty again.
+    """
+
+    def __init__(self, record_queue, handlers):
+        self.queue = record_queue
+        self.handlers = handlers
+        self.dropped = 0
+        self.reported = 0
+        self.thread = threading.Thread(target=self.run, name="log-listener")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is _STOP_LISTENER:
+                break
+            self.handle(record)
+            if self.dropped != self.reported and self.queue.empty():
+                dropped = self.dropped
+                self.handle(logging.makeLogRecord({
+                    "name": MODULE_NAME, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": str(dropped - self.reported) + " log records dropped because the log queue was full"}))
+                self.reported = dropped
+
+    def handle(self, record):
+        for handler in self.handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self):
+        # Queued after the pending records, so they are all written before the thread ends
+        self.queue.put(_STOP_LISTENER)
+        self.thread.join()
+
+
+class AsyncQueueHandler(logging.Handler):
+    """
+    Puts the records on a bounded queue instead of writing them, so logging from the distcp and sqoop read loops
+    does not wait for the disk or the logstash connection. When the queue is full the overflow policy decides:
+    block waits for room, drop_debug drops DEBUG records and waits for the others, sample keeps one record below
+    WARNING in every sample_rate and drops the rest. WARNING and above are never dropped.
+    """
+
+    def __init__(self, handlers, queue_size=DEFAULT_ASYNC_QUEUE_SIZE, overflow_policy=ASYNC_OVERFLOW_BLOCK,
+                 sample_rate=DEFAULT_ASYNC_SAMPLE_RATE):
+        logging.Handler.__init__(self, min(handler.level for handler in handlers) if handlers else logging.NOTSET)
+        self.handlers = handlers
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.sample_rate = max(1, sample_rate)
+        self.overflow_counter = itertools.count()
+        self.start_listener()
+
+    def start_listener(self):
+        self.pid = os.getpid()
+        self.queue = Queue.Queue(self.queue_size)
+        self.listener = QueueListener(self.queue, self.handlers)
+
+    def restart_after_fork(self):
+        # The listener thread of the parent does not exist in a forked worker, and the locks of the handlers may
+        # have been held by it when the process forked
+        with self.lock:
+            if self.pid != os.getpid():
+                for handler in self.handlers:
+                    handler.createLock()
+                self.start_listener()
+
+    def prepare(self, record):
+        # Format the arguments and the exception now: they may change before the listener writes the record
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def handle(self, record):
+        # The queue is thread safe, so unlike logging.Handler the emitting threads do not take the handler lock
+        if self.filter(record):
+            self.emit(record)
+        return record
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.restart_after_fork()
+        try:
+            record = self.prepare(record)
+            try:
+                self.queue.put_nowait(record)
+            except Queue.Full:
+                self.overflow(record)
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except:
+            self.handleError(record)
+
+    def overflow(self, record):
+        if self.overflow_policy == ASYNC_OVERFLOW_DROP_DEBUG and record.levelno <= logging.DEBUG:
+            self.drop()
+        elif self.overflow_policy == ASYNC_OVERFLOW_SAMPLE and record.levelno < logging.WARNING and \
+                next(self.overflow_counter) % self.sample_rate != 0:
+            self.drop()
+        else:
+            self.queue.put(record)
+
+    def drop(self):
+        with self.lock:
+            self.listener.dropped += 1
+
+    def close(self):
+        # Called by logging.shutdown(): write the queued records before the process exits
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+        logging.Handler.close(self)
+
+
+def make_async(logger_obj, queue_size, overflow_policy, sample_rate):
+    handlers = list(logger_obj.handlers)
+    for handler in handlers:
+        logger_obj.removeHandler(handler)
+    logger_obj.addHandler(AsyncQueueHandler(handlers, queue_size, overflow_policy, sample_rate))
+
+
 def get_logger(file_name=None, append_ts=True, timed_rotating_fh=False):
-    configuration = ConfigUtility(os.path.normpath(os.path.dirname(os.path.realpath(__file__)))+'/'+ENVIRONMENT_CONFIG_FILE)
-    public_machine_list = configuration.get_configuration(MODULE_NAME, "public_machine_list")
-    logstash_port = configuration.get_configuration(MODULE_NAME, "logstash_port")
-    logstash_schema_version = configuration.get_configuration(MODULE_NAME, "schema_version")
-    logstash_public_host_name = configuration.get_configuration(MODULE_NAME, "logstash_public_ip")
-    logstash_private_host_name = configuration.get_configuration(MODULE_NAME, "logstash_private_ip")
-    console_logging_level = configuration.get_configuration(MODULE_NAME, "console_logging_level")
-    file_logging_level = configuration.get_configuration(MODULE_NAME, "file_logging_level")
-    logstash_logging_level = configuration.get_configuration(MODULE_NAME, "logstash_logging_level")
-    timed_rotating_file_suffix = configuration.get_configuration(MODULE_NAME, "timed_rotating_file_suffix")
-    logfile_path = configuration.get_configuration(MODULE_NAME, "logfile_path")
-    logfile_name = configuration.get_configuration(MODULE_NAME, "logfile_name")
-    timed_rotating_file_handler_interval = configuration.get_configuration(
+    # Parsed once and cached until log_setup.conf changes
+    configuration = get_snapshot(os.path.normpath(os.path.dirname(os.path.realpath(__file__)))+'/'+ENVIRONMENT_CONFIG_FILE)
+    public_machine_list = configuration.get(MODULE_NAME, "public_machine_list")
+    logstash_port = configuration.get(MODULE_NAME, "logstash_port")
+    logstash_schema_version = configuration.get(MODULE_NAME, "schema_version")
+    logstash_public_host_name = configuration.get(MODULE_NAME, "logstash_public_ip")
+    logstash_private_host_name = configuration.get(MODULE_NAME, "logstash_private_ip")
+    console_logging_level = configuration.get(MODULE_NAME, "console_logging_level")
+    file_logging_level = configuration.get(MODULE_NAME, "file_logging_level")
+    logstash_logging_level = configuration.get(MODULE_NAME, "logstash_logging_level")
+    timed_rotating_file_suffix = configuration.get(MODULE_NAME, "timed_rotating_file_suffix")
+    logfile_path = configuration.get(MODULE_NAME, "logfile_path")
+    logfile_name = configuration.get(MODULE_NAME, "logfile_name")
+    timed_rotating_file_handler_interval = configuration.get(
         MODULE_NAME, "timed_rotating_file_handler_interval")
-    timed_rotating_file_handler_cycle = configuration.get_configuration(
+    timed_rotating_file_handler_cycle = configuration.get(
         MODULE_NAME, "timed_rotating_file_handler_cycle")
     # creating log file name based on the timestamp and file name
     if file_name is None:
@@ -79,7 +222,7 @@ def get_logger(file_name=None, append_ts=True, timed_rotating_fh=False):
             logger_obj.setLevel(logging.INFO)
 
         # create formatter
-        log_formatter_keys = configuration.get_configuration(MODULE_NAME, "log_formatter_keys")
+        log_formatter_keys = configuration.get(MODULE_NAME, "log_formatter_keys")
         if log_formatter_keys is not None:
             # if log_formatter_keys exists and its not a list or blank list default formatter will be created
             if len(log_formatter_keys) == 0 or not isinstance(log_formatter_keys, list):
@@ -100,9 +243,9 @@ def get_logger(file_name=None, append_ts=True, timed_rotating_fh=False):
         formatter = logging.Formatter(formatter_string)
 
         # create file handler which logs even debug messages
-        file_handler_flag = configuration.get_configuration(MODULE_NAME, "file_handler_flag")
+        file_handler_flag = configuration.get(MODULE_NAME, "file_handler_flag")
         if file_handler_flag == "Y":
-            file_handler_path = configuration.get_configuration(MODULE_NAME, "file_handler_path")
+            file_handler_path = configuration.get(MODULE_NAME, "file_handler_path")
             # checking if file_handler_path key is present in json
             if file_handler_path != "" and file_handler_path is not None:
                 if os.path.exists(file_handler_path):
@@ -110,6 +253,9 @@ def get_logger(file_name=None, append_ts=True, timed_rotating_fh=False):
                     file_log_path = os.path.join(str(file_handler_path), file_name)
                 else:
                     file_log_path = file_name
+            elif logfile_path:
+                # log file will be created in logfile_path
+                file_log_path = os.path.join(str(logfile_path), file_name)
             else:
                 # log file will be created on path where code runs
                 file_log_path = file_name
@@ -149,6 +295,7 @@ def get_logger(file_name=None, append_ts=True, timed_rotating_fh=False):
                 logstash_host_name = logstash_public_host_name
             else:
                 logstash_host_name = logstash_private_host_name
+            import logstash
             logstash_handler = logstash.LogstashHandler(logstash_host_name, int(logstash_port),
                                                         version=int(logstash_schema_version))
             logger_obj.addHandler(logstash_handler)
@@ -157,7 +304,7 @@ def get_logger(file_name=None, append_ts=True, timed_rotating_fh=False):
             pass
 
         # create console handler with debug level
-        console_handler_flag = configuration.get_configuration(MODULE_NAME, "console_handler_flag")
+        console_handler_flag = configuration.get(MODULE_NAME, "console_handler_flag")
         if console_handler_flag != "N":
             console_handler = logging.StreamHandler()
 
@@ -178,6 +325,53 @@ def get_logger(file_name=None, append_ts=True, timed_rotating_fh=False):
 
             logger_obj.addHandler(console_handler)
 
+        # Write the records of each job to its own structured log as well
+        job_log_dir = configuration.get(MODULE_NAME, "job_log_dir")
+        if job_log_dir:
+            import JobLog
+            job_log_segment_size = configuration.get_int(MODULE_NAME, "job_log_segment_size",
+                                                         JobLog.DEFAULT_SEGMENT_SIZE)
+            job_log_shared_level = configuration.get(MODULE_NAME, "job_log_shared_level")
+            JobLog.install(logger_obj, job_log_dir, job_log_segment_size, JobLog.get_level(job_log_shared_level))
+
+        # Move the handlers behind a queue so logging calls do not wait for the file, console or logstash I/O
+        if configuration.get_bool(MODULE_NAME, "async_logging", False):
+            async_queue_size = configuration.get_int(MODULE_NAME, "async_queue_size", DEFAULT_ASYNC_QUEUE_SIZE)
+            async_overflow_policy = configuration.get(MODULE_NAME, "async_overflow_policy")
+            async_sample_rate = configuration.get_int(MODULE_NAME, "async_sample_rate", DEFAULT_ASYNC_SAMPLE_RATE)
+            if async_overflow_policy not in ASYNC_OVERFLOW_POLICIES:
+                async_overflow_policy = ASYNC_OVERFLOW_BLOCK
+            make_async(logger_obj, async_queue_size, async_overflow_policy, async_sample_rate)
+
     return logger_obj, file_log_path
 
-logger, log_path = get_logger()
+
+class LazyLogger(object):
+    """
+    Stands in for the module level logger. The log configuration is read and the file, console and logstash
+    handlers are attached on the first use of the logger instead of when LogSetup is imported.
+    """
+
+    def __init__(self):
+        self._logger = None
+        self._lock = threading.Lock()
+
+    def _get_logger(self):
+        global log_path
+        if self._logger is None:
+            with self._lock:
+                if self._logger is None:
+                    self._logger, log_path = get_logger()
+        return self._logger
+
+    def __getattr__(self, name):
+        value = getattr(self._get_logger(), name)
+        if callable(value):
+            # Keep the bound method on the proxy so later calls skip __getattr__
+            setattr(self, name, value)
+        return value
+
+
+# Path of the log file, set once the logger has been configured
+log_path = None
+logger = LazyLogger()
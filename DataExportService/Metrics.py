@@ -0,0 +1,353 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : Metrics
+Purpose             : In-process counters, gauges and histograms for the data export service, rendered in the
+                      Prometheus text exposition format. When the service runs with several worker processes each
+                      worker periodically writes a snapshot of its metrics to a shared directory and the metrics
+                      endpoint merges the snapshots of all workers.
+Input Parameters    : Metric name, help text and label names at definition; label values at each update
+Output Value        : Prometheus text format from render()
+Dependencies        : None
+Predecessor Module  : DataExportService, HdfsToS3, SqoopUtility
+Successor Module    : None
+Pre-requisites      : None
+How to run          : Update the module level metrics, e.g. Metrics.FILES_TRANSFERRED.inc(1, "hdfsToS3")
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+import Tracing
+
+"""
+Module Constants
+"""
+MODULE_NAME = "Metrics"
+METRIC_PREFIX = "dataexport_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+SNAPSHOT_FILE_PREFIX = "metrics_"
+SNAPSHOT_FILE_SUFFIX = ".json"
+DEFAULT_FLUSH_INTERVAL = 5
+
+EXPORT_TYPE_HDFS_TO_S3 = "hdfsToS3"
+EXPORT_TYPE_DB_EXPORT = "dbexport"
+EXPORT_TYPE_LOCAL_TO_S3 = "localToS3"
+EXPORT_TYPE_S3_TO_HDFS = "s3ToHdfs"
+
+# Latency buckets in seconds, from a single S3 API call up to a multi hour export
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600,
+                   7200, 14400)
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for name, value in pairs) + "}"
+
+
+class Metric(object):
+    """
+    Base class of all metric types. Values are kept per tuple of label values; every update takes the metric's
+    own lock so updates from the request threads of a worker never interleave.
+    """
+
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = METRIC_PREFIX + name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(labels), value] for labels, value in self.values.items()]
+
+    def render(self, values):
+        lines = ["# HELP " + self.name + " " + self.help_text, "# TYPE " + self.name + " " + self.metric_type]
+        for labels, value in sorted(values.items()):
+            lines.append(self.name + _format_labels(self.label_names, labels) + " " + _format_value(value))
+        return lines
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def merge(self, merged, value):
+        return merged + value
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dec(self, amount=1, *label_values):
+        self.inc(-amount, *label_values)
+
+    def merge(self, merged, value):
+        return merged + value
+
+
+class Histogram(Metric):
+    """
+    Histogram with fixed upper bounds. Each label set stores [per bucket counts..., sum, count] so an observation
+    is one bisect and three additions.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=LATENCY_BUCKETS):
+        Metric.__init__(self, name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(label_values)
+            if state is None:
+                state = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - started, *label_values)
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(labels), list(state)] for labels, state in self.values.items()]
+
+    def merge(self, merged, value):
+        return [left + right for left, right in zip(merged, value)]
+
+    def render(self, values):
+        lines = ["# HELP " + self.name + " " + self.help_text, "# TYPE " + self.name + " histogram"]
+        for labels, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                lines.append(self.name + "_bucket" + _format_labels(self.label_names, labels,
+                                                                    ("le", _format_value(float(bound))))
+                             + " " + str(cumulative))
+            lines.append(self.name + "_sum" + _format_labels(self.label_names, labels) + " " +
+                         _format_value(float(state[-2])))
+            lines.append(self.name + "_count" + _format_labels(self.label_names, labels) + " " + str(state[-1]))
+        return lines
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.metrics = []
+        self.snapshot_dir = None
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    """
+    Purpose   :   Capture the current value of every metric of this process
+    Input     :   None
+    Output    :   Returns a json serializable dictionary keyed by metric name
+    """
+
+    def snapshot(self):
+        return {"pid": os.getpid(), "metrics": dict((metric.name, metric.snapshot()) for metric in self.metrics)}
+
+    """
+    Purpose   :   Write the snapshot of this process to the shared snapshot directory. The file is written to a
+                  temporary name and renamed so readers never see a partial snapshot.
+    Input     :   None
+    Output    :   None
+    """
+
+    def write_snapshot(self):
+        if not self.snapshot_dir:
+            return
+        path = os.path.join(self.snapshot_dir, SNAPSHOT_FILE_PREFIX + str(os.getpid()) + SNAPSHOT_FILE_SUFFIX)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file)
+        os.rename(temp_path, path)
+
+    def read_snapshots(self):
+        snapshots = [self.snapshot()]
+        if not self.snapshot_dir or not os.path.isdir(self.snapshot_dir):
+            return snapshots
+        own_file = SNAPSHOT_FILE_PREFIX + str(os.getpid()) + SNAPSHOT_FILE_SUFFIX
+        for file_name in os.listdir(self.snapshot_dir):
+            if not file_name.startswith(SNAPSHOT_FILE_PREFIX) or not file_name.endswith(SNAPSHOT_FILE_SUFFIX) \
+                    or file_name == own_file:
+                continue
+            try:
+                with open(os.path.join(self.snapshot_dir, file_name)) as snapshot_file:
+                    snapshots.append(json.load(snapshot_file))
+            except (IOError, ValueError):
+                continue
+        return snapshots
+
+    """
+    Purpose   :   Render the metrics of this process, merged with the snapshots of the other workers, in the
+                  Prometheus text format. Gauges of worker processes that are no longer alive are left out while
+                  their counters and histograms are kept so totals never go backwards.
+    Input     :   None
+    Output    :   Returns the exposition text
+    """
+
+    def render(self):
+        snapshots = self.read_snapshots()
+        lines = []
+        for metric in self.metrics:
+            merged = {}
+            for snapshot in snapshots:
+                if isinstance(metric, Gauge) and snapshot["pid"] != os.getpid() and not _is_alive(snapshot["pid"]):
+                    continue
+                for labels, value in snapshot["metrics"].get(metric.name, []):
+                    labels = tuple(labels)
+                    merged[labels] = metric.merge(merged[labels], value) if labels in merged else value
+            lines.extend(metric.render(merged))
+        return "\n".join(lines) + "\n"
+
+    """
+    Purpose   :   Enable multi-process aggregation. Every process using the registry writes its snapshot to the
+                  directory every flush_interval seconds from a daemon thread.
+    Input     :   Snapshot directory, flush interval in seconds
+    Output    :   None
+    """
+
+    def start_snapshot_writer(self, snapshot_dir, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.snapshot_dir = snapshot_dir
+        if not os.path.isdir(snapshot_dir):
+            os.makedirs(snapshot_dir)
+
+        def writer():
+            while True:
+                time.sleep(flush_interval)
+                try:
+                    self.write_snapshot()
+                except (IOError, OSError):
+                    pass
+
+        thread = threading.Thread(target=writer, name="metrics-snapshot-writer")
+        thread.daemon = True
+        thread.start()
+
+    """
+    Purpose   :   Remove the snapshots left behind by a previous run of the service
+    Input     :   Snapshot directory
+    Output    :   None
+    """
+
+    def clear_snapshots(self, snapshot_dir):
+        if not os.path.isdir(snapshot_dir):
+            return
+        for file_name in os.listdir(snapshot_dir):
+            if file_name.startswith(SNAPSHOT_FILE_PREFIX):
+                os.remove(os.path.join(snapshot_dir, file_name))
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "request_duration_seconds", "Time taken to serve an export request", ["export_type"]))
+REQUESTS = registry.register(Counter(
+    "requests_total", "Export requests served by export type and result status", ["export_type", "status"]))
+IN_FLIGHT_JOBS = registry.register(Gauge(
+    "in_flight_jobs", "Export jobs currently running", ["export_type"]))
+QUEUE_DEPTH = registry.register(Gauge(
+    "queue_depth", "Files and tasks accepted by running exports but not started yet", ["export_type"]))
+BYTES_TRANSFERRED = registry.register(Counter(
+    "bytes_transferred_total", "Bytes transferred and verified", ["export_type"]))
+FILES_TRANSFERRED = registry.register(Counter(
+    "files_transferred_total", "Files transferred and verified", ["export_type"]))
+RECORDS_TRANSFERRED = registry.register(Counter(
+    "records_transferred_total", "Records imported by sqoop jobs", ["export_type"]))
+DISTCP_DURATION = registry.register(Histogram(
+    "distcp_duration_seconds", "Wall time of hadoop distcp runs", ["result"]))
+SQOOP_DURATION = registry.register(Histogram(
+    "sqoop_duration_seconds", "Wall time of sqoop import runs", ["result"]))
+RETRIES = registry.register(Counter(
+    "retries_total", "Failed transfers and sqoop imports by retry decision", ["export_type", "decision"]))
+BYTES_DEDUPLICATED = registry.register(Counter(
+    "bytes_deduplicated_total", "Bytes copied server side from identical objects instead of uploaded",
+    ["export_type"]))
+QUEUE_TASKS = registry.register(Counter(
+    "queue_tasks_total", "Work queue tasks run by this worker by kind and claim (own, new or stolen)",
+    ["kind", "claim"]))
+COMMANDS = registry.register(Gauge(
+    "commands", "Hadoop and sqoop commands running or waiting for a slot (see CommandRunner)", ["state"]))
+COMMAND_KILLS = registry.register(Counter(
+    "command_kills_total", "Commands killed after their timeout or cancelled", ["reason"]))
+S3_REQUESTS = registry.register(Counter(
+    "s3_requests_total", "S3 API calls by operation and outcome", ["operation", "result"]))
+S3_LATENCY = registry.register(Histogram(
+    "s3_request_duration_seconds", "Latency of S3 API calls", ["operation"]))
+
+
+"""
+Purpose   :   Call an S3 client method and record its count and latency
+Input     :   Operation name, bound client method and its arguments
+Output    :   Returns the value returned by the client method. Exceptions are recorded and re-raised
+"""
+
+
+def s3_call(operation, method, *args, **kwargs):
+    started = time.time()
+    result = "error"
+    try:
+        with Tracing.span("s3." + operation, bucket=kwargs.get("Bucket")):
+            response = method(*args, **kwargs)
+        result = "ok"
+        return response
+    finally:
+        S3_LATENCY.observe(time.time() - started, operation)
+        S3_REQUESTS.inc(1, operation, result)
+
+
+def render():
+    return registry.render()
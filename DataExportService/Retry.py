@@ -0,0 +1,190 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : Retry
+Purpose             : Selective retries of failed transfers. A failure is classified from the output of the failed
+                      command as transient (S3 throttling, timeouts, YARN preemption, lost connections) or
+                      permanent (access denied, missing source, bad credentials); only transient failures of the
+                      failed file or import are retried, after a jittered exponential backoff. Every retry is taken
+                      from the retry budget of the job, so a job whose transfers keep failing still rolls back
+                      within a bounded time.
+Input Parameters    : The attempt function, returning its result and failure classification
+Output Value        : The result of the last attempt
+Dependencies        : None
+Predecessor Module  : HdfsToS3, SqoopUtility, BulkExport
+Successor Module    : None
+Pre-requisites      : [retry] section of settings.conf
+How to run          : Retry.run_with_retries(description, export_type, attempt, before_retry)
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import re
+import time
+import random
+import threading
+from ConfigUtility import get_snapshot
+from LogSetup import logger
+import Metrics
+import JobEvents
+
+"""
+Module Constants
+"""
+MODULE_NAME = "Retry"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "retry"
+FAILURE_TRANSIENT = "transient"
+FAILURE_PERMANENT = "permanent"
+DECISION_RETRIED = "retried"
+DECISION_PERMANENT = "permanent"
+DECISION_ATTEMPTS_EXHAUSTED = "attempts_exhausted"
+DECISION_BUDGET_EXHAUSTED = "budget_exhausted"
+# Retries of one file or import after its first attempt
+DEFAULT_MAX_RETRIES = 2
+# Retries of all the files and imports of one job
+DEFAULT_JOB_BUDGET = 20
+DEFAULT_BASE_DELAY = 2.0
+DEFAULT_MAX_DELAY = 120.0
+
+# Checked first: a failure matching one of these is never retried
+PERMANENT_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"Access Denied", r"AccessDenied", r"InvalidAccessKeyId", r"SignatureDoesNotMatch", r"NoSuchBucket",
+    r"FileNotFoundException", r"No such file or directory", r"Permission denied", r"AccessControlException",
+    r"Unknown database", r"Table '[^']*' doesn't exist", r"ORA-00942", r"ORA-01017", r"command not found",
+    r"Login failed", r"password authentication failed")]
+TRANSIENT_PATTERNS = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"SlowDown", r"Throttl", r"503 Service Unavailable", r"ServiceUnavailable", r"Status Code: 5\d\d",
+    r"InternalError", r"RequestTimeout", r"SocketTimeoutException", r"Connection reset", r"Connection refused",
+    r"Connection timed out", r"ConnectTimeoutException", r"Communications link failure", r"Broken pipe",
+    r"preempt", r"Container killed", r"Lost task tracker", r"NodeManager .* lost", r"Too many connections",
+    r"Lock wait timeout", r"Deadlock found", r"Temporary failure", r"UnknownHostException", r"Command timed out")]
+
+
+def classify(logs, default=FAILURE_PERMANENT):
+    if not logs:
+        return default
+    for pattern in PERMANENT_PATTERNS:
+        if pattern.search(logs):
+            return FAILURE_PERMANENT
+    for pattern in TRANSIENT_PATTERNS:
+        if pattern.search(logs):
+            return FAILURE_TRANSIENT
+    return default
+
+
+class RetryPolicy(object):
+    """
+    Retries per file or import and backoff. The delay before retry n is drawn uniformly between 0 and
+    min(max_delay, base_delay * 2 ** (n - 1)), so the files of a throttled job do not retry in lock step.
+    """
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY,
+                 max_delay=DEFAULT_MAX_DELAY):
+        self.max_retries = max(0, max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry_number):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry_number - 1)))
+
+
+class RetryBudget(object):
+    """Retries left to the transfers of one job, taken from all their threads"""
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self.lock = threading.Lock()
+
+    def take(self):
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+"""
+Purpose   :   Build the retry policy from the [retry] section of settings.conf
+Input     :   Retries per file or import used when max_retries is not configured
+Output    :   Returns a RetryPolicy
+"""
+
+
+def get_policy(default_max_retries=DEFAULT_MAX_RETRIES):
+    configuration = get_snapshot(CONFIGURATION_FILE)
+    return RetryPolicy(configuration.get_int(SETTINGS_SECTION, "max_retries", default_max_retries),
+                       configuration.get_float(SETTINGS_SECTION, "base_delay", DEFAULT_BASE_DELAY),
+                       configuration.get_float(SETTINGS_SECTION, "max_delay", DEFAULT_MAX_DELAY))
+
+
+def new_budget():
+    return RetryBudget(get_snapshot(CONFIGURATION_FILE).get_int(SETTINGS_SECTION, "job_budget", DEFAULT_JOB_BUDGET))
+
+
+_budget_lock = threading.Lock()
+
+
+"""
+Purpose   :   Return the retry budget of the job of the current thread, created on first use. Calls made outside a
+              job get a budget of their own
+Input     :   None
+Output    :   Returns a RetryBudget
+"""
+
+
+def job_budget():
+    job = JobEvents.current_job()
+    if job is None:
+        return new_budget()
+    with _budget_lock:
+        if job.retry_budget is None:
+            job.retry_budget = new_budget()
+        return job.retry_budget
+
+
+"""
+Purpose   :   Run an attempt until it succeeds, fails permanently, runs out of retries or the job runs out of
+              retries. Before each retry the caller can undo the partial work of the failed attempt
+Input     :   Description used in the logs and events, export type of the metrics, attempt function returning
+              (result, failure) with failure None on success, before_retry function returning False to give up,
+              policy and budget (by default from settings.conf and the current job)
+Output    :   Returns the result of the last attempt
+"""
+
+
+def run_with_retries(description, export_type, attempt, before_retry=None, policy=None, budget=None):
+    policy = policy if policy is not None else get_policy()
+    attempt_number = 1
+    while True:
+        result, failure = attempt()
+        if failure is None:
+            return result
+        if failure != FAILURE_TRANSIENT:
+            decision = DECISION_PERMANENT
+        elif attempt_number > policy.max_retries:
+            decision = DECISION_ATTEMPTS_EXHAUSTED
+        else:
+            if budget is None:
+                budget = job_budget()
+            decision = DECISION_RETRIED if budget.take() else DECISION_BUDGET_EXHAUSTED
+        Metrics.RETRIES.inc(1, export_type, decision)
+        if decision != DECISION_RETRIED:
+            if failure == FAILURE_TRANSIENT:
+                logger.error("Not retrying " + description + " after " + str(attempt_number) + " attempts: " +
+                             decision.replace("_", " "))
+            return result
+        delay = policy.delay(attempt_number)
+        logger.warning("Transient failure of " + description + ", attempt " + str(attempt_number) + " of " +
+                       str(policy.max_retries + 1) + ". Retrying in " + "%.1f" % delay + " seconds")
+        JobEvents.publish(JobEvents.EVENT_RETRY, target=description, attempt=attempt_number + 1,
+                          delay=round(delay, 3))
+        time.sleep(delay)
+        if before_retry is not None and not before_retry():
+            logger.error("Could not prepare the retry of " + description)
+            return result
+        attempt_number += 1
@@ -0,0 +1,483 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : S3ToHdfs
+Purpose             : Imports an S3 object or prefix into HDFS, the reverse direction of HdfsToS3. Large trees
+                      (total size above distcp_threshold, or any object above large_object_size) are copied by
+                      hadoop distcp with the options of HdfsToS3. Other imports are copied in process, which saves
+                      the start of a MapReduce job: objects smaller than range_size are downloaded concurrently to a
+                      local staging directory and written with one "hadoop fs -put" per target directory and batch,
+                      larger objects are fetched with concurrent ranged GETs and streamed in order into
+                      "hadoop fs -put -" through a bounded window of buffers per object. Every import is verified
+                      against the S3 inventory. When it fails, the files it wrote are removed; files that were at
+                      target_path before the import are left alone.
+Input Parameters    : s3_credentials, source_path (s3a://bucket/key or prefix), target_path (HDFS) and optionally
+                      mode (auto, distcp or direct), atomic_transaction and the [s3tohdfs] settings
+Output Value        : Status json with the files_copied_list array (file_name, file_size) like HdfsToS3
+Dependencies        : boto3, hadoop command line
+Predecessor Module  : DataExportService
+Successor Module    : HdfsToS3 (distcp options)
+Pre-requisites      : None
+How to run          : Call runS3ToHdfs with the request json
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import pipes
+import shutil
+import tempfile
+import threading
+import traceback
+import collections
+from multiprocessing.pool import ThreadPool
+from LogSetup import logger
+from ConfigUtility import get_snapshot
+from ExportContext import ExportContext, split_s3_path, hdfs_path_of, run_command, parse_hdfs_listing
+import CommandRunner
+import Metrics
+import JobEvents
+import JobLog
+import Tracing
+import Retry
+
+"""
+Module Constants
+"""
+MODULE_NAME = "S3ToHdfs"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "s3tohdfs"
+STATUS_KEY = "status"
+STATUS_SUCCESS = "SUCCESS"
+STATUS_FAILED = "FAILED"
+MESSAGE_KEY = "message"
+FILES_COPIED_LIST_KEY = "files_copied_list"
+FILE_NAME_KEY = "file_name"
+FILE_SIZE_KEY = "file_size"
+FLAG_YES = "y"
+
+S3_CREDENTIALS_KEY = "s3_credentials"
+SOURCE_PATH_KEY = "source_path"
+TARGET_PATH_KEY = "target_path"
+MODE_KEY = "mode"
+ATOMIC_TRANSACTION_KEY = "atomic_transaction"
+MODE_AUTO = "auto"
+MODE_DISTCP = "distcp"
+MODE_DIRECT = "direct"
+
+MEGABYTE = 1024 * 1024
+DEFAULT_DISTCP_THRESHOLD = 10 * 1024 * MEGABYTE
+DEFAULT_LARGE_OBJECT_SIZE = 1024 * MEGABYTE
+DEFAULT_RANGE_SIZE = 8 * MEGABYTE
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MAX_STREAMS = 4
+DEFAULT_BUFFERS_PER_STREAM = 4
+DEFAULT_PUT_BATCH_BYTES = 256 * MEGABYTE
+DEFAULT_PUT_BATCH_FILES = 200
+# Paths passed to one hadoop fs -mkdir or -rm command
+COMMAND_BATCH_SIZE = 200
+COPY_BUFFER_SIZE = MEGABYTE
+# Keys written by S3 consoles and tools to mark folders
+FOLDER_MARKER_SUFFIXES = ("/", "_$folder$")
+
+
+class ImportObject(object):
+    __slots__ = ("key", "size", "hdfs_path")
+
+    def __init__(self, key, size, hdfs_path):
+        self.key = key
+        self.size = size
+        self.hdfs_path = hdfs_path
+
+
+class S3ToHdfs(object):
+    def __init__(self, config, context=None):
+        self.config = config
+        self.context = context if context is not None else ExportContext()
+        self.s3_credentials_json = config[S3_CREDENTIALS_KEY]
+        self.source_path = config[SOURCE_PATH_KEY]
+        self.target_path = config[TARGET_PATH_KEY].rstrip("/")
+        self.bucket_name, self.prefix = split_s3_path(self.source_path)
+        self.mode = (config.get(MODE_KEY) or MODE_AUTO).lower()
+        self.atomic_transaction = (config.get(ATOMIC_TRANSACTION_KEY) or FLAG_YES).lower()
+        # Request values override settings.conf, read for every request so tuning changes apply without a restart
+        settings = get_snapshot(CONFIGURATION_FILE)
+
+        def setting(name, default):
+            return int(config.get(name) or settings.get_int(SETTINGS_SECTION, name, default))
+
+        self.distcp_threshold = setting("distcp_threshold", DEFAULT_DISTCP_THRESHOLD)
+        self.large_object_size = setting("large_object_size", DEFAULT_LARGE_OBJECT_SIZE)
+        self.range_size = max(MEGABYTE, setting("range_size", DEFAULT_RANGE_SIZE))
+        self.max_concurrency = max(1, setting("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+        self.max_streams = max(1, setting("max_streams", DEFAULT_MAX_STREAMS))
+        self.buffers_per_stream = max(1, setting("buffers_per_stream", DEFAULT_BUFFERS_PER_STREAM))
+        self.put_batch_bytes = setting("put_batch_bytes", DEFAULT_PUT_BATCH_BYTES)
+        self.put_batch_files = max(1, setting("put_batch_files", DEFAULT_PUT_BATCH_FILES))
+        self.staging_dir = settings.get(SETTINGS_SECTION, "staging_dir") or tempfile.gettempdir()
+        self.job = JobEvents.current_job()
+        self.fetch_pool = None
+        # Target files written by this import, the only files a rollback removes
+        self.written_paths = []
+        self.written_lock = threading.Lock()
+
+    """
+    Purpose   :   List the objects to import from the S3 inventory. A key equal to the source path is imported to
+                  target_path itself; the objects below a prefix keep their path relative to the prefix
+    Input     :   None
+    Output    :   Returns a list of ImportObject
+    """
+
+    @Tracing.traced("s3.inventory")
+    def list_objects(self):
+        inventory = self.context.get_s3_inventory(self.bucket_name, self.prefix, self.s3_credentials_json,
+                                                  refresh=True)
+        sizes = dict(zip(inventory.keys, inventory.sizes))
+        if self.prefix and self.prefix in sizes and not self.prefix.endswith("/"):
+            return [ImportObject(self.prefix, sizes[self.prefix], self.target_path)]
+        directory = self.prefix.rstrip("/") + "/" if self.prefix.rstrip("/") else ""
+        objects = []
+        for key, size in zip(inventory.keys, inventory.sizes):
+            if not key.startswith(directory) or key.endswith(FOLDER_MARKER_SUFFIXES):
+                continue
+            objects.append(ImportObject(key, size, self.target_path + "/" + key[len(directory):]))
+        return objects
+
+    def choose_mode(self, objects):
+        if self.mode in (MODE_DISTCP, MODE_DIRECT):
+            return self.mode
+        if sum(item.size for item in objects) >= self.distcp_threshold or \
+                any(item.size >= self.large_object_size for item in objects):
+            return MODE_DISTCP
+        return MODE_DIRECT
+
+    def add_written_paths(self, paths):
+        with self.written_lock:
+            self.written_paths.extend(paths)
+
+    """
+    Purpose   :   List the files already below target_path, which a rollback must not remove
+    Input     :   None
+    Output    :   Returns a set of file paths (see hdfs_path_of). Raises an exception if target_path exists and
+                  could not be listed
+    """
+
+    @Tracing.traced("hdfs_ls")
+    def list_existing_paths(self):
+        exit_code, output = run_command("hadoop fs -ls -R " + pipes.quote(self.target_path))
+        if exit_code == 0:
+            return set(parse_hdfs_listing(output))
+        if run_command("hadoop fs -test -e " + pipes.quote(self.target_path))[0] != 0:
+            return set()
+        raise Exception("Unable to list " + self.target_path + ": " + output.strip()[-2000:])
+
+    def run_batched_command(self, command, paths):
+        for index in range(0, len(paths), COMMAND_BATCH_SIZE):
+            exit_code, output = run_command(command + " " + " ".join(
+                pipes.quote(path) for path in paths[index:index + COMMAND_BATCH_SIZE]))
+            if exit_code != 0:
+                raise Exception("Command " + command + " failed: " + output.strip()[-2000:])
+
+    """
+    Purpose   :   Copy the import with hadoop distcp, using the options of HdfsToS3 (credentials, encryption, queue,
+                  distcp_command_options of the request). A prefix is copied with -update so its contents land in
+                  target_path. Transient failures are retried with the backoff of Retry. distcp does not report the
+                  files it wrote, so every target path absent before the copy counts as written
+    Input     :   List of ImportObject and the set of file paths below target_path before the copy
+    Output    :   None. Raises an exception if the copy fails
+    """
+
+    @Tracing.traced("distcp")
+    def copy_with_distcp(self, objects, existing_paths):
+        # Imported here so the direct imports do not need hadoopy
+        import HdfsToS3
+        hdfs_to_s3 = HdfsToS3.HdfsToS3(self.context)
+        option_string = hdfs_to_s3.create_command_options_string(self.s3_credentials_json)
+        if not option_string:
+            raise Exception("Error Occured while creating hadoop distcp options")
+        single_object = len(objects) == 1 and objects[0].hdfs_path == self.target_path
+        update = "" if single_object else " -update"
+        command = "hadoop distcp " + option_string + update + " " + pipes.quote(self.source_path) + " " + \
+                  pipes.quote(self.target_path)
+        self.add_written_paths([item.hdfs_path for item in objects
+                                if hdfs_path_of(item.hdfs_path) not in existing_paths])
+
+        def attempt():
+            running_command = CommandRunner.start(command, CommandRunner.job_timeout(), stream=True)
+            output_summarizer = JobLog.OutputSummarizer(logger, "distcp")
+            output = []
+            try:
+                for log in running_command.lines():
+                    output_summarizer.line(log)
+                    output.append(log)
+            finally:
+                if not running_command.done():
+                    running_command.cancel()
+                exit_code = running_command.wait()
+            output_summarizer.close()
+            output = "".join(output)
+            if exit_code == 0 and not hdfs_to_s3.log_parser(output):
+                return output, None
+            logger.error("distcp of " + self.source_path + " failed: " + output.strip()[-2000:])
+            return None, Retry.classify(output)
+
+        if Retry.run_with_retries(self.source_path, Metrics.EXPORT_TYPE_S3_TO_HDFS, attempt,
+                                  policy=Retry.get_policy(HdfsToS3.S3PUT_RETRIES)) is None:
+            raise Exception("distcp of " + self.source_path + " failed")
+
+    def run_in_job(self, function, *args):
+        # Pool threads publish their events and spans to the job of the request
+        JobEvents.set_current_job(self.job)
+        return function(*args)
+
+    def fetch(self, function, *args):
+        return self.fetch_pool.apply_async(self.run_in_job, (function,) + args)
+
+    @Tracing.traced("s3.get_range")
+    def get_range(self, key, offset, length):
+        s3 = self.context.get_s3_client(self.s3_credentials_json)
+        response = Metrics.s3_call("get_object", s3.get_object, Bucket=self.bucket_name, Key=key,
+                                   Range="bytes=%d-%d" % (offset, offset + length - 1))
+        return response["Body"].read()
+
+    @Tracing.traced("s3.download")
+    def download(self, item, local_path):
+        s3 = self.context.get_s3_client(self.s3_credentials_json)
+        response = Metrics.s3_call("get_object", s3.get_object, Bucket=self.bucket_name, Key=item.key)
+        with open(local_path, "wb") as local_file:
+            shutil.copyfileobj(response["Body"], local_file, COPY_BUFFER_SIZE)
+
+    """
+    Purpose   :   Stream one object into HDFS. Its ranges are fetched on the shared pool with at most
+                  buffers_per_stream ranges in flight and written in order to the stdin of "hadoop fs -put -", so
+                  the memory used by an object is bounded whatever its size
+    Input     :   ImportObject
+    Output    :   None. Raises an exception if the object could not be written
+    """
+
+    @Tracing.traced("stream_object")
+    def stream_object(self, item):
+        command = CommandRunner.start("hadoop fs -put -f - " + pipes.quote(item.hdfs_path),
+                                      CommandRunner.job_timeout(), stdin=True)
+        try:
+            if command.stdin is None:
+                raise Exception("hadoop fs -put of " + item.hdfs_path + " failed: " + command.output().strip())
+            pending = collections.deque()
+            for offset in range(0, item.size, self.range_size):
+                if len(pending) >= self.buffers_per_stream:
+                    command.stdin.write(pending.popleft().get())
+                pending.append(self.fetch(self.get_range, item.key, offset, min(self.range_size,
+                                                                                item.size - offset)))
+            while pending:
+                command.stdin.write(pending.popleft().get())
+            command.stdin.close()
+            exit_code = command.wait()
+            output = command.output()
+            if exit_code != 0:
+                raise Exception("hadoop fs -put of " + item.hdfs_path + " failed: " + output.strip()[-2000:])
+            self.add_written_paths([item.hdfs_path])
+        except Exception:
+            if not command.done():
+                command.cancel()
+                command.wait()
+            raise
+
+    """
+    Purpose   :   Copy a batch of small objects: download them concurrently to a staging directory, then write
+                  them with one "hadoop fs -put" per target directory
+    Input     :   List of ImportObject
+    Output    :   None. Raises an exception if the batch could not be written
+    """
+
+    @Tracing.traced("put_batch")
+    def put_batch(self, batch):
+        staging = tempfile.mkdtemp(prefix="s3tohdfs_", dir=self.staging_dir)
+        try:
+            groups = collections.OrderedDict()
+            downloads = []
+            for item in batch:
+                directory = os.path.dirname(item.hdfs_path)
+                if directory not in groups:
+                    groups[directory] = os.path.join(staging, str(len(groups)))
+                    os.mkdir(groups[directory])
+                local_path = os.path.join(groups[directory], os.path.basename(item.hdfs_path))
+                downloads.append(self.fetch(self.download, item, local_path))
+            for download in downloads:
+                download.get()
+            for directory, local_dir in groups.items():
+                exit_code, output = run_command("hadoop fs -put -f " + " ".join(
+                    pipes.quote(os.path.join(local_dir, name)) for name in sorted(os.listdir(local_dir))) + " " +
+                    pipes.quote(directory))
+                if exit_code != 0:
+                    raise Exception("hadoop fs -put to " + directory + " failed: " + output.strip()[-2000:])
+                self.add_written_paths([item.hdfs_path for item in batch
+                                        if os.path.dirname(item.hdfs_path) == directory])
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def batches(self, objects):
+        batch = []
+        batch_bytes = 0
+        for item in objects:
+            if batch and (len(batch) >= self.put_batch_files or batch_bytes + item.size > self.put_batch_bytes):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(item)
+            batch_bytes += item.size
+        if batch:
+            yield batch
+
+    def with_retries(self, description, function, *args):
+        def attempt():
+            try:
+                function(*args)
+                return True, None
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt
+            except Exception as e:
+                logger.error("Import of " + description + " failed: " + str(e))
+                return False, Retry.classify(str(e), Retry.FAILURE_TRANSIENT)
+
+        if not Retry.run_with_retries(description, Metrics.EXPORT_TYPE_S3_TO_HDFS, attempt):
+            raise Exception("Import of " + description + " failed")
+
+    """
+    Purpose   :   Copy the import in process. Objects of range_size and more are streamed, max_streams at a time;
+                  the smaller objects are written in batches meanwhile. All the GETs share one pool of
+                  max_concurrency threads
+    Input     :   List of ImportObject
+    Output    :   None. Raises an exception if an object could not be written
+    """
+
+    @Tracing.traced("direct_copy")
+    def copy_direct(self, objects):
+        directories = sorted(set(os.path.dirname(item.hdfs_path) for item in objects))
+        self.run_batched_command("hadoop fs -mkdir -p", directories)
+        small_objects = [item for item in objects if item.size < self.range_size]
+        large_objects = [item for item in objects if item.size >= self.range_size]
+        logger.info("Importing " + str(len(small_objects)) + " small objects in batches and streaming " +
+                    str(len(large_objects)) + " objects from " + self.source_path)
+        self.fetch_pool = ThreadPool(self.max_concurrency)
+        stream_pool = ThreadPool(min(self.max_streams, len(large_objects) or 1))
+        try:
+            streams = [stream_pool.apply_async(self.run_in_job, (self.with_retries, item.key, self.stream_object,
+                                                                 item)) for item in large_objects]
+            for batch in self.batches(small_objects):
+                self.with_retries(str(len(batch)) + " objects below " + os.path.dirname(batch[0].key),
+                                  self.put_batch, batch)
+            for stream in streams:
+                stream.get()
+        finally:
+            stream_pool.close()
+            stream_pool.join()
+            self.fetch_pool.close()
+            self.fetch_pool.join()
+
+    """
+    Purpose   :   Check the size of every imported file, listed with one recursive listing of target_path, against
+                  the S3 inventory
+    Input     :   List of ImportObject
+    Output    :   Returns True if all the sizes match
+    """
+
+    @Tracing.traced("verify")
+    def verify(self, objects):
+        exit_code, output = run_command("hadoop fs -ls -R " + pipes.quote(self.target_path))
+        if exit_code != 0 and len(objects) == 1:
+            exit_code, output = run_command("hadoop fs -ls " + pipes.quote(self.target_path))
+        if exit_code != 0:
+            logger.error("Unable to list " + self.target_path + ": " + output.strip()[-2000:])
+            return False
+        sizes = parse_hdfs_listing(output)
+        for item in objects:
+            size = sizes.get(hdfs_path_of(item.hdfs_path))
+            if size != item.size:
+                logger.error("Size of source and target do not match for " + item.hdfs_path + ". S3 size = " +
+                             str(item.size) + " Hdfs size = " + str(size))
+                return False
+        return True
+
+    """
+    Purpose   :   Roll a failed import back: remove the files it wrote that were not below target_path before
+    Input     :   Set of file paths below target_path before the copy
+    Output    :   None
+    """
+
+    @Tracing.traced("hdfs_cleanup")
+    def cleanup(self, existing_paths):
+        with self.written_lock:
+            paths = [path for path in self.written_paths if hdfs_path_of(path) not in existing_paths]
+        self.run_batched_command("hadoop fs -rm -f -skipTrash", paths)
+
+    """
+    Purpose   :   Import the objects of source_path into target_path, verify them and remove the files written
+                  when the import fails (unless atomic_transaction is n). Files already at target_path are kept
+    Input     :   None
+    Output    :   Returns a status json containing the files_copied_list array
+    """
+
+    def run(self):
+        status_message = ""
+        existing_paths = None
+        try:
+            objects = self.list_objects()
+            if not objects:
+                status_message = "No S3 object found at " + self.source_path
+                raise Exception
+            mode = self.choose_mode(objects)
+            status_message = "Importing " + str(len(objects)) + " objects from " + self.source_path + " to " + \
+                             self.target_path + " with " + mode
+            logger.info(status_message)
+            existing_paths = self.list_existing_paths()
+            Metrics.QUEUE_DEPTH.inc(len(objects), Metrics.EXPORT_TYPE_S3_TO_HDFS)
+            try:
+                if mode == MODE_DISTCP:
+                    self.copy_with_distcp(objects, existing_paths)
+                else:
+                    self.copy_direct(objects)
+            finally:
+                Metrics.QUEUE_DEPTH.dec(len(objects), Metrics.EXPORT_TYPE_S3_TO_HDFS)
+            if not self.verify(objects):
+                status_message = "Verification of the imported files failed"
+                raise Exception
+
+            files_copied_list = []
+            for item in objects:
+                status = {FILE_NAME_KEY: item.hdfs_path, FILE_SIZE_KEY: str(item.size)}
+                files_copied_list.append(status)
+                JobEvents.publish(JobEvents.EVENT_FILE_COPIED, **status)
+            Metrics.BYTES_TRANSFERRED.inc(sum(item.size for item in objects), Metrics.EXPORT_TYPE_S3_TO_HDFS)
+            Metrics.FILES_TRANSFERRED.inc(len(objects), Metrics.EXPORT_TYPE_S3_TO_HDFS)
+            return {STATUS_KEY: STATUS_SUCCESS, FILES_COPIED_LIST_KEY: files_copied_list}
+
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+
+        except:
+            logger.error(status_message + " ERROR MESSAGE: " + traceback.format_exc())
+            if existing_paths is not None and self.atomic_transaction == FLAG_YES:
+                try:
+                    self.cleanup(existing_paths)
+                except Exception:
+                    logger.error("Error in cleaning files already written to hdfs: " + traceback.format_exc())
+            return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: status_message, FILES_COPIED_LIST_KEY: []}
+
+
+"""
+Purpose   :   Entry point of the s3ToHdfs export type
+Input     :   Request json
+Output    :   Returns the result of the import
+"""
+
+
+def runS3ToHdfs(config):
+    try:
+        s3_to_hdfs = S3ToHdfs(config)
+    except Exception:
+        logger.error("Error Parsing Input Config ")
+        return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Error Parsing Input Config", FILES_COPIED_LIST_KEY: []}
+    return s3_to_hdfs.run()
@@ -21,11 +21,18 @@ Reason for change   :
 """Library and external modules declaration"""
 import traceback
 import sys
-import errno
 import json
-from subprocess import Popen, PIPE, STDOUT
+import re
+import time
+import threading
 from LogSetup import logger
 import SeviceConstants
+import CommandRunner
+import Metrics
+import JobEvents
+import JobLog
+import Tracing
+import Retry
 
 
 
@@ -51,6 +58,8 @@ HIVE_IMPORT_KEY = "--hive-import"
 DELETE_KEY = "Deleted"
 LOCATION_KEYS = ["Output directory", "already exists"]
 FILE_EXCEPTION = "FileAlreadyExistsException"
+PROGRESS_PATTERN = re.compile(r"map (\d+)% reduce (\d+)%")
+TARGET_DIR_PATTERN = re.compile(r"--target-dir\s+(\S+)")
 
 """
 dictionary of possible driver connection based on database type
@@ -78,6 +87,10 @@ class SqoopUtility(object):
         logger.info(MODULE_NAME)
         self.status = {RETURN_KEYS[0]: STATUS_TYPE[1], RETURN_KEYS[1]: -1, RETURN_KEYS[2]: None}
         logger.debug(self.status)
+        # Sqoop process of the current attempt, cancel() kills it and no further attempt is started
+        self.command = None
+        self.cancelled = False
+        self.lock = threading.Lock()
 
     """"
     Purpose            :   To delete the directory in HDFS
@@ -85,6 +98,7 @@ class SqoopUtility(object):
     Output             :   Returns True if deleted else False
     """
 
+    @Tracing.traced("hdfs.rm")
     def delete_dir(self, location):
         status_message = ""
         try:
@@ -92,8 +106,7 @@ class SqoopUtility(object):
             logger.debug(status_message)
             delete_command = "hadoop fs -rm -r -skipTrash " + location
             logger.debug(delete_command)
-            process = Popen(delete_command, stdout=PIPE, shell=True, stderr=STDOUT)
-            del_log = process.communicate()[0]
+            del_log = CommandRunner.run(delete_command, CommandRunner.fs_timeout())[1]
             if del_log.find(DELETE_KEY) != 0:
                 status_message = "Directory delete fail: " + del_log
                 logger.error(status_message)
@@ -112,33 +125,34 @@ class SqoopUtility(object):
 
     """
     Purpose            :   Read logs to check the status of sqoop job
-    Input              :   Sqoop logs
+    Input              :   Running sqoop command (CommandRunner.Command)
     Output             :   Returns execution status and record count
     """
 
-    def read_logs(self, process_logs):
+    def read_logs(self, command):
         status_message = ""
         try:
             status_message = "Starting function to read sqoop logs"
             logger.debug(status_message)
-            consolidated_log = ""
-            while True:
-                try:
-                    ret_code = process_logs.poll()
-                    log = process_logs.stdout.readline()
-                    consolidated_log += log
-                    if log != '':
-                        logger.debug(log.strip(), )
-                    if ret_code is not None:
-                        break
-                except IOError as e:
-                    if e.errno == errno.EINTR:
-                        logger.warning(str(e))
-                        continue
-                    else:
-                        status_message = "IO Exception: " + str(e)
-                        logger.error(status_message)
-                        raise e
+            # Lines are joined once at the end, appending to a string copies the whole log for every line
+            log_lines = []
+            output_summarizer = JobLog.OutputSummarizer(logger, "sqoop")
+            try:
+                for log in command.lines():
+                    log_lines.append(log)
+                    output_summarizer.line(log)
+                    if JobEvents.current_job() is not None:
+                        self.publish_log_events(log)
+            finally:
+                if not command.done():
+                    command.cancel()
+                command.wait()
+            output_summarizer.close()
+            consolidated_log = "".join(log_lines)
+            if command.kill_reason is not None:
+                status_message = "FAIL: " + command.kill_message()
+                logger.error(status_message)
+                raise Exception(command.kill_message())
 
             """ 
             Reading Sqoop logs line by line
@@ -199,13 +213,43 @@ class SqoopUtility(object):
             self.status[RETURN_KEYS[2]] = str(e)
             return self.status
 
+    """
+    Purpose            :   Publish the progress, record count and errors of the running sqoop job to the job of the
+                           current thread as soon as the line is read
+    Input              :   One line of the sqoop logs
+    Output             :   None
+    """
+
+    def publish_log_events(self, log):
+        progress = PROGRESS_PATTERN.search(log)
+        if progress:
+            JobEvents.publish(JobEvents.EVENT_PROGRESS, map=int(progress.group(1)), reduce=int(progress.group(2)))
+        elif TOTAL_RECORD_COUNT in log:
+            count = log[log.find(TOTAL_RECORD_COUNT) + len(TOTAL_RECORD_COUNT) + 1:].strip()
+            if count.isdigit():
+                JobEvents.publish(JobEvents.EVENT_RECORD_COUNT, record_count=int(count))
+        elif INVALID_COMMAND in log or (ERROR_KEYWORD in log and
+                                        not any(error in log for error in ERROR_IGNORE_LIST)):
+            JobEvents.publish(JobEvents.EVENT_ERROR, message=log.strip())
+
+    """
+    Purpose            :   Check if a directory exists in HDFS
+    Input              :   Location (String)
+    Output             :   Returns True if the directory exists else False
+    """
+
+    def dir_exists(self, location):
+        return CommandRunner.run("hadoop fs -test -d " + location, CommandRunner.fs_timeout())[0] == 0
+
     """
     Purpose   :   This method is used to execute sqoop command. It also calls read_log method to read Sqoop logs
-    Input     :   Sqoop command (String)
+    Input     :   Sqoop command (String), optional function called before the import is run again (see
+                  run_sqoop_with_retries)
     Output    :   Returns execution status and record count
     """
 
-    def execute_sqoop_command(self, command):
+    @Tracing.traced("sqoop")
+    def execute_sqoop_command(self, command, before_retry=None):
         status_message = ""
         try:
             status_message = "Starting function to execute sqoop command"
@@ -224,24 +268,18 @@ class SqoopUtility(object):
                 raise Exception
             logger.debug("Input is a valid Sqoop command")
 
-            sqoop_output = Popen(command, shell=True, stdout=PIPE, stderr=STDOUT)
-            self.status = self.read_logs(sqoop_output)
+            self.status = self.run_sqoop_with_retries(command, before_retry)
             logger.debug(self.status)
 
-            """ If status is ReRun, it will execute sqoop command again"""
-            if self.status[RETURN_KEYS[0]] == STATUS_TYPE[2]:
-                status_message = "Running the sqoop job again"
-                logger.info(status_message)
-                sqoop_output = Popen(command, shell=True, stdout=PIPE, stderr=STDOUT)
-                self.status = self.read_logs(sqoop_output)
-
-            """ If the status is ReRun again, set the status to Failed"""
+            """ If the status is still ReRun after the retries, set the status to Failed"""
             if self.status[RETURN_KEYS[0]] == STATUS_TYPE[2]:
                 status_message = "Temporary directory still exists after initial successful deletion"
                 logger.error(status_message)
                 self.status[RETURN_KEYS[0]] = STATUS_TYPE[1]
 
             logger.debug(self.status)
+            if self.status[RETURN_KEYS[0]] == STATUS_TYPE[0] and self.status[RETURN_KEYS[1]] > 0:
+                Metrics.RECORDS_TRANSFERRED.inc(self.status[RETURN_KEYS[1]], Metrics.EXPORT_TYPE_DB_EXPORT)
             return self.status
 
         except KeyboardInterrupt:
@@ -253,6 +291,73 @@ class SqoopUtility(object):
             self.status[RETURN_KEYS[2]] = str(e)
             return self.status
 
+    """
+    Purpose   :   This method runs the sqoop import and runs it again while it fails with a transient error
+                  (connection failures, lock timeouts, YARN preemption) or its temp directory had to be deleted
+                  (ReRun), with the backoff and retry budget of the job (see Retry). Sqoop cannot restart a single
+                  map task, so the whole import is run again after deleting the partial target directory
+    Input     :   Sqoop command (String), optional function called before the target directory is deleted for a
+                  retry, e.g. to drop what was already read from it; the import is not retried if it returns False
+    Output    :   Returns execution status and record count of the last run
+    """
+
+    def run_sqoop_with_retries(self, command, before_retry_hook=None):
+        target_dir = TARGET_DIR_PATTERN.search(command)
+
+        def attempt():
+            self.status = {RETURN_KEYS[0]: STATUS_TYPE[1], RETURN_KEYS[1]: -1, RETURN_KEYS[2]: None}
+            status = self.run_sqoop_process(command)
+            if status[RETURN_KEYS[0]] == STATUS_TYPE[0]:
+                return status, None
+            if self.cancelled:
+                return status, Retry.FAILURE_PERMANENT
+            if status[RETURN_KEYS[0]] == STATUS_TYPE[2]:
+                return status, Retry.FAILURE_TRANSIENT
+            return status, Retry.classify(status[RETURN_KEYS[2]])
+
+        def before_retry():
+            if before_retry_hook is not None and not before_retry_hook():
+                return False
+            # A ReRun already deleted the directory
+            if self.status[RETURN_KEYS[0]] != STATUS_TYPE[2] and target_dir is not None and \
+                    self.dir_exists(target_dir.group(1)) and not self.delete_dir(target_dir.group(1)):
+                return False
+            logger.info("Running the sqoop job again")
+            return True
+
+        return Retry.run_with_retries("sqoop import", Metrics.EXPORT_TYPE_DB_EXPORT, attempt, before_retry)
+
+    """
+    Purpose   :   This method starts one sqoop process with the job timeout of the [commands] section, reads its
+                  logs and records the duration of the run
+    Input     :   Sqoop command (String)
+    Output    :   Returns execution status and record count
+    """
+
+    def run_sqoop_process(self, command):
+        with self.lock:
+            if self.cancelled:
+                return {RETURN_KEYS[0]: STATUS_TYPE[1], RETURN_KEYS[1]: -1, RETURN_KEYS[2]: "Sqoop import cancelled"}
+            self.command = CommandRunner.start(command, CommandRunner.job_timeout(), stream=True)
+        started = time.time()
+        with Tracing.span("sqoop.process"):
+            status = self.read_logs(self.command)
+        Metrics.SQOOP_DURATION.observe(time.time() - started, status[RETURN_KEYS[0]].lower())
+        return status
+
+    """
+    Purpose   :   Kill the running sqoop process and stop the retries, e.g. when the output of the import can no
+                  longer be used
+    Input     :   None
+    Output    :   None
+    """
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            if self.command is not None and not self.command.done():
+                self.command.cancel()
+
 
     """  
     Purpose   :   This method to validate the database type
@@ -299,6 +404,7 @@ class SqoopUtility(object):
     Output    :   Returns sqoop command
     """
 
+    @Tracing.traced("generate_command")
     def generate_command(self, user_name, password, db_name, db_type, db_host, db_port, table_name, destination):
 
         try:
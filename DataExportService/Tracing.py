@@ -0,0 +1,231 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : Tracing
+Purpose             : Span based profiling of exports. When a job is traced ("trace": true in the request, or trace
+                      in the [jobs] section of settings.conf), every phase wrapped in span() or @traced records its
+                      start, duration, thread and arguments; the commands run with CommandRunner add their CPU
+                      time and peak memory, and every S3 call made through Metrics.s3_call is a span.
+                      The trace is saved with the job as a Chrome trace (chrome://tracing, Perfetto) and can be
+                      converted to the folded stack format of flamegraph.pl and speedscope. Jobs that are not
+                      traced only pay for one thread-local lookup per span.
+Input Parameters    : Span names and arguments
+Output Value        : <jobs_dir>/<job_id>.trace.json
+Dependencies        : None
+Predecessor Module  : DataExportService, HdfsToS3, SqoopUtility, LocalToS3, BulkExport, ExportContext, Metrics, CommandRunner
+Successor Module    : JobEvents
+Pre-requisites      : None
+How to run          : with Tracing.span("distcp", file_name=path): ...
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import json
+import time
+import threading
+import functools
+import JobEvents
+
+"""
+Module Constants
+"""
+MODULE_NAME = "Tracing"
+FORMAT_CHROME = "chrome"
+FORMAT_FOLDED = "folded"
+# Spans kept per trace, later spans are counted but not recorded
+MAX_SPANS = 200000
+MICROSECONDS = 1000000.0
+
+
+class Trace(object):
+    """
+    Spans of one job. Spans are appended from every thread of the job; each thread keeps its own stack of open
+    spans, nesting is given by the time ranges of the spans of a thread.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.pid = os.getpid()
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.events = []
+        self.threads = {}
+        self.dropped = 0
+
+    def add(self, name, started, duration, args):
+        thread = threading.current_thread()
+        event = {"name": name, "ph": "X", "ts": int((started - self.started) * MICROSECONDS),
+                 "dur": int(duration * MICROSECONDS), "pid": self.pid, "tid": thread.ident}
+        if args:
+            event["args"] = args
+        with self.lock:
+            if len(self.events) >= MAX_SPANS:
+                self.dropped += 1
+                return
+            self.events.append(event)
+            self.threads[thread.ident] = thread.name
+
+    def to_chrome(self):
+        with self.lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "job " + self.job_id}}]
+        for tid, name in threads.items():
+            metadata.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}})
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                "otherData": {"job_id": self.job_id, "started": self.started, "dropped_spans": self.dropped}}
+
+    def save(self, path):
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as trace_file:
+            json.dump(self.to_chrome(), trace_file)
+        os.rename(temp_path, path)
+
+
+class Span(object):
+    __slots__ = ("trace", "name", "args", "started")
+
+    def __init__(self, trace, name, args):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.started = None
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        stack = _spans()
+        stack.append(self)
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        duration = time.time() - self.started
+        stack = _spans()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.trace.add(self.name, self.started, duration, self.args)
+        return False
+
+
+class NullSpan(object):
+    """Returned by span() when the job is not traced"""
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+_local = threading.local()
+
+
+def _spans():
+    stack = getattr(_local, "spans", None)
+    if stack is None:
+        stack = _local.spans = []
+    return stack
+
+
+def current_trace():
+    job = JobEvents.current_job()
+    return job.trace if job is not None else None
+
+
+"""
+Purpose   :   Open a span in the trace of the job of the calling thread
+Input     :   Span name, arguments recorded with the span
+Output    :   Returns a context manager, the Span or NULL_SPAN when the job is not traced
+"""
+
+
+def span(name, **args):
+    job = JobEvents.current_job()
+    if job is None or job.trace is None:
+        return NULL_SPAN
+    return Span(job.trace, name, args)
+
+
+def current_span():
+    stack = getattr(_local, "spans", None)
+    return stack[-1] if stack else NULL_SPAN
+
+
+def traced(name):
+    """Decorator running the function in a span"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            job = JobEvents.current_job()
+            if job is None or job.trace is None:
+                return function(*args, **kwargs)
+            with Span(job.trace, name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+"""
+Purpose   :   Convert a Chrome trace to the folded stack format of flamegraph.pl: one line per stack with the time
+              spent in its last frame, in microseconds. The stacks are rebuilt from the nesting of the spans of
+              each thread
+Input     :   Chrome trace json
+Output    :   Returns the folded stacks as a string
+"""
+
+
+def to_folded(chrome_trace):
+    spans = [event for event in chrome_trace.get("traceEvents", []) if event.get("ph") == "X"]
+    spans.sort(key=lambda event: (event["tid"], event["ts"], -event["dur"]))
+    totals = {}
+    stack = []
+    current_tid = None
+
+    def close(until):
+        # Pop the spans ending before until and charge them their time not covered by child spans
+        while stack and (until is None or stack[-1]["end"] <= until):
+            frame = stack.pop()
+            path = ";".join([item["name"] for item in stack] + [frame["name"]])
+            totals[path] = totals.get(path, 0) + max(0, frame["dur"] - frame["children"])
+
+    for event in spans:
+        if event["tid"] != current_tid:
+            close(None)
+            current_tid = event["tid"]
+        close(event["ts"])
+        if stack:
+            stack[-1]["children"] += event["dur"]
+        stack.append({"name": event["name"].replace(";", ":"), "dur": event["dur"], "end": event["ts"] + event["dur"],
+                      "children": 0})
+    close(None)
+    return "".join("%s %d\n" % (path, value) for path, value in sorted(totals.items()) if value > 0)
+
+
+"""
+Purpose   :   Read the saved trace of a job
+Input     :   Job id, format (chrome or folded)
+Output    :   Returns the trace as a string, or None if the job has no trace
+"""
+
+
+def load_trace(job_id, trace_format=FORMAT_CHROME):
+    path = JobEvents.trace_path(job_id)
+    if not os.path.exists(path):
+        return None
+    with open(path) as trace_file:
+        if trace_format == FORMAT_FOLDED:
+            return to_folded(json.load(trace_file))
+        return trace_file.read()
@@ -0,0 +1,663 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : WorkQueue
+Purpose             : Shared queue of export jobs and file tasks for a fleet of service instances. With the queue
+                      enabled, an export request is added to the queue instead of being run by the worker serving
+                      it, and every instance (on the same node or on several nodes sharing the queue file) runs
+                      a QueueWorker whose slots claim tasks from the queue with a lease. A worker renews the leases of
+                      the tasks it runs; the task of a worker that died is claimed again once its lease expires.
+                      An hdfsToS3 export with at least split_files source entries is split into one task per entry:
+                      the worker running the job claims the tasks of its own jobs first, idle workers first take new
+                      jobs and otherwise steal the tasks of the export with the most tasks left. The worker of the
+                      job collects the results, publishes the events of the job and rolls the export back when a
+                      task failed. The other export types run as a single task.
+                      The queue is a SQLite database in WAL mode. Workers on several nodes need a shared file system
+                      with working POSIX locks; the jobs_dir of the [jobs] section must be shared as well.
+Input Parameters    : Export type and request json of the jobs
+Output Value        : Result of the export, stored with the job
+Dependencies        : sqlite3, ExportRegistry, HdfsToS3
+Predecessor Module  : DataExportService
+Successor Module    : ExportRegistry, HdfsToS3
+Pre-requisites      : [workqueue] section of settings.conf
+How to run          : python WorkQueue.py runs a worker without the web service, e.g. on another node
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import json
+import time
+import signal
+import argparse
+import socket
+import sqlite3
+import threading
+import traceback
+from ConfigUtility import get_snapshot
+from LogSetup import logger
+from EDLExceptions import WorkerStopping
+import ExportRegistry
+import ExportHistory
+import CommandRunner
+import JobEvents
+import Metrics
+import Tracing
+
+"""
+Module Constants
+"""
+MODULE_NAME = "WorkQueue"
+CONFIGURATION_FILE = os.path.normpath(os.path.dirname(os.path.realpath(__file__))) + '/settings.conf'
+SETTINGS_SECTION = "workqueue"
+DEFAULT_QUEUE_PATH = "/tmp/dataexportservice_queue.sqlite"
+DEFAULT_SLOTS = 4
+DEFAULT_LEASE = 60
+DEFAULT_POLL_INTERVAL = 1
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_SPLIT_FILES = 10
+DEFAULT_RETENTION = 7 * 24 * 3600
+# Seconds a writer waits for the lock of the database held by another worker
+LOCK_TIMEOUT = 30
+HEARTBEAT_TICK = 0.5
+STATUS_KEY = "status"
+STATUS_SUCCESS = "SUCCESS"
+STATUS_FAILED = "FAILED"
+MESSAGE_KEY = "message"
+FILES_COPIED_LIST_KEY = "files_copied_list"
+FILE_NAME_KEY = "file_name"
+FILE_SIZE_KEY = "file_size"
+TARGET_PATHS_KEY = "target_paths"
+WORKER_KEY = "worker"
+TASKS_BY_WORKER_KEY = "tasks_by_worker"
+FLAG_YES = "y"
+
+KIND_JOB = "job"
+KIND_FILE = "file"
+STATE_PENDING = "pending"
+STATE_LEASED = "leased"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+CLAIM_OWN = "own"
+CLAIM_NEW = "new"
+CLAIM_STOLEN = "stolen"
+SPLIT_EXPORT_TYPE = "hdfsToS3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (job_id, kind, name)
+);
+CREATE INDEX IF NOT EXISTS tasks_claim ON tasks (kind, state, lease_expires);
+CREATE INDEX IF NOT EXISTS tasks_job ON tasks (job_id, kind)
+"""
+CLAIMABLE = "(t.state = 'pending' OR (t.state = 'leased' AND t.lease_expires < ?))"
+# Job row of a file task t, only file tasks of a job still pending or running are claimed
+ACTIVE_JOB = "JOIN tasks j ON j.job_id = t.job_id AND j.kind = 'job' AND j.state IN ('pending', 'leased')"
+
+_queues = {}
+_queues_lock = threading.Lock()
+_worker = None
+
+
+def is_enabled():
+    return get_snapshot(CONFIGURATION_FILE).get_bool(SETTINGS_SECTION, "enabled", False)
+
+
+def fetch_one(connection, query, parameters):
+    # The rows are all read: a statement left unfinished keeps its read snapshot of the WAL, and the connection
+    # would not see the tasks updated by the other workers
+    rows = connection.execute(query, parameters).fetchall()
+    return rows[0] if rows else None
+
+
+def create_schema(connection):
+    for statement in SCHEMA.split(";"):
+        connection.execute(statement)
+
+
+class Task(object):
+    __slots__ = ("task_id", "job_id", "kind", "name", "payload", "attempts", "claim")
+
+    def __init__(self, task_id, job_id, kind, name, payload, attempts, claim):
+        self.task_id = task_id
+        self.job_id = job_id
+        self.kind = kind
+        self.name = name
+        self.payload = payload
+        self.attempts = attempts
+        self.claim = claim
+
+
+class WorkQueue(object):
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        self.connection().execute("PRAGMA journal_mode=WAL").fetchall()
+        # Workers starting together create the table one after the other
+        self.write(create_schema)
+
+    def connection(self):
+        # One connection per thread and process; a connection inherited through fork is not reused. Transactions
+        # are started explicitly, a claim must read and update the task under the write lock
+        connection = getattr(self.local, "connection", None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def write(self, function, *args):
+        """Run function(connection, *args) in a transaction holding the write lock"""
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = function(connection, *args)
+        except:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    """
+    Purpose   :   Add an export job to the queue
+    Input     :   Job id, export type, request json
+    Output    :   None. Raises sqlite3.IntegrityError if the job id is already queued
+    """
+
+    def submit_job(self, job_id, export_type, config):
+        now = time.time()
+        self.write(lambda connection: connection.execute(
+            "INSERT INTO tasks (job_id, kind, name, payload, state, created_at, updated_at) VALUES "
+            "(?, ?, ?, ?, ?, ?, ?)", (job_id, KIND_JOB, export_type, json.dumps(config), STATE_PENDING, now, now)))
+
+    """
+    Purpose   :   Add the file tasks of a job. Tasks already added, e.g. by a worker that ran the job before its
+                  lease expired, are kept with their state
+    Input     :   Job id, list of source entries
+    Output    :   None
+    """
+
+    def add_file_tasks(self, job_id, names):
+        now = time.time()
+        self.write(lambda connection: connection.executemany(
+            "INSERT OR IGNORE INTO tasks (job_id, kind, name, payload, state, created_at, updated_at) VALUES "
+            "(?, ?, ?, ?, ?, ?, ?)", [(job_id, KIND_FILE, name, "{}", STATE_PENDING, now, now) for name in names]))
+
+    """
+    Purpose   :   Claim the next task for a worker, with a lease of lease seconds. The file tasks of the jobs run by
+                  the worker come first, then new jobs, then the file tasks of the job with the most tasks left.
+                  A task whose lease expired max_attempts times is failed instead, and so are the file tasks not
+                  running of a job failed this way
+    Input     :   Worker id, lease in seconds, maximum attempts, optional job id to claim only its file tasks
+    Output    :   Returns a Task, or None when there is nothing to claim, and the list of job ids failed because
+                  their lease expired too often
+    """
+
+    def claim(self, worker_id, lease, max_attempts, job_id=None):
+        return self.write(self._claim, worker_id, lease, max_attempts, job_id)
+
+    def _claim(self, connection, worker_id, lease, max_attempts, job_id):
+        now = time.time()
+        expired_jobs = [row[0] for row in connection.execute(
+            "SELECT job_id FROM tasks WHERE kind = ? AND state = ? AND lease_expires < ? AND attempts >= ?",
+            (KIND_JOB, STATE_LEASED, now, max_attempts))]
+        connection.execute(
+            "UPDATE tasks SET state = ?, result = ?, updated_at = ? WHERE state = ? AND lease_expires < ? AND "
+            "attempts >= ?", (STATE_FAILED, json.dumps({STATUS_KEY: STATUS_FAILED, MESSAGE_KEY:
+                                                        "Lease expired " + str(max_attempts) + " times"}),
+                              now, STATE_LEASED, now, max_attempts))
+        if expired_jobs:
+            # No owner is left to collect the results of these tasks or to roll them back
+            placeholders = ",".join("?" * len(expired_jobs))
+            connection.execute(
+                "UPDATE tasks SET state = ?, result = ?, updated_at = ? WHERE kind = ? AND (state = ? OR (state = ? "
+                "AND lease_expires < ?)) AND job_id IN (" + placeholders + ")",
+                [STATE_FAILED, json.dumps({MESSAGE_KEY: "Cancelled after the lease of the job expired"}), now,
+                 KIND_FILE, STATE_PENDING, STATE_LEASED, now] + expired_jobs)
+        if job_id is not None:
+            candidates = [("SELECT t.task_id FROM tasks t " + ACTIVE_JOB + " WHERE t.job_id = ? AND t.kind = ? AND " +
+                           CLAIMABLE + " ORDER BY t.task_id LIMIT 1", (job_id, KIND_FILE, now), CLAIM_OWN)]
+        else:
+            candidates = [
+                ("SELECT t.task_id FROM tasks t JOIN tasks j ON j.job_id = t.job_id AND j.kind = ? WHERE "
+                 "t.kind = ? AND j.owner = ? AND j.state = ? AND " + CLAIMABLE + " ORDER BY t.task_id LIMIT 1",
+                 (KIND_JOB, KIND_FILE, worker_id, STATE_LEASED, now), CLAIM_OWN),
+                ("SELECT t.task_id FROM tasks t WHERE t.kind = ? AND " + CLAIMABLE + " ORDER BY t.task_id LIMIT 1",
+                 (KIND_JOB, now), CLAIM_NEW),
+                ("SELECT t.task_id FROM tasks t WHERE t.kind = ? AND " + CLAIMABLE + " AND t.job_id = ("
+                 "SELECT t.job_id FROM tasks t " + ACTIVE_JOB + " WHERE t.kind = ? AND " + CLAIMABLE +
+                 " GROUP BY t.job_id ORDER BY COUNT(*) DESC LIMIT 1) ORDER BY t.task_id LIMIT 1",
+                 (KIND_FILE, now, KIND_FILE, now), CLAIM_STOLEN)]
+        for query, parameters, claim in candidates:
+            row = fetch_one(connection, query, parameters)
+            if row is None:
+                continue
+            connection.execute("UPDATE tasks SET state = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                               "updated_at = ? WHERE task_id = ?", (STATE_LEASED, worker_id, now + lease, now,
+                                                                    row[0]))
+            task_id, job, kind, name, payload, attempts = fetch_one(
+                connection, "SELECT task_id, job_id, kind, name, payload, attempts FROM tasks WHERE task_id = ?",
+                (row[0],))
+            return Task(task_id, job, kind, name, json.loads(payload), attempts, claim), expired_jobs
+        return None, expired_jobs
+
+    """
+    Purpose   :   Extend the leases of the tasks run by a worker
+    Input     :   Worker id, task ids, lease in seconds
+    Output    :   None
+    """
+
+    def renew(self, worker_id, task_ids, lease):
+        if not task_ids:
+            return
+        placeholders = ",".join("?" * len(task_ids))
+        self.write(lambda connection: connection.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE owner = ? AND state = ? AND task_id IN (" + placeholders + ")",
+            [time.time() + lease, worker_id, STATE_LEASED] + list(task_ids)))
+
+    """
+    Purpose   :   Store the result of a task
+    Input     :   Task id, worker id, final state (done or failed), result json
+    Output    :   Returns False if the worker lost the lease of the task, the result is then dropped
+    """
+
+    def complete(self, task_id, worker_id, state, result):
+        cursor = self.write(lambda connection: connection.execute(
+            "UPDATE tasks SET state = ?, result = ?, lease_expires = NULL, updated_at = ? WHERE task_id = ? AND "
+            "owner = ? AND state = ?", (state, json.dumps(result), time.time(), task_id, worker_id, STATE_LEASED)))
+        return cursor.rowcount == 1
+
+    """
+    Purpose   :   Give a task back to the queue without counting the attempt, when the worker stops before it is done
+    Input     :   Task id, worker id
+    Output    :   None
+    """
+
+    def release(self, task_id, worker_id):
+        self.write(lambda connection: connection.execute(
+            "UPDATE tasks SET state = ?, owner = NULL, lease_expires = NULL, attempts = attempts - 1, updated_at = ? "
+            "WHERE task_id = ? AND owner = ? AND state = ?", (STATE_PENDING, time.time(), task_id, worker_id,
+                                                               STATE_LEASED)))
+
+    """
+    Purpose   :   Fail the file tasks of a job that no worker has claimed yet, after another task failed
+    Input     :   Job id, message
+    Output    :   None
+    """
+
+    def cancel_pending(self, job_id, message):
+        self.write(lambda connection: connection.execute(
+            "UPDATE tasks SET state = ?, result = ?, updated_at = ? WHERE job_id = ? AND kind = ? AND state = ?",
+            (STATE_FAILED, json.dumps({MESSAGE_KEY: message}), time.time(), job_id, KIND_FILE, STATE_PENDING)))
+
+    def get_job(self, job_id):
+        row = fetch_one(self.connection(), "SELECT state, result FROM tasks WHERE job_id = ? AND kind = ?",
+                        (job_id, KIND_JOB))
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def get_job_config(self, job_id):
+        row = fetch_one(self.connection(), "SELECT payload FROM tasks WHERE job_id = ? AND kind = ?",
+                        (job_id, KIND_JOB))
+        return json.loads(row[0]) if row is not None else None
+
+    def file_tasks(self, job_id):
+        """Returns the (task_id, name, state, result) of the file tasks of a job"""
+        return [(task_id, name, state, json.loads(result) if result else None) for task_id, name, state, result in
+                self.connection().execute("SELECT task_id, name, state, result FROM tasks WHERE job_id = ? AND "
+                                          "kind = ? ORDER BY task_id", (job_id, KIND_FILE))]
+
+    def counts(self):
+        """Returns the number of tasks by (kind, state)"""
+        return dict(((kind, state), count) for kind, state, count in self.connection().execute(
+            "SELECT kind, state, COUNT(*) FROM tasks GROUP BY kind, state"))
+
+    def purge(self, retention):
+        oldest = time.time() - retention
+        self.write(lambda connection: connection.execute(
+            "DELETE FROM tasks WHERE job_id IN (SELECT job_id FROM tasks WHERE kind = ? AND state IN (?, ?) AND "
+            "updated_at < ?)", (KIND_JOB, STATE_DONE, STATE_FAILED, oldest)))
+
+
+"""
+Purpose   :   Return the queue configured in the [workqueue] section, opened once per process
+Input     :   None
+Output    :   Returns a WorkQueue
+"""
+
+
+def get_queue():
+    path = get_snapshot(CONFIGURATION_FILE).get(SETTINGS_SECTION, "queue_path") or DEFAULT_QUEUE_PATH
+    queue = _queues.get(path)
+    if queue is None:
+        with _queues_lock:
+            queue = _queues.get(path)
+            if queue is None:
+                queue = _queues[path] = WorkQueue(path)
+    return queue
+
+
+"""
+Purpose   :   Wait for the result of a queued job
+Input     :   Job id, maximum number of seconds to wait (no limit when None), queue (the configured one when None)
+Output    :   Returns the result json, or None on timeout
+"""
+
+
+def wait_for_result(job_id, timeout=None, queue=None):
+    queue = queue if queue is not None else get_queue()
+    poll_interval = max(0.1, get_snapshot(CONFIGURATION_FILE).get_float(SETTINGS_SECTION, "poll_interval",
+                                                                        DEFAULT_POLL_INTERVAL))
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        state, result = queue.get_job(job_id)
+        if state in (STATE_DONE, STATE_FAILED):
+            return result or {STATUS_KEY: STATUS_FAILED}
+        if deadline is not None and time.time() >= deadline:
+            return None
+        time.sleep(poll_interval)
+
+
+class QueueWorker(object):
+    def __init__(self, queue, slots=None, lease=None, split_files=None):
+        settings = get_snapshot(CONFIGURATION_FILE)
+        self.queue = queue
+        # The arguments override the [workqueue] section
+        self.slots = max(1, slots or settings.get_int(SETTINGS_SECTION, "slots", DEFAULT_SLOTS))
+        self.lease = max(1, lease or settings.get_int(SETTINGS_SECTION, "lease", DEFAULT_LEASE))
+        self.poll_interval = max(0.1, settings.get_float(SETTINGS_SECTION, "poll_interval", DEFAULT_POLL_INTERVAL))
+        self.max_attempts = max(1, settings.get_int(SETTINGS_SECTION, "max_attempts", DEFAULT_MAX_ATTEMPTS))
+        self.split_files = max(1, split_files or settings.get_int(SETTINGS_SECTION, "split_files",
+                                                                  DEFAULT_SPLIT_FILES))
+        self.worker_id = socket.gethostname() + ":" + str(os.getpid())
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        # Tasks run by this worker, their leases are renewed by the heartbeat thread
+        self.held = set()
+        self.slot_threads = []
+        self.threads = []
+        # Request json of the running jobs whose file tasks this worker ran
+        self.job_configs = {}
+
+    def start(self):
+        self.slot_threads = [threading.Thread(target=self.run_slot, name="queue-slot-" + str(index))
+                             for index in range(self.slots)]
+        self.threads = self.slot_threads + [threading.Thread(target=self.heartbeat, name="queue-heartbeat")]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        logger.info("Queue worker " + self.worker_id + " started with " + str(self.slots) + " slots on " +
+                    self.queue.path)
+
+    """
+    Purpose   :   Stop claiming tasks and wait for the tasks running. Tasks still running after the timeout keep
+                  their lease until it expires
+    Input     :   Maximum number of seconds to wait
+    Output    :   Returns True if no task is left
+    """
+
+    def stop(self, timeout):
+        self.stopped.set()
+        deadline = time.time() + timeout
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.time()))
+        return not any(thread.is_alive() for thread in self.threads)
+
+    def heartbeat(self):
+        # Runs until the worker is stopped and its slots finished their last task
+        renewed = time.time()
+        while not (self.stopped.is_set() and not any(thread.is_alive() for thread in self.slot_threads)):
+            if time.time() - renewed >= self.lease / 3.0:
+                with self.lock:
+                    task_ids = list(self.held)
+                try:
+                    self.queue.renew(self.worker_id, task_ids, self.lease)
+                except Exception:
+                    logger.error("Unable to renew the leases of " + self.worker_id + ": " + traceback.format_exc())
+                renewed = time.time()
+            time.sleep(HEARTBEAT_TICK)
+
+    def run_slot(self):
+        while not self.stopped.is_set():
+            try:
+                task, expired_jobs = self.queue.claim(self.worker_id, self.lease, self.max_attempts)
+                for job_id in expired_jobs:
+                    JobEvents.resume_job(job_id).finish(self.queue.get_job(job_id)[1])
+                    JobEvents.set_current_job(None)
+                if task is None:
+                    self.prune_job_configs()
+                    self.stopped.wait(self.poll_interval)
+                    continue
+                self.run_task(task)
+            except KeyboardInterrupt:
+                raise KeyboardInterrupt
+            except:
+                logger.error("Queue slot of " + self.worker_id + " failed: " + traceback.format_exc())
+                self.stopped.wait(self.poll_interval)
+
+    def run_task(self, task):
+        with self.lock:
+            self.held.add(task.task_id)
+        Metrics.QUEUE_TASKS.inc(1, task.kind, task.claim)
+        try:
+            if task.kind == KIND_JOB:
+                state, result = self.run_job(task)
+            else:
+                state, result = self.run_file_task(task)
+            if state == STATE_PENDING:
+                self.queue.release(task.task_id, self.worker_id)
+            elif not self.queue.complete(task.task_id, self.worker_id, state, result):
+                logger.warning("Lease of task " + str(task.task_id) + " of job " + task.job_id + " was lost, " +
+                               "its result is dropped")
+            return state
+        finally:
+            with self.lock:
+                self.held.discard(task.task_id)
+
+    """
+    Purpose   :   Run an export job: split it into file tasks when it is a large hdfsToS3 export, otherwise run its
+                  handler. The job is the current job of the thread and is finished with the result. A split job
+                  left because the worker is stopping is given back to the queue and continued by another worker
+    Input     :   Task of the job
+    Output    :   Returns the final state of the task (pending when it is given back) and the result of the export
+    """
+
+    def run_job(self, task):
+        config = task.payload
+        export_type = task.name
+        job = JobEvents.resume_job(task.job_id)
+        if config.get("trace", JobEvents.is_tracing_default()):
+            job.trace = Tracing.Trace(job.job_id)
+        result = {STATUS_KEY: STATUS_FAILED}
+        stopping = False
+        Metrics.IN_FLIGHT_JOBS.inc(1, export_type)
+        started = time.time()
+        try:
+            with Metrics.REQUEST_LATENCY.time(export_type), Tracing.span("export", export_type=export_type,
+                                                                         worker=self.worker_id):
+                result = None
+                if export_type == SPLIT_EXPORT_TYPE and isinstance(config.get("target_path"), basestring):
+                    result = self.run_split_job(task, config)
+                if result is None:
+                    result = ExportRegistry.get_handler(export_type)(config)
+        except KeyboardInterrupt:
+            raise KeyboardInterrupt
+        except WorkerStopping:
+            logger.info("Worker " + self.worker_id + " is stopping, job " + task.job_id + " is given back")
+            stopping = True
+        except:
+            logger.error("Job " + task.job_id + " failed: " + traceback.format_exc())
+            result = {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: "Export failed on worker " + self.worker_id}
+        finally:
+            Metrics.IN_FLIGHT_JOBS.dec(1, export_type)
+            if stopping:
+                # The worker claiming the job again continues its events file
+                job.close()
+            else:
+                status = result.get(STATUS_KEY, "UNKNOWN") if isinstance(result, dict) else STATUS_FAILED
+                Metrics.REQUESTS.inc(1, export_type, status)
+                if export_type != ExportRegistry.BULK_EXPORT:
+                    ExportHistory.record(export_type, config, result, time.time() - started)
+                job.finish(result)
+            JobEvents.set_current_job(None)
+        if stopping:
+            return STATE_PENDING, None
+        return (STATE_DONE if status == STATUS_SUCCESS else STATE_FAILED), result
+
+    """
+    Purpose   :   Run an hdfsToS3 export as one file task per source entry. The worker of the job runs the tasks
+                  of the job it can claim, then waits for the tasks claimed by other workers, publishing a file
+                  copied event for each task done. After a failed task the tasks not claimed yet are cancelled and
+                  the objects written by the export are removed (atomic_transaction). When the worker is stopping
+                  it stops waiting, WorkerStopping is raised and the job is left to the other workers
+    Input     :   Task of the job, request json
+    Output    :   Returns the result of the export, or None when the export has less than split_files entries
+    """
+
+    @Tracing.traced("queue.split")
+    def run_split_job(self, task, config):
+        import HdfsToS3
+        hdfs_to_s3 = HdfsToS3.HdfsToS3()
+        names = config.get("file_list") or list(hdfs_to_s3.context.iter_hdfs(config["source_path"]))
+        if len(names) < self.split_files:
+            return None
+        self.queue.add_file_tasks(task.job_id, names)
+        logger.info("Job " + task.job_id + " split into " + str(len(names)) + " file tasks")
+        published = set()
+        failure = None
+        cancel_message = None
+        while True:
+            if self.stopped.is_set():
+                raise WorkerStopping("Worker " + self.worker_id + " is stopping")
+            # After a failed task the tasks left are cancelled below instead of being run
+            if failure is None:
+                file_task, _ = self.queue.claim(self.worker_id, self.lease, self.max_attempts, task.job_id)
+                if file_task is not None and self.run_task(file_task) != STATE_FAILED:
+                    continue
+            tasks = self.queue.file_tasks(task.job_id)
+            for task_id, name, state, result in tasks:
+                if state == STATE_DONE and task_id not in published:
+                    published.add(task_id)
+                    JobEvents.publish(JobEvents.EVENT_FILE_COPIED, file_name=result[FILE_NAME_KEY],
+                                      file_size=result[FILE_SIZE_KEY], worker=result[WORKER_KEY])
+                elif state == STATE_FAILED and failure is None:
+                    failure = "Failed to transfer Hdfs file " + name + " to S3"
+                    cancel_message = "Cancelled after the failure of " + name
+            # Also cancels the tasks a stopping worker gave back after the failure
+            if failure is not None and any(state == STATE_PENDING for _, _, state, _ in tasks):
+                self.queue.cancel_pending(task.job_id, cancel_message)
+                continue
+            if all(state in (STATE_DONE, STATE_FAILED) for _, _, state, _ in tasks):
+                break
+            self.stopped.wait(self.poll_interval)
+        self.job_configs.pop(task.job_id, None)
+
+        tasks_by_worker = {}
+        for _, _, state, result in tasks:
+            if result and result.get(WORKER_KEY):
+                tasks_by_worker[result[WORKER_KEY]] = tasks_by_worker.get(result[WORKER_KEY], 0) + 1
+        if failure is None:
+            return {STATUS_KEY: STATUS_SUCCESS, TASKS_BY_WORKER_KEY: tasks_by_worker,
+                    FILES_COPIED_LIST_KEY: [{FILE_NAME_KEY: result[FILE_NAME_KEY],
+                                             FILE_SIZE_KEY: result[FILE_SIZE_KEY]} for _, _, _, result in tasks]}
+        logger.error(failure)
+        if (config.get("atomic_transaction") or FLAG_YES).lower() == FLAG_YES:
+            target_paths = [path for _, _, _, result in tasks if result for path in result.get(TARGET_PATHS_KEY, [])]
+            if target_paths and not hdfs_to_s3.s3_cleanup(target_paths, config["s3_credentials"]):
+                failure = "Error in cleaning files already loaded to s3"
+        return {STATUS_KEY: STATUS_FAILED, MESSAGE_KEY: failure, TASKS_BY_WORKER_KEY: tasks_by_worker,
+                FILES_COPIED_LIST_KEY: []}
+
+    def prune_job_configs(self):
+        for job_id in list(self.job_configs):
+            if self.queue.get_job(job_id)[0] != STATE_LEASED:
+                self.job_configs.pop(job_id, None)
+
+    """
+    Purpose   :   Copy one source entry of a split hdfsToS3 export with the transfer, verification and retries of
+                  HdfsToS3
+    Input     :   File task
+    Output    :   Returns the final state of the task and its result: file_name and file_size of the transfer, the
+                  S3 paths written and the worker id
+    """
+
+    def run_file_task(self, task):
+        import HdfsToS3
+        import DedupIndex
+        config = self.job_configs.get(task.job_id)
+        if config is None:
+            config = self.job_configs[task.job_id] = self.queue.get_job_config(task.job_id)
+        hdfs_to_s3 = HdfsToS3.HdfsToS3()
+        hdfs_to_s3.atomic_transaction = (config.get("atomic_transaction") or FLAG_YES).lower()
+        if DedupIndex.is_enabled(config):
+            hdfs_to_s3.enable_dedup(config.get(HdfsToS3.DEDUP_BUCKETS_KEY))
+        target_paths = []
+        status = {FILE_NAME_KEY: "", FILE_SIZE_KEY: 0}
+        option_string = hdfs_to_s3.create_command_options_string(config["s3_credentials"])
+        if option_string:
+            status = hdfs_to_s3.transfer_file_with_retries(option_string, config["source_path"], task.name,
+                                                           config["target_path"], config["s3_credentials"], set(),
+                                                           target_paths)
+        result = {FILE_NAME_KEY: status[FILE_NAME_KEY], FILE_SIZE_KEY: status[FILE_SIZE_KEY],
+                  TARGET_PATHS_KEY: target_paths, WORKER_KEY: self.worker_id}
+        return (STATE_DONE if status[FILE_NAME_KEY] else STATE_FAILED), result
+
+
+"""
+Purpose   :   Start the queue worker of this process, called in each service worker when the queue is enabled
+Input     :   None
+Output    :   None
+"""
+
+
+def start_worker(queue=None, slots=None):
+    global _worker
+    queue = queue if queue is not None else get_queue()
+    queue.purge(get_snapshot(CONFIGURATION_FILE).get_int(SETTINGS_SECTION, "retention", DEFAULT_RETENTION))
+    _worker = QueueWorker(queue, slots)
+    _worker.start()
+
+
+def stop_worker(timeout):
+    if _worker is None:
+        return True
+    return _worker.stop(timeout)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a work queue worker without the web service")
+    parser.add_argument("--queue-path", help="queue database, queue_path of the [workqueue] section by default")
+    parser.add_argument("--slots", type=int, help="tasks run at the same time, slots of [workqueue] by default")
+    args = parser.parse_args()
+    start_worker(WorkQueue(args.queue_path) if args.queue_path else None, args.slots)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+    while not stopping.wait(1):
+        pass
+    logger.info("Queue worker " + _worker.worker_id + " stopping")
+    if not stop_worker(get_snapshot(CONFIGURATION_FILE).get_int("servicesettings", "graceful_timeout", 3600)):
+        logger.error("Queue worker " + _worker.worker_id + " exiting with tasks still running")
+        CommandRunner.cancel_all()
@@ -0,0 +1,316 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : WsgiServer
+Purpose             : Production serving mode for the data export service. A parent process binds the listening
+                      socket and forks a fixed number of worker processes; each worker serves requests from a
+                      bounded pool of request threads. On SIGTERM/SIGINT the workers stop accepting connections,
+                      drain the exports already in flight and exit.
+Input Parameters    : WSGI application, host, port, worker count, threads per worker, graceful timeout
+Output Value        : None. Blocks until the service is stopped.
+Dependencies        : werkzeug (installed with flask)
+Predecessor Module  : DataExportService
+Successor Module    : None
+Pre-requisites      : POSIX platform (os.fork)
+How to run          : Call serve_forever() with the flask application and the values from settings.conf
+Last changed on     :
+Last changed by     :
+Reason for change   :
+"""
+
+"""Library and external modules declaration"""
+import os
+import sys
+import time
+import logging
+import errno
+import signal
+import socket
+import threading
+import traceback
+import Queue
+from werkzeug.serving import BaseWSGIServer
+from werkzeug.wsgi import ClosingIterator
+from LogSetup import logger
+
+"""
+Module Constants
+"""
+MODULE_NAME = "WsgiServer"
+SERVER_MODE_PRODUCTION = "production"
+SERVER_MODE_DEVELOPMENT = "development"
+DEFAULT_WORKERS = 4
+DEFAULT_THREADS_PER_WORKER = 8
+DEFAULT_GRACEFUL_TIMEOUT = 3600
+DEFAULT_LISTEN_BACKLOG = 128
+# Seconds the parent waits after the graceful timeout before killing workers that are still alive
+KILL_GRACE_PERIOD = 5
+# Seconds a crashed worker is given before being restarted, to avoid a tight fork loop
+RESPAWN_DELAY = 1
+# Seconds between two checks of the child processes by the parent
+MONITOR_INTERVAL = 0.2
+# Seconds between two reads of the number of workers when it is given as a callable
+RESIZE_CHECK_INTERVAL = 5
+
+
+class InFlightTracker(object):
+    """
+    WSGI middleware counting the requests currently being served by this worker, so a shutdown can wait for
+    running exports to finish before the process exits.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self.condition:
+            self.in_flight += 1
+        try:
+            app_iter = self.app(environ, start_response)
+        except:
+            self._leave()
+            raise
+        return ClosingIterator(app_iter, [self._leave])
+
+    def _leave(self):
+        with self.condition:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self.condition.notify_all()
+
+    """
+    Purpose   :   Wait until every in-flight request has completed
+    Input     :   Maximum number of seconds to wait
+    Output    :   Returns True if the worker is idle, False if the timeout expired first
+    """
+
+    def wait_idle(self, timeout):
+        deadline = time.time() + timeout
+        with self.condition:
+            while self.in_flight > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    WSGI server handing accepted connections to a fixed pool of request threads instead of spawning one thread
+    per connection. Connections wait in a bounded queue when every thread is busy.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, threads, fd=None):
+        BaseWSGIServer.__init__(self, host, port, app, fd=fd)
+        self.requests = Queue.Queue(maxsize=threads * 2)
+        self.pool = []
+        for index in range(threads):
+            thread = threading.Thread(target=self._request_loop, name="wsgi-request-%d" % index)
+            thread.daemon = True
+            thread.start()
+            self.pool.append(thread)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def _request_loop(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    """
+    Purpose   :   Stop the request threads once the requests already queued have been served
+    Input     :   Maximum number of seconds to wait
+    Output    :   None
+    """
+
+    def stop_pool(self, timeout):
+        deadline = time.time() + timeout
+        for _ in self.pool:
+            self.requests.put(None)
+        for thread in self.pool:
+            thread.join(max(0, deadline - time.time()))
+
+
+"""
+Purpose   :   Create the listening socket shared by all the workers
+Input     :   Host and port
+Output    :   Returns the bound and listening socket
+"""
+
+
+def create_listener(host, port, backlog=DEFAULT_LISTEN_BACKLOG):
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    return listener
+
+
+"""
+Purpose   :   Main loop of a worker process. Serves requests until SIGTERM/SIGINT, then drains in-flight exports
+Input     :   WSGI application, listening socket, threads per worker, graceful timeout in seconds, an optional
+              callable run in the worker process before it starts serving and an optional callable given the
+              remaining timeout to drain work running outside of requests
+Output    :   None. The process exits when the loop ends
+"""
+
+
+def _worker_main(app, listener, host, threads, graceful_timeout, on_worker_start, on_worker_stop):
+    if on_worker_start is not None:
+        on_worker_start()
+    tracker = InFlightTracker(app)
+    server = PooledWSGIServer(host, 0, tracker, threads, fd=listener.fileno())
+
+    def request_shutdown(signum, frame):
+        # shutdown() blocks until serve_forever returns, so it must not run on the serving thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    logger.info("Worker " + str(os.getpid()) + " serving with " + str(threads) + " threads")
+    try:
+        server.serve_forever()
+    finally:
+        logger.info("Worker " + str(os.getpid()) + " draining " + str(tracker.in_flight) + " in-flight requests")
+        deadline = time.time() + graceful_timeout
+        server.stop_pool(graceful_timeout)
+        if not tracker.wait_idle(max(0, deadline - time.time())):
+            logger.error("Worker " + str(os.getpid()) + " exiting with " + str(tracker.in_flight) +
+                         " requests still running after " + str(graceful_timeout) + " seconds")
+        if on_worker_stop is not None and not on_worker_stop(max(0, deadline - time.time())):
+            logger.error("Worker " + str(os.getpid()) + " exiting with background work still running after " +
+                         str(graceful_timeout) + " seconds")
+        logger.info("Worker " + str(os.getpid()) + " stopped")
+
+
+def _spawn_worker(app, listener, host, threads, graceful_timeout, on_worker_start, on_worker_stop):
+    pid = os.fork()
+    if pid != 0:
+        return pid
+    exit_code = 0
+    try:
+        _worker_main(app, listener, host, threads, graceful_timeout, on_worker_start, on_worker_stop)
+    except:
+        logger.error("Worker " + str(os.getpid()) + " failed: " + traceback.format_exc())
+        exit_code = 1
+    finally:
+        # os._exit skips the atexit hooks, flush the log handlers (and the async log queue) here
+        logging.shutdown()
+        os._exit(exit_code)
+
+
+"""
+Purpose   :   Run the application with a pre-forked pool of worker processes. Dead workers are restarted; on
+              SIGTERM/SIGINT the signal is forwarded to the workers, which drain their in-flight exports before
+              exiting. Workers still alive after the graceful timeout are killed. The number of workers and threads
+              can be callables, e.g. reading settings.conf: the pool is then resized when the number of workers
+              changes and new workers use the current number of threads.
+Input     :   WSGI application, host, port, number of workers, threads per worker, graceful timeout in seconds,
+              optional callable run in each worker process before it starts serving, optional callable draining
+              background work of a stopping worker (given the remaining timeout, returns True when done)
+Output    :   None
+"""
+
+
+def serve_forever(app, host, port, workers=DEFAULT_WORKERS, threads=DEFAULT_THREADS_PER_WORKER,
+                  graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT, on_worker_start=None, on_worker_stop=None):
+    listener = create_listener(host, port)
+    state = {"stopping": False}
+    children = set()
+    retiring = set()
+
+    def resolve(value):
+        return int(value()) if callable(value) else value
+
+    def spawn():
+        children.add(_spawn_worker(app, listener, host, resolve(threads), graceful_timeout, on_worker_start,
+                                   on_worker_stop))
+
+    def resize():
+        try:
+            target = max(1, resolve(workers))
+        except Exception:
+            logger.error("Invalid number of workers: " + traceback.format_exc())
+            return
+        active = sorted(children - retiring)
+        if len(active) < target:
+            logger.info("Increasing workers from " + str(len(active)) + " to " + str(target))
+            for _ in range(target - len(active)):
+                spawn()
+        elif len(active) > target:
+            logger.info("Decreasing workers from " + str(len(active)) + " to " + str(target))
+            for pid in active[:len(active) - target]:
+                retiring.add(pid)
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def request_stop(signum, frame):
+        state["stopping"] = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    logger.info("Starting " + str(resolve(workers)) + " workers on " + host + ":" + str(port))
+    resize()
+
+    kill_deadline = None
+    next_resize = time.time() + RESIZE_CHECK_INTERVAL
+    while children:
+        if state["stopping"] and kill_deadline is None:
+            kill_deadline = time.time() + graceful_timeout + KILL_GRACE_PERIOD
+        try:
+            pid, exit_status = os.waitpid(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.ECHILD:
+                break
+            raise
+        if pid == 0:
+            if kill_deadline is not None and time.time() > kill_deadline:
+                for child in list(children):
+                    logger.error("Killing worker " + str(child) + " after graceful timeout")
+                    try:
+                        os.kill(child, signal.SIGKILL)
+                    except OSError:
+                        pass
+                kill_deadline = sys.maxint
+            elif kill_deadline is None and time.time() >= next_resize:
+                # workers may be a callable reading the configuration, follow its changes
+                next_resize = time.time() + RESIZE_CHECK_INTERVAL
+                resize()
+            time.sleep(MONITOR_INTERVAL)
+            continue
+        children.discard(pid)
+        if pid in retiring:
+            retiring.discard(pid)
+            logger.info("Worker " + str(pid) + " retired")
+        elif not state["stopping"]:
+            logger.error("Worker " + str(pid) + " exited with status " + str(exit_status) + ", restarting")
+            time.sleep(RESPAWN_DELAY)
+            spawn()
+    listener.close()
+    logger.info("Service stopped")
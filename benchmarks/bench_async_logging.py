@@ -0,0 +1,111 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : bench_async_logging
+Purpose             : Throughput of a distcp/sqoop style log read loop (one logger.debug per output line) with the
+                      handlers of LogSetup attached directly to the logger and behind the AsyncQueueHandler with
+                      each overflow policy. The handlers are a file handler and a handler standing in for logstash
+                      that waits --handler-us microseconds per record.
+Input Parameters    : --lines, --handler-us, --queue-size, --output
+Output Value        : Lines per second of the loop, time until every record is written and dropped records for each
+                      mode; optionally appended as a json line to --output
+How to run          : python benchmarks/bench_async_logging.py --lines 200000 --handler-us 20
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "DataExportService"))
+
+import LogSetup
+
+LINE = "18/04/12 10:15:%02d INFO mapreduce.Job:  map %d%% reduce 0%%"
+
+
+class SlowHandler(logging.Handler):
+    def __init__(self, delay):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.delay = delay
+        self.records = 0
+
+    def emit(self, record):
+        self.format(record)
+        self.records += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+
+def run(mode, lines, handler_us, queue_size, log_dir):
+    logger = logging.getLogger("bench_" + mode)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s ")
+    file_handler = logging.FileHandler(os.path.join(log_dir, mode + ".log"))
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(formatter)
+    slow_handler = SlowHandler(handler_us / 1000000.0)
+    slow_handler.setFormatter(formatter)
+    handlers = [file_handler, slow_handler]
+    async_handler = None
+    if mode == "sync":
+        for handler in handlers:
+            logger.addHandler(handler)
+    else:
+        async_handler = LogSetup.AsyncQueueHandler(handlers, queue_size, mode)
+        logger.addHandler(async_handler)
+
+    started = time.time()
+    for index in range(lines):
+        logger.debug(LINE % (index % 60, index % 100))
+        if index % 1000 == 0:
+            logger.info("Completed " + str(index) + " lines")
+    loop_seconds = time.time() - started
+    if async_handler is not None:
+        dropped = async_handler.listener.dropped
+        async_handler.close()
+    else:
+        dropped = 0
+    total_seconds = time.time() - started
+    file_handler.close()
+    return {"lines_per_second": lines / loop_seconds, "loop_seconds": loop_seconds,
+            "written_seconds": total_seconds, "dropped": dropped}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of synchronous and asynchronous logging")
+    parser.add_argument("--lines", type=int, default=200000)
+    parser.add_argument("--handler-us", type=int, default=20, help="microseconds the logstash stand-in waits")
+    parser.add_argument("--queue-size", type=int, default=LogSetup.DEFAULT_ASYNC_QUEUE_SIZE)
+    parser.add_argument("--output", help="append the results as a json line to this file")
+    args = parser.parse_args()
+
+    results = {"benchmark": "async_logging", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "lines": args.lines,
+               "handler_us": args.handler_us, "queue_size": args.queue_size}
+    log_dir = tempfile.mkdtemp(prefix="bench_async_logging_")
+    try:
+        for mode in ("sync",) + LogSetup.ASYNC_OVERFLOW_POLICIES:
+            sample = run(mode, args.lines, args.handler_us, args.queue_size, log_dir)
+            results[mode] = sample
+            print("%-10s %10.0f lines/s  loop %6.2f s  written after %6.2f s  dropped %d" % (
+                mode, sample["lines_per_second"], sample["loop_seconds"], sample["written_seconds"],
+                sample["dropped"]))
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
+
+    if args.output:
+        directory = os.path.dirname(os.path.abspath(args.output))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.output, "a") as output_file:
+            output_file.write(json.dumps(results, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
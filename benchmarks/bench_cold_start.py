@@ -0,0 +1,74 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : bench_cold_start
+Purpose             : Cold-start benchmark of the data export service. Each sample runs in a fresh interpreter and
+                      measures how long it takes until the flask application is importable and the first request
+                      is served, with the export backends loaded lazily (the service default) and loaded eagerly
+                      before the first request (the behaviour before ExportRegistry).
+Input Parameters    : --runs, --output
+Output Value        : Median and worst time of each phase; optionally appended as a json line to --output
+How to run          : python benchmarks/bench_cold_start.py --runs 10 --output benchmarks/results/cold_start.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "DataExportService")
+
+# Runs inside the fresh interpreter; prints the elapsed seconds of each phase as json
+PROBE = """
+import json, time
+started = time.time()
+import DataExportService
+imported = time.time()
+if %(eager)s:
+    DataExportService.ExportRegistry.warm_up(background=False)
+client = DataExportService.app.test_client()
+client.get('/dataexportservice/metrics')
+served = time.time()
+print(json.dumps({"import": imported - started, "first_request": served - started}))
+"""
+
+
+def sample(eager):
+    output = subprocess.check_output([sys.executable, "-c", PROBE % {"eager": eager}], cwd=SERVICE_DIR,
+                                     stderr=open(os.devnull, "w"))
+    return json.loads(output.strip().split("\n")[-1])
+
+
+def summarize(values):
+    ordered = sorted(values)
+    return {"median": ordered[len(ordered) // 2], "max": ordered[-1]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark of the data export service")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--output", help="append the results as a json line to this file")
+    args = parser.parse_args()
+
+    results = {"benchmark": "cold_start", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "runs": args.runs}
+    for mode, eager in (("lazy", False), ("eager", True)):
+        samples = [sample(eager) for _ in range(args.runs)]
+        for phase in ("import", "first_request"):
+            summary = summarize([item[phase] for item in samples])
+            results[mode + "_" + phase] = summary
+            print("%-6s %-14s median %7.1f ms  max %7.1f ms" % (mode, phase, summary["median"] * 1000,
+                                                                 summary["max"] * 1000))
+
+    if args.output:
+        directory = os.path.dirname(os.path.abspath(args.output))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.output, "a") as output_file:
+            output_file.write(json.dumps(results, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : bench_command_runner
+Purpose             : Supervision of many concurrent external commands by CommandRunner (one supervisor thread and
+                      one poll() loop per process) against a thread per command reading its output with readline,
+                      as the exports did before. Every command prints --lines distcp style progress lines, one every
+                      --interval seconds. For each mode the wall time, the threads used, the CPU time of this process
+                      and the lines read are reported. Then --timeouts commands that leave a background child behind
+                      are run with a timeout of --timeout seconds: the time until they are all killed and the processes
+                      of their groups still alive afterwards are reported.
+Input Parameters    : --commands, --lines, --interval, --max-processes, --timeouts, --timeout, --output
+Output Value        : Wall time, threads and CPU time of each mode and the timeout results; optionally appended as a
+                      json line to --output
+How to run          : python benchmarks/bench_command_runner.py --commands 300 --lines 20 --interval 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "DataExportService"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import harness
+import CommandRunner
+
+PROGRESS_COMMAND = "for i in $(seq 1 %d); do echo \"INFO mapreduce.Job:  map $i%% reduce 0%%\"; sleep %s; done"
+# The marker lets the processes left behind be found with ps
+TIMEOUT_COMMAND = "sleep 3600 & sleep 3600; wait # bench_command_runner_%d"
+
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def measure(run):
+    peak_threads = [threading.active_count()]
+    stop = threading.Event()
+
+    def watch():
+        while not stop.is_set():
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.01)
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    started, cpu_started = time.time(), cpu_seconds()
+    try:
+        lines = run()
+    finally:
+        stop.set()
+        watcher.join()
+    # The watcher thread is not counted
+    return {"seconds": time.time() - started, "cpu_seconds": cpu_seconds() - cpu_started,
+            "peak_threads": peak_threads[0] - 1, "lines": lines}
+
+
+def run_with_threads(commands):
+    counts = []
+
+    def read(command):
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        count = 0
+        for _ in iter(process.stdout.readline, ""):
+            count += 1
+        process.wait()
+        counts.append(count)
+
+    threads = [threading.Thread(target=read, args=(command,)) for command in commands]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(counts)
+
+
+def run_with_runner(commands):
+    running = [CommandRunner.start(command, stream=True) for command in commands]
+    count = 0
+    # One consumer reads every command in turn, the supervisor keeps reading the others meanwhile
+    for command in running:
+        for _ in command.lines():
+            count += 1
+        command.wait()
+    return count
+
+
+def run_timeouts(count, timeout):
+    started = time.time()
+    running = [CommandRunner.start(TIMEOUT_COMMAND % index, timeout=timeout) for index in range(count)]
+    exit_codes = [command.wait() for command in running]
+    seconds = time.time() - started
+    time.sleep(0.2)
+    left = [line for line in subprocess.check_output(["ps", "-eo", "args"]).splitlines()
+            if line.startswith("sleep 3600")]
+    return {"seconds": seconds, "killed": sum(1 for command in running if command.kill_reason is not None),
+            "exit_codes": sorted(set(exit_codes)), "processes_left": len(left)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the supervision of concurrent commands")
+    parser.add_argument("--commands", type=int, default=300)
+    parser.add_argument("--lines", type=int, default=20, help="progress lines printed by each command")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between two lines")
+    parser.add_argument("--max-processes", type=int, help="max_processes of the supervisor, --commands by default")
+    parser.add_argument("--timeouts", type=int, default=20, help="commands run with a timeout")
+    parser.add_argument("--timeout", type=float, default=1.0)
+    parser.add_argument("--output", help="append the results as a json line to this file")
+    args = parser.parse_args()
+
+    CommandRunner.get_runner().max_processes = args.max_processes or args.commands
+    commands = [PROGRESS_COMMAND % (args.lines, args.interval) for _ in range(args.commands)]
+    results = {"benchmark": "command_runner", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "commit": harness.current_commit(), "commands": args.commands, "lines": args.lines,
+               "interval": args.interval, "max_processes": CommandRunner.get_runner().max_processes}
+    for mode, run in (("thread_per_command", run_with_threads), ("command_runner", run_with_runner)):
+        result = measure(lambda: run(commands))
+        results[mode] = result
+        print("%-20s %7.2f s  cpu %6.2f s  peak threads %4d  lines %d" % (
+            mode, result["seconds"], result["cpu_seconds"], result["peak_threads"], result["lines"]))
+    timeouts = run_timeouts(args.timeouts, args.timeout)
+    results["timeouts"] = timeouts
+    print("%d commands with a timeout of %g s: all ended after %.2f s, %d killed, exit codes %s, %d processes left" % (
+        args.timeouts, args.timeout, timeouts["seconds"], timeouts["killed"], timeouts["exit_codes"],
+        timeouts["processes_left"]))
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(json.dumps(results) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
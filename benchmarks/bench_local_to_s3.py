@@ -0,0 +1,153 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : bench_local_to_s3
+Purpose             : Throughput and memory benchmark of the localToS3 export type against the local S3 stub
+                      (benchmarks/s3_stub.py). Two workloads are uploaded: one large file and a directory of many
+                      small files. Each is uploaded by LocalToS3 and by a naive baseline reading every file into
+                      memory and sending it with one sequential PutObject. Every upload runs in its own process so
+                      the peak resident memory it reports is its own.
+Input Parameters    : --large-mb, --small-files, --small-kb, --part-mb, --concurrency, --output
+Output Value        : MB/s, files/s and peak RSS growth of each run; optionally appended as a json line to --output
+How to run          : python benchmarks/bench_local_to_s3.py --large-mb 1024 --small-files 2000
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "DataExportService"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import boto3
+import s3_stub
+
+BUCKET = "bench"
+CREDENTIALS = {"aws_access_key_id": "bench", "aws_secret_access_key": "bench"}
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def make_workloads(data_dir, large_mb, small_files, small_kb):
+    large_file = os.path.join(data_dir, "large.bin")
+    chunk = os.urandom(1024 * 1024)
+    with open(large_file, "wb") as output:
+        for _ in range(large_mb):
+            output.write(chunk)
+    small_dir = os.path.join(data_dir, "small")
+    os.makedirs(small_dir)
+    for index in range(small_files):
+        with open(os.path.join(small_dir, "part-%05d" % index), "wb") as output:
+            output.write(chunk[:small_kb * 1024])
+    return large_file, small_dir
+
+
+def upload_local_to_s3(config):
+    import LocalToS3
+    result = LocalToS3.runLocalTos3Upload(config)
+    if result["status"] != "SUCCESS":
+        raise Exception(result.get("message"))
+
+
+def upload_baseline(config):
+    s3 = boto3.client("s3", aws_access_key_id=config["aws_access_key_id"],
+                      aws_secret_access_key=config["aws_secret_access_key"], endpoint_url=config["endpoint_url"],
+                      region_name="us-east-1")
+    source = config["source_file"]
+    if os.path.isdir(source):
+        paths = [os.path.join(source, name) for name in sorted(os.listdir(source))]
+        keys = [config["destination_file"] + "/" + os.path.basename(path) for path in paths]
+    else:
+        paths = [source]
+        keys = [config["destination_file"]]
+    for path, key in zip(paths, keys):
+        with open(path, "rb") as source_file:
+            s3.put_object(Bucket=config["bucket_name"], Key=key, Body=source_file.read())
+
+
+def measure(function, config, results):
+    import logging
+    logging.disable(logging.CRITICAL)
+    rss_before = peak_rss_mb()
+    started = time.time()
+    function(config)
+    results.put({"seconds": time.time() - started, "peak_rss_growth_mb": peak_rss_mb() - rss_before})
+
+
+def run(function, config):
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=measure, args=(function, config, results))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise Exception("Upload process failed with exit code " + str(process.exitcode))
+    return results.get()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the localToS3 uploader")
+    parser.add_argument("--large-mb", type=int, default=512)
+    parser.add_argument("--small-files", type=int, default=1000)
+    parser.add_argument("--small-kb", type=int, default=16)
+    parser.add_argument("--part-mb", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", help="append the results as a json line to this file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_local_to_s3_")
+    server = None
+    try:
+        store_dir = os.path.join(work_dir, "store")
+        data_dir = os.path.join(work_dir, "data")
+        os.makedirs(store_dir)
+        os.makedirs(data_dir)
+        large_file, small_dir = make_workloads(data_dir, args.large_mb, args.small_files, args.small_kb)
+        server = s3_stub.start_in_thread(store_dir)
+        endpoint_url = "http://%s:%d" % server.server_address
+        boto3.client("s3", endpoint_url=endpoint_url, region_name="us-east-1",
+                     **CREDENTIALS).create_bucket(Bucket=BUCKET)
+
+        results = {"benchmark": "local_to_s3", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "large_mb": args.large_mb, "small_files": args.small_files, "small_kb": args.small_kb,
+                   "part_mb": args.part_mb, "concurrency": args.concurrency}
+        workloads = (("large", large_file, args.large_mb, 1),
+                     ("small", small_dir, args.small_files * args.small_kb / 1024.0, args.small_files))
+        for workload, source, megabytes, files in workloads:
+            for mode, function in (("localToS3", upload_local_to_s3), ("baseline", upload_baseline)):
+                config = dict(CREDENTIALS, endpoint_url=endpoint_url, bucket_name=BUCKET, source_file=source,
+                              destination_file=mode + "/" + workload, part_size=args.part_mb * 1024 * 1024,
+                              max_concurrency=args.concurrency)
+                sample = run(function, config)
+                sample["mb_per_second"] = megabytes / sample["seconds"]
+                sample["files_per_second"] = files / sample["seconds"]
+                results[workload + "_" + mode] = sample
+                print("%-5s %-9s %8.1f MB/s %9.1f files/s  peak RSS +%7.1f MB" % (
+                    workload, mode, sample["mb_per_second"], sample["files_per_second"],
+                    sample["peak_rss_growth_mb"]))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        directory = os.path.dirname(os.path.abspath(args.output))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.output, "a") as output_file:
+            output_file.write(json.dumps(results, sort_keys=True) + "\n")
+
+
+if __name__ == "__main__":
+    main()
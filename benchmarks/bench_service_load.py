@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : bench_service_load
+Purpose             : Load benchmark comparing the flask development server (app.run(debug=True)) with the
+                      pre-forked production serving mode of WsgiServer. The benchmark application simulates an
+                      export request: it waits on I/O (standing in for a distcp/sqoop subprocess) and then does
+                      some CPU work building the files_copied_list response.
+Input Parameters    : --clients, --duration, --io-ms, --cpu-files, --workers, --threads
+Output Value        : Requests per second and latency percentiles for each serving mode
+How to run          : python benchmarks/bench_service_load.py --clients 32 --duration 10
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import httplib
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "DataExportService"))
+
+from flask import Flask, jsonify
+import WsgiServer
+
+
+def build_app(io_ms, cpu_files):
+    app = Flask("bench")
+
+    @app.route("/dataexportservice/export", methods=["POST"])
+    def export():
+        time.sleep(io_ms / 1000.0)
+        files = [{"file_name": "s3a://bench/part-%05d" % index, "file_size": str(index * 1024)}
+                 for index in range(cpu_files)]
+        return jsonify({"status": "SUCCESS", "files_copied_list": json.loads(json.dumps(files))})
+
+    return app
+
+
+def run_development(app, port):
+    app.run(host="127.0.0.1", port=port, debug=True, use_reloader=False)
+
+
+def run_production(app, port, workers, threads):
+    WsgiServer.serve_forever(app, "127.0.0.1", port, workers=workers, threads=threads, graceful_timeout=30)
+
+
+def free_port():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def wait_for_port(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return True
+        except socket.error:
+            time.sleep(0.1)
+    return False
+
+
+def client_loop(port, stop_at, latencies, errors):
+    body = json.dumps({"export_type": "hdfsToS3"})
+    while time.time() < stop_at:
+        started = time.time()
+        try:
+            connection = httplib.HTTPConnection("127.0.0.1", port, timeout=60)
+            connection.request("POST", "/dataexportservice/export", body, {"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        latencies.append(time.time() - started)
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(name, target, args):
+    port = free_port()
+    server = multiprocessing.Process(target=target, args=(port,))
+    server.start()
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(name + " server did not start")
+        latencies, errors = [], []
+        stop_at = time.time() + args.duration
+        clients = [threading.Thread(target=client_loop, args=(port, stop_at, latencies, errors))
+                   for _ in range(args.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        rps = len(latencies) / float(args.duration)
+        print("%-12s %8.1f req/s  p50 %7.1f ms  p99 %7.1f ms  errors %d" % (
+            name, rps, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, len(errors)))
+        return rps
+    finally:
+        os.kill(server.pid, signal.SIGTERM)
+        server.join(40)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[2])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--io-ms", type=float, default=20)
+    parser.add_argument("--cpu-files", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+
+    app = build_app(args.io_ms, args.cpu_files)
+    development = measure("development", lambda port: run_development(app, port), args)
+    production = measure("production", lambda port: run_production(app, port, args.workers, args.threads), args)
+    if development:
+        print("speedup      %8.2fx" % (production / development))
+
+
+if __name__ == "__main__":
+    main()
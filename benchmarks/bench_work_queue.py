@@ -0,0 +1,148 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : bench_work_queue
+Purpose             : Demonstration and benchmark of the shared work queue (DataExportService/WorkQueue.py) with
+                      several local worker processes, run against the fake hadoop commands and the S3 stub (see
+                      harness.py). A batch of one large hdfsToS3 export and a few small ones is queued and run by
+                      1..N worker processes sharing one SQLite queue file. For each fleet size the wall time, the
+                      file tasks run by each worker and the tasks claimed as own, new or stolen are reported. With
+                      --kill one worker is killed while it runs tasks: its tasks are claimed again once their lease
+                      expires and the batch still succeeds.
+Input Parameters    : --workers, --slots, --large-files, --small-exports, --small-files, --file-kb, --startup, --lease,
+                      --kill, --output
+Output Value        : Wall time and task distribution of each fleet size; optionally appended as a json line to
+                      --output
+How to run          : python benchmarks/bench_work_queue.py --workers 1,2,4 --large-files 200 --startup 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import multiprocessing
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_DIR, "..", "DataExportService"))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import harness
+
+
+def run_worker(queue_path, slots, lease, split_files):
+    import threading
+    import WorkQueue
+    import Metrics
+    # Stopped with SIGTERM: a multiprocessing.Event would block the parent once a waiting worker is killed
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    worker = WorkQueue.QueueWorker(WorkQueue.WorkQueue(queue_path), slots, lease, split_files)
+    worker.start()
+    while not stop.is_set():
+        stop.wait(1)
+    worker.stop(60)
+    claims = dict((kind + "_" + claim, count) for (kind, claim), count in Metrics.QUEUE_TASKS.snapshot())
+    with open(queue_path + "." + str(os.getpid()) + ".claims", "w") as claims_file:
+        json.dump(claims, claims_file)
+
+
+def run_fleet(env, args, workers, kill):
+    import WorkQueue
+    queue_path = os.path.join(env.work_dir, "queue_%d_%d.sqlite" % (workers, int(time.time() * 1000)))
+    prefix = "fleet_%d_%d" % (workers, int(time.time() * 1000))
+    sources = [("large", args.large_files)] + [("small_%d" % index, args.small_files)
+                                                for index in range(args.small_exports)]
+    sources = [(name, env.make_hdfs_dataset(prefix + "/" + name, files, args.file_kb * 1024))
+               for name, files in sources]
+    # The workers are forked before this process opens the queue, a sqlite connection must not cross a fork
+    processes = [multiprocessing.Process(target=run_worker, args=(queue_path, args.slots, args.lease,
+                                                                  args.split_files))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        queue = WorkQueue.WorkQueue(queue_path)
+        started = time.time()
+        jobs = []
+        for name, source in sources:
+            job_id = prefix + "_" + name
+            queue.submit_job(job_id, "hdfsToS3", {"source_path": source, "s3_credentials": env.s3_credentials(),
+                                                  "target_path": "s3a://%s/%s/%s" % (harness.BUCKET, prefix, name)})
+            jobs.append(job_id)
+        killed = None
+        if kill and workers > 1:
+            # Kill a worker as soon as it holds file tasks of the large export
+            while killed is None and time.time() - started < 60:
+                owners = set(owner for owner, in queue.connection().execute(
+                    "SELECT owner FROM tasks WHERE kind = 'file' AND state = 'leased'").fetchall())
+                for process in processes[1:]:
+                    if any(owner.endswith(":" + str(process.pid)) for owner in owners):
+                        os.kill(process.pid, signal.SIGKILL)
+                        killed = process.pid
+                        break
+                time.sleep(0.05)
+        results = dict((job_id, WorkQueue.wait_for_result(job_id, 600, queue)) for job_id in jobs)
+        seconds = time.time() - started
+    finally:
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        for process in processes:
+            process.join()
+
+    claims = {}
+    for process in processes:
+        path = queue_path + "." + str(process.pid) + ".claims"
+        if os.path.exists(path):
+            with open(path) as claims_file:
+                for key, count in json.load(claims_file).items():
+                    claims[key] = claims.get(key, 0) + count
+    failed = [failed_job for failed_job, result in results.items() if not result or result.get("status") != "SUCCESS"]
+    tasks_by_worker = results[jobs[0]].get("tasks_by_worker", {}) if results[jobs[0]] else {}
+    return {"workers": workers, "seconds": seconds, "failed_jobs": len(failed), "claims": claims,
+            "large_export_tasks_by_worker": sorted(tasks_by_worker.values(), reverse=True),
+            "killed_worker": killed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the shared work queue with local worker processes")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated fleet sizes")
+    parser.add_argument("--slots", type=int, default=2, help="tasks run at the same time by each worker")
+    parser.add_argument("--large-files", type=int, default=100)
+    parser.add_argument("--small-exports", type=int, default=3)
+    parser.add_argument("--small-files", type=int, default=5)
+    parser.add_argument("--file-kb", type=int, default=64)
+    parser.add_argument("--split-files", type=int, default=10)
+    parser.add_argument("--startup", type=float, default=0.2, help="seconds of start-up of every hadoop command")
+    parser.add_argument("--lease", type=int, default=5, help="lease of the tasks in seconds")
+    parser.add_argument("--kill", action="store_true", help="kill one worker of each fleet while it runs tasks")
+    parser.add_argument("--output", help="append the results as a json line to this file")
+    args = parser.parse_args()
+
+    missing = harness.missing_modules(["hadoopy", "boto3"])
+    if missing:
+        print("Skipped, missing modules: " + ", ".join(missing))
+        return 0
+    results = {"benchmark": "work_queue", "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "commit": harness.current_commit(), "large_files": args.large_files,
+               "small_exports": args.small_exports, "small_files": args.small_files, "file_kb": args.file_kb,
+               "slots": args.slots, "startup": args.startup, "kill": args.kill, "fleets": []}
+    with harness.BenchmarkEnvironment(startup=args.startup) as env:
+        for workers in [int(value) for value in args.workers.split(",")]:
+            fleet = run_fleet(env, args, workers, args.kill)
+            results["fleets"].append(fleet)
+            print("%2d workers %8.2f s  failed jobs %d  claims %s  large export tasks by worker %s%s" % (
+                workers, fleet["seconds"], fleet["failed_jobs"], json.dumps(fleet["claims"], sort_keys=True),
+                fleet["large_export_tasks_by_worker"],
+                "  killed %d" % fleet["killed_worker"] if fleet["killed_worker"] else ""))
+    if args.output:
+        with open(args.output, "a") as output:
+            output.write(json.dumps(results) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
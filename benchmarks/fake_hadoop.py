@@ -0,0 +1,372 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : fake_hadoop
+Purpose             : Stand-ins for the hadoop and sqoop command line tools used by the export service, so HdfsToS3
+                      and SqoopUtility can be measured without a cluster. HDFS is a local directory
+                      ($FAKE_HDFS_ROOT, hdfs://host/path maps to $FAKE_HDFS_ROOT/path) and S3 paths (s3a://, s3n://,
+                      s3://) are written to the storage directory of benchmarks/s3_stub.py ($FAKE_S3_ROOT), so the
+                      objects copied by distcp are served by the stub. The commands print output shaped like the
+                      real tools (MapReduce progress, counters, errors) so the log parsing of the service does the
+                      same work.
+                      Environment variables:
+                        FAKE_HDFS_ROOT, FAKE_S3_ROOT  storage directories (required)
+                        FAKE_HADOOP_STARTUP           seconds slept by every command, standing in for JVM start-up
+                        FAKE_HADOOP_PROGRESS_LINES    progress lines printed by distcp and sqoop jobs (default 10)
+                        FAKE_HADOOP_FAIL_PATTERN      regular expression; distcp/sqoop fail when the command matches
+                        FAKE_HADOOP_FAIL_MESSAGE      cause printed by injected failures (default "Injected failure"),
+                                                      e.g. "com.amazonaws.AmazonS3Exception: SlowDown" for a
+                                                      transient failure
+                        FAKE_HADOOP_FAIL_TIMES        only the first n matching commands fail (default all)
+                        FAKE_SQOOP_ROWS               rows written by a sqoop import (default 1000)
+                        FAKE_SQOOP_MAPPERS            part files written by a sqoop import (default 4)
+                        FAKE_SQOOP_TASK_SECONDS       seconds each map task of a sqoop import takes (default 0). A
+                                                      task writes its part file below _temporary and moves it into
+                                                      the target directory when it finishes, like the version 2
+                                                      output committer
+Input Parameters    : Command line of hadoop or sqoop
+Output Value        : Exit code and output of the emulated command
+How to run          : Put benchmarks/fakebin first on PATH and set the environment variables above
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import hashlib
+import shutil
+
+S3_SCHEMES = ("s3a://", "s3n://", "s3://")
+DEFAULT_PROGRESS_LINES = 10
+DEFAULT_SQOOP_ROWS = 1000
+DEFAULT_SQOOP_MAPPERS = 4
+
+
+def log_time():
+    return time.strftime("%y/%m/%d %H:%M:%S")
+
+
+def out(line):
+    sys.stdout.write(line + "\n")
+
+
+def is_s3(path):
+    return path.startswith(S3_SCHEMES)
+
+
+def local_path(path):
+    """Map an hdfs:// or s3 path (or a plain HDFS path) to its local file"""
+    if is_s3(path):
+        bucket_and_key = path.split("://", 1)[1]
+        return os.path.join(os.environ["FAKE_S3_ROOT"], *bucket_and_key.split("/"))
+    if path.startswith("hdfs://"):
+        # Drop the name node authority: hdfs://namenode:8020/tmp/x and hdfs:///tmp/x are both /tmp/x
+        rest = path[len("hdfs://"):]
+        path = rest[rest.find("/"):] if "/" in rest else "/"
+    return os.path.join(os.environ["FAKE_HDFS_ROOT"], path.lstrip("/"))
+
+
+def display_path(path, name):
+    return path.rstrip("/") + "/" + name
+
+
+def tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path), 1
+    size = files = 0
+    for directory, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(directory, file_name))
+            files += 1
+    return size, files
+
+
+def copy_tree(source, target):
+    """Copy a file or directory; files are written under a temporary name and renamed like the S3 committer"""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            copy_tree(os.path.join(source, name), os.path.join(target, name))
+        return
+    directory = os.path.dirname(target)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+    temp_path = target + ".%d.tmp" % os.getpid()
+    shutil.copyfile(source, temp_path)
+    os.rename(temp_path, target)
+
+
+def should_fail(arguments):
+    pattern = os.environ.get("FAKE_HADOOP_FAIL_PATTERN")
+    if not pattern or re.search(pattern, " ".join(arguments)) is None:
+        return False
+    times = os.environ.get("FAKE_HADOOP_FAIL_TIMES")
+    if not times:
+        return True
+    # Failures so far, counted in the HDFS stand-in so they are shared by the commands of a run
+    counter_path = os.path.join(os.environ["FAKE_HDFS_ROOT"], ".fake_hadoop_failures")
+    failures = int(open(counter_path).read() or 0) if os.path.exists(counter_path) else 0
+    with open(counter_path, "w") as counter_file:
+        counter_file.write(str(failures + 1))
+    return failures < int(times)
+
+
+def fail_message():
+    return os.environ.get("FAKE_HADOOP_FAIL_MESSAGE", "Injected failure")
+
+
+def print_job(job_name, counters):
+    job_id = "job_%d_%04d" % (int(time.time()), random.randint(1, 9999))
+    out("%s INFO mapreduce.Job: The url to track the job: http://localhost:8088/proxy/application_%s/" %
+        (log_time(), job_id[4:]))
+    out("%s INFO mapreduce.Job: Running job: %s" % (log_time(), job_id))
+    out("%s INFO mapreduce.Job: Job %s running in uber mode : false" % (log_time(), job_id))
+    steps = max(1, int(os.environ.get("FAKE_HADOOP_PROGRESS_LINES", DEFAULT_PROGRESS_LINES)))
+    for step in range(steps + 1):
+        out("%s INFO mapreduce.Job:  map %d%% reduce 0%%" % (log_time(), step * 100 // steps))
+    out("%s INFO mapreduce.Job: Job %s completed successfully" % (log_time(), job_id))
+    out("%s INFO mapreduce.Job: Counters: %d" % (log_time(), len(counters) + 2))
+    out("\tFile System Counters")
+    out("\tMap-Reduce Framework")
+    for name, value in counters:
+        out("\t\t%s=%d" % (name, value))
+    out("\t%s" % job_name)
+
+
+def distcp(arguments):
+    paths = [argument for argument in arguments if not argument.startswith("-")]
+    if len(paths) < 2:
+        out("usage: distcp OPTIONS [source_path...] <target_path>")
+        return 1
+    sources, target = paths[:-1], paths[-1]
+    out("%s INFO tools.DistCp: Input Options: DistCpOptions{sourcePaths=[%s], targetPath=%s}" %
+        (log_time(), ", ".join(sources), target))
+    if should_fail(arguments):
+        out("%s ERROR tools.DistCp: Exception encountered" % log_time())
+        out('Exception in thread "main" java.lang.RuntimeException: %s copying %s' % (fail_message(), sources[0]))
+        return 1
+    copied_bytes = copied_files = 0
+    for source in sources:
+        source_local = local_path(source)
+        if not os.path.exists(source_local):
+            out("%s ERROR tools.DistCp: Invalid input: " % log_time())
+            out("org.apache.hadoop.tools.CopyListing$InvalidInputException: %s doesn't exist" % source)
+            return 1
+        target_local = local_path(target)
+        # -update and -overwrite copy the contents of a source directory into the target
+        if not ("-update" in arguments or "-overwrite" in arguments) and \
+                (len(sources) > 1 or os.path.isdir(target_local)):
+            target_local = os.path.join(target_local, os.path.basename(source_local.rstrip("/")))
+        copy_tree(source_local, target_local)
+        size, files = tree_size(source_local)
+        copied_bytes += size
+        copied_files += files
+    print_job("DistCp Counters", [("Map input records", copied_files), ("Map output records", 0),
+                                  ("Bytes Copied", copied_bytes), ("Bytes Expected", copied_bytes),
+                                  ("Files Copied", copied_files)])
+    return 0
+
+
+def list_entry(path, name, local):
+    is_dir = os.path.isdir(local)
+    return "%s   %s hadoop supergroup %10d %s %s" % (
+        "drwxr-xr-x" if is_dir else "-rw-r--r--", "-" if is_dir else "3", 0 if is_dir else os.path.getsize(local),
+        time.strftime("%Y-%m-%d %H:%M", time.localtime(os.path.getmtime(local))), display_path(path, name))
+
+
+def fs(arguments):
+    # Generic options such as -Ddfs.checksum.combine.mode=COMPOSITE_CRC come before the command
+    arguments = [argument for argument in arguments if not argument.startswith("-D")]
+    command, options = arguments[0], [argument for argument in arguments[1:] if argument.startswith("-")]
+    paths = [argument for argument in arguments[1:] if not argument.startswith("-")]
+    if command == "-test":
+        local = local_path(paths[0])
+        if "-d" in options:
+            return 0 if os.path.isdir(local) else 1
+        if "-f" in options:
+            return 0 if os.path.isfile(local) else 1
+        return 0 if os.path.exists(local) else 1
+    if command == "-ls":
+        local = local_path(paths[0])
+        if not os.path.exists(local):
+            sys.stderr.write("ls: `%s': No such file or directory\n" % paths[0])
+            return 1
+        if os.path.isfile(local):
+            out(list_entry(os.path.dirname(paths[0]), os.path.basename(paths[0]), local))
+            return 0
+        if "-R" in options:
+            for directory, directory_names, file_names in os.walk(local):
+                display = paths[0].rstrip("/") + directory[len(local.rstrip("/")):]
+                for name in sorted(directory_names + file_names):
+                    out(list_entry(display, name, os.path.join(directory, name)))
+            return 0
+        names = sorted(os.listdir(local))
+        out("Found %d items" % len(names))
+        for name in names:
+            out(list_entry(paths[0], name, os.path.join(local, name)))
+        return 0
+    if command == "-du":
+        local = local_path(paths[0])
+        if not os.path.exists(local):
+            sys.stderr.write("du: `%s': No such file or directory\n" % paths[0])
+            return 1
+        size = tree_size(local)[0]
+        out("%d  %d  %s" % (size, size * 3, paths[0]))
+        return 0
+    if command in ("-rm", "-rmr"):
+        exit_code = 0
+        for path in paths:
+            local = local_path(path)
+            if not os.path.exists(local):
+                if "-f" not in options:
+                    out("rm: `%s': No such file or directory" % path)
+                    exit_code = 1
+                continue
+            if os.path.isdir(local):
+                shutil.rmtree(local)
+            else:
+                os.remove(local)
+            out("Deleted " + path)
+        return exit_code
+    if command == "-mkdir":
+        for path in paths:
+            local = local_path(path)
+            if not os.path.isdir(local):
+                os.makedirs(local)
+        return 0
+    if command == "-touchz":
+        local = local_path(paths[0])
+        if not os.path.isdir(os.path.dirname(local)):
+            os.makedirs(os.path.dirname(local))
+        open(local, "a").close()
+        return 0
+    if command == "-checksum":
+        # MD5 of the content, printed in the format of the HDFS MD5-of-CRC checksums
+        exit_code = 0
+        for path in paths:
+            local = local_path(path)
+            if not os.path.isfile(local):
+                sys.stderr.write("checksum: `%s': No such file or directory\n" % path)
+                exit_code = 1
+                continue
+            digest = hashlib.md5()
+            with open(local, "rb") as source:
+                for block in iter(lambda: source.read(1024 * 1024), b""):
+                    digest.update(block)
+            out("%s\tMD5-of-0MD5-of-512CRC32C\t%s" % (path, digest.hexdigest()))
+        return exit_code
+    if command == "-cat":
+        for path in paths:
+            with open(local_path(path), "rb") as source:
+                shutil.copyfileobj(source, getattr(sys.stdout, "buffer", sys.stdout), 1024 * 1024)
+        return 0
+    if command == "-put":
+        # hadoop fs -put [-f] <local source or -> <target>, or several local files into a target directory
+        if len(paths) > 2:
+            target_directory = local_path(paths[-1])
+            for source in paths[:-1]:
+                target = os.path.join(target_directory, os.path.basename(source))
+                if os.path.exists(target) and "-f" not in options:
+                    sys.stderr.write("put: `%s': File exists\n" % display_path(paths[-1], os.path.basename(source)))
+                    return 1
+                copy_tree(source, target)
+            return 0
+        source = "-" if arguments[-2] == "-" else paths[0]
+        local = local_path(paths[-1])
+        if source != "-" and os.path.isdir(local):
+            local = os.path.join(local, os.path.basename(source))
+        if os.path.exists(local) and "-f" not in options:
+            sys.stderr.write("put: `%s': File exists\n" % paths[-1])
+            return 1
+        if not os.path.isdir(os.path.dirname(local)):
+            os.makedirs(os.path.dirname(local))
+        with open(local + ".tmp", "wb") as target:
+            if source == "-":
+                shutil.copyfileobj(getattr(sys.stdin, "buffer", sys.stdin), target, 1024 * 1024)
+            else:
+                with open(source, "rb") as source_file:
+                    shutil.copyfileobj(source_file, target, 1024 * 1024)
+        os.rename(local + ".tmp", local)
+        return 0
+    sys.stderr.write("fake hadoop: unsupported fs command " + command + "\n")
+    return 255
+
+
+def option_value(arguments, name, default=None):
+    if name in arguments and arguments.index(name) + 1 < len(arguments):
+        return arguments[arguments.index(name) + 1]
+    return default
+
+
+def sqoop(arguments):
+    if not arguments or arguments[0] != "import":
+        out("%s ERROR tool.BaseSqoopTool: Unrecognized argument: %s" % (log_time(), " ".join(arguments[:1])))
+        return 1
+    table = option_value(arguments, "--table")
+    target_dir = option_value(arguments, "--target-dir")
+    out("%s INFO sqoop.Sqoop: Running Sqoop version: 1.4.6" % log_time())
+    out("%s WARN tool.BaseSqoopTool: Setting your password on the command-line is insecure." % log_time())
+    out("%s INFO manager.SqlManager: Using default fetchSize of 1000" % log_time())
+    out("%s INFO tool.CodeGenTool: Beginning code generation" % log_time())
+    out("%s INFO orm.CompilationManager: Writing jar file: /tmp/sqoop-hadoop/compile/%s.jar" % (log_time(), table))
+    out("%s ERROR hdfs.KeyProviderCache: Could not find uri with key [dfs.encryption.key.provider.uri] to "
+        "create a keyProvider !!" % log_time())
+    if should_fail(arguments):
+        out("%s ERROR manager.SqlManager: Error executing statement: java.sql.SQLException: %s reading table %s" %
+            (log_time(), fail_message(), table))
+        return 1
+    local = local_path(target_dir)
+    if os.path.exists(local):
+        out("%s ERROR tool.ImportTool: Encountered IOException running import job: "
+            "org.apache.hadoop.mapred.FileAlreadyExistsException: Output directory hdfs://localhost:8020%s "
+            "already exists" % (log_time(), target_dir if target_dir.startswith("/") else "/" + target_dir))
+        return 1
+    rows = int(os.environ.get("FAKE_SQOOP_ROWS", DEFAULT_SQOOP_ROWS))
+    mappers = int(option_value(arguments, "--num-mappers", os.environ.get("FAKE_SQOOP_MAPPERS",
+                                                                         DEFAULT_SQOOP_MAPPERS)))
+    task_seconds = float(os.environ.get("FAKE_SQOOP_TASK_SECONDS", 0))
+    attempt_dir = os.path.join(local, "_temporary", "0")
+    os.makedirs(attempt_dir)
+    written = 0
+    for mapper in range(mappers):
+        count = rows // mappers + (1 if mapper < rows % mappers else 0)
+        name = "part-m-%05d" % mapper
+        with open(os.path.join(attempt_dir, name), "w") as part:
+            for row in range(written, written + count):
+                part.write("%d,%s_%d,%d.%02d,2018-04-12 10:15:%02d\n" % (row, table, row, row % 1000, row % 100,
+                                                                        row % 60))
+        if task_seconds:
+            time.sleep(task_seconds)
+        os.rename(os.path.join(attempt_dir, name), os.path.join(local, name))
+        written += count
+    shutil.rmtree(os.path.join(local, "_temporary"))
+    open(os.path.join(local, "_SUCCESS"), "w").close()
+    print_job("File Output Format Counters", [("Map input records", rows), ("Map output records", rows),
+                                              ("Bytes Written", tree_size(local)[0])])
+    out("%s INFO mapreduce.ImportJobBase: Retrieved %d records." % (log_time(), rows))
+    return 0
+
+
+def startup():
+    delay = float(os.environ.get("FAKE_HADOOP_STARTUP", 0))
+    if delay:
+        time.sleep(delay)
+
+
+def hadoop_main(arguments):
+    startup()
+    if arguments and arguments[0] == "distcp":
+        return distcp(arguments[1:])
+    if arguments and arguments[0] in ("fs", "dfs"):
+        return fs(arguments[1:])
+    sys.stderr.write("fake hadoop: unsupported command " + " ".join(arguments[:1]) + "\n")
+    return 255
+
+
+def sqoop_main(arguments):
+    startup()
+    return sqoop(arguments)
@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : harness
+Purpose             : Shared pieces of the benchmark suite: a BenchmarkEnvironment putting the fake hadoop/sqoop
+                      commands (benchmarks/fakebin) first on PATH with a local HDFS stand-in and the S3 stub running
+                      in a thread, timing helpers, and the ResultStore keeping the results of every run as json lines
+                      so a run can be compared with the previous one.
+Input Parameters    : None
+Output Value        : None
+How to run          : Used by benchmarks/run_suite.py
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.realpath(__file__))
+SERVICE_DIR = os.path.join(BENCHMARK_DIR, "..", "DataExportService")
+FAKEBIN_DIR = os.path.join(BENCHMARK_DIR, "fakebin")
+sys.path.insert(0, SERVICE_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import s3_stub
+
+BUCKET = "bench"
+ACCESS_KEY = "bench"
+SECRET_KEY = "bench"
+
+
+class BenchmarkEnvironment(object):
+    """
+    Temporary HDFS stand-in and S3 endpoint. While the environment is entered, hadoop and sqoop resolve to the
+    fake commands, the working directory is the temporary directory (the service writes its log file there) and
+    the bucket BUCKET exists.
+    """
+
+    def __init__(self, progress_lines=10, startup=0.0):
+        self.progress_lines = progress_lines
+        self.startup = startup
+        self.work_dir = None
+        self.server = None
+        self.saved_environment = None
+        self.saved_cwd = None
+
+    def __enter__(self):
+        self.work_dir = tempfile.mkdtemp(prefix="dataexport_bench_")
+        self.hdfs_root = os.path.join(self.work_dir, "hdfs")
+        self.s3_root = os.path.join(self.work_dir, "s3")
+        os.makedirs(self.hdfs_root)
+        os.makedirs(os.path.join(self.s3_root, BUCKET))
+        self.server = s3_stub.start_in_thread(self.s3_root)
+        self.endpoint_url = "http://%s:%d" % self.server.server_address
+        self.saved_environment = dict(os.environ)
+        os.environ.update({
+            "PATH": FAKEBIN_DIR + os.pathsep + os.environ.get("PATH", ""),
+            "FAKE_HDFS_ROOT": self.hdfs_root,
+            "FAKE_S3_ROOT": self.s3_root,
+            "FAKE_HADOOP_PROGRESS_LINES": str(self.progress_lines),
+            "FAKE_HADOOP_STARTUP": str(self.startup),
+            "AWS_DEFAULT_REGION": os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+        })
+        self.saved_cwd = os.getcwd()
+        os.chdir(self.work_dir)
+        return self
+
+    def __exit__(self, *exc_info):
+        os.chdir(self.saved_cwd)
+        os.environ.clear()
+        os.environ.update(self.saved_environment)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def s3_credentials(self):
+        return {"aws_access_key_id": ACCESS_KEY, "aws_secret_access_key": SECRET_KEY, "aes_encryption_enabled": "n",
+                "endpoint_url": self.endpoint_url}
+
+    def write_files(self, root, path, files, size):
+        directory = os.path.join(root, path.strip("/"))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        block = os.urandom(min(size, 1024 * 1024)) if size else ""
+        for index in range(files):
+            with open(os.path.join(directory, "part-%05d" % index), "wb") as output:
+                remaining = size
+                while remaining > 0:
+                    output.write(block[:remaining])
+                    remaining -= len(block)
+        return directory
+
+    """
+    Purpose   :   Create <files> files of <size> bytes in the HDFS stand-in
+    Input     :   HDFS directory, number of files, size of each file
+    Output    :   Returns the hdfs:// uri of the directory
+    """
+
+    def make_hdfs_dataset(self, path, files, size):
+        self.write_files(self.hdfs_root, path, files, size)
+        return "hdfs://" + "/" + path.strip("/")
+
+    def make_s3_objects(self, prefix, files, size):
+        self.write_files(os.path.join(self.s3_root, BUCKET), prefix, files, size)
+        return "s3a://" + BUCKET + "/" + prefix.strip("/")
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {"median": ordered[len(ordered) // 2], "min": ordered[0], "max": ordered[-1]}
+
+
+def time_call(function, repeat=1):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.time()
+        result = function()
+        samples.append(time.time() - started)
+    return summarize(samples), result
+
+
+def missing_modules(names):
+    missing = []
+    for name in names:
+        try:
+            __import__(name)
+        except ImportError:
+            missing.append(name)
+    return missing
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR,
+                                       stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class ResultStore(object):
+    """
+    Results of the suite, one json line per case and parameters of every run. compare() matches a new result with
+    the latest stored result of the same case and parameters.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as results_file:
+            return [json.loads(line) for line in results_file if line.strip()]
+
+    def append(self, records):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path, "a") as results_file:
+            for record in records:
+                results_file.write(json.dumps(record, sort_keys=True) + "\n")
+
+    """
+    Purpose   :   Compare the primary metric (seconds, lower is better) of new results with the previous run
+    Input     :   New result records, relative slowdown reported as a regression
+    Output    :   Returns a list of (record, previous record or None, relative change, regression flag)
+    """
+
+    def compare(self, records, threshold):
+        previous = {}
+        for record in self.load():
+            if record.get("status") == "ok":
+                previous[(record["case"], json.dumps(record["params"], sort_keys=True))] = record
+        comparisons = []
+        for record in records:
+            before = previous.get((record["case"], json.dumps(record["params"], sort_keys=True)))
+            if record.get("status") != "ok" or before is None:
+                comparisons.append((record, before, None, False))
+                continue
+            old_value = before["metrics"]["seconds"]["median"]
+            new_value = record["metrics"]["seconds"]["median"]
+            change = (new_value - old_value) / old_value if old_value else 0.0
+            comparisons.append((record, before, change, change > threshold))
+        return comparisons
+
+
+def make_record(case, params, status, metrics=None, reason=None):
+    record = {"case": case, "params": params, "status": status, "metrics": metrics or {},
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": current_commit(),
+              "python": platform.python_version(), "host": platform.node()}
+    if reason:
+        record["reason"] = reason
+    return record
@@ -0,0 +1,334 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : run_suite
+Purpose             : Benchmark suite of the HdfsToS3 and SqoopUtility exports, run against the fake hadoop/sqoop
+                      commands, the local HDFS stand-in and the S3 stub (see harness.py), so no cluster is needed.
+                      Cases:
+                        hdfs_to_s3     runHdfsTOS3 over file counts and sizes: request time and time per file
+                        s3_to_hdfs     runS3ToHdfs (direct or distcp) over object counts and sizes
+                        fan_out        hdfsToS3 to several targets (HdfsFanOut) over file counts and sizes
+                        db_to_s3       dbToS3 (import and copy overlapped) against dbexport to hdfs followed by
+                                       hdfsToS3, with map tasks of a given duration
+                        s3_listing     ExportContext listing of a prefix holding N objects
+                        verification   ExportContext.verify_pending of N transferred directories
+                        log_parsing    SqoopUtility.read_logs and HdfsToS3.log_parser throughput in lines/s
+                        end_to_end     latency of /dataexportservice/export requests through the flask app
+                      Every result is appended to --results and compared with the previous result of the same case
+                      and parameters; a median slower by more than --threshold is reported as a regression.
+                      Cases whose modules cannot be imported here (e.g. hadoopy) are recorded as skipped.
+Input Parameters    : --cases, --repeat, --progress-lines, --startup, --results, --threshold, --no-store
+Output Value        : Table of results and comparisons; exit code 1 when a regression is found
+How to run          : python benchmarks/run_suite.py --repeat 3
+"""
+
+import os
+import sys
+import json
+import base64
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+
+import harness
+
+DEFAULT_RESULTS = os.path.join(harness.BENCHMARK_DIR, "results", "suite.jsonl")
+DEFAULT_THRESHOLD = 0.2
+counter = itertools.count()
+
+
+def unique(name):
+    return "%s_%d_%d" % (name, os.getpid(), next(counter))
+
+
+class FakeCommand(object):
+    """Replays captured command output through the CommandRunner.Command interface read_logs uses"""
+
+    kill_reason = None
+
+    def __init__(self, lines):
+        self.output_lines = lines
+
+    def lines(self):
+        return iter(self.output_lines)
+
+    def done(self):
+        return True
+
+    def cancel(self):
+        pass
+
+    def wait(self):
+        return 0
+
+    def kill_message(self):
+        return None
+
+
+def case_hdfs_to_s3(env, params, repeat):
+    import HdfsToS3
+
+    def run():
+        source = env.make_hdfs_dataset(unique("hdfs_to_s3"), params["files"], params["file_kb"] * 1024)
+        result = HdfsToS3.runHdfsTOS3({"source_path": source, "target_path": "s3a://%s/%s" % (
+            harness.BUCKET, unique("out")), "s3_credentials": env.s3_credentials()})
+        if result["status"] != "SUCCESS":
+            raise Exception("hdfsToS3 failed: " + json.dumps(result))
+
+    seconds, _ = harness.time_call(run, repeat)
+    return {"seconds": seconds, "seconds_per_file": seconds["median"] / params["files"]}
+
+
+def case_s3_to_hdfs(env, params, repeat):
+    import S3ToHdfs
+    source = env.make_s3_objects(unique("s3_to_hdfs"), params["objects"], params["object_kb"] * 1024)
+
+    def run():
+        result = S3ToHdfs.runS3ToHdfs({"s3_credentials": env.s3_credentials(), "source_path": source,
+                                       "target_path": "hdfs:///" + unique("import"), "mode": params["mode"]})
+        if result["status"] != "SUCCESS":
+            raise Exception("s3ToHdfs failed: " + json.dumps(result))
+
+    seconds, _ = harness.time_call(run, repeat)
+    return {"seconds": seconds, "seconds_per_object": seconds["median"] / params["objects"]}
+
+
+def case_fan_out(env, params, repeat):
+    import HdfsFanOut
+    source = env.make_hdfs_dataset(unique("fan_out"), params["files"], params["file_kb"] * 1024)
+
+    def run():
+        prefix = unique("out")
+        targets = ["s3a://%s/%s/%d" % (harness.BUCKET, prefix, index) for index in range(params["targets"])]
+        result = HdfsFanOut.runHdfsFanOut({"source_path": source, "target_path": targets,
+                                           "s3_credentials": env.s3_credentials()})
+        if result["status"] != "SUCCESS":
+            raise Exception("fan-out failed: " + json.dumps(result))
+
+    seconds, _ = harness.time_call(run, repeat)
+    return {"seconds": seconds, "seconds_per_file": seconds["median"] / params["files"]}
+
+
+def case_db_to_s3(env, params, repeat):
+    import DbToS3
+    import SqoopUtility
+    import HdfsToS3
+    os.environ["FAKE_SQOOP_ROWS"] = str(params["rows"])
+    os.environ["FAKE_SQOOP_TASK_SECONDS"] = str(params["task_seconds"])
+    database = {"db_type": "mysql", "db_name": "bench", "user_name": "bench", "password": "bench",
+                "table_name": "bench", "db_host": "localhost", "db_port": "3306"}
+
+    def run():
+        target_path = "s3a://%s/%s" % (harness.BUCKET, unique("db_to_s3"))
+        if params["mode"] == "pipelined":
+            result = DbToS3.runDbToS3(dict(database, s3_credentials=env.s3_credentials(), target_path=target_path,
+                                           num_mappers=params["mappers"]))
+        else:
+            staging_dir = "/" + unique("staging")
+            sqoop_utility = SqoopUtility.SqoopUtility()
+            command = sqoop_utility.generate_command(database["user_name"], database["password"],
+                                                     database["db_name"], database["db_type"], database["db_host"],
+                                                     database["db_port"], database["table_name"], staging_dir)
+            result = sqoop_utility.execute_sqoop_command(command + " --num-mappers " + str(params["mappers"]))
+            if result["status"] == "SUCCESS":
+                result = HdfsToS3.runHdfsTOS3({"source_path": staging_dir, "target_path": target_path,
+                                               "s3_credentials": env.s3_credentials()})
+        if result["status"] != "SUCCESS":
+            raise Exception("db export failed: " + json.dumps(result))
+
+    try:
+        seconds, _ = harness.time_call(run, repeat)
+    finally:
+        del os.environ["FAKE_SQOOP_TASK_SECONDS"]
+    return {"seconds": seconds}
+
+
+def case_s3_listing(env, params, repeat):
+    from ExportContext import ExportContext
+    prefix = unique("listing")
+    env.make_s3_objects(prefix, params["objects"], 0)
+
+    def run():
+        return ExportContext().list_s3_objects(harness.BUCKET, prefix + "/", env.s3_credentials())
+
+    seconds, objects = harness.time_call(run, repeat)
+    if len(objects) != params["objects"]:
+        raise Exception("Listed %d objects instead of %d" % (len(objects), params["objects"]))
+    return {"seconds": seconds, "objects_per_second": params["objects"] / seconds["median"]}
+
+
+def case_verification(env, params, repeat):
+    from ExportContext import ExportContext
+    prefix = unique("verify")
+    targets = []
+    for index in range(params["targets"]):
+        env.make_s3_objects("%s/dir-%04d" % (prefix, index), params["files_per_target"], 100)
+        targets.append("s3a://%s/%s/dir-%04d" % (harness.BUCKET, prefix, index))
+
+    def run():
+        context = ExportContext()
+        for target in targets:
+            context.add_pending_verification(target, env.s3_credentials(), params["files_per_target"] * 100)
+        return context.verify_pending()
+
+    seconds, sizes = harness.time_call(run, repeat)
+    if any(size != params["files_per_target"] * 100 for size in sizes.values()):
+        raise Exception("Verification returned wrong sizes")
+    return {"seconds": seconds, "seconds_per_target": seconds["median"] / params["targets"]}
+
+
+def captured_output(command):
+    import subprocess
+    return subprocess.check_output(command, shell=True)
+
+
+def case_log_parsing(env, params, repeat):
+    os.environ["FAKE_HADOOP_PROGRESS_LINES"] = str(params["progress_lines"])
+    if params["tool"] == "sqoop":
+        import SqoopUtility
+        output = captured_output("sqoop import --connect jdbc:mysql://localhost:3306/bench --table bench "
+                                 "--target-dir /" + unique("sqoop"))
+        lines = output.splitlines(True)
+
+        def run():
+            status = SqoopUtility.SqoopUtility().read_logs(FakeCommand(lines))
+            if status["status"] != "SUCCESS":
+                raise Exception("read_logs failed: " + json.dumps(status))
+    else:
+        import HdfsToS3
+        source = env.make_hdfs_dataset(unique("parse"), 1, 10)
+        output = captured_output("hadoop distcp %s s3a://%s/%s" % (source, harness.BUCKET, unique("parse")))
+        lines = output.splitlines(True)
+
+        def run():
+            if HdfsToS3.HdfsToS3().log_parser("".join(lines)):
+                raise Exception("log_parser found an error")
+
+    seconds, _ = harness.time_call(run, repeat)
+    return {"seconds": seconds, "lines": len(lines), "lines_per_second": len(lines) / seconds["median"]}
+
+
+def case_end_to_end(env, params, repeat):
+    import DataExportService
+    client = DataExportService.app.test_client()
+    headers = {"Authorization": "Basic " + base64.b64encode(
+        DataExportService.app.config["BASIC_AUTH_USERNAME"] + ":" +
+        DataExportService.app.config["BASIC_AUTH_PASSWORD"]), "Content-Type": "application/json"}
+    if params["export_type"] == "dbexport":
+        os.environ["FAKE_SQOOP_ROWS"] = str(params["rows"])
+
+        def payload():
+            return {"export_type": "dbexport", "db_type": "mysql", "db_name": "bench", "user_name": "bench",
+                    "password": "bench", "table_name": "bench", "destination": "/" + unique("dbexport"),
+                    "db_host": "localhost", "db_port": "3306"}
+    else:
+        def payload():
+            return {"export_type": "hdfsToS3", "s3_credentials": env.s3_credentials(),
+                    "source_path": env.make_hdfs_dataset(unique("e2e"), params["files"], params["file_kb"] * 1024),
+                    "target_path": "s3a://%s/%s" % (harness.BUCKET, unique("e2e"))}
+
+    def run():
+        response = client.post("/dataexportservice/export", data=json.dumps(payload()), headers=headers)
+        result = json.loads(response.data)
+        if response.status_code != 200 or result.get("status") != "SUCCESS":
+            raise Exception("Request failed with %d: %s" % (response.status_code, response.data))
+
+    seconds, _ = harness.time_call(run, repeat)
+    return {"seconds": seconds}
+
+
+# name, required modules, parameter grid, function
+CASES = [
+    ("hdfs_to_s3", ["hadoopy", "boto3"], [{"files": 1, "file_kb": 64}, {"files": 10, "file_kb": 64},
+                                           {"files": 50, "file_kb": 64}, {"files": 1, "file_kb": 65536}],
+     case_hdfs_to_s3),
+    ("s3_to_hdfs", ["boto3"], [{"mode": "direct", "objects": 50, "object_kb": 64},
+                               {"mode": "direct", "objects": 2, "object_kb": 65536}], case_s3_to_hdfs),
+    ("s3_to_hdfs", ["boto3", "hadoopy"], [{"mode": "distcp", "objects": 50, "object_kb": 64}], case_s3_to_hdfs),
+    ("fan_out", ["boto3"], [{"files": 50, "file_kb": 64, "targets": 3},
+                            {"files": 2, "file_kb": 65536, "targets": 3}], case_fan_out),
+    ("db_to_s3", ["hadoopy", "boto3"], [{"mode": mode, "rows": 100000, "mappers": 8, "task_seconds": 1}
+                                         for mode in ("sequential", "pipelined")], case_db_to_s3),
+    ("s3_listing", ["boto3"], [{"objects": 100}, {"objects": 1000}, {"objects": 5000}], case_s3_listing),
+    ("verification", ["boto3"], [{"targets": 10, "files_per_target": 10}, {"targets": 100, "files_per_target": 10}],
+     case_verification),
+    ("log_parsing", [], [{"tool": "sqoop", "progress_lines": 1000}, {"tool": "sqoop", "progress_lines": 50000}],
+     case_log_parsing),
+    ("log_parsing", ["hadoopy"], [{"tool": "distcp", "progress_lines": 50000}], case_log_parsing),
+    ("end_to_end", ["flask", "flask_basicauth"], [{"export_type": "dbexport", "rows": 1000},
+                                                  {"export_type": "dbexport", "rows": 100000}], case_end_to_end),
+    ("end_to_end", ["flask", "flask_basicauth", "hadoopy", "boto3"],
+     [{"export_type": "hdfsToS3", "files": 10, "file_kb": 64}], case_end_to_end),
+]
+
+
+def run_case(env, name, requirements, params, function, repeat):
+    missing = harness.missing_modules(requirements)
+    if missing:
+        return harness.make_record(name, params, "skipped", reason="missing modules: " + ", ".join(missing))
+    saved_environment = dict(os.environ)
+    # The service logs every command line; keep its console output out of the report
+    stderr_fd = os.dup(2)
+    with open(os.path.join(env.work_dir, "stderr.log"), "a") as stderr_log:
+        os.dup2(stderr_log.fileno(), 2)
+        try:
+            metrics = function(env, params, repeat)
+            record = harness.make_record(name, params, "ok", metrics)
+        except Exception as e:
+            record = harness.make_record(name, params, "failed", reason=str(e)[:500])
+        finally:
+            os.dup2(stderr_fd, 2)
+            os.close(stderr_fd)
+            os.environ.clear()
+            os.environ.update(saved_environment)
+    return record
+
+
+def describe(params):
+    return ",".join("%s=%s" % (key, params[key]) for key in sorted(params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite of the data export service")
+    parser.add_argument("--cases", help="comma separated case names, all by default")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--progress-lines", type=int, default=10, help="progress lines printed by fake jobs")
+    parser.add_argument("--startup", type=float, default=0.0, help="seconds slept by every fake command")
+    parser.add_argument("--results", default=DEFAULT_RESULTS)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown of the median reported as a regression")
+    parser.add_argument("--no-store", action="store_true", help="compare without storing the results")
+    args = parser.parse_args()
+
+    selected = set(args.cases.split(",")) if args.cases else None
+    records = []
+    with harness.BenchmarkEnvironment(args.progress_lines, args.startup) as env:
+        for name, requirements, grid, function in CASES:
+            if selected and name not in selected:
+                continue
+            for params in grid:
+                records.append(run_case(env, name, requirements, params, function, args.repeat))
+
+    store = harness.ResultStore(args.results)
+    regressions = 0
+    for record, before, change, regression in store.compare(records, args.threshold):
+        label = "%-13s %-40s" % (record["case"], describe(record["params"]))
+        if record["status"] != "ok":
+            print("%s %s (%s)" % (label, record["status"].upper(), record.get("reason")))
+            continue
+        line = "%s median %9.4f s" % (label, record["metrics"]["seconds"]["median"])
+        if change is not None:
+            line += "  %+6.1f%% vs %s" % (change * 100, before.get("commit") or before["timestamp"])
+        if regression:
+            line += "  REGRESSION"
+            regressions += 1
+        print(line)
+    if not args.no_store:
+        store.append(records)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
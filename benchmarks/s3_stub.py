@@ -0,0 +1,348 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : s3_stub
+Purpose             : Minimal S3-compatible HTTP endpoint for benchmarks. Objects are stored as files under
+                      <root>/<bucket>/<key>. Implements the calls used by the export service: PutObject, CopyObject,
+                      GetObject (with Range), HeadObject, DeleteObject, DeleteObjects, ListObjects/ListObjectsV2 and
+                      the multipart upload calls. Request signatures are not checked.
+Input Parameters    : --host, --port, --root
+Output Value        : None. Serves until interrupted
+How to run          : python benchmarks/s3_stub.py --port 9000 --root /tmp/s3stub
+                      and use endpoint_url http://127.0.0.1:9000 with any credentials
+"""
+
+import os
+import sys
+import time
+import uuid
+import shutil
+import hashlib
+import urllib
+import argparse
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from xml.sax.saxutils import escape
+
+COPY_BUFFER_SIZE = 1024 * 1024
+LIST_MAX_KEYS = 1000
+UPLOADS_DIR = ".uploads"
+
+
+class S3Store(object):
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.etags = {}
+
+    def object_path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    def upload_dir(self, upload_id):
+        return os.path.join(self.root, UPLOADS_DIR, upload_id)
+
+    def write_stream(self, path, stream, length):
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        digest = hashlib.md5()
+        temp_path = path + "." + uuid.uuid4().hex + ".tmp"
+        with open(temp_path, "wb") as output:
+            remaining = length
+            while remaining > 0:
+                chunk = stream.read(min(COPY_BUFFER_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                output.write(chunk)
+                remaining -= len(chunk)
+        os.rename(temp_path, path)
+        etag = '"' + digest.hexdigest() + '"'
+        with self.lock:
+            self.etags[path] = etag
+        return etag
+
+    def etag_of(self, path):
+        with self.lock:
+            etag = self.etags.get(path)
+        return etag or '"' + hashlib.md5(path).hexdigest() + '"'
+
+    def list_objects(self, bucket, prefix):
+        bucket_dir = os.path.join(self.root, bucket)
+        objects = []
+        for directory, _, files in os.walk(bucket_dir):
+            for file_name in files:
+                if file_name.endswith(".tmp"):
+                    continue
+                path = os.path.join(directory, file_name)
+                key = os.path.relpath(path, bucket_dir).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    objects.append((key, os.path.getsize(path), os.path.getmtime(path), self.etag_of(path)))
+        objects.sort()
+        return objects
+
+
+def iso_time(timestamp):
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+def http_time(timestamp):
+    return time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(timestamp))
+
+
+class S3RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "S3Stub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def store(self):
+        return self.server.store
+
+    def parse(self):
+        parsed = urlparse.urlparse(self.path)
+        parts = parsed.path.lstrip("/").split("/", 1)
+        bucket = urllib.unquote(parts[0])
+        key = urllib.unquote(parts[1]) if len(parts) > 1 else ""
+        query = dict((name, values[0]) for name, values in urlparse.parse_qs(parsed.query,
+                                                                             keep_blank_values=True).items())
+        return bucket, key, query
+
+    def continue_if_expected(self):
+        if self.headers.get("Expect", "").lower() == "100-continue":
+            self.wfile.write("HTTP/1.1 100 Continue\r\n\r\n")
+            self.wfile.flush()
+
+    def body_length(self):
+        return int(self.headers.get("Content-Length", 0))
+
+    def read_body(self):
+        self.continue_if_expected()
+        return self.rfile.read(self.body_length())
+
+    def respond(self, status, body="", headers=None, content_type="application/xml"):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body or content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def error(self, status, code):
+        self.respond(status, "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>%s</Code>"
+                             "<Message>%s</Message></Error>" % (code, code))
+
+    def do_PUT(self):
+        bucket, key, query = self.parse()
+        if not key:
+            bucket_dir = os.path.join(self.store.root, bucket)
+            if not os.path.isdir(bucket_dir):
+                os.makedirs(bucket_dir)
+            self.read_body()
+            return self.respond(200)
+        if "uploadId" in query:
+            upload_dir = self.store.upload_dir(query["uploadId"])
+            if not os.path.isdir(upload_dir):
+                self.read_body()
+                return self.error(404, "NoSuchUpload")
+            self.continue_if_expected()
+            etag = self.store.write_stream(os.path.join(upload_dir, "%05d" % int(query["partNumber"])),
+                                           self.rfile, self.body_length())
+            return self.respond(200, headers={"ETag": etag})
+        copy_source = self.headers.get("x-amz-copy-source")
+        if copy_source:
+            self.read_body()
+            source_bucket, source_key = urllib.unquote(copy_source).lstrip("/").split("/", 1)
+            source_path = self.store.object_path(source_bucket, source_key)
+            if not os.path.isfile(source_path):
+                return self.error(404, "NoSuchKey")
+            with open(source_path, "rb") as source:
+                etag = self.store.write_stream(self.store.object_path(bucket, key), source,
+                                               os.path.getsize(source_path))
+            return self.respond(200, "<?xml version=\"1.0\" encoding=\"UTF-8\"?><CopyObjectResult>"
+                                     "<LastModified>%s</LastModified><ETag>%s</ETag></CopyObjectResult>"
+                                % (iso_time(time.time()), escape(etag)))
+        self.continue_if_expected()
+        etag = self.store.write_stream(self.store.object_path(bucket, key), self.rfile, self.body_length())
+        self.respond(200, headers={"ETag": etag})
+
+    def do_POST(self):
+        bucket, key, query = self.parse()
+        if "uploads" in query:
+            self.read_body()
+            upload_id = uuid.uuid4().hex
+            os.makedirs(self.store.upload_dir(upload_id))
+            return self.respond(200, "<?xml version=\"1.0\" encoding=\"UTF-8\"?><InitiateMultipartUploadResult>"
+                                     "<Bucket>%s</Bucket><Key>%s</Key><UploadId>%s</UploadId>"
+                                     "</InitiateMultipartUploadResult>" % (escape(bucket), escape(key), upload_id))
+        if "uploadId" in query:
+            self.read_body()
+            upload_dir = self.store.upload_dir(query["uploadId"])
+            if not os.path.isdir(upload_dir):
+                return self.error(404, "NoSuchUpload")
+            path = self.store.object_path(bucket, key)
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    pass
+            temp_path = path + "." + uuid.uuid4().hex + ".tmp"
+            with open(temp_path, "wb") as output:
+                for part in sorted(os.listdir(upload_dir)):
+                    with open(os.path.join(upload_dir, part), "rb") as part_file:
+                        shutil.copyfileobj(part_file, output, COPY_BUFFER_SIZE)
+            os.rename(temp_path, path)
+            shutil.rmtree(upload_dir)
+            etag = '"' + uuid.uuid4().hex + '-1"'
+            with self.store.lock:
+                self.store.etags[path] = etag
+            return self.respond(200, "<?xml version=\"1.0\" encoding=\"UTF-8\"?><CompleteMultipartUploadResult>"
+                                     "<Location>/%s/%s</Location><Bucket>%s</Bucket><Key>%s</Key><ETag>%s</ETag>"
+                                     "</CompleteMultipartUploadResult>"
+                                % (escape(bucket), escape(key), escape(bucket), escape(key), escape(etag)))
+        if "delete" in query:
+            body = self.read_body()
+            deleted = []
+            for chunk in body.split("<Key>")[1:]:
+                object_key = chunk.split("</Key>")[0].replace("&amp;", "&").replace("&lt;", "<")\
+                    .replace("&gt;", ">")
+                path = self.store.object_path(bucket, object_key)
+                if os.path.isfile(path):
+                    os.remove(path)
+                deleted.append("<Deleted><Key>%s</Key></Deleted>" % escape(object_key))
+            return self.respond(200, "<?xml version=\"1.0\" encoding=\"UTF-8\"?><DeleteResult>%s</DeleteResult>"
+                                % "".join(deleted))
+        self.read_body()
+        self.error(400, "InvalidRequest")
+
+    def do_DELETE(self):
+        bucket, key, query = self.parse()
+        if "uploadId" in query:
+            shutil.rmtree(self.store.upload_dir(query["uploadId"]), ignore_errors=True)
+            return self.respond(204, content_type=None)
+        path = self.store.object_path(bucket, key)
+        if os.path.isfile(path):
+            os.remove(path)
+        self.respond(204, content_type=None)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        bucket, key, query = self.parse()
+        if not key:
+            return self.list_bucket(bucket, query)
+        path = self.store.object_path(bucket, key)
+        if not os.path.isfile(path):
+            return self.error(404, "NoSuchKey")
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, last = range_header[len("bytes="):].split("-")
+            start = int(first) if first else max(0, size - int(last))
+            end = min(size - 1, int(last)) if last and first else size - 1
+            status = 206
+        length = max(0, end - start + 1)
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("ETag", self.store.etag_of(path))
+        self.send_header("Last-Modified", http_time(os.path.getmtime(path)))
+        if status == 206:
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        with open(path, "rb") as source:
+            source.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = source.read(min(COPY_BUFFER_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def list_bucket(self, bucket, query):
+        prefix = query.get("prefix", "")
+        max_keys = int(query.get("max-keys", LIST_MAX_KEYS))
+        version_2 = query.get("list-type") == "2"
+        marker = query.get("continuation-token") or query.get("start-after") or query.get("marker") or ""
+        objects = [item for item in self.store.list_objects(bucket, prefix) if item[0] > marker]
+        page = objects[:max_keys]
+        truncated = len(objects) > max_keys
+        contents = "".join("<Contents><Key>%s</Key><LastModified>%s</LastModified><ETag>%s</ETag><Size>%d</Size>"
+                           "<StorageClass>STANDARD</StorageClass></Contents>"
+                           % (escape(key), iso_time(mtime), escape(etag), size)
+                           for key, size, mtime, etag in page)
+        extra = ""
+        if version_2:
+            extra = "<KeyCount>%d</KeyCount>" % len(page)
+            if truncated:
+                extra += "<NextContinuationToken>%s</NextContinuationToken>" % escape(page[-1][0])
+        elif truncated:
+            extra = "<NextMarker>%s</NextMarker>" % escape(page[-1][0])
+        self.respond(200, "<?xml version=\"1.0\" encoding=\"UTF-8\"?><ListBucketResult>"
+                          "<Name>%s</Name><Prefix>%s</Prefix><MaxKeys>%d</MaxKeys><IsTruncated>%s</IsTruncated>%s%s"
+                          "</ListBucketResult>" % (escape(bucket), escape(prefix), max_keys,
+                                                   "true" if truncated else "false", extra, contents))
+
+
+class S3StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root):
+        BaseHTTPServer.HTTPServer.__init__(self, address, S3RequestHandler)
+        self.store = S3Store(root)
+
+
+"""
+Purpose   :   Start the stub in a background thread of the calling process
+Input     :   Storage root directory, host and port (0 picks a free port)
+Output    :   Returns the server; its endpoint url is http://host:server.server_address[1]
+"""
+
+
+def start_in_thread(root, host="127.0.0.1", port=0):
+    server = S3StubServer((host, port), root)
+    thread = threading.Thread(target=server.serve_forever, name="s3-stub")
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local S3-compatible endpoint for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--root", default="/tmp/s3stub")
+    args = parser.parse_args()
+    if not os.path.isdir(args.root):
+        os.makedirs(args.root)
+    server = S3StubServer((args.host, args.port), args.root)
+    sys.stdout.write("S3 stub listening on http://%s:%d storing under %s\n" % (args.host, server.server_address[1],
+                                                                            args.root))
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
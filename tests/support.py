@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Module Name         : support
+Purpose             : Setup shared by the unit tests. Importing it puts DataExportService on sys.path;
+                      TemporaryDirectoryTest gives each test a directory removed after it and FakeS3 stands for the
+                      boto3 S3 client of the exports
+Pre-requisites      : Python 2.7. The tests of the modules importing HdfsToS3 need hadoopy, those of the S3 exports
+                      and imports need boto3 and those of WsgiServer need werkzeug; they are skipped when the package
+                      is missing. The log file of the tests is written to a temporary directory
+How to run          : python -m unittest discover -s tests, from the repository root
+"""
+
+import os
+import sys
+import atexit
+import shutil
+import hashlib
+import tempfile
+import logging
+import unittest
+import StringIO
+
+ROOT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+SOURCE_DIR = os.path.join(ROOT_DIR, "DataExportService")
+TEMPORARY_PREFIX = "dataexportservice_test_"
+
+if SOURCE_DIR not in sys.path:
+    sys.path.insert(0, SOURCE_DIR)
+
+import LogSetup
+
+# The log file of the module level logger goes to a temporary directory instead of the current directory
+LOG_DIR = tempfile.mkdtemp(prefix=TEMPORARY_PREFIX)
+
+
+class LogSettings(object):
+    def __init__(self, settings):
+        self.settings = settings
+
+    def get(self, conf_section, conf_name, default=None):
+        if (conf_section, conf_name) == (LogSetup.MODULE_NAME, "logfile_path"):
+            return LOG_DIR
+        return self.settings.get(conf_section, conf_name, default)
+
+    def __getattr__(self, name):
+        return getattr(self.settings, name)
+
+
+def remove_log_dir():
+    # Write and close the log files before their directory is removed
+    logging.shutdown()
+    shutil.rmtree(LOG_DIR, ignore_errors=True)
+
+
+LogSetup.get_snapshot = lambda path, get_snapshot=LogSetup.get_snapshot: LogSettings(get_snapshot(path))
+atexit.register(remove_log_dir)
+
+
+class TemporaryDirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix=TEMPORARY_PREFIX)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class FakeS3(object):
+    """
+    S3 client keeping the content of the objects by key, whatever the bucket. fail(operation, key) makes the calls of
+    an operation on a key fail, always or a number of times; on_call, when set, is called with the operation and the
+    arguments of every call before it is served and fails the call when it raises.
+    """
+
+    def __init__(self, objects=None):
+        self.objects = dict(objects or {})
+        # Parts by upload id of the multipart uploads not completed or aborted
+        self.uploads = {}
+        self.upload_count = 0
+        self.parts = []
+        self.aborted = []
+        self.deleted = []
+        self.failures = {}
+        self.on_call = None
+
+    def fail(self, operation, key, times=None, message="Access Denied"):
+        self.failures[(operation, key)] = [times, message]
+
+    def check(self, operation, **kwargs):
+        failure = self.failures.get((operation, kwargs.get("Key")))
+        if failure is not None and failure[0] != 0:
+            if failure[0] is not None:
+                failure[0] -= 1
+            raise IOError(failure[1])
+        if self.on_call is not None:
+            self.on_call(operation, **kwargs)
+
+    def sizes(self):
+        return dict((key, len(data)) for key, data in self.objects.items())
+
+    @staticmethod
+    def etag(data):
+        return '"' + hashlib.md5(data).hexdigest() + '"'
+
+    @staticmethod
+    def read(body):
+        # A string, an mmap'd part or an open file
+        return body[:] if hasattr(body, "__getitem__") else body.read()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.check("put_object", Key=Key)
+        self.objects[Key] = self.read(Body)
+        return {"ETag": self.etag(self.objects[Key])}
+
+    def get_object(self, Bucket, Key, Range=None):
+        self.check("get_object", Key=Key, Range=Range)
+        data = self.objects[Key]
+        if Range is not None:
+            first, last = [int(offset) for offset in Range[len("bytes="):].split("-")]
+            data = data[first:last + 1]
+        return {"Body": StringIO.StringIO(data), "ContentLength": len(data)}
+
+    def head_object(self, Bucket, Key):
+        self.check("head_object", Key=Key)
+        if Key not in self.objects:
+            error = IOError("Not Found")
+            error.response = {"Error": {"Code": "404"}}
+            raise error
+        return {"ContentLength": len(self.objects[Key]), "ETag": self.etag(self.objects[Key])}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.check("create_multipart_upload", Key=Key)
+        self.upload_count += 1
+        upload_id = "upload-%d" % self.upload_count
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self.check("upload_part", Key=Key, PartNumber=PartNumber)
+        self.uploads[UploadId][PartNumber] = self.read(Body)
+        self.parts.append(len(self.uploads[UploadId][PartNumber]))
+        return {"ETag": "etag-%d" % PartNumber}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.check("complete_multipart_upload", Key=Key)
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = "".join(parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+        return {"ETag": self.etag(self.objects[Key])}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+        self.aborted.append(Key)
+
+    def list_objects_v2(self, Bucket, Prefix, **kwargs):
+        return {"Contents": [{"Key": key, "Size": len(data), "ETag": self.etag(data)}
+                             for key, data in sorted(self.objects.items()) if key.startswith(Prefix)]}
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete["Objects"]:
+            self.deleted.append(item["Key"])
+            self.objects.pop(item["Key"], None)
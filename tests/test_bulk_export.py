@@ -0,0 +1,115 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the planning of a bulk export and of the retry of the transfers that failed verification"""
+
+import unittest
+
+import support
+import Metrics
+
+try:
+    import BulkExport
+except ImportError:
+    BulkExport = None
+
+CREDENTIALS = {"aws_access_key_id": "key", "aws_secret_access_key": "secret"}
+OTHER_CREDENTIALS = {"aws_access_key_id": "other", "aws_secret_access_key": "secret"}
+
+
+@unittest.skipIf(BulkExport is None, "BulkExport cannot be imported without hadoopy")
+class RemoveOverlapsTest(unittest.TestCase):
+    def plan(self, transfers):
+        bulk_export = BulkExport.BulkExport([], 4)
+        tasks = {}
+        for source_path, file_name, target_path, credentials in transfers:
+            task = BulkExport.TransferTask(source_path, file_name, target_path, credentials, "")
+            tasks[task.hdfs_file] = task
+            bulk_export.tasks.append(task)
+        bulk_export.remove_overlaps()
+        return bulk_export, tasks
+
+    def covering(self, tasks):
+        return dict((path, task.covered_by.hdfs_file if task.covered_by else None) for path, task in tasks.items())
+
+    def test_transfer_inside_a_copied_directory(self):
+        bulk_export, tasks = self.plan([("/data", "/data/sales", "s3a://bucket/out", CREDENTIALS),
+                                        ("/data/sales", "/data/sales/part-0", "s3a://bucket/out/sales", CREDENTIALS)])
+        self.assertEqual(self.covering(tasks), {"/data/sales": None, "/data/sales/part-0": "/data/sales"})
+        self.assertEqual(tasks["/data/sales"].covered_tasks, [tasks["/data/sales/part-0"]])
+        self.assertEqual(bulk_export.deduplicated, 1)
+
+    def test_different_target_or_credentials_are_kept(self):
+        bulk_export, tasks = self.plan([("/data", "/data/sales", "s3a://bucket/out", CREDENTIALS),
+                                        ("/data/sales", "/data/sales/a", "s3a://bucket/elsewhere", CREDENTIALS),
+                                        ("/data/sales", "/data/sales/b", "s3a://bucket/out/sales", OTHER_CREDENTIALS)])
+        self.assertEqual(set(self.covering(tasks).values()), set([None]))
+        self.assertEqual(bulk_export.deduplicated, 0)
+
+    def test_sibling_with_a_common_prefix_is_not_covered(self):
+        bulk_export, tasks = self.plan([("/data", "/data/sales", "s3a://bucket/out", CREDENTIALS),
+                                        ("/data", "/data/sales2", "s3a://bucket/out", CREDENTIALS)])
+        self.assertEqual(set(self.covering(tasks).values()), set([None]))
+
+    def test_nearest_matching_ancestor_is_used(self):
+        # The outermost directory goes to another target, the nearest one covers the file
+        bulk_export, tasks = self.plan([("/data", "/data/sales", "s3a://bucket/other", CREDENTIALS),
+                                        ("/data/sales", "/data/sales/2024", "s3a://bucket/out", CREDENTIALS),
+                                        ("/data/sales/2024", "/data/sales/2024/part-0", "s3a://bucket/out/2024",
+                                         CREDENTIALS)])
+        self.assertEqual(self.covering(tasks), {"/data/sales": None, "/data/sales/2024": None,
+                                                "/data/sales/2024/part-0": "/data/sales/2024"})
+
+    def test_covered_ancestor_passes_its_covering_transfer(self):
+        bulk_export, tasks = self.plan([("/data", "/data/sales", "s3a://bucket/out", CREDENTIALS),
+                                        ("/data/sales", "/data/sales/2024", "s3a://bucket/out/sales", CREDENTIALS),
+                                        ("/data/sales/2024", "/data/sales/2024/part-0", "s3a://bucket/out/sales/2024",
+                                         CREDENTIALS)])
+        self.assertEqual(self.covering(tasks), {"/data/sales": None, "/data/sales/2024": "/data/sales",
+                                                "/data/sales/2024/part-0": "/data/sales"})
+        self.assertEqual(len(tasks["/data/sales"].covered_tasks), 2)
+        self.assertEqual(bulk_export.deduplicated, 2)
+
+
+@unittest.skipIf(BulkExport is None, "BulkExport cannot be imported without hadoopy")
+class PlanTest(unittest.TestCase):
+    def test_identical_specs_run_once(self):
+        spec = {"export_type": "localToS3", "bucket_name": "bucket", "source_file": "/tmp/a"}
+        bulk_export = BulkExport.BulkExport([spec, dict(spec), {"export_type": "unknown"}], 4)
+        bulk_export.plan()
+        self.assertEqual(bulk_export.other_jobs, [([0, 1], spec)])
+        self.assertEqual(bulk_export.deduplicated, 1)
+        self.assertEqual(bulk_export.results[2][BulkExport.STATUS_KEY], BulkExport.STATUS_FAILED)
+
+
+@unittest.skipIf(BulkExport is None, "BulkExport cannot be imported without hadoopy")
+class RetryUnverifiedTest(unittest.TestCase):
+    def setUp(self):
+        self.get_policy = BulkExport.Retry.get_policy
+        BulkExport.Retry.get_policy = lambda default_max_retries: BulkExport.Retry.RetryPolicy(2, 0, 0)
+
+    def tearDown(self):
+        BulkExport.Retry.get_policy = self.get_policy
+
+    def queue_depth(self):
+        return Metrics.QUEUE_DEPTH.values.get((Metrics.EXPORT_TYPE_HDFS_TO_S3,), 0)
+
+    def test_retried_transfers_are_counted_in_the_queue_depth(self):
+        bulk_export = BulkExport.BulkExport([], 2)
+        task = BulkExport.TransferTask("/data", "/data/a", "s3a://bucket/out", CREDENTIALS, "")
+        task.status = {BulkExport.FILE_NAME_KEY: task.s3_file_path, BulkExport.FILE_SIZE_KEY: "3"}
+        task.target_paths = [task.s3_file_path]
+        cleaned = []
+        bulk_export.hdfs_to_s3.s3_cleanup = lambda paths, credentials: cleaned.extend(paths) or True
+        bulk_export.hdfs_to_s3.transfer_file_with_retries = lambda *args: dict(task.status)
+        # The copy is verified the second time
+        bulk_export.context.verify_pending = lambda: {task.s3_file_path: 3}
+        depth = self.queue_depth()
+        verified = bulk_export.retry_unverified([task], {})
+        self.assertEqual(verified, {task.s3_file_path: 3})
+        self.assertEqual(cleaned, [task.s3_file_path])
+        self.assertEqual(self.queue_depth(), depth)
+
+
+if __name__ == "__main__":
+    unittest.main()
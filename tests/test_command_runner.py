@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the command supervisor of CommandRunner with real shell commands: exit codes and output, timeouts,
+cancellation, the limit on the running commands and the buffering of streamed output"""
+
+import os
+import time
+import unittest
+
+import support
+import CommandRunner
+
+WAIT_TIMEOUT = 10
+
+
+def wait_for(condition, timeout=WAIT_TIMEOUT):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def is_running(pid):
+    try:
+        with open("/proc/%d/stat" % pid) as stat_file:
+            # A zombie waiting for its parent is not running
+            return stat_file.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except IOError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class CommandRunnerTest(support.TemporaryDirectoryTest):
+    MAX_PROCESSES = 4
+
+    @classmethod
+    def setUpClass(cls):
+        cls.runner = CommandRunner.Supervisor(cls.MAX_PROCESSES)
+        cls.runner.start()
+
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.commands = []
+
+    def tearDown(self):
+        for command in self.commands:
+            command.cancel()
+        for command in self.commands:
+            command.wait()
+        support.TemporaryDirectoryTest.tearDown(self)
+
+    def start(self, command, timeout=None, stream=False, merge_stderr=True):
+        running_command = CommandRunner.Command(self.runner, command, timeout, stream, False, merge_stderr)
+        self.runner.submit(running_command)
+        self.commands.append(running_command)
+        return running_command
+
+    def run_command(self, command, **kwargs):
+        running_command = self.start(command, **kwargs)
+        return running_command.wait(), running_command
+
+
+class OutputTest(CommandRunnerTest):
+    def test_exit_codes(self):
+        self.assertEqual(self.run_command("true")[0], 0)
+        self.assertEqual(self.run_command("exit 3")[0], 3)
+        self.assertEqual(self.run_command("kill -9 $$")[0], -9)
+
+    def test_stderr_is_merged(self):
+        exit_code, command = self.run_command("echo out; echo err >&2; exit 1")
+        self.assertEqual(exit_code, 1)
+        self.assertEqual(command.output(), "out\nerr\n")
+        self.assertEqual(command.error_output(), "")
+
+    def test_stderr_is_kept_apart(self):
+        exit_code, command = self.run_command("echo out; echo err >&2", merge_stderr=False)
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(command.output(), "out\n")
+        self.assertEqual(command.error_output(), "err\n")
+
+    def test_streamed_lines(self):
+        command = self.start("printf 'a\\nb\\nc'", stream=True)
+        self.assertEqual(list(command.lines()), ["a\n", "b\n", "c"])
+        self.assertEqual(command.wait(), 0)
+
+    def test_command_that_cannot_run(self):
+        exit_code, command = self.run_command("/nonexistent/command")
+        self.assertEqual(exit_code, 127)
+        self.assertIn("/nonexistent/command", command.output())
+
+
+class TimeoutTest(CommandRunnerTest):
+    def test_timeout_kills_the_process_group(self):
+        started = time.time()
+        # The shell prints the pid of its background sleep and waits for it
+        exit_code, command = self.run_command("sh -c 'sleep 100 & echo $!; wait'", timeout=0.5)
+        self.assertLess(time.time() - started, WAIT_TIMEOUT)
+        self.assertEqual(exit_code, -15)
+        self.assertEqual(command.kill_reason, CommandRunner.REASON_TIMEOUT)
+        lines = command.output().splitlines()
+        self.assertEqual(lines[-1], "Command timed out after 0.5 seconds")
+        self.assertTrue(wait_for(lambda: not is_running(int(lines[0]))))
+
+    def test_command_within_its_timeout(self):
+        exit_code, command = self.run_command("echo done", timeout=WAIT_TIMEOUT)
+        self.assertEqual(exit_code, 0)
+        self.assertIsNone(command.kill_reason)
+        self.assertEqual(command.output(), "done\n")
+
+
+class SlotTest(CommandRunnerTest):
+    MAX_PROCESSES = 1
+
+    def test_command_waits_for_a_slot(self):
+        first = self.start("sleep 0.5")
+        second = self.start("echo second")
+        self.assertTrue(first.started.wait(WAIT_TIMEOUT))
+        time.sleep(0.2)
+        self.assertFalse(second.started.is_set())
+        self.assertEqual(first.wait(), 0)
+        self.assertEqual(second.wait(), 0)
+        self.assertEqual(second.output(), "second\n")
+
+    def test_cancelled_waiting_command_never_starts(self):
+        marker = os.path.join(self.directory, "started")
+        blocker = self.start("sleep 100")
+        waiting = self.start("touch " + marker)
+        self.assertTrue(blocker.started.wait(WAIT_TIMEOUT))
+        waiting.cancel()
+        self.assertTrue(waiting.done())
+        self.assertEqual(waiting.wait(), CommandRunner.EXIT_NOT_STARTED)
+        self.assertEqual(waiting.kill_reason, CommandRunner.REASON_CANCELLED)
+        self.assertEqual(waiting.output(), "Command cancelled\n")
+        self.assertIsNone(waiting.process)
+        blocker.cancel()
+        self.assertEqual(blocker.wait(), -15)
+        # The slot is free again, the cancelled command is not started in it
+        self.assertEqual(self.run_command("true")[0], 0)
+        self.assertFalse(os.path.exists(marker))
+
+
+class StreamBufferTest(CommandRunnerTest):
+    def test_reader_that_stops_pauses_the_pipes(self):
+        command = self.start("yes", stream=True)
+        self.assertTrue(wait_for(lambda: command.buffered >= CommandRunner.STREAM_BUFFER_BYTES))
+        time.sleep(0.3)
+        buffered = command.buffered
+        # One read past the limit at most, then the pipe is no longer read
+        self.assertLess(buffered, CommandRunner.STREAM_BUFFER_BYTES + CommandRunner.READ_SIZE)
+        time.sleep(0.3)
+        self.assertEqual(command.buffered, buffered)
+        self.assertFalse(command.done())
+        data = command.read(CommandRunner.STREAM_BUFFER_BYTES)
+        self.assertEqual(len(data), CommandRunner.STREAM_BUFFER_BYTES)
+        self.assertEqual(data.count("y\n") * 2, len(data))
+        # Reading resumes the pipes
+        self.assertTrue(wait_for(lambda: command.buffered >= CommandRunner.STREAM_BUFFER_BYTES))
+        command.cancel()
+        self.assertEqual(command.wait(), -15)
+        self.assertEqual(command.kill_reason, CommandRunner.REASON_CANCELLED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the configuration snapshots of ConfigUtility: typed values, read-only snapshots and reloads"""
+
+import os
+import unittest
+
+import support
+import ConfigUtility
+from ConfigUtility import get_snapshot, get_json_snapshot
+
+
+class ConfigSnapshotTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.path = os.path.join(self.directory, "settings.conf")
+        self.write("[service]\nworkers = 4\nratio = 0.5\nenabled = y\nempty =\nName = value\n")
+
+    def write(self, content, path=None):
+        with open(path or self.path, "w") as conf_file:
+            conf_file.write(content)
+
+    def expire(self, path=None):
+        # The file is checked again once RELOAD_CHECK_INTERVAL passed
+        ConfigUtility._get_config_file(path or self.path, ConfigUtility.parse_conf_file).checked = 0
+
+    def test_typed_values(self):
+        snapshot = get_snapshot(self.path)
+        self.assertEqual(snapshot.get("service", "workers"), "4")
+        self.assertEqual(snapshot.get_int("service", "workers"), 4)
+        self.assertEqual(snapshot.get_float("service", "ratio"), 0.5)
+        self.assertTrue(snapshot.get_bool("service", "enabled"))
+        self.assertEqual(snapshot.get_int("service", "empty", 7), 7)
+        self.assertEqual(snapshot.get_int("service", "missing", 3), 3)
+        self.assertEqual(snapshot.get("service", "name"), "value")
+        self.assertRaises(ValueError, snapshot.get_int, "service", "name")
+
+    def test_snapshot_is_read_only(self):
+        snapshot = get_snapshot(self.path)
+        self.assertRaises(TypeError, setattr, snapshot, "version", None)
+        self.assertRaises(TypeError, snapshot.values.__setitem__, ("service", "workers"), "8")
+
+    def test_snapshot_is_cached(self):
+        self.assertIs(get_snapshot(self.path), get_snapshot(self.path))
+
+    def test_changed_file_is_reloaded(self):
+        before = get_snapshot(self.path)
+        self.write("[service]\nworkers = 16\n")
+        self.expire()
+        after = get_snapshot(self.path)
+        self.assertIsNot(before, after)
+        self.assertEqual(after.get_int("service", "workers"), 16)
+        # A snapshot taken before the change keeps its values
+        self.assertEqual(before.get_int("service", "workers"), 4)
+
+    def test_unchanged_file_keeps_its_snapshot(self):
+        before = get_snapshot(self.path)
+        self.expire()
+        self.assertIs(get_snapshot(self.path), before)
+
+    def test_invalid_file_keeps_the_previous_snapshot(self):
+        before = get_snapshot(self.path)
+        self.write("not a configuration file, the section header is missing\n")
+        self.expire()
+        self.assertIs(get_snapshot(self.path), before)
+
+    def test_json_snapshot(self):
+        path = os.path.join(self.directory, "settings.json")
+        self.write('{"s3": {"buckets": ["a", "b"], "retries": 3}}', path)
+        snapshot = get_json_snapshot(path)
+        self.assertEqual(snapshot.lookup(("s3", "retries")), 3)
+        self.assertEqual(snapshot.lookup(("s3", "buckets", 1)), "b")
+        self.assertEqual(snapshot.lookup(("s3", "buckets")), ("a", "b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the database exports of DbToS3 copying the part files while sqoop imports them: restart of the import
+and cancellation of the import after a failed copy"""
+
+import time
+import threading
+import unittest
+
+import support
+import CommandRunner
+from SqoopUtility import SqoopUtility, RETURN_KEYS, STATUS_TYPE
+
+try:
+    import DbToS3
+except ImportError:
+    DbToS3 = None
+
+WAIT_TIMEOUT = 10
+STAGING_DIR = "/tmp/staging/sales"
+TARGET = "s3a://bucket/sales"
+
+
+def import_status(status, record_count=0, message=None):
+    return {RETURN_KEYS[0]: status, RETURN_KEYS[1]: record_count, RETURN_KEYS[2]: message}
+
+
+def wait_for(condition):
+    deadline = time.time() + WAIT_TIMEOUT
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Condition not met after " + str(WAIT_TIMEOUT) + " seconds")
+        time.sleep(0.01)
+
+
+@unittest.skipIf(DbToS3 is None, "DbToS3 cannot be imported without hadoopy")
+class DbToS3Test(unittest.TestCase):
+    def setUp(self):
+        self.run_command = DbToS3.run_command
+        DbToS3.run_command = self.list_staging
+        # Part files of the staging directory, None while it does not exist
+        self.part_files = None
+        self.failing = set()
+        self.cleaned = []
+        self.cancelled = threading.Event()
+        config = {"user_name": "user", "password": "secret", "db_name": "shop", "db_type": "mysql",
+                  "db_host": "localhost", "db_port": 3306, "table_name": "sales", DbToS3.TARGET_PATH_KEY: TARGET,
+                  DbToS3.S3_CREDENTIALS_KEY: {"aws_access_key_id": "key"}, DbToS3.STAGING_DIR_KEY: STAGING_DIR}
+        self.db_to_s3 = DbToS3.DbToS3(config)
+        self.db_to_s3.poll_interval = 0.01
+        self.db_to_s3.hdfs_to_s3.create_command_options_string = lambda credentials: "-Dfs.s3a.access.key=key"
+        self.db_to_s3.hdfs_to_s3.transfer_file_with_retries = self.transfer
+        self.db_to_s3.hdfs_to_s3.s3_cleanup = lambda paths, credentials: self.cleaned.append(list(paths)) or True
+        self.db_to_s3.sqoop_utility.dir_exists = lambda path: self.part_files is not None
+        self.db_to_s3.sqoop_utility.delete_dir = lambda path: True
+        self.db_to_s3.sqoop_utility.cancel = self.cancelled.set
+
+    def tearDown(self):
+        DbToS3.run_command = self.run_command
+
+    def list_staging(self, command):
+        if self.part_files is None:
+            return 1, "No such file or directory"
+        return 0, "".join("-rw-r--r--   3 hdfs hdfs 10 2026-01-01 00:00 %s/%s\n" % (STAGING_DIR, name)
+                          for name in ["_SUCCESS"] + self.part_files)
+
+    def transfer(self, option_string, staging_dir, name, target_path, credentials, buckets, target_paths):
+        if name in self.failing:
+            return {DbToS3.FILE_NAME_KEY: "", DbToS3.FILE_SIZE_KEY: ""}
+        target_paths.append(target_path + "/" + name)
+        return {DbToS3.FILE_NAME_KEY: target_path + "/" + name, DbToS3.FILE_SIZE_KEY: "10"}
+
+    def copied_names(self, result):
+        return [status[DbToS3.FILE_NAME_KEY].rsplit("/", 1)[1] for status in result[DbToS3.FILES_COPIED_LIST_KEY]]
+
+    def test_part_files_are_copied_during_the_import(self):
+        def execute(command, before_retry):
+            self.assertIn(DbToS3.COMMITTER_OPTION, command)
+            self.part_files = ["part-m-00000"]
+            wait_for(lambda: "part-m-00000" in self.db_to_s3.copied)
+            self.part_files.append("part-m-00001")
+            return import_status(STATUS_TYPE[0], 42)
+
+        self.db_to_s3.sqoop_utility.execute_sqoop_command = execute
+        result = self.db_to_s3.run()
+        self.assertEqual(result[DbToS3.STATUS_KEY], DbToS3.STATUS_SUCCESS)
+        self.assertEqual(result[DbToS3.RECORD_COUNT_KEY], 42)
+        # The last part file is picked up by the listing after the import finished
+        self.assertEqual(self.copied_names(result), ["part-m-00000", "part-m-00001"])
+        self.assertFalse(self.cancelled.is_set())
+
+    def test_restart_drops_the_copies_of_the_failed_run(self):
+        failed_run, new_run = object(), object()
+
+        def execute(command, before_retry):
+            self.db_to_s3.sqoop_utility.command = failed_run
+            self.part_files = ["part-m-00000"]
+            wait_for(lambda: "part-m-00000" in self.db_to_s3.copied)
+            self.assertTrue(before_retry())
+            self.assertEqual(self.cleaned, [[TARGET + "/part-m-00000"]])
+            self.assertEqual(self.db_to_s3.copied, {})
+            # Part files left by the failed run are not copied until the new run is started
+            self.part_files = ["part-m-00000", "part-m-00009"]
+            time.sleep(0.1)
+            self.assertEqual(self.db_to_s3.copied, {})
+            self.db_to_s3.sqoop_utility.command = new_run
+            self.part_files = ["part-m-00001"]
+            wait_for(lambda: "part-m-00001" in self.db_to_s3.copied)
+            return import_status(STATUS_TYPE[0], 7)
+
+        self.db_to_s3.sqoop_utility.execute_sqoop_command = execute
+        result = self.db_to_s3.run()
+        self.assertEqual(result[DbToS3.STATUS_KEY], DbToS3.STATUS_SUCCESS)
+        self.assertEqual(self.copied_names(result), ["part-m-00001"])
+        self.assertEqual(self.db_to_s3.target_paths, [TARGET + "/part-m-00001"])
+
+    def test_restart_is_refused_after_a_failed_copy(self):
+        self.db_to_s3.failed = "Transfer failed"
+        self.assertFalse(self.db_to_s3.restart())
+        self.db_to_s3.failed = None
+        self.db_to_s3.target_paths = [TARGET + "/part-m-00000"]
+        self.db_to_s3.hdfs_to_s3.s3_cleanup = lambda paths, credentials: False
+        self.assertFalse(self.db_to_s3.restart())
+        self.assertEqual(self.db_to_s3.failed, "Unable to remove the objects copied from the failed import")
+
+    def test_failed_copy_cancels_the_import(self):
+        self.failing.add("part-m-00001")
+
+        def execute(command, before_retry):
+            self.part_files = ["part-m-00000", "part-m-00001"]
+            self.assertTrue(self.cancelled.wait(WAIT_TIMEOUT))
+            return import_status(STATUS_TYPE[1], -1, "Sqoop import cancelled")
+
+        self.db_to_s3.sqoop_utility.execute_sqoop_command = execute
+        result = self.db_to_s3.run()
+        self.assertEqual(result[DbToS3.STATUS_KEY], DbToS3.STATUS_FAILED)
+        self.assertEqual(result[DbToS3.MESSAGE_KEY], "Transfer of " + STAGING_DIR + "/part-m-00001 failed")
+        self.assertEqual(result[DbToS3.FILES_COPIED_LIST_KEY], [])
+        # The object copied before the failure is removed
+        self.assertEqual(self.cleaned, [[TARGET + "/part-m-00000"]])
+
+
+class SqoopCancelTest(unittest.TestCase):
+    def test_cancel_kills_the_running_process(self):
+        sqoop_utility = SqoopUtility()
+        sqoop_utility.command = CommandRunner.start("sleep 100", WAIT_TIMEOUT * 2)
+        self.assertTrue(sqoop_utility.command.started.wait(WAIT_TIMEOUT))
+        sqoop_utility.cancel()
+        self.assertEqual(sqoop_utility.command.wait(), -15)
+        self.assertEqual(sqoop_utility.command.kill_reason, CommandRunner.REASON_CANCELLED)
+
+    def test_no_process_is_started_after_a_cancel(self):
+        sqoop_utility = SqoopUtility()
+        sqoop_utility.cancel()
+        status = sqoop_utility.run_sqoop_process("sqoop import --connect jdbc:mysql://localhost/shop")
+        self.assertEqual(status, import_status(STATUS_TYPE[1], -1, "Sqoop import cancelled"))
+        self.assertIsNone(sqoop_utility.command)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the content index of DedupIndex, including the migration of an index created before the ETags were
+recorded"""
+
+import os
+import time
+import sqlite3
+import unittest
+
+import support
+import DedupIndex
+
+
+class DedupIndexTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.path = os.path.join(self.directory, "dedup.sqlite")
+
+    def test_lookup_returns_the_latest_first(self):
+        index = DedupIndex.DedupIndex(self.path)
+        index.add([("sum", 10, "bucket", "old/a", '"etag-1"')])
+        time.sleep(0.01)
+        index.add([("sum", 10, "bucket", "new/a", '"etag-2"'), ("sum", 11, "bucket", "other/a", '"etag-3"')])
+        self.assertEqual(index.lookup("sum", 10, ["bucket"]),
+                         [("bucket", "new/a", '"etag-2"'), ("bucket", "old/a", '"etag-1"')])
+        self.assertEqual(index.lookup("sum", 10, ["another"]), [])
+        self.assertEqual(index.lookup("sum", 10, []), [])
+
+    def test_remove_prefix(self):
+        index = DedupIndex.DedupIndex(self.path)
+        index.add([("sum", 10, "bucket", "dir/a", None), ("sum", 10, "bucket", "dir2/a", None),
+                   ("sum", 10, "bucket", "dir", None)])
+        index.remove_prefix("bucket", "dir")
+        self.assertEqual(sorted(key for _, key, _ in index.lookup("sum", 10, ["bucket"])), ["dir2/a"])
+
+    def test_index_without_etags_is_migrated(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("CREATE TABLE objects (checksum TEXT NOT NULL, size INTEGER NOT NULL, bucket TEXT NOT "
+                           "NULL, object_key TEXT NOT NULL, indexed_at REAL NOT NULL, PRIMARY KEY (checksum, size, "
+                           "bucket, object_key))")
+        connection.execute("INSERT INTO objects VALUES ('sum', 10, 'bucket', 'a', 1)")
+        connection.commit()
+        connection.close()
+        index = DedupIndex.DedupIndex(self.path)
+        # The rows indexed before have no ETag, they are never used as a copy source
+        self.assertEqual(index.lookup("sum", 10, ["bucket"]), [("bucket", "a", None)])
+
+    def test_is_enabled_by_request(self):
+        self.assertTrue(DedupIndex.is_enabled({"dedup": "y"}))
+        self.assertFalse(DedupIndex.is_enabled({"dedup": "n"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
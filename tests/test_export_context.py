@@ -0,0 +1,71 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the S3 inventory sizes, the path helpers and the shared contexts of ExportContext"""
+
+import unittest
+
+import support
+
+try:
+    from ExportContext import ExportContext, S3Inventory, split_s3_path
+except ImportError:
+    ExportContext = None
+
+
+@unittest.skipIf(ExportContext is None, "ExportContext cannot be imported without boto3")
+class S3InventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.inventory = S3Inventory([("data/b.csv", 5), ("data/a.csv", 3), ("data/dir/x", 10), ("data/dir/y", 20),
+                                      ("data/dir.bak", 7), ("data/dirx/z", 100), ("other/a.csv", 1)])
+
+    def test_keys_are_sorted(self):
+        self.assertEqual(self.inventory.keys, sorted(self.inventory.keys))
+        self.assertEqual(self.inventory.sizes[self.inventory.keys.index("data/a.csv")], 3)
+
+    def test_size_of_an_object(self):
+        self.assertEqual(self.inventory.size_of("data/a.csv"), (3, 1))
+
+    def test_size_of_a_directory(self):
+        # Siblings sharing the prefix of the directory name are not counted
+        self.assertEqual(self.inventory.size_of("data/dir"), (30, 2))
+        self.assertEqual(self.inventory.size_of("data/dir/"), (30, 2))
+        self.assertEqual(self.inventory.size_of("data"), (145, 6))
+
+    def test_size_of_a_missing_key(self):
+        self.assertEqual(self.inventory.size_of("data/c.csv"), (0, 0))
+        self.assertEqual(S3Inventory([]).size_of("data"), (0, 0))
+
+    def test_object_and_directory_with_the_same_name(self):
+        inventory = S3Inventory([("data/dir", 1), ("data/dir/x", 2)])
+        self.assertEqual(inventory.size_of("data/dir"), (3, 2))
+
+
+@unittest.skipIf(ExportContext is None, "ExportContext cannot be imported without boto3")
+class SplitS3PathTest(unittest.TestCase):
+    def test_split(self):
+        self.assertEqual(split_s3_path("s3a://bucket/some/prefix"), ("bucket", "some/prefix"))
+        self.assertEqual(split_s3_path("s3://bucket")[0], "bucket")
+        self.assertFalse(split_s3_path("s3://bucket")[1])
+
+
+@unittest.skipIf(ExportContext is None, "ExportContext cannot be imported without boto3")
+class SharedContextTest(unittest.TestCase):
+    def test_shared_context_reuses_the_caches(self):
+        context = ExportContext()
+        context.defer_verification = True
+        context.add_pending_verification("s3a://bucket/key", {}, 10)
+        shared = context.shared()
+        self.assertIs(shared.lock, context.lock)
+        self.assertIs(shared.s3_clients, context.s3_clients)
+        self.assertIs(shared.hdfs_listings, context.hdfs_listings)
+        self.assertIs(shared.s3_inventories, context.s3_inventories)
+        # The verifications stay with the context that queued them
+        self.assertFalse(shared.defer_verification)
+        self.assertEqual(shared.pending_verifications, [])
+        self.assertEqual(len(context.pending_verifications), 1)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the dry run of ExportPlanner: delta against the target and duration estimated from the throughput
+recorded in ExportHistory"""
+
+import os
+import time
+import shlex
+import unittest
+
+import support
+import ExportHistory
+
+try:
+    import ExportContext
+    import ExportPlanner
+except ImportError:
+    ExportPlanner = None
+
+BUCKET = "bucket"
+
+
+class HistoryTest(support.TemporaryDirectoryTest):
+    HISTORY_RUNS = 3
+
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.history = ExportHistory.ExportHistory(os.path.join(self.directory, "history", "runs.sqlite"))
+        self.get_history = ExportHistory.get_history
+        self.get_history_runs = ExportHistory.get_history_runs
+        ExportHistory.get_history = lambda: self.history
+        ExportHistory.get_history_runs = lambda: self.HISTORY_RUNS
+
+    def tearDown(self):
+        ExportHistory.get_history = self.get_history
+        ExportHistory.get_history_runs = self.get_history_runs
+        support.TemporaryDirectoryTest.tearDown(self)
+
+
+class ExportHistoryTest(HistoryTest):
+    def test_destination_of(self):
+        self.assertEqual(ExportHistory.destination_of("hdfsToS3", {"target_path": "s3a://bucket/out"}), "s3://bucket")
+        self.assertEqual(ExportHistory.destination_of("hdfsToS3", {"target_path": [
+            "s3a://second/out", {"target_path": "s3://first/out"}, "s3a://second/copy"]}), "s3://first,s3://second")
+        self.assertEqual(ExportHistory.destination_of("s3ToHdfs", {"target_path": "/data/in"}), "hdfs")
+        self.assertEqual(ExportHistory.destination_of("localToS3", {"bucket_name": "bucket"}), "s3://bucket")
+        self.assertEqual(ExportHistory.destination_of("dbexport", {"destination": "/user/hive/sales"}), "hdfs")
+
+    def test_estimate_from_the_runs_to_the_destination(self):
+        self.history.add("hdfsToS3", "s3://bucket", 100, 1, 1.0)
+        self.history.add("hdfsToS3", "s3://bucket", 300, 3, 3.0)
+        self.history.add("hdfsToS3", "s3://other", 1000, 1, 1.0)
+        self.assertEqual(ExportHistory.estimate("hdfsToS3", "s3://bucket", 500),
+                         {"seconds": 5.0, "bytes_per_second": 100, "runs": 2, "basis": "destination"})
+
+    def test_estimate_falls_back_to_the_export_type(self):
+        self.history.add("hdfsToS3", "s3://other", 1000, 1, 1.0)
+        self.history.add("localToS3", "s3://bucket", 10, 1, 10.0)
+        self.assertEqual(ExportHistory.estimate("hdfsToS3", "s3://bucket", 500),
+                         {"seconds": 0.5, "bytes_per_second": 1000, "runs": 1, "basis": "export_type"})
+
+    def test_estimate_without_history(self):
+        self.history.add("hdfsToS3", "s3://bucket", 0, 0, 1.0)
+        self.assertEqual(ExportHistory.estimate("hdfsToS3", "s3://bucket", 500),
+                         {"seconds": None, "bytes_per_second": None, "runs": 0, "basis": "none"})
+
+    def test_estimate_of_unknown_size_is_the_average_duration(self):
+        self.history.add("dbexport", "hdfs", 0, 0, 10.0)
+        self.history.add("dbexport", "hdfs", 0, 0, 20.0)
+        self.assertEqual(ExportHistory.estimate("dbexport", "hdfs", None),
+                         {"seconds": 15.0, "bytes_per_second": None, "runs": 2, "basis": "destination"})
+
+    def test_record_keeps_the_last_runs(self):
+        config = {"target_path": "s3a://bucket/out"}
+        for size in (1000, 10, 20, 30):
+            ExportHistory.record("hdfsToS3", config, {"status": "SUCCESS", "files_copied_list": [
+                {"file_name": "s3a://bucket/out/a", "file_size": str(size)}]}, 1.0)
+            # The runs are ordered by the time they finished
+            time.sleep(0.01)
+        ExportHistory.record("hdfsToS3", config, {"status": "FAILED", "files_copied_list": []}, 1.0)
+        self.assertEqual(self.history.totals("hdfsToS3", "s3://bucket", 10), (3, 60, 3, 3.0))
+
+    def test_record_does_not_count_the_bytes_saved_by_dedup(self):
+        ExportHistory.record("hdfsToS3", {"target_path": "s3a://bucket/out"}, {
+            "status": "SUCCESS", "bytes_saved": 70, "files_copied_list": [
+                {"file_name": "s3a://bucket/out/a", "file_size": "100"}]}, 2.0)
+        self.assertEqual(self.history.totals("hdfsToS3", "s3://bucket", 10), (1, 30, 1, 2.0))
+
+
+@unittest.skipIf(ExportPlanner is None, "ExportPlanner cannot be imported without boto3")
+class PlanExportTest(HistoryTest):
+    def setUp(self):
+        HistoryTest.setUp(self)
+        self.source = os.path.join(self.directory, "source")
+        os.mkdir(self.source)
+        for name, size in (("new", 10), ("changed", 20), ("unchanged", 30)):
+            with open(os.path.join(self.source, name), "wb") as data_file:
+                data_file.write("x" * size)
+        s3 = support.FakeS3({"out/changed": "x" * 5, "out/unchanged": "x" * 30, "other/new": "x" * 10})
+        self.export_context = ExportPlanner.ExportContext
+
+        class PlanContext(ExportContext.ExportContext):
+            def get_s3_client(self, s3_credentials_json):
+                return s3
+
+        ExportPlanner.ExportContext = PlanContext
+
+    def tearDown(self):
+        ExportPlanner.ExportContext = self.export_context
+        HistoryTest.tearDown(self)
+
+    def plan(self):
+        return ExportPlanner.plan_export("localToS3", {"bucket_name": BUCKET, "source_file": self.source,
+                                                       "destination_file": "out", "multipart_threshold": "25"})
+
+    def test_delta_against_the_target(self):
+        result = self.plan()
+        self.assertEqual(result[ExportPlanner.STATUS_KEY], ExportPlanner.STATUS_SUCCESS)
+        self.assertEqual((result["file_count"], result["total_bytes"], result["bytes_to_copy"]), (3, 60, 60))
+        self.assertEqual([(item[ExportPlanner.TARGET_KEY], item[ExportPlanner.ACTION_KEY]) for item in result["files"]],
+                         [("s3://bucket/out/changed", ExportPlanner.ACTION_CHANGED),
+                          ("s3://bucket/out/new", ExportPlanner.ACTION_NEW),
+                          ("s3://bucket/out/unchanged", ExportPlanner.ACTION_UNCHANGED)])
+        self.assertEqual(result["delta"], {"new_files": 1, "new_bytes": 10, "changed_files": 1, "changed_bytes": 20,
+                                           "unchanged_files": 1, "unchanged_bytes": 30})
+        self.assertEqual((result["batching"]["put_object_files"], result["batching"]["multipart_files"]), (2, 1))
+        self.assertEqual(result["estimate"]["basis"], "none")
+
+    def test_estimate_from_the_recorded_runs(self):
+        self.history.add("localToS3", "s3://bucket", 40, 2, 2.0)
+        self.history.add("localToS3", "s3://bucket", 20, 1, 1.0)
+        result = self.plan()
+        self.assertEqual(result["destination"], "s3://bucket")
+        self.assertEqual(result["estimate"], {"seconds": 3.0, "bytes_per_second": 20, "runs": 2,
+                                              "basis": "destination"})
+
+    def test_listed_files_are_truncated(self):
+        get_snapshot = ExportPlanner.get_snapshot
+        settings = get_snapshot(ExportPlanner.CONFIGURATION_FILE)
+
+        class Settings(object):
+            def get_int(self, section, name, default):
+                return 1 if name == "max_listed_files" else settings.get_int(section, name, default)
+
+        ExportPlanner.get_snapshot = lambda path: Settings()
+        try:
+            result = self.plan()
+        finally:
+            ExportPlanner.get_snapshot = get_snapshot
+        self.assertEqual((len(result["files"]), result["file_count"], result["files_truncated"]), (1, 3, True))
+
+    def test_s3_to_hdfs_target_is_quoted(self):
+        target = "/data/in b&c"
+        commands = []
+
+        def run_command(command):
+            commands.append(shlex.split(command))
+            return 0, "-rw-r--r--   3 hdfs hdfs 10 2026-01-01 00:00 " + target + "/new\n"
+
+        ExportPlanner.run_command, saved_run_command = run_command, ExportPlanner.run_command
+        try:
+            result = ExportPlanner.plan_export("s3ToHdfs", {"source_path": "s3a://bucket/other", "target_path": target,
+                                                            "s3_credentials": {}})
+        finally:
+            ExportPlanner.run_command = saved_run_command
+        self.assertEqual(commands, [["hadoop", "fs", "-ls", "-R", target]])
+        self.assertEqual([(item[ExportPlanner.TARGET_KEY], item[ExportPlanner.ACTION_KEY]) for item in result["files"]],
+                         [(target + "/new", ExportPlanner.ACTION_UNCHANGED)])
+
+    def test_unknown_export_type(self):
+        result = ExportPlanner.plan_export("ftpToS3", {})
+        self.assertEqual(result[ExportPlanner.STATUS_KEY], ExportPlanner.STATUS_FAILED)
+        self.assertIn("No planner for export type ftpToS3", result[ExportPlanner.MESSAGE_KEY])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the lazy loading of the export backends by ExportRegistry and of the lazy logger of LogSetup"""
+
+import os
+import sys
+import logging
+import subprocess
+import unittest
+
+import support
+import LogSetup
+import ExportRegistry
+from EDLExceptions import BackendUnavailable
+
+BACKEND_MODULE = "test_registry_backend"
+BROKEN_MODULE = "test_registry_broken_backend"
+
+
+class ExportRegistryTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        with open(os.path.join(self.directory, BACKEND_MODULE + ".py"), "w") as module_file:
+            module_file.write("def run(config):\n    return {'status': 'SUCCESS', 'config': config}\n")
+        with open(os.path.join(self.directory, BROKEN_MODULE + ".py"), "w") as module_file:
+            module_file.write("import module_that_does_not_exist\n")
+        sys.path.insert(0, self.directory)
+        ExportRegistry.BACKENDS["testBackend"] = (BACKEND_MODULE, "run")
+        ExportRegistry.BACKENDS["brokenBackend"] = (BROKEN_MODULE, "run")
+
+    def tearDown(self):
+        for name in ("testBackend", "brokenBackend"):
+            ExportRegistry.BACKENDS.pop(name)
+            ExportRegistry._handlers.pop(name, None)
+            ExportRegistry._failures.pop(name, None)
+        for module_name in (BACKEND_MODULE, BROKEN_MODULE):
+            sys.modules.pop(module_name, None)
+        sys.path.remove(self.directory)
+        support.TemporaryDirectoryTest.tearDown(self)
+
+    def test_backend_is_imported_on_first_use(self):
+        self.assertNotIn(BACKEND_MODULE, sys.modules)
+        handler = ExportRegistry.get_handler("testBackend")
+        self.assertIn(BACKEND_MODULE, sys.modules)
+        self.assertEqual(handler({"a": 1}), {"status": "SUCCESS", "config": {"a": 1}})
+        self.assertIs(ExportRegistry.get_handler("testBackend"), handler)
+
+    def test_backend_that_cannot_be_imported_is_unavailable(self):
+        self.assertRaises(BackendUnavailable, ExportRegistry.get_handler, "brokenBackend")
+        # The failure is kept, the import is not attempted again
+        sys.modules.pop(BROKEN_MODULE, None)
+        os.remove(os.path.join(self.directory, BROKEN_MODULE + ".py"))
+        try:
+            ExportRegistry.get_handler("brokenBackend")
+        except BackendUnavailable as e:
+            self.assertIn("brokenBackend is unavailable", str(e))
+            self.assertIn("module_that_does_not_exist", str(e))
+        else:
+            self.fail("BackendUnavailable not raised")
+
+    def test_unknown_backend(self):
+        self.assertRaises(BackendUnavailable, ExportRegistry.get_handler, "unknown")
+
+    def test_warm_up(self):
+        ExportRegistry.warm_up(["testBackend", "brokenBackend"], background=False)
+        self.assertIn("testBackend", ExportRegistry._handlers)
+        self.assertIn("brokenBackend", ExportRegistry._failures)
+        thread = ExportRegistry.warm_up(["testBackend"])
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+    def test_import_does_not_load_the_backends(self):
+        code = "import sys, ExportRegistry; print(sorted(set(['HdfsToS3', 'SqoopUtility', 'boto3']) & " \
+               "set(sys.modules)))"
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=self.directory,
+                                         env=dict(os.environ, PYTHONPATH=support.SOURCE_DIR))
+        self.assertEqual(output.strip(), "[]")
+
+
+class LazyLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.get_logger = LogSetup.get_logger
+        self.calls = []
+
+        def get_logger():
+            self.calls.append(1)
+            return logging.getLogger("test_lazy_logger"), None
+
+        LogSetup.get_logger = get_logger
+
+    def tearDown(self):
+        LogSetup.get_logger = self.get_logger
+
+    def test_logger_is_configured_on_first_use(self):
+        lazy_logger = LogSetup.LazyLogger()
+        self.assertEqual(self.calls, [])
+        lazy_logger.debug("first")
+        lazy_logger.info("second")
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(lazy_logger.name, "test_lazy_logger")
+        # Methods are kept on the proxy
+        self.assertIn("info", vars(lazy_logger))
+
+
+if __name__ == "__main__":
+    unittest.main()
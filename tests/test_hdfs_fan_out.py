@@ -0,0 +1,142 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the exports of HdfsFanOut to several destinations: each HDFS file is read once and written to every
+destination, and a destination that fails is rolled back while the others are kept"""
+
+import os
+import stat
+import shlex
+import unittest
+
+import support
+
+try:
+    import HdfsFanOut
+except ImportError:
+    HdfsFanOut = None
+
+# Above the 5 MB minimum part size of S3
+LARGE_FILE_SIZE = 5 * 1024 * 1024 + 10
+# Stands in for the hadoop command line: "hadoop fs -cat <path>" prints the local file
+HADOOP_SCRIPT = "#!/bin/sh\nexec cat \"$3\"\n"
+
+
+@unittest.skipIf(HdfsFanOut is None, "HdfsFanOut cannot be imported without boto3")
+class HdfsFanOutTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.source = os.path.join(self.directory, "source")
+        os.makedirs(os.path.join(self.source, "part"))
+        self.sizes = {"a": 10, "part/b": 20, "large": LARGE_FILE_SIZE}
+        for name, size in self.sizes.items():
+            with open(os.path.join(self.source, name), "wb") as data_file:
+                data_file.write("x" * size)
+        bin_dir = os.path.join(self.directory, "bin")
+        os.mkdir(bin_dir)
+        with open(os.path.join(bin_dir, "hadoop"), "w") as script:
+            script.write(HADOOP_SCRIPT)
+        os.chmod(os.path.join(bin_dir, "hadoop"), stat.S_IRWXU)
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = bin_dir + os.pathsep + self.path
+        self.run_command = HdfsFanOut.run_command
+        HdfsFanOut.run_command = self.list_source
+        self.get_policy = HdfsFanOut.Retry.get_policy
+        HdfsFanOut.Retry.get_policy = lambda default_max_retries=None: HdfsFanOut.Retry.RetryPolicy(1, 0, 0)
+        self.first, self.second = support.FakeS3(), support.FakeS3()
+        # An object of an earlier export in the second destination
+        self.second.objects["copy/old"] = "x" * 3
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        HdfsFanOut.run_command = self.run_command
+        HdfsFanOut.Retry.get_policy = self.get_policy
+        support.TemporaryDirectoryTest.tearDown(self)
+
+    def list_source(self, command):
+        # "hadoop fs -ls -R <path>" lists the path itself or the files below it
+        listed_path = shlex.split(command)[-1]
+        return 0, "".join("-rw-r--r--   3 hdfs hdfs %d 2026-01-01 00:00 %s\n" % (size, path)
+                          for path, size in sorted((os.path.join(self.source, name), size)
+                                                   for name, size in self.sizes.items())
+                          if path == listed_path or path.startswith(listed_path + "/"))
+
+    def export(self, **config):
+        config.update({HdfsFanOut.SOURCE_PATH_KEY: self.source,
+                       HdfsFanOut.S3_CREDENTIALS_KEY: {"aws_access_key_id": "1"},
+                       HdfsFanOut.TARGET_PATH_KEY: ["s3a://first/export", {
+                           HdfsFanOut.TARGET_PATH_KEY: "s3a://second/copy/",
+                           HdfsFanOut.S3_CREDENTIALS_KEY: {"aws_access_key_id": "2"}}],
+                       "part_size": str(HdfsFanOut.MINIMUM_PART_SIZE)})
+        fan_out = HdfsFanOut.HdfsFanOut(config)
+        clients = {"1": self.first, "2": self.second}
+        fan_out.context.get_s3_client = lambda credentials: clients[credentials["aws_access_key_id"]]
+        return fan_out.run()
+
+    def exported(self, prefix):
+        return dict((prefix + "/" + name, size) for name, size in self.sizes.items())
+
+    def test_every_destination_is_written(self):
+        result = self.export()
+        self.assertEqual(result[HdfsFanOut.STATUS_KEY], HdfsFanOut.STATUS_SUCCESS)
+        self.assertEqual([(target[HdfsFanOut.TARGET_PATH_KEY], target[HdfsFanOut.STATUS_KEY])
+                          for target in result[HdfsFanOut.TARGETS_KEY]],
+                         [("s3a://first/export", HdfsFanOut.STATUS_SUCCESS),
+                          ("s3a://second/copy", HdfsFanOut.STATUS_SUCCESS)])
+        self.assertEqual(len(result[HdfsFanOut.FILES_COPIED_LIST_KEY]), 6)
+        self.assertEqual(self.first.sizes(), self.exported("export"))
+        self.assertEqual(self.second.sizes(), dict(self.exported("copy"), **{"copy/old": 3}))
+
+    def test_paths_are_quoted(self):
+        self.sizes["part/b c&d"] = 5
+        with open(os.path.join(self.source, "part/b c&d"), "wb") as data_file:
+            data_file.write("x" * 5)
+        result = self.export()
+        self.assertEqual(result[HdfsFanOut.STATUS_KEY], HdfsFanOut.STATUS_SUCCESS)
+        self.assertEqual(self.first.sizes()["export/part/b c&d"], 5)
+
+    def test_file_list_is_resolved_against_the_source(self):
+        result = self.export(file_list=["a", self.source + "/part"])
+        self.assertEqual(result[HdfsFanOut.STATUS_KEY], HdfsFanOut.STATUS_SUCCESS)
+        self.assertEqual(self.first.sizes(), {"export/a": 10, "export/part/b": 20})
+        self.assertEqual(self.second.sizes(), {"copy/a": 10, "copy/part/b": 20, "copy/old": 3})
+
+    def test_failed_destination_is_rolled_back_alone(self):
+        self.second.fail("put_object", "copy/part/b")
+        result = self.export()
+        self.assertEqual(result[HdfsFanOut.STATUS_KEY], HdfsFanOut.STATUS_FAILED)
+        self.assertEqual(result[HdfsFanOut.MESSAGE_KEY], "1 of 2 destinations failed")
+        first, second = result[HdfsFanOut.TARGETS_KEY]
+        self.assertEqual(first[HdfsFanOut.STATUS_KEY], HdfsFanOut.STATUS_SUCCESS)
+        self.assertEqual(second[HdfsFanOut.STATUS_KEY], HdfsFanOut.STATUS_FAILED)
+        self.assertIn("put_object of copy/part/b failed: Access Denied", second[HdfsFanOut.MESSAGE_KEY])
+        self.assertEqual(result[HdfsFanOut.FILES_COPIED_LIST_KEY], first[HdfsFanOut.FILES_COPIED_LIST_KEY])
+        self.assertEqual(self.first.sizes(), self.exported("export"))
+        self.assertEqual(self.first.deleted, [])
+        # Only the keys the export wrote are deleted
+        self.assertEqual(self.second.sizes(), {"copy/old": 3})
+        self.assertNotIn("copy/old", self.second.deleted)
+
+    def test_failed_part_aborts_the_upload_of_the_destination(self):
+        self.second.fail("upload_part", "copy/large")
+        result = self.export()
+        self.assertEqual([target[HdfsFanOut.STATUS_KEY] for target in result[HdfsFanOut.TARGETS_KEY]],
+                         [HdfsFanOut.STATUS_SUCCESS, HdfsFanOut.STATUS_FAILED])
+        self.assertEqual(self.second.aborted, ["copy/large"])
+        self.assertEqual(self.second.uploads, {})
+        self.assertEqual(self.first.sizes(), self.exported("export"))
+        self.assertEqual(self.second.sizes(), {"copy/old": 3})
+
+    def test_source_read_error_fails_every_destination(self):
+        # The listing announces more bytes than the file holds
+        self.sizes["a"] = 11
+        result = self.export()
+        self.assertEqual([target[HdfsFanOut.STATUS_KEY] for target in result[HdfsFanOut.TARGETS_KEY]],
+                         [HdfsFanOut.STATUS_FAILED, HdfsFanOut.STATUS_FAILED])
+        self.assertIn("Error reading", result[HdfsFanOut.TARGETS_KEY][0][HdfsFanOut.MESSAGE_KEY])
+        self.assertEqual(self.first.sizes(), {})
+        self.assertEqual(self.second.sizes(), {"copy/old": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the S3 paths HdfsToS3 records for the retries and the rollback of a failed export"""
+
+import os
+import shlex
+import unittest
+
+import support
+import DedupIndex
+
+try:
+    import HdfsToS3
+except ImportError:
+    HdfsToS3 = None
+
+CREDENTIALS = {"aws_access_key_id": "key", "aws_secret_access_key": "secret"}
+
+
+class RecordingS3(object):
+    def __init__(self):
+        self.copies = []
+
+    def copy(self, CopySource, Bucket, Key, ExtraArgs=None):
+        self.copies.append((CopySource["Bucket"], CopySource["Key"], Bucket, Key))
+
+
+@unittest.skipIf(HdfsToS3 is None, "HdfsToS3 cannot be imported without hadoopy")
+class DedupTransferTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.s3 = RecordingS3()
+        self.commands = []
+        self.hdfs_to_s3 = HdfsToS3.HdfsToS3()
+        self.hdfs_to_s3.dedup_index = DedupIndex.DedupIndex(os.path.join(self.directory, "dedup.sqlite"))
+        self.hdfs_to_s3.context.defer_verification = True
+        self.hdfs_to_s3.context.get_s3_client = lambda credentials: self.s3
+        self.hdfs_to_s3.get_hdfs_checksums = lambda paths: dict((HdfsToS3.hdfs_path_of(path), "crc:" + path)
+                                                                for path in paths)
+        self.hdfs_to_s3.get_s3_etags = lambda s3, bucket_name, prefix: {}
+        self.hdfs_to_s3.run_distcp = lambda command, source_path: self.commands.append(command) or ("", False)
+
+    def transfer(self, files, duplicates):
+        # files: relative name to size, duplicates: relative name to the (bucket, key) holding its content
+        self.hdfs_to_s3.get_hdfs_file_sizes = lambda source_path: [(source_path + "/" + name, name, size)
+                                                                   for name, size in sorted(files.items())]
+        self.hdfs_to_s3.find_duplicate = lambda s3, checksum, size, buckets, bucket_name, key: \
+            duplicates.get(key.rsplit("/", 1)[-1])
+        target_paths = []
+        status = self.hdfs_to_s3.dedup_transfer("", "hdfs:///data", "s3a://bucket/out", CREDENTIALS, set(),
+                                                target_paths)
+        return status, target_paths
+
+    def test_only_the_keys_written_are_recorded(self):
+        status, target_paths = self.transfer({"held": 1, "copied": 2, "new": 3},
+                                             {"held": ("bucket", "out/held"), "copied": ("other", "copied")})
+        self.assertEqual(status[HdfsToS3.FILE_NAME_KEY], "s3a://bucket/out")
+        self.assertEqual(status[HdfsToS3.BYTES_SAVED_KEY], 3)
+        self.assertEqual(self.s3.copies, [("other", "copied", "bucket", "out/copied")])
+        self.assertEqual(len(self.commands), 1)
+        # The object the target already held is not rolled back
+        self.assertEqual(target_paths, ["s3a://bucket/out/copied", "s3a://bucket/out/new"])
+
+    def test_target_already_complete(self):
+        status, target_paths = self.transfer({"a": 1, "b": 2}, {"a": ("bucket", "out/a"), "b": ("bucket", "out/b")})
+        self.assertEqual(status[HdfsToS3.BYTES_SAVED_KEY], 3)
+        self.assertEqual((self.s3.copies, self.commands, target_paths), ([], [], []))
+
+    def test_distcp_paths_are_quoted(self):
+        self.transfer({"b c&d": 1}, {})
+        self.assertEqual(shlex.split(self.commands[0]),
+                         ["hadoop", "distcp", "hdfs:///data/b c&d", "s3a://bucket/out/b c&d"])
+
+    def test_failed_upload_is_recorded(self):
+        self.hdfs_to_s3.run_distcp = lambda command, source_path: ("Connection reset", True)
+        status, target_paths = self.transfer({"held": 1, "new": 3}, {"held": ("bucket", "out/held")})
+        self.assertEqual(status[HdfsToS3.FILE_NAME_KEY], "")
+        self.assertEqual(target_paths, ["s3a://bucket/out/new"])
+
+
+@unittest.skipIf(HdfsToS3 is None, "HdfsToS3 cannot be imported without hadoopy")
+class HdfsCommandTest(unittest.TestCase):
+    SOURCE = "/data/sales 2026&x"
+
+    def setUp(self):
+        self.commands = []
+        self.run_command = HdfsToS3.run_command
+        HdfsToS3.run_command = self.record
+        self.hdfs_to_s3 = HdfsToS3.HdfsToS3()
+
+    def tearDown(self):
+        HdfsToS3.run_command = self.run_command
+
+    def record(self, command):
+        self.commands.append(shlex.split(command))
+        if "-du" in command:
+            return self.du_result
+        if "-checksum" in command:
+            return 0, "".join("%s\tMD5-of-0MD5-of-512CRC32C\tcrc\n" % path for path in shlex.split(command)[3:])
+        return 0, "-rw-r--r--   3 hdfs hdfs 5 2026-01-01 00:00 " + self.SOURCE + "/a b\n"
+
+    def test_listing_path_is_quoted(self):
+        files = self.hdfs_to_s3.get_hdfs_file_sizes(self.SOURCE)
+        self.assertEqual(self.commands, [["hadoop", "fs", "-ls", "-R", self.SOURCE]])
+        self.assertEqual(files, [(self.SOURCE + "/a b", "a b", 5)])
+
+    def test_folder_size(self):
+        self.du_result = (0, "25  75  " + self.SOURCE + "\n")
+        self.assertEqual(self.hdfs_to_s3.get_hdfs_folder_size(self.SOURCE), 25)
+        self.assertEqual(self.commands, [["hadoop", "fs", "-du", "-s", self.SOURCE]])
+
+    def test_failed_folder_size_without_output(self):
+        self.du_result = (1, "")
+        self.assertIsNone(self.hdfs_to_s3.get_hdfs_folder_size(self.SOURCE))
+
+    def test_checksum_paths_are_quoted(self):
+        checksums = self.hdfs_to_s3.get_hdfs_checksums([self.SOURCE + "/a b", self.SOURCE + "/c"])
+        self.assertEqual(self.commands[0][-2:], [self.SOURCE + "/a b", self.SOURCE + "/c"])
+        self.assertEqual(sorted(checksums), [self.SOURCE + "/a b", self.SOURCE + "/c"])
+
+
+@unittest.skipIf(HdfsToS3 is None, "HdfsToS3 cannot be imported without hadoopy")
+class FindDuplicateTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.s3 = support.FakeS3({"in/a": "abc"})
+        self.hdfs_to_s3 = HdfsToS3.HdfsToS3()
+        self.hdfs_to_s3.dedup_index = DedupIndex.DedupIndex(os.path.join(self.directory, "dedup.sqlite"))
+
+    def find(self, etag):
+        self.hdfs_to_s3.dedup_index.add([("crc", 3, "other", "in/a", etag)])
+        return self.hdfs_to_s3.find_duplicate(self.s3, "crc", 3, ["other", "bucket"], "bucket", "out/a")
+
+    def indexed(self):
+        return self.hdfs_to_s3.dedup_index.lookup("crc", 3, ["other", "bucket"])
+
+    def test_matching_etag(self):
+        self.assertEqual(self.find(self.s3.etag("abc")), ("other", "in/a"))
+        self.assertEqual(len(self.indexed()), 1)
+
+    def test_object_overwritten_since_it_was_indexed(self):
+        self.assertIsNone(self.find(self.s3.etag("xyz")))
+        self.assertEqual(self.indexed(), [])
+
+    def test_row_without_etag_is_dropped_unchecked(self):
+        self.s3.fail("head_object", "in/a")
+        self.assertIsNone(self.find(None))
+        self.assertEqual(self.indexed(), [])
+
+
+@unittest.skipIf(HdfsToS3 is None, "HdfsToS3 cannot be imported without hadoopy")
+class TransferRetryTest(unittest.TestCase):
+    TARGET = "s3a://bucket/out/a"
+
+    def setUp(self):
+        self.get_policy = HdfsToS3.Retry.get_policy
+        HdfsToS3.Retry.get_policy = lambda default_max_retries: HdfsToS3.Retry.RetryPolicy(2, 0, 0)
+        self.cleaned = []
+        self.hdfs_to_s3 = HdfsToS3.HdfsToS3()
+        self.hdfs_to_s3.s3_cleanup = lambda paths, credentials: self.cleaned.append(list(paths)) or True
+
+    def tearDown(self):
+        HdfsToS3.Retry.get_policy = self.get_policy
+
+    def transfer(self, failures, target_paths):
+        attempts = []
+
+        def transfer_file(option_string, source_path, file_name, target_path, credentials, transferred_files,
+                          written_paths):
+            written_paths.append(self.TARGET)
+            # Another transfer thread of the export records its path meanwhile
+            target_paths.append("s3a://bucket/out/other-" + str(len(attempts)))
+            failure = failures[len(attempts)] if len(attempts) < len(failures) else None
+            attempts.append(failure)
+            if failure is None:
+                return {HdfsToS3.FILE_NAME_KEY: self.TARGET, HdfsToS3.FILE_SIZE_KEY: "1"}
+            return {HdfsToS3.FILE_NAME_KEY: "", HdfsToS3.FILE_SIZE_KEY: 0, HdfsToS3.FAILURE_KEY: failure}
+
+        self.hdfs_to_s3.transfer_file = transfer_file
+        return self.hdfs_to_s3.transfer_file_with_retries("", "hdfs:///data", "hdfs:///data/a", "s3a://bucket/out",
+                                                          CREDENTIALS, set(), target_paths)
+
+    def test_retried_path_is_recorded_once(self):
+        target_paths = []
+        status = self.transfer([HdfsToS3.Retry.FAILURE_TRANSIENT], target_paths)
+        self.assertEqual(status[HdfsToS3.FILE_NAME_KEY], self.TARGET)
+        self.assertEqual(self.cleaned, [[self.TARGET]])
+        self.assertEqual(target_paths, ["s3a://bucket/out/other-0", "s3a://bucket/out/other-1", self.TARGET])
+
+    def test_failed_path_is_left_to_the_rollback(self):
+        target_paths = []
+        status = self.transfer([HdfsToS3.Retry.FAILURE_PERMANENT], target_paths)
+        self.assertEqual(status[HdfsToS3.FILE_NAME_KEY], "")
+        self.assertEqual(self.cleaned, [])
+        self.assertEqual(target_paths, ["s3a://bucket/out/other-0", self.TARGET])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of HiveToS3: the partition filter parser, the grouping of a table listing by partition, the selection of
+the partitions to copy, and the copy, commit marker and rollback of each partition"""
+
+import json
+import unittest
+
+import support
+
+try:
+    import HiveToS3
+except ImportError:
+    HiveToS3 = None
+
+
+@unittest.skipIf(HiveToS3 is None, "HiveToS3 cannot be imported without hadoopy")
+class ParseFilterTest(unittest.TestCase):
+    def test_conditions(self):
+        self.assertEqual(HiveToS3.parse_filter("dt >= '2024-01-01' and country in ('US', \"CA\") AND hour<>3"),
+                         [("dt", ">=", "2024-01-01"), ("country", "in", ["US", "CA"]), ("hour", "!=", "3")])
+
+    def test_operators_are_normalized(self):
+        self.assertEqual(HiveToS3.parse_filter("a == 1")[0][1], "=")
+        self.assertEqual(HiveToS3.parse_filter("a IN (1)")[0][1], "in")
+
+    def test_invalid_filters(self):
+        for partition_filter in ("dt", "dt ~ 1", "country in 'US'", "dt >= 1 or dt < 0", "c = 'US' or c = 'CA'", ""):
+            self.assertRaises(ValueError, HiveToS3.parse_filter, partition_filter)
+
+    def test_matches(self):
+        conditions = HiveToS3.parse_filter("dt >= '2024-01-01' and hour in (1, 2) and country != 'US'")
+        self.assertTrue(HiveToS3.matches({"dt": "2024-02-01", "hour": "2", "country": "CA"}, conditions))
+        self.assertFalse(HiveToS3.matches({"dt": "2023-12-31", "hour": "2", "country": "CA"}, conditions))
+        self.assertFalse(HiveToS3.matches({"dt": "2024-02-01", "hour": "3", "country": "CA"}, conditions))
+        self.assertFalse(HiveToS3.matches({"dt": "2024-02-01", "hour": "2", "country": "US"}, conditions))
+        self.assertFalse(HiveToS3.matches({"dt": "2024-02-01", "hour": "2"}, conditions))
+
+    def test_numbers_are_compared_as_numbers(self):
+        self.assertTrue(HiveToS3.matches({"hour": "10"}, HiveToS3.parse_filter("hour > 9")))
+        self.assertTrue(HiveToS3.matches({"hour": "01"}, HiveToS3.parse_filter("hour = 1")))
+        self.assertFalse(HiveToS3.matches({"name": "10"}, HiveToS3.parse_filter("name > '9a'")))
+
+
+@unittest.skipIf(HiveToS3 is None, "HiveToS3 cannot be imported without hadoopy")
+class FindPartitionsTest(unittest.TestCase):
+    TABLE = "hdfs:///warehouse/sales"
+
+    def test_partitions(self):
+        sizes = {"/warehouse/sales/dt=2024-01-01/country=US/part-0": 10,
+                 "/warehouse/sales/dt=2024-01-01/country=US/part-1": 5,
+                 "/warehouse/sales/dt=2024-01-01/country=US/_SUCCESS": 0,
+                 "/warehouse/sales/dt=2024-01-01/country=C%3AA/part-0": 7,
+                 "/warehouse/sales/dt=2024-01-01/_temporary/0/part-0": 99,
+                 "/warehouse/sales/.hive-staging/dt=2024-01-02/country=US/part-0": 99,
+                 "/warehouse/sales/_metadata": 1,
+                 "/warehouse/other/dt=2024-01-01/country=US/part-0": 99}
+        partitions = HiveToS3.find_partitions(self.TABLE, sizes)
+        self.assertEqual([(partition.path, partition.values, partition.size, partition.files)
+                          for partition in partitions],
+                         [("dt=2024-01-01/country=C%3AA", {"dt": "2024-01-01", "country": "C:A"}, 7, 1),
+                          ("dt=2024-01-01/country=US", {"dt": "2024-01-01", "country": "US"}, 15, 2)])
+
+    def test_inconsistent_layout(self):
+        sizes = {"/warehouse/sales/dt=2024-01-01/part-0": 1, "/warehouse/sales/country=US/part-0": 1}
+        self.assertRaises(ValueError, HiveToS3.find_partitions, self.TABLE, sizes)
+
+    def test_table_without_partitions(self):
+        self.assertRaises(ValueError, HiveToS3.find_partitions, self.TABLE, {"/warehouse/sales/part-0": 1})
+
+
+@unittest.skipIf(HiveToS3 is None, "HiveToS3 cannot be imported without hadoopy")
+class HiveToS3Test(unittest.TestCase):
+    TABLE = "/warehouse/sales data"
+    TARGET = "s3a://bucket/out"
+
+    def setUp(self):
+        self.files = {"dt=1/part-0": 10, "dt=2/part-0": 20, "dt=2/part-1": 2, "dt=3/part-0": 30}
+        # dt=1 is committed with the size of the source, dt=2 is committed with a different size
+        self.s3 = support.FakeS3({"out/dt=1/part-0": "x" * 10, "out/dt=1/_SUCCESS": "{}",
+                                  "out/dt=2/part-0": "x" * 5, "out/dt=2/_SUCCESS": "{}"})
+        self.commands = []
+        self.failures = set()
+        self.run_command = HiveToS3.run_command
+        HiveToS3.run_command = self.list_table
+
+    def tearDown(self):
+        HiveToS3.run_command = self.run_command
+
+    def list_table(self, command):
+        self.commands.append(command)
+        return 0, "".join("-rw-r--r--   3 hdfs hdfs %d 2026-01-01 00:00 %s/%s\n" % (size, self.TABLE, name)
+                          for name, size in sorted(self.files.items()))
+
+    def transfer(self, option_string, source_path, file_name, target_path, s3_credentials_json, transferred,
+                 target_paths):
+        # Copies the partition directory like distcp, the partitions in failures fail after their first file
+        target_paths.append(target_path + "/" + file_name)
+        names = sorted(name for name in self.files if name.startswith(file_name + "/"))
+        for name in names[:1] if file_name in self.failures else names:
+            self.s3.objects["out/" + name] = "x" * self.files[name]
+        if file_name in self.failures:
+            return {HiveToS3.FILE_NAME_KEY: "", HiveToS3.FILE_SIZE_KEY: 0}
+        return {HiveToS3.FILE_NAME_KEY: target_path + "/" + file_name,
+                HiveToS3.FILE_SIZE_KEY: sum(self.files[name] for name in names)}
+
+    def exporter(self, **config):
+        config.update({HiveToS3.S3_CREDENTIALS_KEY: {"aws_access_key_id": "key", "aws_secret_access_key": "secret",
+                                                     "aes_encryption_enabled": "n"},
+                       HiveToS3.TABLE_LOCATION_KEY: self.TABLE, HiveToS3.TARGET_PATH_KEY: self.TARGET, "dedup": "n"})
+        hive_to_s3 = HiveToS3.HiveToS3(config)
+        hive_to_s3.context.get_s3_client = lambda credentials: self.s3
+        hive_to_s3.hdfs_to_s3.transfer_file_with_retries = self.transfer
+        return hive_to_s3
+
+    def test_plan_skips_the_committed_partitions(self):
+        selected, unchanged = self.exporter().plan()
+        self.assertEqual([partition.path for partition in selected], ["dt=2", "dt=3"])
+        self.assertEqual([(partition.path, partition.status) for partition in unchanged],
+                         [("dt=1", HiveToS3.STATUS_SKIPPED)])
+        self.assertEqual(self.commands, ["hadoop fs -ls -R '/warehouse/sales data'"])
+
+    def test_plan_with_refresh_and_filter(self):
+        selected, unchanged = self.exporter(refresh="y", partition_filter="dt <= 2").plan()
+        self.assertEqual(([partition.path for partition in selected], unchanged), (["dt=1", "dt=2"], []))
+
+    def test_export_replaces_the_stale_copies_and_commits(self):
+        result = self.exporter().run()
+        self.assertEqual(result[HiveToS3.STATUS_KEY], HiveToS3.STATUS_SUCCESS)
+        self.assertEqual(result[HiveToS3.PARTITIONS_KEY], [
+            {HiveToS3.PARTITION_KEY: "dt=2", HiveToS3.STATUS_KEY: HiveToS3.STATUS_SUCCESS},
+            {HiveToS3.PARTITION_KEY: "dt=3", HiveToS3.STATUS_KEY: HiveToS3.STATUS_SUCCESS}])
+        self.assertEqual(result["partitions_unchanged"], 1)
+        # The stale copy of dt=2 was removed before the copy, the committed dt=1 was not touched
+        self.assertEqual(sorted(self.s3.deleted), ["out/dt=2/_SUCCESS", "out/dt=2/part-0"])
+        self.assertEqual(sorted(key for key in self.s3.objects if not key.endswith("_SUCCESS")),
+                         ["out/dt=1/part-0", "out/dt=2/part-0", "out/dt=2/part-1", "out/dt=3/part-0"])
+        marker = json.loads(self.s3.objects["out/dt=2/_SUCCESS"])
+        self.assertEqual((marker["source"], marker["files"], marker["bytes"]), (self.TABLE + "/dt=2", 2, 22))
+        self.assertEqual(json.loads(self.s3.objects["out/dt=3/_SUCCESS"])["bytes"], 30)
+
+    def test_failed_partition_is_rolled_back_alone(self):
+        self.failures.add("dt=3")
+        result = self.exporter().run()
+        self.assertEqual(result[HiveToS3.STATUS_KEY], HiveToS3.STATUS_FAILED)
+        self.assertEqual(result[HiveToS3.MESSAGE_KEY], "1 of 2 partitions failed")
+        self.assertEqual([status[HiveToS3.FILE_NAME_KEY] for status in result[HiveToS3.FILES_COPIED_LIST_KEY]],
+                         [self.TARGET + "/dt=2"])
+        # dt=3 has neither its partial copy nor a marker, dt=2 is committed
+        self.assertEqual(sorted(key for key in self.s3.objects if key.startswith("out/dt=3")), [])
+        self.assertIn("out/dt=2/_SUCCESS", self.s3.objects)
+
+    def test_write_marker(self):
+        hive_to_s3 = self.exporter()
+        partition = HiveToS3.Partition("dt=4", {"dt": "4"})
+        partition.size, partition.files = 7, 3
+        hive_to_s3.write_marker(partition)
+        marker = json.loads(self.s3.objects["out/dt=4/_SUCCESS"])
+        self.assertEqual((marker["source"], marker["files"], marker["bytes"]), (self.TABLE + "/dt=4", 3, 7))
+        self.assertIn("committed_at", marker)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the job events of JobEvents: numbering, the owner lock of a running job and the event streams"""
+
+import os
+import json
+import unittest
+
+import support
+import JobEvents
+
+
+class RecordingTrace(object):
+    def __init__(self, saved):
+        self.saved = saved
+
+    def save(self, path):
+        self.saved.append(path)
+
+
+class JobEventsTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.get_jobs_dir = JobEvents.get_jobs_dir
+        JobEvents.get_jobs_dir = lambda: self.directory
+
+    def tearDown(self):
+        JobEvents.get_jobs_dir = self.get_jobs_dir
+        JobEvents.set_current_job(None)
+        support.TemporaryDirectoryTest.tearDown(self)
+
+    def read_events(self, job_id):
+        with open(JobEvents.events_path(job_id)) as events_file:
+            return [json.loads(line) for line in events_file]
+
+    def test_events_are_numbered(self):
+        job = JobEvents.start_job("job1", "hdfsToS3")
+        JobEvents.publish(JobEvents.EVENT_FILE_COPIED, file_name="a", file_size=1)
+        job.finish({"status": "SUCCESS"})
+        events = self.read_events("job1")
+        self.assertEqual([event["id"] for event in events], [1, 2, 3])
+        self.assertEqual([event["event"] for event in events], [JobEvents.EVENT_JOB_STARTED,
+                                                                JobEvents.EVENT_FILE_COPIED,
+                                                                JobEvents.EVENT_JOB_FINISHED])
+
+    def test_resumed_job_continues_the_numbering(self):
+        JobEvents.start_job("job1").close()
+        job = JobEvents.resume_job("job1")
+        job.publish(JobEvents.EVENT_PROGRESS, {})
+        job.close()
+        self.assertEqual([event["id"] for event in self.read_events("job1")], [1, 2])
+
+    def test_job_closed_for_a_hand_off_is_finished(self):
+        saved = []
+        job = JobEvents.start_job("job1")
+        job.trace = RecordingTrace(saved)
+        job.close()
+        job.finish({"status": "SUCCESS"})
+        self.assertEqual(len(self.read_events("job1")), 1)
+        self.assertEqual(saved, [JobEvents.trace_path("job1")])
+
+    def test_publish_without_a_job(self):
+        JobEvents.set_current_job(None)
+        JobEvents.publish(JobEvents.EVENT_PROGRESS, value=1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_owner_lock(self):
+        job = JobEvents.start_job("job1")
+        self.assertTrue(JobEvents.has_live_owner("job1"))
+        job.close()
+        self.assertFalse(JobEvents.has_live_owner("job1"))
+        self.assertFalse(JobEvents.has_live_owner("unknown"))
+
+    def test_stream_of_a_finished_job(self):
+        job = JobEvents.start_job("job1")
+        JobEvents.publish(JobEvents.EVENT_FILE_COPIED, file_name="a", file_size=1)
+        job.finish({"status": "SUCCESS"})
+        messages = list(JobEvents.stream_events("job1", last_event_id=1))
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0].startswith("id: 2\nevent: file_copied\n"))
+        self.assertTrue(messages[1].startswith("id: 3\nevent: job_finished\n"))
+
+    def test_stream_ends_when_the_job_has_no_owner(self):
+        owner_check_interval = JobEvents.OWNER_CHECK_INTERVAL
+        JobEvents.OWNER_CHECK_INTERVAL = 0
+        try:
+            JobEvents.start_job("job1").close()
+            messages = list(JobEvents.stream_events("job1"))
+        finally:
+            JobEvents.OWNER_CHECK_INTERVAL = owner_check_interval
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[1].startswith("event: error\n"))
+
+    def test_open_streams_are_limited(self):
+        JobEvents.start_job("job1").finish({})
+        first = JobEvents.open_stream("job1", 0, 2)
+        second = JobEvents.open_stream("job1", 0, 2)
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(JobEvents.open_stream("job1", 0, 2))
+        self.assertEqual(len(list(first)), 2)
+        first.close()
+        first.close()
+        third = JobEvents.open_stream("job1", 0, 2)
+        self.assertIsNotNone(third)
+        self.assertIsNone(JobEvents.open_stream("job1", 0, 2))
+        second.close()
+        third.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
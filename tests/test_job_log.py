@@ -0,0 +1,68 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the suppression of repeated subprocess output lines by JobLog.OutputSummarizer"""
+
+import logging
+import unittest
+
+import support
+import JobLog
+import ConfigUtility
+
+
+class RecordingLogger(object):
+    def __init__(self):
+        self.lines = []
+
+    def log(self, level, message):
+        self.lines.append(message)
+
+
+class OutputSummarizerTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = RecordingLogger()
+        self.summarizer = JobLog.OutputSummarizer(self.logger, "distcp", max_repeats=2, level=logging.INFO)
+
+    def test_distinct_lines_are_logged(self):
+        for line in ("starting\n", "copying a\n", "done\n"):
+            self.summarizer.line(line)
+        self.summarizer.close()
+        self.assertEqual(self.logger.lines, ["starting", "copying a", "done"])
+
+    def test_similar_lines_are_summarized(self):
+        for percent in range(0, 100, 10):
+            self.summarizer.line("map %d%% reduce 0%%" % percent)
+        self.summarizer.line("Job completed")
+        self.assertEqual(self.logger.lines, ["map 0% reduce 0%", "map 10% reduce 0%",
+                                             "8 similar distcp lines suppressed, last: map 90% reduce 0%",
+                                             "Job completed"])
+
+    def test_summary_is_logged_on_close(self):
+        for percent in range(5):
+            self.summarizer.line("map %d%%" % percent)
+        self.summarizer.close()
+        self.assertEqual(self.logger.lines[-1], "3 similar distcp lines suppressed, last: map 4%")
+
+    def test_empty_lines_are_ignored(self):
+        self.summarizer.line("\n")
+        self.summarizer.line("   ")
+        self.summarizer.close()
+        self.assertEqual(self.logger.lines, [])
+
+    def test_max_repeats_from_the_settings(self):
+        max_repeats = ConfigUtility.get_snapshot(JobLog.CONFIGURATION_FILE).get_int(
+            JobLog.SETTINGS_SECTION, "subprocess_max_repeats", JobLog.DEFAULT_MAX_REPEATS)
+        self.assertEqual(JobLog.OutputSummarizer(self.logger, "sqoop").max_repeats, max_repeats)
+
+    def test_close_resets_the_repeats(self):
+        for _ in range(2):
+            for percent in range(3):
+                self.summarizer.line("map %d%%" % percent)
+            self.summarizer.close()
+        self.assertEqual(self.logger.lines, ["map 0%", "map 1%", "1 similar distcp lines suppressed, last: map 2%",
+                                             "map 0%", "map 1%", "1 similar distcp lines suppressed, last: map 2%"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the uploads of LocalToS3 and of the rollback of a failed request"""
+
+import os
+import unittest
+
+import support
+
+try:
+    import LocalToS3
+except ImportError:
+    LocalToS3 = None
+
+BUCKET = "bucket"
+# Above the 5 MB minimum part size of S3
+LARGE_FILE_SIZE = 5 * 1024 * 1024 + 1024
+
+
+@unittest.skipIf(LocalToS3 is None, "LocalToS3 cannot be imported without boto3")
+class LocalToS3Test(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.source = os.path.join(self.directory, "source")
+        os.makedirs(os.path.join(self.source, "sub"))
+        self.write("small", 10)
+        self.write("sub/large", LARGE_FILE_SIZE)
+        # An object of an earlier export, at a key the request does not write
+        self.s3 = support.FakeS3({"out/previous": "x" * 5})
+
+    def write(self, name, size):
+        with open(os.path.join(self.source, name), "wb") as data_file:
+            data_file.write("x" * size)
+
+    def upload(self):
+        config = {LocalToS3.BUCKET_NAME_KEY: BUCKET, LocalToS3.MAX_CONCURRENCY_KEY: "4",
+                  LocalToS3.PART_SIZE_KEY: str(LocalToS3.MINIMUM_PART_SIZE),
+                  LocalToS3.MULTIPART_THRESHOLD_KEY: str(LocalToS3.MINIMUM_PART_SIZE)}
+        local_to_s3 = LocalToS3.LocalToS3(config)
+        local_to_s3.context.get_s3_client = lambda credentials: self.s3
+        return local_to_s3.upload(self.source, "out")
+
+    def test_upload(self):
+        status = self.upload()
+        self.assertEqual(status[LocalToS3.STATUS_KEY], LocalToS3.STATUS_SUCCESS)
+        # Two parts for the large file, the last one is shorter
+        self.assertEqual(sorted(self.s3.parts), [1024, LocalToS3.MINIMUM_PART_SIZE])
+        self.assertEqual(status[LocalToS3.FILES_COPIED_LIST_KEY], [
+            {LocalToS3.FILE_NAME_KEY: "s3://bucket/out/small", LocalToS3.FILE_SIZE_KEY: "10"},
+            {LocalToS3.FILE_NAME_KEY: "s3://bucket/out/sub/large", LocalToS3.FILE_SIZE_KEY: str(LARGE_FILE_SIZE)}])
+        self.assertEqual(self.s3.sizes(), {"out/previous": 5, "out/small": 10, "out/sub/large": LARGE_FILE_SIZE})
+        self.assertEqual(self.s3.uploads, {})
+
+    def test_failed_part_aborts_the_upload(self):
+        self.s3.fail("upload_part", "out/sub/large")
+        status = self.upload()
+        self.assertEqual(status[LocalToS3.STATUS_KEY], LocalToS3.STATUS_FAILED)
+        self.assertIn("large", status[LocalToS3.MESSAGE_KEY])
+        self.assertEqual(self.s3.aborted, ["out/sub/large"])
+        self.assertEqual(self.s3.uploads, {})
+        # Only the object written by the request is deleted
+        self.assertEqual(self.s3.deleted, ["out/small"])
+        self.assertEqual(self.s3.sizes(), {"out/previous": 5})
+
+    def test_failed_put_keeps_the_objects_it_did_not_write(self):
+        self.s3.objects["out/small"] = "x" * 7
+        self.s3.fail("put_object", "out/small")
+        status = self.upload()
+        self.assertEqual(status[LocalToS3.STATUS_KEY], LocalToS3.STATUS_FAILED)
+        self.assertEqual(self.s3.aborted, [])
+        self.assertEqual(self.s3.deleted, ["out/sub/large"])
+        self.assertEqual(self.s3.sizes(), {"out/previous": 5, "out/small": 7})
+
+    def test_failed_verification_deletes_the_written_objects(self):
+        self.s3.list_objects_v2 = lambda Bucket, Prefix, **kwargs: {"Contents": []}
+        status = self.upload()
+        self.assertEqual(status[LocalToS3.MESSAGE_KEY], "Verification of the uploaded files failed")
+        self.assertEqual(sorted(self.s3.deleted), ["out/small", "out/sub/large"])
+        self.assertEqual(self.s3.sizes(), {"out/previous": 5})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the asynchronous log handler of LogSetup: overflow policies of the bounded queue and the drain on close"""
+
+import time
+import logging
+import itertools
+import threading
+import unittest
+
+import support
+import LogSetup
+
+DROPPED_MESSAGE = "1 log records dropped because the log queue was full"
+BLOCKED_WAIT = 0.2
+
+
+class GatedHandler(logging.Handler):
+    """Records the messages it is given, each one once the gate is open"""
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.gate = threading.Event()
+        self.received = threading.Event()
+        self.messages = []
+
+    def emit(self, record):
+        self.received.set()
+        self.gate.wait()
+        self.messages.append(record.getMessage())
+
+
+def make_record(message, level=logging.INFO):
+    return logging.makeLogRecord({"msg": message, "levelno": level, "levelname": logging.getLevelName(level)})
+
+
+class AsyncQueueHandlerTest(unittest.TestCase):
+    QUEUE_SIZE = 2
+
+    def start(self, overflow_policy, sample_rate=LogSetup.DEFAULT_ASYNC_SAMPLE_RATE):
+        self.target = GatedHandler()
+        self.handler = LogSetup.AsyncQueueHandler([self.target], self.QUEUE_SIZE, overflow_policy, sample_rate)
+        # The listener holds the first record until the gate opens, the next records fill the queue
+        self.handler.handle(make_record("first"))
+        self.assertTrue(self.target.received.wait(10))
+        for index in range(self.QUEUE_SIZE):
+            self.handler.handle(make_record("queued %d" % index))
+        self.assertTrue(self.handler.queue.full())
+
+    def tearDown(self):
+        self.target.gate.set()
+        if self.handler.listener is not None:
+            self.handler.close()
+
+    def emit_in_thread(self, record):
+        thread = threading.Thread(target=self.handler.handle, args=(record,))
+        thread.start()
+        time.sleep(BLOCKED_WAIT)
+        return thread
+
+    def drain(self, *threads):
+        self.target.gate.set()
+        for thread in threads:
+            thread.join(10)
+        self.handler.close()
+        return self.target.messages
+
+    def test_drop_debug(self):
+        self.start(LogSetup.ASYNC_OVERFLOW_DROP_DEBUG)
+        self.handler.handle(make_record("debug", logging.DEBUG))
+        self.assertEqual(self.handler.listener.dropped, 1)
+        # Records above DEBUG wait for room
+        thread = self.emit_in_thread(make_record("info"))
+        self.assertTrue(thread.is_alive())
+        messages = self.drain(thread)
+        self.assertEqual([message for message in messages if message != DROPPED_MESSAGE],
+                         ["first", "queued 0", "queued 1", "info"])
+        self.assertEqual(messages.count(DROPPED_MESSAGE), 1)
+
+    def test_sample(self):
+        self.start(LogSetup.ASYNC_OVERFLOW_SAMPLE, sample_rate=3)
+        # The first overflowing record is kept: start the count after it so the next two are dropped
+        self.handler.overflow_counter = itertools.count(1)
+        self.handler.handle(make_record("dropped 0"))
+        self.handler.handle(make_record("dropped 1", logging.DEBUG))
+        self.assertEqual(self.handler.listener.dropped, 2)
+        # One record in sample_rate is kept and waits for room, warnings are never dropped
+        sampled = self.emit_in_thread(make_record("sampled"))
+        self.assertTrue(sampled.is_alive())
+        self.assertEqual(self.handler.listener.dropped, 2)
+        messages = self.drain(sampled)
+        self.assertEqual([message for message in messages if not message.endswith("queue was full")],
+                         ["first", "queued 0", "queued 1", "sampled"])
+        self.assertIn("2 log records dropped because the log queue was full", messages)
+
+    def test_warning_is_never_sampled_out(self):
+        self.start(LogSetup.ASYNC_OVERFLOW_SAMPLE, sample_rate=3)
+        self.handler.overflow_counter = itertools.count(1)
+        warning = self.emit_in_thread(make_record("warning", logging.WARNING))
+        self.assertTrue(warning.is_alive())
+        self.assertIn("warning", self.drain(warning))
+
+    def test_block(self):
+        self.start(LogSetup.ASYNC_OVERFLOW_BLOCK)
+        thread = self.emit_in_thread(make_record("debug", logging.DEBUG))
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(self.drain(thread), ["first", "queued 0", "queued 1", "debug"])
+
+    def test_close_writes_the_queued_records(self):
+        self.start(LogSetup.ASYNC_OVERFLOW_BLOCK)
+        self.target.gate.set()
+        for index in range(5):
+            self.handler.handle(make_record("after %d" % index))
+        self.handler.close()
+        self.assertEqual(self.target.messages, ["first", "queued 0", "queued 1"] +
+                         ["after %d" % index for index in range(5)])
+        self.assertIsNone(self.handler.listener)
+
+    def test_arguments_are_formatted_when_logged(self):
+        self.start(LogSetup.ASYNC_OVERFLOW_BLOCK)
+        values = ["before"]
+        record = logging.makeLogRecord({"msg": "value %s", "args": (values,), "levelno": logging.INFO})
+        thread = self.emit_in_thread(record)
+        values[0] = "after"
+        self.assertIn("value ['before']", self.drain(thread))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the Prometheus rendering of Metrics and the merge of the snapshots of the worker processes"""
+
+import os
+import json
+import subprocess
+import unittest
+
+import support
+import Metrics
+
+
+class MetricsRegistryTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.registry = Metrics.MetricsRegistry()
+        self.registry.snapshot_dir = self.directory
+        self.counter = self.registry.register(Metrics.Counter("files_total", "Files", ["export_type"]))
+        self.gauge = self.registry.register(Metrics.Gauge("queue_depth", "Queued files", ["export_type"]))
+        self.histogram = self.registry.register(Metrics.Histogram("duration_seconds", "Duration", [],
+                                                                  buckets=(1, 10)))
+
+    def test_render(self):
+        self.counter.inc(2, "hdfsToS3")
+        self.counter.inc(1, "hdfsToS3")
+        self.gauge.inc(5, 'a"b')
+        self.gauge.dec(2, 'a"b')
+        self.histogram.observe(0.5)
+        self.histogram.observe(4)
+        self.assertEqual(self.registry.render().splitlines(), [
+            "# HELP dataexport_files_total Files", "# TYPE dataexport_files_total counter",
+            'dataexport_files_total{export_type="hdfsToS3"} 3',
+            "# HELP dataexport_queue_depth Queued files", "# TYPE dataexport_queue_depth gauge",
+            'dataexport_queue_depth{export_type="a\\"b"} 3',
+            "# HELP dataexport_duration_seconds Duration", "# TYPE dataexport_duration_seconds histogram",
+            'dataexport_duration_seconds_bucket{le="1"} 1', 'dataexport_duration_seconds_bucket{le="10"} 2',
+            'dataexport_duration_seconds_bucket{le="+Inf"} 2', "dataexport_duration_seconds_sum 4.5",
+            "dataexport_duration_seconds_count 2"])
+
+    def write_worker_snapshot(self, pid, files, queue_depth, durations):
+        snapshot = {"pid": pid, "metrics": {self.counter.name: [[["hdfsToS3"], files]],
+                                            self.gauge.name: [[["hdfsToS3"], queue_depth]],
+                                            self.histogram.name: [[[], durations]]}}
+        path = os.path.join(self.directory, Metrics.SNAPSHOT_FILE_PREFIX + str(pid) + Metrics.SNAPSHOT_FILE_SUFFIX)
+        with open(path, "w") as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+
+    def dead_pid(self):
+        process = subprocess.Popen(["true"])
+        process.wait()
+        return process.pid
+
+    def test_snapshots_of_the_workers_are_merged(self):
+        self.counter.inc(1, "hdfsToS3")
+        self.gauge.inc(1, "hdfsToS3")
+        self.histogram.observe(0.5)
+        # A live worker and a worker that exited: the gauges of the exited worker are left out
+        self.write_worker_snapshot(os.getppid(), 10, 4, [1, 1, 0, 20, 2])
+        self.write_worker_snapshot(self.dead_pid(), 100, 50, [0, 0, 1, 100, 1])
+        lines = self.registry.render().splitlines()
+        self.assertIn('dataexport_files_total{export_type="hdfsToS3"} 111', lines)
+        self.assertIn('dataexport_queue_depth{export_type="hdfsToS3"} 5', lines)
+        self.assertIn('dataexport_duration_seconds_bucket{le="1"} 2', lines)
+        self.assertIn('dataexport_duration_seconds_bucket{le="10"} 3', lines)
+        self.assertIn('dataexport_duration_seconds_bucket{le="+Inf"} 4', lines)
+        self.assertIn("dataexport_duration_seconds_sum 120.5", lines)
+        self.assertIn("dataexport_duration_seconds_count 4", lines)
+
+    def test_own_snapshot_file_is_not_counted_twice(self):
+        self.counter.inc(3, "hdfsToS3")
+        self.registry.write_snapshot()
+        self.assertEqual(os.listdir(self.directory),
+                         [Metrics.SNAPSHOT_FILE_PREFIX + str(os.getpid()) + Metrics.SNAPSHOT_FILE_SUFFIX])
+        self.assertIn('dataexport_files_total{export_type="hdfsToS3"} 3', self.registry.render().splitlines())
+
+    def test_unreadable_snapshot_is_skipped(self):
+        with open(os.path.join(self.directory, Metrics.SNAPSHOT_FILE_PREFIX + "1" + Metrics.SNAPSHOT_FILE_SUFFIX),
+                  "w") as snapshot_file:
+            snapshot_file.write("{")
+        self.counter.inc(1, "hdfsToS3")
+        self.assertIn('dataexport_files_total{export_type="hdfsToS3"} 1', self.registry.render().splitlines())
+
+    def test_clear_snapshots(self):
+        self.registry.write_snapshot()
+        self.registry.clear_snapshots(self.directory)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class S3CallTest(unittest.TestCase):
+    def count(self, result):
+        return Metrics.S3_REQUESTS.values.get(("test_operation", result), 0)
+
+    def test_calls_are_counted(self):
+        def fail(**kwargs):
+            raise IOError("throttled")
+
+        self.assertEqual(Metrics.s3_call("test_operation", lambda **kwargs: kwargs, Bucket="b"), {"Bucket": "b"})
+        self.assertRaises(IOError, Metrics.s3_call, "test_operation", fail, Bucket="b")
+        self.assertEqual((self.count("ok"), self.count("error")), (1, 1))
+        self.assertEqual(Metrics.S3_LATENCY.values[("test_operation",)][-1], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the failure classification, backoff and retry loop of Retry"""
+
+import unittest
+
+import support
+import Retry
+import Metrics
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_transient_failures(self):
+        for logs in ("SlowDown: Please reduce your request rate", "java.net.ConnectException: Connection refused",
+                     "Container killed by the ApplicationMaster", "Status Code: 503", "Command timed out after 5 s"):
+            self.assertEqual(Retry.classify(logs), Retry.FAILURE_TRANSIENT, logs)
+
+    def test_permanent_failures(self):
+        for logs in ("An error occurred (AccessDenied) when calling the PutObject operation",
+                     "java.io.FileNotFoundException: File does not exist", "ORA-00942: table or view does not exist"):
+            self.assertEqual(Retry.classify(logs), Retry.FAILURE_PERMANENT, logs)
+
+    def test_permanent_pattern_wins(self):
+        logs = "Connection reset while reading\nAccessDenied: Access Denied"
+        self.assertEqual(Retry.classify(logs), Retry.FAILURE_PERMANENT)
+
+    def test_unknown_failure_uses_the_default(self):
+        self.assertEqual(Retry.classify("something odd happened"), Retry.FAILURE_PERMANENT)
+        self.assertEqual(Retry.classify("something odd happened", Retry.FAILURE_TRANSIENT), Retry.FAILURE_TRANSIENT)
+        self.assertEqual(Retry.classify("", Retry.FAILURE_TRANSIENT), Retry.FAILURE_TRANSIENT)
+        self.assertEqual(Retry.classify(None), Retry.FAILURE_PERMANENT)
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_delay_is_capped(self):
+        policy = Retry.RetryPolicy(max_retries=5, base_delay=2.0, max_delay=5.0)
+        for retry_number in range(1, 6):
+            delay = policy.delay(retry_number)
+            self.assertTrue(0 <= delay <= min(5.0, 2.0 * 2 ** (retry_number - 1)), delay)
+
+    def test_negative_retries(self):
+        self.assertEqual(Retry.RetryPolicy(max_retries=-1).max_retries, 0)
+
+
+class RunWithRetriesTest(unittest.TestCase):
+    def run_attempts(self, failures, max_retries=2, budget=10, before_retry=None):
+        calls = []
+
+        def attempt():
+            failure = failures[len(calls)] if len(calls) < len(failures) else None
+            calls.append(failure)
+            return len(calls), failure
+
+        result = Retry.run_with_retries("test", Metrics.EXPORT_TYPE_HDFS_TO_S3, attempt, before_retry,
+                                        policy=Retry.RetryPolicy(max_retries, 0, 0),
+                                        budget=Retry.RetryBudget(budget))
+        return result, calls
+
+    def test_transient_failures_are_retried(self):
+        result, calls = self.run_attempts([Retry.FAILURE_TRANSIENT, Retry.FAILURE_TRANSIENT])
+        self.assertEqual(result, 3)
+        self.assertEqual(len(calls), 3)
+
+    def test_permanent_failure_is_not_retried(self):
+        result, calls = self.run_attempts([Retry.FAILURE_PERMANENT])
+        self.assertEqual(len(calls), 1)
+
+    def test_attempts_are_limited(self):
+        result, calls = self.run_attempts([Retry.FAILURE_TRANSIENT] * 5, max_retries=2)
+        self.assertEqual(len(calls), 3)
+
+    def test_budget_is_shared(self):
+        result, calls = self.run_attempts([Retry.FAILURE_TRANSIENT] * 5, max_retries=4, budget=1)
+        self.assertEqual(len(calls), 2)
+
+    def test_failed_preparation_stops_the_retries(self):
+        result, calls = self.run_attempts([Retry.FAILURE_TRANSIENT] * 3, before_retry=lambda: False)
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,297 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the imports of S3ToHdfs: listing of the source, choice of the copy mode, batched puts, ranged GETs
+streamed into hadoop fs -put, distcp, verification and the removal of the written files when an import fails"""
+
+import os
+import shlex
+import threading
+import unittest
+
+import support
+
+try:
+    import S3ToHdfs
+except ImportError:
+    S3ToHdfs = None
+
+try:
+    import HdfsToS3
+except ImportError:
+    HdfsToS3 = None
+
+CREDENTIALS = {"aws_access_key_id": "key", "aws_secret_access_key": "secret", "aes_encryption_enabled": "n"}
+TARGET = "/data/in"
+MEGABYTE = 1024 * 1024
+
+
+class FakeCommand(object):
+    """Command started with CommandRunner.start: a hadoop fs -put - reading its stdin, or a command with an output"""
+
+    def __init__(self, hdfs, path=None, exit_code=0, output=""):
+        self.hdfs = hdfs
+        self.path = path
+        self.exit_code = exit_code
+        self.stdin = self if path is not None else None
+        self.data = []
+        self.finished = path is None
+        self.cancelled = False
+        self._output = output
+
+    def write(self, data):
+        with self.hdfs.lock:
+            self.hdfs.written_ranges += 1
+        self.data.append(data)
+
+    def close(self):
+        self.finished = True
+        self.hdfs.files[self.path] = len("".join(self.data))
+        self.hdfs.contents[self.path] = "".join(self.data)
+
+    def lines(self):
+        return iter(self._output.splitlines(True))
+
+    def wait(self):
+        return self.exit_code if not self.cancelled else -9
+
+    def output(self):
+        return self._output
+
+    def done(self):
+        return self.finished or self.cancelled
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeHdfs(object):
+    """Runs the hadoop fs commands of S3ToHdfs against a dictionary of file path to size"""
+
+    def __init__(self):
+        self.files = {}
+        self.contents = {}
+        self.commands = []
+        self.streams = []
+        self.lock = threading.Lock()
+        self.written_ranges = 0
+        # Runs a distcp: called with the source and target paths, returns its exit code and output
+        self.distcp = None
+
+    def start(self, command, timeout=None, stream=False, stdin=False, merge_stderr=True):
+        self.commands.append(command)
+        arguments = shlex.split(command)
+        if arguments[1] == "distcp":
+            exit_code, output = self.distcp(arguments[-2], arguments[-1])
+            return FakeCommand(self, exit_code=exit_code, output=output)
+        self.streams.append(FakeCommand(self, arguments[-1]))
+        return self.streams[-1]
+
+    def run_command(self, command):
+        self.commands.append(command)
+        arguments = shlex.split(command)[2:]
+        if arguments[0] == "-put":
+            local_paths, directory = arguments[2:-1], arguments[-1]
+            for local_path in local_paths:
+                self.files[directory + "/" + os.path.basename(local_path)] = os.path.getsize(local_path)
+        elif arguments[0] == "-rm":
+            for path in arguments[3:]:
+                self.files.pop(path, None)
+        elif arguments[0] == "-test":
+            path = arguments[-1]
+            return (0 if any(name == path or name.startswith(path + "/") for name in self.files) else 1), ""
+        elif arguments[0] == "-ls":
+            return 0, "".join("-rw-r--r--   3 hdfs hdfs %d 2026-01-01 00:00 %s\n" % (size, path)
+                              for path, size in sorted(self.files.items()))
+        return 0, ""
+
+
+@unittest.skipIf(S3ToHdfs is None, "S3ToHdfs cannot be imported without boto3")
+class S3ToHdfsTestCase(support.TemporaryDirectoryTest):
+    """Importer reading a FakeS3 and writing to a FakeHdfs, with one retry and no delay"""
+
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.s3 = support.FakeS3({"logs/a.txt": "a" * 10, "logs/2026/b.txt": "b" * 20, "logs/2026/c.txt": "c" * 30,
+                          "logs/2026/": "", "logs/2026_$folder$": "", "other/d.txt": "d"})
+        self.hdfs = FakeHdfs()
+        self.run_command = S3ToHdfs.run_command
+        S3ToHdfs.run_command = self.hdfs.run_command
+        self.start = S3ToHdfs.CommandRunner.start
+        S3ToHdfs.CommandRunner.start = self.hdfs.start
+        self.get_policy = S3ToHdfs.Retry.get_policy
+        S3ToHdfs.Retry.get_policy = lambda default_max_retries=None: S3ToHdfs.Retry.RetryPolicy(1, 0, 0)
+
+    def tearDown(self):
+        S3ToHdfs.run_command = self.run_command
+        S3ToHdfs.CommandRunner.start = self.start
+        S3ToHdfs.Retry.get_policy = self.get_policy
+        support.TemporaryDirectoryTest.tearDown(self)
+
+    def importer(self, source_path, **config):
+        config.update({S3ToHdfs.S3_CREDENTIALS_KEY: CREDENTIALS, S3ToHdfs.SOURCE_PATH_KEY: source_path,
+                       S3ToHdfs.TARGET_PATH_KEY: TARGET + "/"})
+        s3_to_hdfs = S3ToHdfs.S3ToHdfs(config)
+        s3_to_hdfs.staging_dir = self.directory
+        s3_to_hdfs.context.get_s3_client = lambda credentials: self.s3
+        return s3_to_hdfs
+
+
+class S3ToHdfsTest(S3ToHdfsTestCase):
+    def test_prefix_is_imported_below_the_target(self):
+        objects = self.importer("s3a://bucket/logs").list_objects()
+        self.assertEqual([(item.key, item.size, item.hdfs_path) for item in objects], [
+            ("logs/2026/b.txt", 20, TARGET + "/2026/b.txt"), ("logs/2026/c.txt", 30, TARGET + "/2026/c.txt"),
+            ("logs/a.txt", 10, TARGET + "/a.txt")])
+
+    def test_single_object_is_imported_to_the_target(self):
+        objects = self.importer("s3a://bucket/logs/a.txt").list_objects()
+        self.assertEqual([(item.key, item.hdfs_path) for item in objects], [("logs/a.txt", TARGET)])
+
+    def test_choose_mode(self):
+        objects = [S3ToHdfs.ImportObject("a", 10, TARGET + "/a"), S3ToHdfs.ImportObject("b", 30, TARGET + "/b")]
+        self.assertEqual(self.importer("s3a://bucket/logs").choose_mode(objects), S3ToHdfs.MODE_DIRECT)
+        self.assertEqual(self.importer("s3a://bucket/logs", distcp_threshold="40").choose_mode(objects),
+                         S3ToHdfs.MODE_DISTCP)
+        self.assertEqual(self.importer("s3a://bucket/logs", large_object_size="30").choose_mode(objects),
+                         S3ToHdfs.MODE_DISTCP)
+        self.assertEqual(self.importer("s3a://bucket/logs", large_object_size="30", mode="Direct")
+                         .choose_mode(objects), S3ToHdfs.MODE_DIRECT)
+
+    def test_batches(self):
+        objects = [S3ToHdfs.ImportObject(str(size), size, TARGET) for size in (10, 20, 30, 5, 5, 5)]
+        s3_to_hdfs = self.importer("s3a://bucket/logs", put_batch_bytes="35", put_batch_files="2")
+        self.assertEqual([[item.size for item in batch] for batch in s3_to_hdfs.batches(objects)],
+                         [[10, 20], [30, 5], [5, 5]])
+
+    def test_direct_import(self):
+        self.s3.fail("get_object", "logs/2026/b.txt", 1, "Connection reset by peer")
+        status = self.importer("s3a://bucket/logs").run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_SUCCESS)
+        self.assertEqual(status[S3ToHdfs.FILES_COPIED_LIST_KEY], [
+            {S3ToHdfs.FILE_NAME_KEY: TARGET + "/2026/b.txt", S3ToHdfs.FILE_SIZE_KEY: "20"},
+            {S3ToHdfs.FILE_NAME_KEY: TARGET + "/2026/c.txt", S3ToHdfs.FILE_SIZE_KEY: "30"},
+            {S3ToHdfs.FILE_NAME_KEY: TARGET + "/a.txt", S3ToHdfs.FILE_SIZE_KEY: "10"}])
+        self.assertEqual(self.hdfs.files, {TARGET + "/2026/b.txt": 20, TARGET + "/2026/c.txt": 30,
+                                           TARGET + "/a.txt": 10})
+        # One put per target directory: the failed download is retried before anything is put
+        puts = [command for command in self.hdfs.commands if command.startswith("hadoop fs -put")]
+        self.assertEqual(len(puts), 2)
+        # The staging directories are removed
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_failed_import_removes_the_written_files(self):
+        self.hdfs.files["/data/other"] = 5
+        self.s3.fail("get_object", "logs/a.txt", 2, "Connection reset by peer")
+        status = self.importer("s3a://bucket/logs", put_batch_files="2").run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_FAILED)
+        self.assertEqual(self.hdfs.files, {"/data/other": 5})
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_failed_import_keeps_the_files_already_in_the_target(self):
+        self.hdfs.files[TARGET + "/a.txt"] = 3
+        self.s3.fail("get_object", "logs/2026/b.txt", 2, "Connection reset by peer")
+        status = self.importer("s3a://bucket/logs", put_batch_files="2").run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_FAILED)
+        self.assertEqual(self.hdfs.files, {TARGET + "/a.txt": 3})
+        # A file this import overwrote was not created by it and is kept too
+        self.hdfs.files = {TARGET + "/2026/c.txt": 3}
+        self.s3.fail("get_object", "logs/a.txt", 2, "Connection reset by peer")
+        status = self.importer("s3a://bucket/logs", put_batch_files="2").run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_FAILED)
+        self.assertEqual(self.hdfs.files, {TARGET + "/2026/c.txt": 30})
+
+    def test_failed_import_is_kept_without_atomic_transaction(self):
+        self.s3.fail("get_object", "logs/a.txt", 2, "Connection reset by peer")
+        status = self.importer("s3a://bucket/logs", put_batch_files="2", atomic_transaction="n").run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_FAILED)
+        self.assertEqual(self.hdfs.files, {TARGET + "/2026/b.txt": 20, TARGET + "/2026/c.txt": 30})
+
+    def test_size_mismatch_fails_the_verification(self):
+        s3_to_hdfs = self.importer("s3a://bucket/logs")
+        objects = s3_to_hdfs.list_objects()
+        self.hdfs.files = dict((item.hdfs_path, item.size) for item in objects)
+        self.assertTrue(s3_to_hdfs.verify(objects))
+        self.hdfs.files[TARGET + "/a.txt"] = 9
+        self.assertFalse(s3_to_hdfs.verify(objects))
+
+    def test_large_object_is_streamed_in_order(self):
+        data = "".join(chr(ord("a") + index) * MEGABYTE for index in range(3)) + "tail"
+        self.s3.objects = {"big/part-0": data}
+        ranges = []
+        in_flight = []
+
+        def on_call(operation, Key, Range=None, **kwargs):
+            # Ranges requested and not written yet, this one included
+            with self.hdfs.lock:
+                ranges.append(int(Range[len("bytes="):].split("-")[0]))
+                in_flight.append(len(ranges) - self.hdfs.written_ranges)
+
+        self.s3.on_call = on_call
+        status = self.importer("s3a://bucket/big", buffers_per_stream="2", range_size=str(MEGABYTE)).run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_SUCCESS)
+        self.assertEqual(sorted(ranges), [0, MEGABYTE, 2 * MEGABYTE, 3 * MEGABYTE])
+        self.assertEqual(self.hdfs.contents[TARGET + "/part-0"], data)
+        self.assertTrue(max(in_flight) <= 2)
+        self.assertEqual([command for command in self.hdfs.commands if command.startswith("hadoop fs -put")],
+                         ["hadoop fs -put -f - " + TARGET + "/part-0"])
+
+    def test_failed_range_cancels_the_put(self):
+        self.s3.objects = {"big/part-0": "x" * (2 * MEGABYTE), "big/part-1": "y" * 10}
+        self.hdfs.files[TARGET + "/part-1"] = 3
+
+        def on_call(operation, Key, Range=None, **kwargs):
+            if Range is not None and not Range.startswith("bytes=0-"):
+                raise IOError("Connection reset by peer")
+
+        self.s3.on_call = on_call
+        status = self.importer("s3a://bucket/big", range_size=str(MEGABYTE)).run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_FAILED)
+        # Every attempt fails on its second range: the put of each attempt is cancelled before the end of its stdin
+        self.assertEqual(len(self.hdfs.streams), 2)
+        self.assertTrue(all(stream.cancelled and not stream.finished for stream in self.hdfs.streams))
+        # The small object overwrote a file the target held before, which is kept
+        self.assertEqual(self.hdfs.files, {TARGET + "/part-1": 10})
+
+    def test_missing_source(self):
+        status = self.importer("s3a://bucket/missing").run()
+        self.assertEqual(status[S3ToHdfs.MESSAGE_KEY], "No S3 object found at s3a://bucket/missing")
+        self.assertEqual(self.hdfs.commands, [])
+
+
+@unittest.skipIf(HdfsToS3 is None, "HdfsToS3 cannot be imported without hadoopy")
+class DistcpImportTest(S3ToHdfsTestCase):
+    def setUp(self):
+        S3ToHdfsTestCase.setUp(self)
+        self.hdfs.files[TARGET + "/a.txt"] = 3
+
+    def copy(self, exit_code, output=""):
+        # Copies the objects below the source like distcp -update and ends with the given exit code
+        def distcp(source_path, target_path):
+            for item in self.importer(source_path).list_objects():
+                self.hdfs.files[item.hdfs_path.replace(TARGET, target_path, 1)] = item.size
+            return exit_code, output
+        self.hdfs.distcp = distcp
+
+    def test_distcp_import(self):
+        self.copy(0, "Job job_1 completed successfully\n")
+        status = self.importer("s3a://bucket/logs", mode="distcp").run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_SUCCESS)
+        distcp = [shlex.split(command) for command in self.hdfs.commands if command.startswith("hadoop distcp")]
+        self.assertEqual(len(distcp), 1)
+        self.assertEqual(distcp[0][-3:], ["-update", "s3a://bucket/logs", TARGET])
+        self.assertTrue("-Dfs.s3a.awsAccessKeyId=key" in distcp[0])
+        self.assertEqual(self.hdfs.files, {TARGET + "/2026/b.txt": 20, TARGET + "/2026/c.txt": 30,
+                                           TARGET + "/a.txt": 10})
+
+    def test_failed_distcp_removes_only_the_new_files(self):
+        self.copy(1, "Error: java.net.SocketTimeoutException: Read timed out\n")
+        status = self.importer("s3a://bucket/logs", mode="distcp").run()
+        self.assertEqual(status[S3ToHdfs.STATUS_KEY], S3ToHdfs.STATUS_FAILED)
+        # The transient failure was retried once
+        self.assertEqual(len([command for command in self.hdfs.commands if command.startswith("hadoop distcp")]), 2)
+        self.assertEqual(self.hdfs.files, {TARGET + "/a.txt": 10})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the spans of Tracing and of their conversion to folded stacks"""
+
+import unittest
+
+import support
+import JobEvents
+import Tracing
+
+
+def complete_event(name, tid, ts, dur):
+    return {"name": name, "ph": "X", "ts": ts, "dur": dur, "pid": 1, "tid": tid}
+
+
+class FoldedStackTest(unittest.TestCase):
+    def test_self_time_of_the_nested_spans(self):
+        trace = {"traceEvents": [
+            {"name": "thread_name", "ph": "M", "pid": 1, "tid": 1, "args": {"name": "main"}},
+            complete_event("export", 1, 0, 100),
+            complete_event("distcp", 1, 10, 30),
+            complete_event("put_object", 1, 15, 5),
+            complete_event("put;object", 1, 50, 10),
+            complete_event("export", 2, 0, 30)]}
+        self.assertEqual(Tracing.to_folded(trace), "export 90\n"
+                                                   "export;distcp 25\n"
+                                                   "export;distcp;put_object 5\n"
+                                                   "export;put:object 10\n")
+
+    def test_span_without_self_time_is_left_out(self):
+        trace = {"traceEvents": [complete_event("wrapper", 1, 0, 20), complete_event("work", 1, 0, 20),
+                                 complete_event("next", 1, 20, 5)]}
+        self.assertEqual(Tracing.to_folded(trace), "next 5\nwrapper;work 20\n")
+
+    def test_empty_trace(self):
+        self.assertEqual(Tracing.to_folded({}), "")
+
+
+class SpanTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.get_jobs_dir = JobEvents.get_jobs_dir
+        JobEvents.get_jobs_dir = lambda: self.directory
+
+    def tearDown(self):
+        JobEvents.get_jobs_dir = self.get_jobs_dir
+        JobEvents.set_current_job(None)
+        support.TemporaryDirectoryTest.tearDown(self)
+
+    def test_untraced_job_records_nothing(self):
+        self.assertIs(Tracing.span("distcp"), Tracing.NULL_SPAN)
+        JobEvents.start_job("job1")
+        self.assertIs(Tracing.span("distcp"), Tracing.NULL_SPAN)
+        self.assertIs(Tracing.current_span(), Tracing.NULL_SPAN)
+
+    def test_spans_are_saved_with_the_job(self):
+        @Tracing.traced("failing")
+        def failing():
+            raise ValueError("failed")
+
+        job = JobEvents.start_job("job1")
+        job.trace = Tracing.Trace("job1")
+        with Tracing.span("export", source="hdfs:///data") as export_span:
+            self.assertIs(Tracing.current_span(), export_span)
+            export_span.set(files=2)
+            self.assertRaises(ValueError, failing)
+        self.assertIs(Tracing.current_span(), Tracing.NULL_SPAN)
+        job.finish({"status": "SUCCESS"})
+
+        events = [event for event in job.trace.to_chrome()["traceEvents"] if event["ph"] == "X"]
+        self.assertEqual([(event["name"], event.get("args")) for event in events],
+                         [("failing", {"error": "ValueError"}), ("export", {"source": "hdfs:///data", "files": 2})])
+        self.assertLessEqual(events[1]["ts"], events[0]["ts"])
+        self.assertGreaterEqual(events[1]["ts"] + events[1]["dur"], events[0]["ts"] + events[0]["dur"])
+        folded = Tracing.load_trace("job1", Tracing.FORMAT_FOLDED)
+        # Spans shorter than a microsecond have no line
+        self.assertLessEqual(set(line.split(" ")[0] for line in folded.splitlines()),
+                             set(["export", "export;failing"]))
+        self.assertIn('"job_id": "job1"', Tracing.load_trace("job1"))
+        self.assertIsNone(Tracing.load_trace("job2"))
+
+    def test_spans_over_the_limit_are_counted(self):
+        trace = Tracing.Trace("job1")
+        maximum = Tracing.MAX_SPANS
+        Tracing.MAX_SPANS = 2
+        try:
+            for _ in range(3):
+                trace.add("upload_part", trace.started, 0.001, {})
+        finally:
+            Tracing.MAX_SPANS = maximum
+        chrome_trace = trace.to_chrome()
+        self.assertEqual(len([event for event in chrome_trace["traceEvents"] if event["ph"] == "X"]), 2)
+        self.assertEqual(chrome_trace["otherData"]["dropped_spans"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the shared work queue of WorkQueue: the order in which the tasks are claimed (own file tasks, new jobs,
+stolen file tasks), lease expiry, release and completion, and the QueueWorker running queued and split jobs"""
+
+import os
+import threading
+import unittest
+
+import support
+import ExportHistory
+import ExportRegistry
+import JobEvents
+import WorkQueue
+
+try:
+    import HdfsToS3
+except ImportError:
+    HdfsToS3 = None
+
+LEASE = 60
+MAX_ATTEMPTS = 3
+
+
+class WorkQueueTest(support.TemporaryDirectoryTest):
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.queue = WorkQueue.WorkQueue(os.path.join(self.directory, "queue.sqlite"))
+
+    def claim(self, worker_id, job_id=None, lease=LEASE, max_attempts=MAX_ATTEMPTS):
+        return self.queue.claim(worker_id, lease, max_attempts, job_id)[0]
+
+    def test_claim_order(self):
+        self.queue.submit_job("job1", "hdfsToS3", {"source_path": "hdfs:///one"})
+        self.queue.submit_job("job2", "hdfsToS3", {"source_path": "hdfs:///two"})
+        job1 = self.claim("a")
+        self.assertEqual((job1.job_id, job1.kind, job1.claim), ("job1", WorkQueue.KIND_JOB, WorkQueue.CLAIM_NEW))
+        self.assertEqual(job1.payload, {"source_path": "hdfs:///one"})
+        self.queue.add_file_tasks("job1", ["f1", "f2", "f3"])
+        # The owner of a job claims its file tasks before new jobs
+        own = self.claim("a")
+        self.assertEqual((own.job_id, own.name, own.claim), ("job1", "f1", WorkQueue.CLAIM_OWN))
+        # Another worker takes the new job first, then steals file tasks
+        job2 = self.claim("b")
+        self.assertEqual((job2.job_id, job2.claim), ("job2", WorkQueue.CLAIM_NEW))
+        stolen = self.claim("b")
+        self.assertEqual((stolen.job_id, stolen.name, stolen.claim), ("job1", "f2", WorkQueue.CLAIM_STOLEN))
+
+    def test_claim_of_one_job(self):
+        self.queue.submit_job("job1", "hdfsToS3", {})
+        self.queue.submit_job("job2", "hdfsToS3", {})
+        self.queue.add_file_tasks("job2", ["f1"])
+        self.assertIsNone(self.claim("a", "job1"))
+        task = self.claim("a", "job2")
+        self.assertEqual((task.name, task.claim), ("f1", WorkQueue.CLAIM_OWN))
+
+    def test_stolen_tasks_come_from_the_largest_job(self):
+        for job_id in ("small", "large"):
+            self.queue.submit_job(job_id, "hdfsToS3", {})
+            self.assertEqual(self.claim("owner").job_id, job_id)
+        self.queue.add_file_tasks("small", ["f0"])
+        self.queue.add_file_tasks("large", ["f0", "f1", "f2"])
+        self.assertEqual(self.claim("thief").job_id, "large")
+
+    def test_added_file_tasks_are_not_duplicated(self):
+        self.queue.submit_job("job1", "hdfsToS3", {})
+        self.queue.add_file_tasks("job1", ["f1", "f2"])
+        self.queue.add_file_tasks("job1", ["f1", "f2"])
+        self.assertEqual([name for _, name, _, _ in self.queue.file_tasks("job1")], ["f1", "f2"])
+
+    def test_expired_lease_is_claimed_again(self):
+        self.queue.submit_job("job1", "hdfsToS3", {})
+        first = self.claim("a", lease=-1)
+        again = self.claim("b")
+        self.assertEqual((again.task_id, again.attempts), (first.task_id, 2))
+        self.assertFalse(self.queue.complete(first.task_id, "a", WorkQueue.STATE_DONE, {}))
+        self.assertTrue(self.queue.complete(again.task_id, "b", WorkQueue.STATE_DONE, {"status": "SUCCESS"}))
+        self.assertEqual(self.queue.get_job("job1"), (WorkQueue.STATE_DONE, {"status": "SUCCESS"}))
+
+    def test_job_fails_after_max_attempts(self):
+        self.queue.submit_job("job1", "hdfsToS3", {})
+        self.claim("a", lease=-1, max_attempts=1)
+        task, expired_jobs = self.queue.claim("b", LEASE, 1)
+        self.assertIsNone(task)
+        self.assertEqual(expired_jobs, ["job1"])
+        self.assertEqual(self.queue.get_job("job1")[0], WorkQueue.STATE_FAILED)
+
+    def test_released_task_keeps_its_attempts(self):
+        self.queue.submit_job("job1", "hdfsToS3", {})
+        task = self.claim("a")
+        self.queue.release(task.task_id, "b")
+        self.assertEqual(self.queue.get_job("job1")[0], WorkQueue.STATE_LEASED)
+        self.queue.release(task.task_id, "a")
+        self.assertEqual(self.queue.get_job("job1")[0], WorkQueue.STATE_PENDING)
+        again = self.claim("b")
+        self.assertEqual((again.task_id, again.attempts, again.claim), (task.task_id, 1, WorkQueue.CLAIM_NEW))
+
+    def test_cancel_pending(self):
+        self.queue.submit_job("job1", "hdfsToS3", {})
+        self.queue.add_file_tasks("job1", ["f1", "f2"])
+        self.claim("a", "job1")
+        self.queue.cancel_pending("job1", "cancelled")
+        self.assertEqual([state for _, _, state, _ in self.queue.file_tasks("job1")],
+                         [WorkQueue.STATE_LEASED, WorkQueue.STATE_FAILED])
+
+    def test_file_tasks_of_an_expired_job_are_failed(self):
+        self.queue.submit_job("job1", "hdfsToS3", {})
+        self.queue.add_file_tasks("job1", ["f1", "f2"])
+        self.assertEqual(self.claim("a", lease=-1, max_attempts=1).kind, WorkQueue.KIND_JOB)
+        # The file tasks are not stolen once the lease of the job expired for the last time
+        task, expired_jobs = self.queue.claim("b", LEASE, 1)
+        self.assertIsNone(task)
+        self.assertEqual(expired_jobs, ["job1"])
+        self.assertEqual([state for _, _, state, _ in self.queue.file_tasks("job1")],
+                         [WorkQueue.STATE_FAILED, WorkQueue.STATE_FAILED])
+
+    def test_file_tasks_of_a_finished_job_are_not_claimed(self):
+        self.queue.submit_job("job1", "hdfsToS3", {})
+        job = self.claim("a")
+        self.queue.add_file_tasks("job1", ["f1"])
+        self.queue.complete(job.task_id, "a", WorkQueue.STATE_FAILED, {})
+        self.assertIsNone(self.claim("b"))
+        self.assertIsNone(self.claim("a", "job1"))
+
+
+class FakeHdfsToS3(object):
+    """Stands for HdfsToS3.HdfsToS3 in the split jobs: the transfers of the names in failures fail"""
+
+    def __init__(self, failures, cleaned):
+        self.failures = failures
+        self.cleaned = cleaned
+        self.atomic_transaction = "y"
+
+    def create_command_options_string(self, s3_credentials_json):
+        return "-Dfs.s3a.access.key=key"
+
+    def transfer_file_with_retries(self, option_string, source_path, file_name, target_path, s3_credentials_json,
+                                   transferred, target_paths):
+        target_paths.append(target_path + "/" + file_name)
+        if file_name in self.failures:
+            return {WorkQueue.FILE_NAME_KEY: "", WorkQueue.FILE_SIZE_KEY: 0}
+        return {WorkQueue.FILE_NAME_KEY: target_path + "/" + file_name, WorkQueue.FILE_SIZE_KEY: len(file_name)}
+
+    def s3_cleanup(self, target_paths, s3_credentials_json):
+        self.cleaned.extend(target_paths)
+        return True
+
+
+class QueueWorkerTestCase(support.TemporaryDirectoryTest):
+    """Queue in the temporary directory, job events written there and the export history left out"""
+
+    def setUp(self):
+        support.TemporaryDirectoryTest.setUp(self)
+        self.queue = WorkQueue.WorkQueue(os.path.join(self.directory, "queue.sqlite"))
+        self.get_jobs_dir = JobEvents.get_jobs_dir
+        JobEvents.get_jobs_dir = lambda: self.directory
+        self.record = ExportHistory.record
+        ExportHistory.record = lambda export_type, config, result, seconds: None
+        self.get_handler = ExportRegistry.get_handler
+
+    def tearDown(self):
+        JobEvents.get_jobs_dir = self.get_jobs_dir
+        ExportHistory.record = self.record
+        ExportRegistry.get_handler = self.get_handler
+        support.TemporaryDirectoryTest.tearDown(self)
+
+    def worker(self, worker_id):
+        worker = WorkQueue.QueueWorker(self.queue, slots=1, lease=LEASE, split_files=2)
+        worker.worker_id = worker_id
+        worker.poll_interval = 0.05
+        return worker
+
+
+class QueueWorkerTest(QueueWorkerTestCase):
+    def test_worker_runs_the_queued_jobs(self):
+        ExportRegistry.get_handler = lambda export_type: lambda config: {"status": "SUCCESS", "echo": config["n"]}
+        worker = self.worker("a")
+        worker.start()
+        try:
+            self.queue.submit_job("job1", "localToS3", {"n": 1})
+            self.assertEqual(WorkQueue.wait_for_result("job1", 10, self.queue), {"status": "SUCCESS", "echo": 1})
+        finally:
+            self.assertTrue(worker.stop(10))
+        self.assertEqual(self.queue.get_job("job1")[0], WorkQueue.STATE_DONE)
+
+
+@unittest.skipIf(HdfsToS3 is None, "HdfsToS3 cannot be imported without hadoopy")
+class SplitJobTest(QueueWorkerTestCase):
+    TARGET = "s3a://bucket/out"
+
+    def setUp(self):
+        QueueWorkerTestCase.setUp(self)
+        self.failures = set()
+        self.cleaned = []
+        self.hdfs_to_s3 = HdfsToS3.HdfsToS3
+        HdfsToS3.HdfsToS3 = lambda: FakeHdfsToS3(self.failures, self.cleaned)
+
+    def tearDown(self):
+        HdfsToS3.HdfsToS3 = self.hdfs_to_s3
+        QueueWorkerTestCase.tearDown(self)
+
+    def submit(self, worker, names):
+        self.queue.submit_job("job1", "hdfsToS3", {"source_path": "hdfs:///data", "target_path": self.TARGET,
+                                                   "s3_credentials": {}, "file_list": names, "dedup": "n"})
+        task, _ = self.queue.claim(worker.worker_id, LEASE, WorkQueue.DEFAULT_MAX_ATTEMPTS)
+        self.assertEqual(task.kind, WorkQueue.KIND_JOB)
+        return task
+
+    def states(self):
+        return [state for _, _, state, _ in self.queue.file_tasks("job1")]
+
+    def test_split_job_runs_its_file_tasks(self):
+        worker = self.worker("owner")
+        worker.run_task(self.submit(worker, ["a", "b", "c"]))
+        state, result = self.queue.get_job("job1")
+        self.assertEqual(state, WorkQueue.STATE_DONE)
+        self.assertEqual(result[WorkQueue.TASKS_BY_WORKER_KEY], {"owner": 3})
+        self.assertEqual([(status[WorkQueue.FILE_NAME_KEY], status[WorkQueue.FILE_SIZE_KEY])
+                          for status in result[WorkQueue.FILES_COPIED_LIST_KEY]],
+                         [(self.TARGET + "/a", 1), (self.TARGET + "/b", 1), (self.TARGET + "/c", 1)])
+        self.assertEqual(worker.job_configs, {})
+
+    def test_split_job_waits_for_the_stolen_tasks(self):
+        owner = self.worker("owner")
+        task = self.submit(owner, ["a", "b"])
+        self.queue.add_file_tasks("job1", ["a", "b"])
+        stolen, _ = self.queue.claim("thief", LEASE, WorkQueue.DEFAULT_MAX_ATTEMPTS)
+        self.assertEqual((stolen.name, stolen.claim), ("a", WorkQueue.CLAIM_STOLEN))
+        result = {WorkQueue.FILE_NAME_KEY: self.TARGET + "/a", WorkQueue.FILE_SIZE_KEY: 1,
+                  WorkQueue.TARGET_PATHS_KEY: [self.TARGET + "/a"], WorkQueue.WORKER_KEY: "thief"}
+        timer = threading.Timer(0.3, self.queue.complete, (stolen.task_id, "thief", WorkQueue.STATE_DONE, result))
+        timer.start()
+        owner.run_task(task)
+        timer.join()
+        state, result = self.queue.get_job("job1")
+        self.assertEqual(state, WorkQueue.STATE_DONE)
+        self.assertEqual(result[WorkQueue.TASKS_BY_WORKER_KEY], {"owner": 1, "thief": 1})
+
+    def test_failed_task_cancels_the_others_and_rolls_back(self):
+        self.failures.add("a")
+        worker = self.worker("owner")
+        worker.run_task(self.submit(worker, ["a", "b", "c"]))
+        state, result = self.queue.get_job("job1")
+        self.assertEqual(state, WorkQueue.STATE_FAILED)
+        self.assertEqual(result[WorkQueue.MESSAGE_KEY], "Failed to transfer Hdfs file a to S3")
+        self.assertEqual(self.states(), [WorkQueue.STATE_FAILED] * 3)
+        self.assertEqual([result.get(WorkQueue.MESSAGE_KEY) for _, _, _, result in self.queue.file_tasks("job1")],
+                         [None] + ["Cancelled after the failure of a"] * 2)
+        # Only the paths of the transfer run are removed
+        self.assertEqual(self.cleaned, [self.TARGET + "/a"])
+
+    def test_stopping_worker_gives_the_job_back(self):
+        owner = self.worker("owner")
+        owner.stopped.set()
+        owner.run_task(self.submit(owner, ["a", "b"]))
+        self.assertEqual(self.queue.get_job("job1")[0], WorkQueue.STATE_PENDING)
+        self.assertEqual(self.states(), [WorkQueue.STATE_PENDING] * 2)
+        # Another worker claims the job again without a lost attempt and continues it
+        other = self.worker("other")
+        task, _ = self.queue.claim(other.worker_id, LEASE, WorkQueue.DEFAULT_MAX_ATTEMPTS)
+        self.assertEqual((task.kind, task.attempts), (WorkQueue.KIND_JOB, 1))
+        other.run_task(task)
+        state, result = self.queue.get_job("job1")
+        self.assertEqual(state, WorkQueue.STATE_DONE)
+        self.assertEqual(result[WorkQueue.TASKS_BY_WORKER_KEY], {"other": 2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""Tests of the graceful shutdown of the pre-forked server of WsgiServer"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import httplib
+import urllib2
+import threading
+import subprocess
+import unittest
+
+import support
+
+try:
+    import WsgiServer
+except ImportError:
+    WsgiServer = None
+
+# Serves a slow request: /slow?<seconds> writes <marker> when it starts and answers with the pid of its worker
+SERVER_SCRIPT = """
+import os
+import sys
+import time
+import WsgiServer
+
+port, graceful_timeout, marker = int(sys.argv[1]), float(sys.argv[2]), sys.argv[3]
+
+
+def app(environ, start_response):
+    if environ["PATH_INFO"] == "/slow":
+        open(marker, "w").close()
+        time.sleep(float(environ["QUERY_STRING"]))
+    start_response("200 OK", [("Content-Type", "text/plain")])
+    return [str(os.getpid())]
+
+WsgiServer.serve_forever(app, "127.0.0.1", port, workers=2, threads=2, graceful_timeout=graceful_timeout)
+"""
+START_TIMEOUT = 30
+
+
+def free_port():
+    probe = socket.socket()
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+@unittest.skipIf(WsgiServer is None, "WsgiServer cannot be imported without werkzeug")
+class InFlightTrackerTest(unittest.TestCase):
+    def test_wait_idle(self):
+        release = threading.Event()
+
+        def app(environ, start_response):
+            release.wait()
+            return ["done"]
+
+        tracker = WsgiServer.InFlightTracker(app)
+
+        def request():
+            response = tracker({}, None)
+            list(response)
+            response.close()
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        while tracker.in_flight == 0:
+            time.sleep(0.01)
+        self.assertFalse(tracker.wait_idle(0.1))
+        release.set()
+        self.assertTrue(tracker.wait_idle(5))
+        thread.join()
+        self.assertEqual(tracker.in_flight, 0)
+
+
+@unittest.skipIf(WsgiServer is None, "WsgiServer cannot be imported without werkzeug")
+class GracefulShutdownTest(support.TemporaryDirectoryTest):
+    def start_server(self, graceful_timeout):
+        self.port = free_port()
+        self.marker = os.path.join(self.directory, "started")
+        environment = dict(os.environ, PYTHONPATH=support.SOURCE_DIR)
+        # The server logs to its current directory and the console
+        with open(os.path.join(self.directory, "server.out"), "w") as output:
+            self.server = subprocess.Popen([sys.executable, "-c", SERVER_SCRIPT, str(self.port),
+                                            str(graceful_timeout), self.marker], cwd=self.directory,
+                                           env=environment, stdout=output, stderr=subprocess.STDOUT)
+        deadline = time.time() + START_TIMEOUT
+        while True:
+            try:
+                return int(urllib2.urlopen(self.url("/"), timeout=5).read())
+            except (urllib2.URLError, socket.error):
+                if time.time() > deadline or self.server.poll() is not None:
+                    raise
+                time.sleep(0.1)
+
+    def tearDown(self):
+        if self.server.poll() is None:
+            self.server.kill()
+            self.server.wait()
+        support.TemporaryDirectoryTest.tearDown(self)
+
+    def url(self, path):
+        return "http://127.0.0.1:%d%s" % (self.port, path)
+
+    def start_request(self, seconds):
+        response = {}
+
+        def request():
+            try:
+                connection = urllib2.urlopen(self.url("/slow?%g" % seconds), timeout=60)
+                response["status"] = connection.getcode()
+                response["pid"] = int(connection.read())
+            except (urllib2.URLError, httplib.HTTPException, socket.error) as e:
+                response["error"] = e
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        deadline = time.time() + START_TIMEOUT
+        while not os.path.exists(self.marker):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.05)
+        return thread, response
+
+    def wait_server(self, timeout):
+        deadline = time.time() + timeout
+        while self.server.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        return self.server.poll()
+
+    def test_in_flight_request_is_drained(self):
+        graceful_timeout = 20
+        self.start_server(graceful_timeout)
+        thread, response = self.start_request(1.5)
+        stopped = time.time()
+        self.server.send_signal(signal.SIGTERM)
+        thread.join(graceful_timeout)
+        self.assertEqual(response.get("status"), 200, response)
+        self.assertIsNotNone(self.wait_server(graceful_timeout))
+        # The workers exited on their own, before the parent kills them
+        self.assertLess(time.time() - stopped, graceful_timeout)
+        self.assertEqual(self.server.returncode, 0)
+        self.assertFalse(is_running(response["pid"]))
+
+    def test_worker_exits_after_the_graceful_timeout(self):
+        graceful_timeout = 1
+        worker_pid = self.start_server(graceful_timeout)
+        thread, response = self.start_request(60)
+        stopped = time.time()
+        self.server.send_signal(signal.SIGTERM)
+        self.assertIsNotNone(self.wait_server(graceful_timeout + WsgiServer.KILL_GRACE_PERIOD + 5))
+        self.assertLess(time.time() - stopped, graceful_timeout + WsgiServer.KILL_GRACE_PERIOD)
+        thread.join(10)
+        self.assertIn("error", response)
+        self.assertFalse(is_running(worker_pid))
+
+
+if __name__ == "__main__":
+    unittest.main()